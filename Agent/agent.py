@@ -0,0 +1,351 @@
+import asyncio
+import os
+import socket
+import threading
+from asyncio import StreamReader, StreamWriter
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Optional
+
+from argon2.exceptions import VerificationError, InvalidHashError
+
+from Agent.protocol import read_frame, encode_frame, ProtocolError, default_socket_path, default_socket_directory, \
+    check_private_directory, is_own_user, DEFAULT_IDLE_TIMEOUT
+from Database.database_setup import setup_database
+from Utils.cryptography import derive_256_bit_salt_and_key, decrypt_aes_256_gcm
+from Utils.database import is_valid_login, get_user_id_by_email, get_account_id_by_account_name_and_user_id, \
+    get_account_name_url_and_username_by_account_id, get_all_account_names_urls_and_usernames_by_user_id, \
+    get_encrypted_account_password, get_all_account_salts_by_user_id, find_accounts_for_url, search_accounts, \
+    get_shared_item_by_name_and_user_id, get_decrypted_shared_item_password, forget_unlocked_keys
+from Utils.sql_trace import connect
+
+# An ssh-agent-style local daemon: it unlocks a vault once (verifying the master password through Utils.database),
+# keeps the master password and the Argon2-derived Account keys in memory, and serves list, search, match, and get
+# requests over a Unix domain socket (see Agent.protocol). Since every Account password is encrypted with a key derived
+# from its own salt, the keys are cached by salt and derived ahead of time in a background thread, so that lookups only
+# cost a query and an AES-GCM decryption. A lookup of an Account whose key is not cached yet derives it on demand
+# (on a separate thread, so that it does not wait behind the prefetching).
+#
+# The agent locks, forgetting the key material, and exits once it has not served a request for idle_timeout seconds
+# or when a client sends the lock op. Locking also forgets the keys that Utils.database cached for the whole process
+# (see forget_unlocked_keys), in case the agent runs in the same process as other code. Python cannot reliably wipe
+# strings and bytes from memory, so locking drops the references and relies on the process exiting soon after.
+
+ACCOUNT_FIELDS = ('name', 'url', 'username', 'password')
+
+
+class AgentRequestError(Exception):
+    """
+    An error in a request that is returned to the client as the error message.
+    """
+
+
+class VaultAgent:
+    def __init__(self, database: str, email: str, master_password: str, socket_path: Optional[str] = None,
+                 idle_timeout: float = DEFAULT_IDLE_TIMEOUT, prefetch: bool = True):
+        """
+        :param database: the path of the database file
+        :param email: the email of the User whose vault is unlocked
+        :param master_password: the User's master password
+        :param socket_path: the path of the Unix domain socket to listen on (defaults to default_socket_path())
+        :param idle_timeout: the seconds without a request after which the agent locks and exits
+        :param prefetch: whether to derive the keys of all Accounts in the background after unlocking
+        """
+        self.database = database
+        self.email = email
+        self.socket_path = socket_path or default_socket_path()
+        self.idle_timeout = idle_timeout
+        self.prefetch = prefetch
+
+        # Set once the agent is unlocked and listening, or once it failed to start (then start_error is set)
+        self.ready = threading.Event()
+        self.start_error: Optional[BaseException] = None
+
+        self._master_password: Optional[str] = master_password
+        self._user_id: Optional[int] = None
+        self._connection = None
+        self._keys: Dict[bytes, bytes] = {}
+        self._pending_keys: Dict[bytes, asyncio.Future] = {}
+        self._prefetch_executor: Optional[ThreadPoolExecutor] = None
+        self._lookup_executor: Optional[ThreadPoolExecutor] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._stopped: Optional[asyncio.Event] = None
+        self._last_request = 0.0
+        self._writers = set()
+
+    def run(self):
+        """
+        Unlocks the vault and serves requests until the agent is locked. Blocks the calling thread.
+        :raise ValueError: if the email or master password is not valid
+        """
+        asyncio.run(self.serve())
+
+    def stop(self):
+        """
+        Locks and stops the agent. Can be called from any thread.
+        """
+        if self._loop is None or self._stopped is None:
+            return
+
+        try:
+            self._loop.call_soon_threadsafe(self._stopped.set)
+        except RuntimeError:
+            # The event loop already closed
+            pass
+
+    @property
+    def cached_key_count(self) -> int:
+        return len(self._keys)
+
+    def _unlock(self):
+        setup_database(self.database)
+        self._connection = connect(self.database)
+
+        try:
+            valid_login = is_valid_login(email=self.email, entered_password=self._master_password,
+                                         connection=self._connection)
+        except (VerificationError, InvalidHashError):
+            valid_login = False
+
+        if not valid_login:
+            self._connection.close()
+            raise ValueError('Invalid email or master password')
+
+        self._user_id = get_user_id_by_email(self.email, self._connection)
+
+    def _lock(self):
+        self._master_password = None
+        self._keys.clear()
+        # Utils.database caches keys (and the master passwords they are derived from) for the whole process
+        forget_unlocked_keys()
+
+        for future in self._pending_keys.values():
+            future.cancel()
+
+        self._pending_keys.clear()
+
+    def _prepare_socket_directory(self):
+        """
+        Creates the directory of the socket, private to the current user, if it does not exist yet, and checks that the
+        default per-user directory is private (the directory of a socket path given explicitly is the caller's choice).
+        """
+        directory = os.path.dirname(os.path.abspath(self.socket_path))
+
+        try:
+            os.mkdir(directory, 0o700)
+        except FileExistsError:
+            pass
+
+        if directory == os.path.abspath(default_socket_directory()):
+            check_private_directory(directory)
+
+    def _remove_stale_socket(self):
+        if not os.path.exists(self.socket_path):
+            return
+
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+
+        try:
+            probe.connect(self.socket_path)
+        except (ConnectionRefusedError, FileNotFoundError):
+            os.unlink(self.socket_path)
+        else:
+            raise ValueError(f'An agent is already listening on {self.socket_path}')
+        finally:
+            probe.close()
+
+    async def serve(self):
+        """
+        Unlocks the vault and serves requests until the agent is locked.
+        :raise ValueError: if the email or master password is not valid, another agent uses the socket path, or the
+        default socket directory is not private to the current user
+        """
+        try:
+            self._loop = asyncio.get_running_loop()
+            self._stopped = asyncio.Event()
+            self._unlock()
+            self._prepare_socket_directory()
+            self._remove_stale_socket()
+
+            # The socket is created with mode 0600 instead of being restricted once it listens, which would let anyone
+            # connect in between
+            previous_umask = os.umask(0o177)
+
+            try:
+                server = await asyncio.start_unix_server(self._handle_client, path=self.socket_path)
+            finally:
+                os.umask(previous_umask)
+        except BaseException as e:
+            self.start_error = e
+            self.ready.set()
+            raise
+
+        self._prefetch_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='AgentKeyPrefetch')
+        self._lookup_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='AgentKeyLookup')
+        self._last_request = self._loop.time()
+
+        prefetch_task = asyncio.create_task(self._prefetch_keys()) if self.prefetch else None
+        idle_task = asyncio.create_task(self._lock_when_idle())
+
+        self.ready.set()
+
+        try:
+            await self._stopped.wait()
+        finally:
+            self._lock()
+            idle_task.cancel()
+
+            if prefetch_task is not None:
+                prefetch_task.cancel()
+
+            server.close()
+
+            for writer in list(self._writers):
+                writer.close()
+
+            await server.wait_closed()
+
+            self._prefetch_executor.shutdown(wait=False, cancel_futures=True)
+            self._lookup_executor.shutdown(wait=False, cancel_futures=True)
+            self._connection.close()
+
+            if os.path.exists(self.socket_path):
+                os.unlink(self.socket_path)
+
+    async def _lock_when_idle(self):
+        while True:
+            remaining = self._last_request + self.idle_timeout - self._loop.time()
+
+            if remaining <= 0:
+                self._stopped.set()
+                return
+
+            await asyncio.sleep(remaining)
+
+    async def _prefetch_keys(self):
+        for salt in get_all_account_salts_by_user_id(self._user_id, self._connection):
+            if salt not in self._keys and salt not in self._pending_keys:
+                await self._derive_key(salt, self._prefetch_executor)
+
+    async def _derive_key(self, salt: bytes, executor: ThreadPoolExecutor) -> bytes:
+        future = self._pending_keys.get(salt)
+
+        if future is None:
+            future = self._loop.run_in_executor(executor, derive_256_bit_salt_and_key, self._master_password, salt)
+            self._pending_keys[salt] = future
+
+        try:
+            key = (await asyncio.shield(future))[1]
+        finally:
+            if future.done():
+                self._pending_keys.pop(salt, None)
+
+        if self._master_password is not None:
+            self._keys[salt] = key
+
+        return key
+
+    async def _key(self, salt: bytes) -> bytes:
+        key = self._keys.get(salt)
+
+        if key is None:
+            key = await self._derive_key(salt, self._lookup_executor)
+
+        return key
+
+    async def _handle_client(self, reader: StreamReader, writer: StreamWriter):
+        if not is_own_user(writer.get_extra_info('socket')):
+            writer.close()
+            return
+
+        self._writers.add(writer)
+
+        try:
+            while not self._stopped.is_set():
+                try:
+                    request = await read_frame(reader)
+                except ProtocolError as e:
+                    writer.write(encode_frame({'ok': False, 'error': str(e)}))
+                    break
+
+                if request is None:
+                    break
+
+                self._last_request = self._loop.time()
+
+                try:
+                    response = {'ok': True, 'result': await self.handle_request(request)}
+                except (AgentRequestError, ValueError) as e:
+                    response = {'ok': False, 'error': str(e)}
+
+                writer.write(encode_frame(response))
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            self._writers.discard(writer)
+            writer.close()
+
+    async def handle_request(self, request: Dict[str, Any]) -> Any:
+        """
+        Returns the result of the given request.
+        :raise AgentRequestError: if the request is not valid
+        :raise ValueError: if the decryption fails
+        """
+        op = request.get('op')
+
+        if op == 'status':
+            return {'email': self.email, 'cached_keys': len(self._keys),
+                    'seconds_until_lock': max(self._last_request + self.idle_timeout - self._loop.time(), 0)}
+
+        if op == 'lock':
+            self._stopped.set()
+            return None
+
+        if op == 'list':
+            return get_all_account_names_urls_and_usernames_by_user_id(self._user_id, self._connection) or []
+
+        if op == 'search':
+            return [account[1:] for account in search_accounts(self._user_id, str(request.get('query', '')),
+                                                               self._connection)]
+
+        if op == 'match':
+            return [account[1:] for account in find_accounts_for_url(self._user_id, str(request.get('url', '')),
+                                                                     self._connection)]
+
+        if op == 'get':
+            return await self._get(str(request.get('name', '')), request.get('field', 'password'))
+
+        raise AgentRequestError(f'Unknown op: {op}')
+
+    async def _get(self, name: str, field: str) -> str:
+        if field not in ACCOUNT_FIELDS:
+            raise AgentRequestError(f'Unknown field: {field}')
+
+        account_id = get_account_id_by_account_name_and_user_id(name, self._user_id, self._connection)
+
+        if account_id is None:
+            return self._get_shared_item_field(name, field)
+
+        if field != 'password':
+            name, url, username = get_account_name_url_and_username_by_account_id(account_id, self._connection)
+            return {'name': name, 'url': url, 'username': username}[field] or ''
+
+        ciphertext, salt, nonce, tag = get_encrypted_account_password(account_id, self._connection)
+        key = await self._key(salt)
+
+        return decrypt_aes_256_gcm(key=key, ciphertext=ciphertext, nonce=nonce, tag=tag)
+
+    def _get_shared_item_field(self, name: str, field: str) -> str:
+        shared_item = get_shared_item_by_name_and_user_id(name, self._user_id, self._connection)
+
+        if shared_item is None:
+            raise AgentRequestError(f'There is no Account named {name}')
+
+        item_id, name, url, username, _ = shared_item
+
+        if field != 'password':
+            return {'name': name, 'url': url, 'username': username}[field] or ''
+
+        # The private key is decrypted with the user key, which is derived once per process, so only the first shared
+        # password blocks the loop for an Argon2 run
+        return get_decrypted_shared_item_password(item_id, self._user_id, self._master_password, self._connection)
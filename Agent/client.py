@@ -0,0 +1,93 @@
+import socket
+from typing import Any, List, Optional, Tuple
+
+from Agent.protocol import encode_frame, receive_frame, default_socket_path, is_own_user
+
+
+class AgentError(Exception):
+    """
+    Raised when the agent cannot be reached or returns an error.
+    """
+
+
+class AgentClient:
+    """
+    A blocking client for the agent. One connection is kept open for all requests until close() is called; it can also
+    be used as a context manager.
+    """
+    def __init__(self, socket_path: Optional[str] = None, timeout: float = 30.0):
+        """
+        :param socket_path: the path of the agent's socket (defaults to default_socket_path())
+        :param timeout: the seconds to wait for a response, which can include deriving a key that is not cached yet
+        """
+        self.socket_path = socket_path or default_socket_path()
+        self.timeout = timeout
+        self._socket: Optional[socket.socket] = None
+
+    def __enter__(self) -> 'AgentClient':
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        if self._socket is not None:
+            self._socket.close()
+            self._socket = None
+
+    def _connect(self) -> socket.socket:
+        if self._socket is None:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(self.timeout)
+
+            try:
+                sock.connect(self.socket_path)
+            except OSError as e:
+                sock.close()
+                raise AgentError(f'Could not connect to the agent at {self.socket_path}: {e}')
+
+            if not is_own_user(sock):
+                sock.close()
+                raise AgentError(f'The agent at {self.socket_path} runs as another user')
+
+            self._socket = sock
+
+        return self._socket
+
+    def request(self, op: str, **params) -> Any:
+        """
+        Sends a request to the agent and returns its result.
+        :raise AgentError: if the agent cannot be reached or returns an error
+        """
+        sock = self._connect()
+
+        try:
+            sock.sendall(encode_frame({'op': op, **params}))
+            response = receive_frame(sock)
+        except (OSError, ValueError) as e:
+            self.close()
+            raise AgentError(f'The request to the agent failed: {e}')
+
+        if not response.get('ok'):
+            raise AgentError(response.get('error', 'The agent returned an error'))
+
+        return response.get('result')
+
+    def status(self) -> dict:
+        return self.request('status')
+
+    def lock(self) -> None:
+        self.request('lock')
+        self.close()
+
+    def list_accounts(self) -> List[Tuple[str, Optional[str], str]]:
+        return [tuple(account) for account in self.request('list')]
+
+    def search(self, query: str) -> List[Tuple[str, Optional[str], str]]:
+        return [tuple(account) for account in self.request('search', query=query)]
+
+    def match(self, url: str) -> List[Tuple[str, Optional[str], str]]:
+        return [tuple(account) for account in self.request('match', url=url)]
+
+    def get(self, name: str, field: str = 'password') -> str:
+        return self.request('get', name=name, field=field)
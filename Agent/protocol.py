@@ -0,0 +1,175 @@
+import json
+import os
+import socket
+import stat
+import tempfile
+import struct
+from typing import Any, Dict, Optional, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from asyncio import StreamReader
+
+# The agent protocol: every request and response is one frame, a 4-byte big-endian length followed by that many bytes
+# of compact UTF-8 JSON. Requests are objects with an "op" key (and the op's parameters); responses are either
+# {"ok": true, "result": ...} or {"ok": false, "error": "..."}.
+#
+# Only the user running the agent may talk to it: the default socket is in a directory private to that user (mode
+# 0700, created by the agent and refused if anyone else owns it or can enter it, which matters when it falls back to
+# the shared temporary directory), the socket itself is created with mode 0600, and both ends check the uid of their
+# peer where the platform reports it (SO_PEERCRED).
+#
+# The clients (and the CLI, which imports them) only need the blocking half of this module, so asyncio is only
+# imported by the agent's read_frame.
+
+SOCKET_ENV_VAR = 'PPM_AGENT_SOCKET'
+
+HEADER = struct.Struct('>I')
+MAX_FRAME_SIZE = 1 << 20
+
+DEFAULT_IDLE_TIMEOUT = 15 * 60
+
+
+def default_socket_directory() -> str:
+    """
+    Returns the per-user directory of the default socket, in the runtime directory (or the temporary directory).
+    """
+    directory = os.environ.get('XDG_RUNTIME_DIR') or tempfile.gettempdir()
+    user = os.getuid() if hasattr(os, 'getuid') else os.getlogin()
+
+    return os.path.join(directory, f'ppm-agent-{user}')
+
+
+def default_socket_path() -> str:
+    """
+    Returns the socket path from the PPM_AGENT_SOCKET environment variable, or else a path in the per-user directory
+    (see default_socket_directory).
+    """
+    if os.environ.get(SOCKET_ENV_VAR):
+        return os.environ[SOCKET_ENV_VAR]
+
+    return os.path.join(default_socket_directory(), 'agent.sock')
+
+
+def check_private_directory(directory: str) -> None:
+    """
+    Checks that the given directory is a real directory (not a symbolic link) that only the current user owns and can
+    access.
+    :raise ValueError: if it is not
+    """
+    status = os.lstat(directory)
+
+    if not stat.S_ISDIR(status.st_mode) or status.st_uid != os.getuid() or stat.S_IMODE(status.st_mode) & 0o077:
+        raise ValueError(f'{directory} is not a directory private to the current user')
+
+
+def peer_uid(sock: socket.socket) -> Optional[int]:
+    """
+    Returns the uid of the process at the other end of the given Unix domain socket, or None if the platform does not
+    report it.
+    """
+    if not hasattr(socket, 'SO_PEERCRED'):
+        return None
+
+    credentials = struct.Struct('3i')
+    _, uid, _ = credentials.unpack(sock.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, credentials.size))
+
+    return uid
+
+
+def is_own_user(sock: socket.socket) -> bool:
+    """
+    Returns whether the process at the other end of the given Unix domain socket runs as the current user (True if the
+    platform does not report it).
+    """
+    uid = peer_uid(sock)
+
+    return uid is None or uid == os.getuid()
+
+
+class ProtocolError(ValueError):
+    """
+    Raised for frames that are oversized, truncated, or not a JSON object.
+    """
+
+
+def encode_frame(message: Dict[str, Any]) -> bytes:
+    """
+    Encodes the given message as a frame.
+    :raise ProtocolError: if the encoded message is larger than MAX_FRAME_SIZE
+    """
+    body = json.dumps(message, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+
+    if len(body) > MAX_FRAME_SIZE:
+        raise ProtocolError(f'The message is larger than the maximum frame size ({len(body)} > {MAX_FRAME_SIZE})')
+
+    return HEADER.pack(len(body)) + body
+
+
+def decode_frame_body(body: bytes) -> Dict[str, Any]:
+    try:
+        message = json.loads(body.decode('utf-8'))
+    except (UnicodeDecodeError, json.JSONDecodeError) as e:
+        raise ProtocolError(f'The frame is not valid JSON: {e}')
+
+    if not isinstance(message, dict):
+        raise ProtocolError('The frame is not a JSON object')
+
+    return message
+
+
+def _check_length(length: int):
+    if length > MAX_FRAME_SIZE:
+        raise ProtocolError(f'The frame is larger than the maximum frame size ({length} > {MAX_FRAME_SIZE})')
+
+
+async def read_frame(reader: 'StreamReader') -> Optional[Dict[str, Any]]:
+    """
+    Reads one frame from the given stream.
+    :return: the decoded message, or None if the stream ended cleanly before a new frame
+    :raise ProtocolError: if the frame is invalid or the stream ended in the middle of it
+    """
+    from asyncio import IncompleteReadError
+
+    try:
+        header = await reader.readexactly(HEADER.size)
+    except IncompleteReadError as e:
+        if not e.partial:
+            return None
+
+        raise ProtocolError('The stream ended in the middle of a frame header')
+
+    length = HEADER.unpack(header)[0]
+    _check_length(length)
+
+    try:
+        body = await reader.readexactly(length)
+    except IncompleteReadError:
+        raise ProtocolError('The stream ended in the middle of a frame')
+
+    return decode_frame_body(body)
+
+
+def _receive_exactly(sock: socket.socket, size: int) -> bytes:
+    chunks = []
+
+    while size:
+        chunk = sock.recv(size)
+
+        if not chunk:
+            raise ProtocolError('The connection was closed in the middle of a frame')
+
+        chunks.append(chunk)
+        size -= len(chunk)
+
+    return b''.join(chunks)
+
+
+def receive_frame(sock: socket.socket) -> Dict[str, Any]:
+    """
+    Reads one frame from the given blocking socket.
+    :raise ProtocolError: if the frame is invalid or the connection was closed before a complete frame
+    """
+    length = HEADER.unpack(_receive_exactly(sock, HEADER.size))[0]
+    _check_length(length)
+
+    return decode_frame_body(_receive_exactly(sock, length))
@@ -0,0 +1,235 @@
+import os
+import shutil
+import socket
+import stat
+import statistics
+import struct
+import tempfile
+import threading
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+from Agent.agent import VaultAgent
+from Agent.client import AgentClient, AgentError
+from Agent.protocol import MAX_FRAME_SIZE, SOCKET_ENV_VAR, receive_frame, default_socket_path
+from Database.database_setup import setup_database
+import Utils.database
+from Utils.database import create_user, create_account
+from Utils.sql_trace import connect
+
+MASTER_PASSWORD = 'MasterPassword'
+ACCOUNTS = [('Company 1', 'https://www.example.com', 'user1', 'Password1'),
+            ('Company 2', None, 'user2', 'Password2'),
+            ('Bank', 'https://bank.example.com', 'banker', 'Password3')]
+
+
+class AgentTests(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls) -> None:
+        cls.directory = tempfile.mkdtemp()
+        cls.database = os.path.join(cls.directory, 'vault.sqlite3')
+
+        setup_database(cls.database)
+        connection = connect(cls.database)
+        user_id = create_user(email='agent@gmail.com', password=MASTER_PASSWORD, connection=connection)
+
+        for name, url, username, password in ACCOUNTS:
+            create_account(user_id=user_id, master_password=MASTER_PASSWORD, name=name, url=url, username=username,
+                           password=password, connection=connection)
+
+        connection.close()
+
+    @classmethod
+    def tearDownClass(cls) -> None:
+        shutil.rmtree(cls.directory)
+
+    def setUp(self) -> None:
+        self.socket_path = os.path.join(self.directory, 'agent.sock')
+        self.agents = []
+
+    def tearDown(self) -> None:
+        for agent, thread in self.agents:
+            agent.stop()
+            thread.join()
+
+    def start_agent(self, master_password: str = MASTER_PASSWORD, **kwargs) -> VaultAgent:
+        agent = VaultAgent(database=self.database, email='agent@gmail.com', master_password=master_password,
+                           socket_path=self.socket_path, **kwargs)
+
+        def run():
+            try:
+                agent.run()
+            except ValueError:
+                pass
+
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        self.agents.append((agent, thread))
+        agent.ready.wait()
+
+        return agent
+
+    def wait_for_prefetch(self, agent: VaultAgent):
+        deadline = time.perf_counter() + 30
+
+        while agent.cached_key_count < len(ACCOUNTS):
+            self.assertLess(time.perf_counter(), deadline)
+            time.sleep(0.05)
+
+    def test_list_search_and_get(self):
+        self.start_agent()
+
+        with AgentClient(self.socket_path) as client:
+            self.assertEqual([(name, url, username) for name, url, username, _ in ACCOUNTS], client.list_accounts())
+            self.assertEqual([('Bank', 'https://bank.example.com', 'banker')], client.search('BANK'))
+            self.assertEqual([('Bank', 'https://bank.example.com', 'banker'),
+                              ('Company 1', 'https://www.example.com', 'user1')],
+                             client.match('https://login.example.com/path'))
+            self.assertEqual('Password2', client.get('company 2'))
+            self.assertEqual('user1', client.get('Company 1', field='username'))
+            self.assertEqual('', client.get('Company 2', field='url'))
+
+            with self.assertRaises(AgentError):
+                client.get('Missing')
+
+            # The connection stays usable after an error response
+            self.assertEqual('agent@gmail.com', client.status()['email'])
+
+    def test_cached_lookups_are_sub_millisecond(self):
+        """
+        Once the keys are prefetched, a get (including the round trip over the socket) takes well under a millisecond.
+        """
+        agent = self.start_agent()
+        self.wait_for_prefetch(agent)
+
+        with AgentClient(self.socket_path) as client:
+            client.get('Company 1')
+            timings = []
+
+            for _ in range(200):
+                start = time.perf_counter()
+                client.get('Company 1')
+                timings.append(time.perf_counter() - start)
+
+        self.assertLess(statistics.median(timings), 0.001)
+
+    def test_keys_are_derived_on_demand_without_prefetch(self):
+        agent = self.start_agent(prefetch=False)
+
+        with AgentClient(self.socket_path) as client:
+            self.assertEqual('Password3', client.get('Bank'))
+            self.assertEqual('Password3', client.get('Bank'))
+
+        self.assertEqual(1, agent.cached_key_count)
+
+    def test_concurrent_clients(self):
+        self.start_agent()
+
+        def lookups(index: int):
+            name, _, _, password = ACCOUNTS[index % len(ACCOUNTS)]
+
+            with AgentClient(self.socket_path) as client:
+                return all(client.get(name) == password for _ in range(20))
+
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            self.assertTrue(all(executor.map(lookups, range(8))))
+
+    def test_idle_timeout_locks_and_exits(self):
+        agent = self.start_agent(idle_timeout=0.3, prefetch=False)
+        thread = self.agents[-1][1]
+
+        thread.join(timeout=5)
+
+        self.assertFalse(thread.is_alive())
+        self.assertFalse(os.path.exists(self.socket_path))
+        self.assertEqual(0, agent.cached_key_count)
+
+        with self.assertRaises(AgentError):
+            AgentClient(self.socket_path).status()
+
+    def test_lock(self):
+        """
+        Locking also empties the key caches of Utils.database, which are shared with the rest of the process.
+        """
+        self.start_agent(prefetch=False)
+        thread = self.agents[-1][1]
+
+        # As unlocking a sealed User in this process would
+        Utils.database._derive_user_key(1, MASTER_PASSWORD, b'sixteen byte salt')
+        Utils.database._metadata_keys[b'sixteen byte salt'] = (b'metadata key', b'blind index key')
+
+        AgentClient(self.socket_path).lock()
+        thread.join(timeout=5)
+
+        self.assertFalse(thread.is_alive())
+        self.assertFalse(os.path.exists(self.socket_path))
+        self.assertEqual({}, Utils.database._user_keys)
+        self.assertEqual({}, Utils.database._metadata_keys)
+
+    def test_invalid_master_password(self):
+        agent = self.start_agent(master_password='WrongPassword')
+
+        self.assertIsInstance(agent.start_error, ValueError)
+        self.assertFalse(os.path.exists(self.socket_path))
+
+    def test_default_socket_is_private(self):
+        """
+        The default socket is created with mode 0600 in a directory with mode 0700, and a directory that is not private
+        is refused.
+        """
+        runtime_directory = os.path.join(self.directory, 'runtime')
+        os.mkdir(runtime_directory)
+
+        with mock.patch.dict(os.environ, {'XDG_RUNTIME_DIR': runtime_directory}):
+            os.environ.pop(SOCKET_ENV_VAR, None)
+            self.socket_path = None
+            agent = self.start_agent(prefetch=False)
+
+            self.assertIsNone(agent.start_error)
+            self.assertEqual(default_socket_path(), agent.socket_path)
+            self.assertEqual(0o600, stat.S_IMODE(os.stat(agent.socket_path).st_mode))
+            self.assertEqual(0o700, stat.S_IMODE(os.stat(os.path.dirname(agent.socket_path)).st_mode))
+
+            with AgentClient(agent.socket_path) as client:
+                self.assertEqual('agent@gmail.com', client.status()['email'])
+
+            agent.stop()
+            self.agents.pop()[1].join()
+            os.chmod(os.path.dirname(agent.socket_path), 0o755)
+
+            self.assertIsInstance(self.start_agent(prefetch=False).start_error, ValueError)
+
+    def test_peers_of_another_user_are_refused(self):
+        self.start_agent(prefetch=False)
+
+        with mock.patch('Agent.agent.is_own_user', return_value=False):
+            with self.assertRaises(AgentError):
+                AgentClient(self.socket_path).status()
+
+        with mock.patch('Agent.client.is_own_user', return_value=False):
+            with self.assertRaises(AgentError) as context:
+                AgentClient(self.socket_path).status()
+
+        self.assertIn('another user', str(context.exception))
+
+    def test_invalid_frames(self):
+        """
+        Oversized and malformed frames get an error response and the connection is closed.
+        """
+        self.start_agent(prefetch=False)
+
+        for frame in (struct.pack('>I', MAX_FRAME_SIZE + 1), struct.pack('>I', 3) + b'{]}',
+                      struct.pack('>I', 2) + b'[]'):
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(5)
+            sock.connect(self.socket_path)
+            sock.sendall(frame)
+
+            self.assertFalse(receive_frame(sock)['ok'])
+            self.assertEqual(b'', sock.recv(1))
+            sock.close()
+
+        with self.assertRaises(AgentError):
+            AgentClient(self.socket_path).request('unknown')
@@ -0,0 +1,1081 @@
+import gc
+import io
+import json
+import os
+import platform
+import shutil
+import sqlite3
+import statistics
+import tempfile
+import tracemalloc
+from argparse import ArgumentParser
+from csv import DictWriter
+from datetime import datetime, timezone
+from itertools import count
+from time import perf_counter
+from typing import Callable, Dict, List, Optional, Tuple, Any
+
+from Benchmarks.synthetic_vault import create_synthetic_vault_file, generate_account_fields, DEFAULT_MASTER_PASSWORD
+from Utils.cryptography import derive_256_bit_salt_and_key, encrypt_aes_256_gcm, decrypt_aes_256_gcm, derive_subkey, \
+    keyed_fingerprint, generate_x25519_key_pair, wrap_key, unwrap_key, encrypt_chunk, decrypt_chunk
+from Utils.database import create_user, create_account, create_accounts, edit_account, delete_account, \
+    get_user_id_by_email, get_login_password_by_user_id, get_account_id_by_account_name_and_user_id, \
+    get_account_name_url_and_username_by_account_id, get_all_account_names_urls_and_usernames_by_user_id, \
+    get_all_account_ids_names_urls_and_usernames_by_user_id, get_decrypted_account_password, \
+    get_all_decrypted_account_passwords_by_user_id, get_encrypted_account_password, get_all_account_salts_by_user_id, \
+    index_account_urls, find_accounts_for_url, fingerprint_account_passwords, get_reused_account_passwords_by_user_id, \
+    get_current_revision, changes_since, compact_account_changes, get_account_version, is_valid_login, \
+    rehash_and_reencrypt_passwords, db_setup, seal_account_metadata, is_account_metadata_sealed, \
+    reveal_sealed_account_metadata, search_accounts, create_shared_item, add_shared_item_member, \
+    remove_shared_item_member, delete_shared_item, get_shared_items_by_user_id, get_shared_item_by_name_and_user_id, \
+    get_decrypted_shared_item_password, add_attachment, add_note, get_attachments_by_account_id, \
+    get_attachment_id_by_name_and_account_id, read_attachment, get_decrypted_note, delete_attachment, \
+    ATTACHMENT_CHUNK_SIZE, forget_unlocked_keys
+from Utils.backup import create_backup
+from Utils.breach_check import convert_hash_dump, BreachedPasswordFile, sha1_digest
+from Utils.encrypted_export import export_accounts_encrypted
+from Utils.encrypted_vault import EncryptedVault, encrypt_database_file
+from Utils.import_export import import_accounts_from_csv, export_accounts_to_csv, export_accounts_to_ndjson
+from Utils.importers import import_accounts_from_file
+from Utils.sharded_vault import shard_database_file
+from Utils.storage import StorageBackend, SQLiteBackend, LogStructuredBackend
+from Utils.sync import sync_vaults
+from Utils.vault_check import check_vault
+
+# Repeatable timing and memory benchmarks for the Utils functions and the import, export, and search paths, run
+# against synthetic vaults of configurable sizes. Usage:
+#
+#   python -m Benchmarks.benchmarks --sizes 1000 100000 --output results.json
+#   python -m Benchmarks.benchmarks --sizes 1000 --baseline results.json
+#
+# Timings are per call. Memory is the peak of Python allocations (tracemalloc) during a single call, measured in a
+# separate run so that tracing does not skew the timings. SQLite's own page cache is not included.
+
+# Minimum total duration of one timed repeat; cheap benchmarks are looped until they reach it (like timeit.autorange)
+MIN_REPEAT_SECONDS = 0.05
+
+DEFAULT_TOLERANCE = 0.10
+
+# The size of the attachment benchmarks' content, which spans several chunks
+ATTACHMENT_BENCHMARK_SIZE = 1024 * 1024
+
+BENCHMARKS: Dict[str, 'Benchmark'] = {}
+
+
+class BenchmarkContext:
+    """
+    The state shared by the benchmarks for one synthetic vault size: a database file with a large synthetic User (for
+    the query benchmarks) and a small one (for the benchmarks that run Argon2 once per Account).
+    """
+    def __init__(self, db_name: str, account_count: int, kdf_sample_size: int, key_pool_size: int, seed: int = 0):
+        self.db_name = db_name
+        self.account_count = account_count
+        self.master_password = DEFAULT_MASTER_PASSWORD
+        self.large_user_id, self.small_user_id = create_synthetic_vault_file(db_name, account_count,
+                                                                             kdf_sample_size=kdf_sample_size,
+                                                                             master_password=self.master_password,
+                                                                             key_pool_size=key_pool_size, seed=seed)
+
+        self.connection = sqlite3.connect(db_name)
+        self.connection.execute("PRAGMA foreign_keys = ON;")
+
+        self.large_user_email = f'large{seed}@example.com'
+
+        cursor = self.connection.cursor()
+        cursor.execute("SELECT id, name FROM accounts WHERE user_id=? ORDER BY id LIMIT 1 OFFSET ?",
+                       (self.large_user_id, account_count // 2))
+        self.sample_account_id, self.sample_account_name = cursor.fetchone()
+        cursor.close()
+
+        self.salt, self.key = derive_256_bit_salt_and_key(self.master_password)
+        self.plaintext = 'Sample account password 123!'
+        self.ciphertext, self.nonce, self.tag = encrypt_aes_256_gcm(self.key, self.plaintext)
+        self.private_key, self.public_key = generate_x25519_key_pair()
+        self.wrapped_key = wrap_key(self.key, self.public_key)
+        self.attachment_content = os.urandom(ATTACHMENT_BENCHMARK_SIZE)
+        self.chunk_ciphertext, self.chunk_tag = encrypt_chunk(self.key, 0, False,
+                                                              self.attachment_content[:ATTACHMENT_CHUNK_SIZE])
+
+        # A CSV file in the format the GUI import expects, with as many rows as the small User has Accounts
+        self.import_csv_name = os.path.join(os.path.dirname(db_name), f'import_{account_count}.csv')
+
+        with open(self.import_csv_name, 'w', encoding='utf-8-sig', newline='') as csv_file:
+            writer = DictWriter(csv_file, fieldnames=['name', 'url', 'username', 'password'])
+            writer.writeheader()
+
+            for name, url, username, password in generate_account_fields(kdf_sample_size, seed=seed + 2):
+                writer.writerow({'name': name, 'url': url or '', 'username': username, 'password': password})
+
+        self._unique_counter = count()
+        self._breached_password_file: Optional[BreachedPasswordFile] = None
+        self._sync_peer_name: Optional[str] = None
+        self._encrypted_vault_name: Optional[str] = None
+        self._sealed_user_id: Optional[int] = None
+        self._shared_item_id: Optional[int] = None
+        self.shared_item_member_id: Optional[int] = None
+        self._attachment_id: Optional[int] = None
+        self.note_id: Optional[int] = None
+        self._storage_backends: Dict[str, Tuple[StorageBackend, int]] = {}
+
+    def breached_password_file(self) -> BreachedPasswordFile:
+        """
+        Returns a breached-password corpus with as many hashes as the vault has Accounts, which is written on first use.
+        """
+        if self._breached_password_file is None:
+            directory = os.path.dirname(self.db_name)
+            dump_name = os.path.join(directory, f'breached_{self.account_count}.txt')
+            corpus_name = os.path.join(directory, f'breached_{self.account_count}.bin')
+
+            with open(dump_name, 'w', encoding='utf-8') as dump_file:
+                for i in range(self.account_count):
+                    dump_file.write(f'{sha1_digest(f"breached{i}").hex().upper()}:{i + 1}\n')
+
+            convert_hash_dump(dump_name, corpus_name)
+            self._breached_password_file = BreachedPasswordFile(corpus_name)
+
+        return self._breached_password_file
+
+    def sync_peer_name(self) -> str:
+        """
+        Returns the path of a copy of the vault, to sync with, which is made on first use.
+        """
+        if self._sync_peer_name is None:
+            self._sync_peer_name = os.path.join(os.path.dirname(self.db_name), f'peer_{self.account_count}.sqlite3')
+
+            if os.path.exists(self._sync_peer_name):
+                os.remove(self._sync_peer_name)
+
+            peer_connection = sqlite3.connect(self._sync_peer_name)
+            self.connection.backup(peer_connection)
+            peer_connection.close()
+
+        return self._sync_peer_name
+
+    def encrypted_vault_name(self) -> str:
+        """
+        Returns the path of an encrypted vault of the database, which is written on first use.
+        """
+        if self._encrypted_vault_name is None:
+            self._encrypted_vault_name = os.path.join(os.path.dirname(self.db_name),
+                                                      f'vault_{self.account_count}.ppmvault')
+
+            if os.path.exists(self._encrypted_vault_name):
+                os.remove(self._encrypted_vault_name)
+
+            self.connection.commit()
+            encrypt_database_file(self.db_name, self._encrypted_vault_name, self.master_password)
+
+        return self._encrypted_vault_name
+
+    def sealed_user_id(self) -> int:
+        """
+        Returns the id of a User with a copy of the large User's Accounts whose metadata is sealed, which is made on
+        first use.
+        """
+        if self._sealed_user_id is None:
+            self._sealed_user_id = create_user(email=f'sealed{self.account_count}@example.com',
+                                               password=self.master_password, connection=self.connection)
+
+            self.connection.execute("""INSERT INTO accounts (name, url, username, password, salt, nonce, tag, user_id)
+            SELECT name, url, username, password, salt, nonce, tag, ? FROM accounts WHERE user_id=? ORDER BY id""",
+                                    (self._sealed_user_id, self.large_user_id))
+            seal_account_metadata(self._sealed_user_id, self.master_password, self.connection)
+
+        return self._sealed_user_id
+
+    def shared_item_id(self) -> int:
+        """
+        Returns the id of an item the large User shares with another User (shared_item_member_id), which is made, along
+        with the key pairs of both Users, on first use.
+        """
+        if self._shared_item_id is None:
+            member_email = f'member{self.account_count}@example.com'
+            self.shared_item_member_id = create_user(email=member_email, password=self.master_password,
+                                                     connection=self.connection)
+            is_valid_login(email=member_email, entered_password=self.master_password, connection=self.connection)
+
+            self._shared_item_id = create_shared_item(self.large_user_id, self.master_password, 'Shared item', None,
+                                                      'shared', self.plaintext, [self.shared_item_member_id],
+                                                      self.connection)
+
+        return self._shared_item_id
+
+    def attachment_id(self) -> int:
+        """
+        Returns the id of an attachment of the sample Account with the attachment_content, which is added, along with a
+        note (note_id), on first use.
+        """
+        if self._attachment_id is None:
+            self._attachment_id = add_attachment(self.sample_account_id, self.master_password, 'Attachment',
+                                                 io.BytesIO(self.attachment_content), self.connection)
+            self.note_id = add_note(self.sample_account_id, self.master_password, 'Note', self.plaintext * 100,
+                                    self.connection)
+
+        return self._attachment_id
+
+    def storage_backend(self, backend_name: str) -> Tuple[StorageBackend, int]:
+        """
+        Returns the storage backend with the given name (sqlite or log) and the id of the User with the large User's
+        Accounts in it. The log is written, with a copy of the large User's Accounts, on first use.
+        """
+        if not self._storage_backends:
+            sqlite_backend = SQLiteBackend(self.connection)
+            self._storage_backends['sqlite'] = (sqlite_backend, self.large_user_id)
+
+            log_name = os.path.join(os.path.dirname(self.db_name), f'vault_{self.account_count}.ppmlog')
+
+            if os.path.exists(log_name):
+                os.remove(log_name)
+
+            log_backend = LogStructuredBackend(log_name)
+
+            with log_backend.transaction():
+                log_user_id = log_backend.add_user(self.large_user_email,
+                                                   sqlite_backend.get_user_password(self.large_user_id))
+
+                for account in sqlite_backend.list_accounts(self.large_user_id):
+                    log_backend.add_account(log_user_id, account.name, account.url, account.username, account[5:])
+
+            self._storage_backends['log'] = (log_backend, log_user_id)
+
+        return self._storage_backends[backend_name]
+
+    def unique_suffix(self) -> int:
+        """
+        Returns a number that has not been returned before, for benchmarks that need fresh Account names or emails.
+        """
+        return next(self._unique_counter)
+
+    def close(self):
+        self.connection.close()
+
+        if self._breached_password_file is not None:
+            self._breached_password_file.close()
+
+        if 'log' in self._storage_backends:
+            self._storage_backends['log'][0].close()
+
+
+class Benchmark:
+    """
+    A registered benchmark: the callable to time and an optional setup callable that runs before every timed call
+    (outside the timed region) and whose result is passed to it.
+    """
+    def __init__(self, name: str, run: Callable[[BenchmarkContext, Any], Any],
+                 setup: Optional[Callable[[BenchmarkContext], Any]] = None):
+        self.name = name
+        self.run = run
+        self.setup = setup
+
+
+def benchmark(name: str, setup: Optional[Callable[[BenchmarkContext], Any]] = None):
+    """
+    Registers the decorated function as the benchmark with the given name.
+    :param name: the unique name of the benchmark, prefixed by the area it covers
+    :param setup: an optional callable that prepares each call (not timed), whose result is passed to the benchmark
+    """
+    def decorator(run: Callable[[BenchmarkContext, Any], Any]):
+        if name in BENCHMARKS:
+            raise ValueError(f'A benchmark with the name {name} is already registered')
+
+        BENCHMARKS[name] = Benchmark(name, run, setup)
+        return run
+
+    return decorator
+
+
+def time_benchmark(bench: Benchmark, context: BenchmarkContext, repeat: int) -> Dict[str, Any]:
+    """
+    Times the given benchmark repeat times, with garbage collection disabled during each timed region, and measures
+    the peak Python memory of one additional call.
+    :return: the timing statistics (per call, in seconds) and the peak memory in bytes
+    """
+    # Benchmarks without per-call setup are looped until one repeat takes long enough to time reliably
+    number = 1
+
+    if bench.setup is None:
+        while True:
+            start = perf_counter()
+            for _ in range(number):
+                bench.run(context, None)
+            if perf_counter() - start >= MIN_REPEAT_SECONDS or number >= 1_000_000:
+                break
+            number *= 10
+
+    timings = []
+
+    for _ in range(repeat):
+        setup_results = [bench.setup(context) if bench.setup else None for _ in range(number)]
+
+        gc_was_enabled = gc.isenabled()
+        gc.disable()
+
+        try:
+            start = perf_counter()
+            for setup_result in setup_results:
+                bench.run(context, setup_result)
+            elapsed = perf_counter() - start
+        finally:
+            if gc_was_enabled:
+                gc.enable()
+
+        timings.append(elapsed / number)
+
+    setup_result = bench.setup(context) if bench.setup else None
+
+    tracemalloc.start()
+    try:
+        tracemalloc.reset_peak()
+        bench.run(context, setup_result)
+        peak_memory = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    return {'name': bench.name,
+            'accounts': context.account_count,
+            'repeat': repeat,
+            'number': number,
+            'min_s': min(timings),
+            'median_s': statistics.median(timings),
+            'mean_s': statistics.mean(timings),
+            'stdev_s': statistics.stdev(timings) if len(timings) > 1 else 0.0,
+            'peak_memory_bytes': peak_memory}
+
+
+def run_benchmarks(sizes: List[int], repeat: int = 5, kdf_sample_size: int = 8, key_pool_size: int = 4,
+                   name_filter: Optional[str] = None, directory: Optional[str] = None,
+                   progress: Optional[Callable[[str], None]] = None) -> Dict[str, Any]:
+    """
+    Runs the registered benchmarks (optionally only those whose name contains name_filter) against a freshly generated
+    synthetic vault for each of the given sizes.
+    :param sizes: the numbers of Accounts of the synthetic vaults to benchmark against
+    :param repeat: the number of timed repeats per benchmark
+    :param kdf_sample_size: the number of Accounts used by the benchmarks that run Argon2 once per Account
+    :param key_pool_size: the number of Argon2-derived keys the synthetic rows are encrypted with
+    :param name_filter: only run benchmarks whose name contains this string
+    :param directory: where to create the synthetic vault files (a temporary directory if not provided)
+    :param progress: an optional callable that receives a message before each benchmark runs
+    :return: the results document, with metadata about the environment and one record per benchmark and size
+    """
+    results = []
+    selected = [bench for name, bench in BENCHMARKS.items() if not name_filter or name_filter in name]
+
+    with tempfile.TemporaryDirectory() as temporary_directory:
+        for size in sizes:
+            db_name = os.path.join(directory or temporary_directory, f'synthetic_vault_{size}.sqlite3')
+
+            if os.path.exists(db_name):
+                os.remove(db_name)
+
+            context = BenchmarkContext(db_name, size, kdf_sample_size=kdf_sample_size, key_pool_size=key_pool_size)
+
+            try:
+                for bench in selected:
+                    if progress:
+                        progress(f'{bench.name} [{size} accounts]')
+                    results.append(time_benchmark(bench, context, repeat))
+            finally:
+                context.close()
+
+    return {'metadata': {'created': datetime.now(timezone.utc).isoformat(),
+                         'python': platform.python_version(),
+                         'sqlite': sqlite3.sqlite_version,
+                         'platform': platform.platform(),
+                         'processor': platform.processor(),
+                         'repeat': repeat,
+                         'kdf_sample_size': kdf_sample_size,
+                         'key_pool_size': key_pool_size},
+            'results': results}
+
+
+def compare_to_baseline(results: Dict[str, Any], baseline: Dict[str, Any], tolerance: float = DEFAULT_TOLERANCE)\
+        -> List[Dict[str, Any]]:
+    """
+    Compares the median timings of the given results against a saved baseline results document. A benchmark counts as
+    a regression (or an improvement) when its median is more than tolerance slower (or faster) than the baseline's.
+    :param results: the results document of the current run
+    :param baseline: a previously saved results document
+    :param tolerance: the allowed relative difference before a change is reported, e.g. 0.1 for 10%
+    :return: one comparison record per benchmark and size in the current results
+    """
+    baseline_medians = {(record['name'], record['accounts']): record['median_s'] for record in baseline['results']}
+    comparisons = []
+
+    for record in results['results']:
+        baseline_median = baseline_medians.get((record['name'], record['accounts']))
+
+        if baseline_median is None:
+            ratio = None
+            status = 'new'
+        else:
+            ratio = record['median_s'] / baseline_median if baseline_median else float('inf')
+
+            if ratio > 1 + tolerance:
+                status = 'regression'
+            elif ratio < 1 - tolerance:
+                status = 'improvement'
+            else:
+                status = 'unchanged'
+
+        comparisons.append({'name': record['name'], 'accounts': record['accounts'], 'baseline_median_s': baseline_median,
+                            'median_s': record['median_s'], 'ratio': ratio, 'status': status})
+
+    return comparisons
+
+
+# Utils.cryptography benchmarks:
+
+@benchmark('cryptography.derive_256_bit_salt_and_key')
+def _derive_256_bit_salt_and_key(context: BenchmarkContext, _):
+    derive_256_bit_salt_and_key(context.master_password, context.salt)
+
+
+@benchmark('cryptography.encrypt_aes_256_gcm')
+def _encrypt_aes_256_gcm(context: BenchmarkContext, _):
+    encrypt_aes_256_gcm(context.key, context.plaintext)
+
+
+@benchmark('cryptography.derive_subkey')
+def _derive_subkey(context: BenchmarkContext, _):
+    derive_subkey(context.key, 'benchmark')
+
+
+@benchmark('cryptography.keyed_fingerprint')
+def _keyed_fingerprint(context: BenchmarkContext, _):
+    keyed_fingerprint(context.key, context.plaintext)
+
+
+@benchmark('cryptography.decrypt_aes_256_gcm')
+def _decrypt_aes_256_gcm(context: BenchmarkContext, _):
+    decrypt_aes_256_gcm(context.key, context.ciphertext, context.nonce, context.tag)
+
+
+@benchmark('cryptography.generate_x25519_key_pair')
+def _generate_x25519_key_pair(context: BenchmarkContext, _):
+    generate_x25519_key_pair()
+
+
+@benchmark('cryptography.wrap_key')
+def _wrap_key(context: BenchmarkContext, _):
+    wrap_key(context.key, context.public_key)
+
+
+@benchmark('cryptography.unwrap_key')
+def _unwrap_key(context: BenchmarkContext, _):
+    unwrap_key(context.wrapped_key, context.private_key)
+
+
+@benchmark('cryptography.encrypt_chunk')
+def _encrypt_chunk(context: BenchmarkContext, _):
+    encrypt_chunk(context.key, 0, False, context.attachment_content[:ATTACHMENT_CHUNK_SIZE])
+
+
+@benchmark('cryptography.decrypt_chunk')
+def _decrypt_chunk(context: BenchmarkContext, _):
+    decrypt_chunk(context.key, 0, False, context.chunk_ciphertext, context.chunk_tag)
+
+
+# Utils.database benchmarks:
+
+def _unique_email(context: BenchmarkContext) -> str:
+    return f'benchmark{context.unique_suffix()}@example.com'
+
+
+def _create_throwaway_account(context: BenchmarkContext) -> int:
+    """
+    Inserts an Account for the large User without running the KDF, for the benchmarks that modify or remove one.
+    """
+    cursor = context.connection.cursor()
+    cursor.execute("""INSERT INTO accounts VALUES (:id, :name, :url, :username, :password, :salt, :nonce, :tag,
+    :user_id) RETURNING id""", {'id': None, 'name': f'Throwaway {context.unique_suffix()}', 'url': None,
+                                'username': 'throwaway', 'password': context.ciphertext, 'salt': context.salt,
+                                'nonce': context.nonce, 'tag': context.tag, 'user_id': context.large_user_id})
+    account_id = cursor.fetchone()[0]
+    context.connection.commit()
+    cursor.close()
+
+    return account_id
+
+
+def _create_throwaway_user(context: BenchmarkContext) -> int:
+    """
+    Creates a User with the synthetic master password and no Accounts, for the benchmarks that fill one up.
+    """
+    return create_user(email=_unique_email(context), password=context.master_password,
+                       connection=context.connection)
+
+
+@benchmark('database.create_user', setup=_unique_email)
+def _create_user(context: BenchmarkContext, email: str):
+    create_user(email=email, password=context.master_password, connection=context.connection)
+
+
+@benchmark('database.create_account', setup=lambda context: f'Benchmark account {context.unique_suffix()}')
+def _create_account(context: BenchmarkContext, name: str):
+    create_account(user_id=context.large_user_id, master_password=context.master_password, name=name,
+                   url='https://www.example.com/login', username='benchmark@example.com', password='Password123',
+                   connection=context.connection)
+
+
+@benchmark('database.create_accounts', setup=_create_throwaway_user)
+def _create_accounts(context: BenchmarkContext, user_id: int):
+    create_accounts(user_id=user_id, master_password=context.master_password,
+                    accounts=[{'name': f'Benchmark account {i}', 'url': 'https://www.example.com/login',
+                               'username': 'benchmark@example.com', 'password': 'Password123'} for i in range(8)],
+                    connection=context.connection)
+
+
+@benchmark('database.edit_account', setup=_create_throwaway_account)
+def _edit_account(context: BenchmarkContext, account_id: int):
+    edit_account(account_id=account_id, connection=context.connection, master_password=context.master_password,
+                 name=f'Edited {account_id}', url='https://www.example.org', username='edited',
+                 password='EditedPassword123')
+
+
+@benchmark('database.delete_account', setup=_create_throwaway_account)
+def _delete_account(context: BenchmarkContext, account_id: int):
+    delete_account(account_id=account_id, connection=context.connection)
+
+
+@benchmark('database.get_account_version')
+def _get_account_version(context: BenchmarkContext, _):
+    get_account_version(account_id=context.sample_account_id, connection=context.connection)
+
+
+@benchmark('database.get_user_id_by_email')
+def _get_user_id_by_email(context: BenchmarkContext, _):
+    get_user_id_by_email(email=context.large_user_email, connection=context.connection)
+
+
+@benchmark('database.get_login_password_by_user_id')
+def _get_login_password_by_user_id(context: BenchmarkContext, _):
+    get_login_password_by_user_id(user_id=context.large_user_id, connection=context.connection)
+
+
+@benchmark('database.get_account_id_by_account_name_and_user_id')
+def _get_account_id_by_account_name_and_user_id(context: BenchmarkContext, _):
+    get_account_id_by_account_name_and_user_id(account_name=context.sample_account_name,
+                                               user_id=context.large_user_id, connection=context.connection)
+
+
+@benchmark('database.get_account_name_url_and_username_by_account_id')
+def _get_account_name_url_and_username_by_account_id(context: BenchmarkContext, _):
+    get_account_name_url_and_username_by_account_id(account_id=context.sample_account_id,
+                                                    connection=context.connection)
+
+
+@benchmark('database.get_all_account_names_urls_and_usernames_by_user_id')
+def _get_all_account_names_urls_and_usernames_by_user_id(context: BenchmarkContext, _):
+    get_all_account_names_urls_and_usernames_by_user_id(user_id=context.large_user_id, connection=context.connection)
+
+
+@benchmark('database.get_all_account_ids_names_urls_and_usernames_by_user_id')
+def _get_all_account_ids_names_urls_and_usernames_by_user_id(context: BenchmarkContext, _):
+    get_all_account_ids_names_urls_and_usernames_by_user_id(user_id=context.large_user_id,
+                                                            connection=context.connection)
+
+
+@benchmark('database.get_decrypted_account_password')
+def _get_decrypted_account_password(context: BenchmarkContext, _):
+    get_decrypted_account_password(account_id=context.sample_account_id, master_password=context.master_password,
+                                   connection=context.connection)
+
+
+@benchmark('database.get_encrypted_account_password')
+def _get_encrypted_account_password(context: BenchmarkContext, _):
+    get_encrypted_account_password(account_id=context.sample_account_id, connection=context.connection)
+
+
+@benchmark('database.get_all_account_salts_by_user_id')
+def _get_all_account_salts_by_user_id(context: BenchmarkContext, _):
+    get_all_account_salts_by_user_id(user_id=context.large_user_id, connection=context.connection)
+
+
+@benchmark('database.get_all_decrypted_account_passwords_by_user_id')
+def _get_all_decrypted_account_passwords_by_user_id(context: BenchmarkContext, _):
+    get_all_decrypted_account_passwords_by_user_id(user_id=context.small_user_id,
+                                                   master_password=context.master_password,
+                                                   connection=context.connection)
+
+
+def _drop_url_index(context: BenchmarkContext):
+    context.connection.execute("DELETE FROM account_urls WHERE user_id=?", (context.large_user_id,))
+    context.connection.commit()
+
+
+@benchmark('database.index_account_urls', setup=_drop_url_index)
+def _index_account_urls(context: BenchmarkContext, _):
+    index_account_urls(connection=context.connection, user_id=context.large_user_id)
+
+
+@benchmark('database.find_accounts_for_url')
+def _find_accounts_for_url(context: BenchmarkContext, _):
+    find_accounts_for_url(user_id=context.large_user_id, url='https://accounts.google.com/signin?continue=mail',
+                          connection=context.connection)
+
+
+def _drop_fingerprints(context: BenchmarkContext):
+    context.connection.execute("DELETE FROM account_fingerprints WHERE user_id=?", (context.small_user_id,))
+    context.connection.commit()
+
+
+@benchmark('database.fingerprint_account_passwords', setup=_drop_fingerprints)
+def _fingerprint_account_passwords(context: BenchmarkContext, _):
+    fingerprint_account_passwords(user_id=context.small_user_id, master_password=context.master_password,
+                                  connection=context.connection)
+
+
+@benchmark('database.get_reused_account_passwords_by_user_id')
+def _get_reused_account_passwords_by_user_id(context: BenchmarkContext, _):
+    get_reused_account_passwords_by_user_id(user_id=context.large_user_id, connection=context.connection)
+
+
+def _change_one_account(context: BenchmarkContext) -> int:
+    """
+    Adds an Account and returns the revision before it, so that changes_since has one change to return.
+    """
+    revision = get_current_revision(context.connection)
+    _create_throwaway_account(context)
+
+    return revision
+
+
+def _create_unsealed_account(context: BenchmarkContext):
+    context.connection.execute("""INSERT INTO accounts (name, url, username, password, salt, nonce, tag, user_id)
+    VALUES (?, NULL, 'throwaway', ?, ?, ?, ?, ?)""", (f'Throwaway {context.unique_suffix()}', context.ciphertext,
+                                                      context.salt, context.nonce, context.tag,
+                                                      context.sealed_user_id()))
+    context.connection.commit()
+
+
+# Runs Argon2 to verify the master password, then seals the one unsealed Account
+@benchmark('database.seal_account_metadata', setup=_create_unsealed_account)
+def _seal_account_metadata(context: BenchmarkContext, _):
+    seal_account_metadata(user_id=context.sealed_user_id(), master_password=context.master_password,
+                          connection=context.connection)
+
+
+@benchmark('database.is_account_metadata_sealed')
+def _is_account_metadata_sealed(context: BenchmarkContext, _):
+    is_account_metadata_sealed(user_id=context.large_user_id, connection=context.connection)
+
+
+def _get_sealed_account_ids(context: BenchmarkContext) -> List[int]:
+    cursor = context.connection.execute("SELECT id FROM accounts WHERE user_id=? ORDER BY id LIMIT 100",
+                                        (context.sealed_user_id(),))
+
+    return [row[0] for row in cursor.fetchall()]
+
+
+@benchmark('database.reveal_sealed_account_metadata', setup=_get_sealed_account_ids)
+def _reveal_sealed_account_metadata(context: BenchmarkContext, account_ids: List[int]):
+    reveal_sealed_account_metadata(user_id=context.sealed_user_id(), account_ids=account_ids,
+                                   connection=context.connection)
+
+
+@benchmark('database.search_accounts')
+def _search_accounts(context: BenchmarkContext, _):
+    search_accounts(user_id=context.large_user_id, query='google', connection=context.connection)
+
+
+# Only the Accounts with both words are decrypted
+@benchmark('search.blind_index')
+def _search_accounts_sealed(context: BenchmarkContext, _):
+    search_accounts(user_id=context.sealed_user_id(), query='google mail', connection=context.connection)
+
+
+# The shared item benchmarks that take a master password run Argon2 to verify it (the user key is derived once)
+@benchmark('database.create_shared_item')
+def _create_shared_item(context: BenchmarkContext, _):
+    context.shared_item_id()
+    create_shared_item(owner_id=context.large_user_id, master_password=context.master_password,
+                       name=f'Shared item {context.unique_suffix()}', url=None, username='shared',
+                       password=context.plaintext, member_ids=[context.shared_item_member_id],
+                       connection=context.connection)
+
+
+def _create_throwaway_shared_item(context: BenchmarkContext, member_ids: Optional[List[int]] = None) -> int:
+    context.shared_item_id()
+
+    return create_shared_item(context.large_user_id, context.master_password,
+                              f'Throwaway shared item {context.unique_suffix()}', None, 'shared', context.plaintext,
+                              member_ids or [], context.connection)
+
+
+@benchmark('database.add_shared_item_member', setup=_create_throwaway_shared_item)
+def _add_shared_item_member(context: BenchmarkContext, item_id: int):
+    add_shared_item_member(item_id=item_id, owner_id=context.large_user_id, master_password=context.master_password,
+                           member_id=context.shared_item_member_id, connection=context.connection)
+
+
+def _create_throwaway_shared_item_with_the_member(context: BenchmarkContext) -> int:
+    return _create_throwaway_shared_item(context, [context.shared_item_member_id])
+
+
+@benchmark('database.remove_shared_item_member', setup=_create_throwaway_shared_item_with_the_member)
+def _remove_shared_item_member(context: BenchmarkContext, item_id: int):
+    remove_shared_item_member(item_id=item_id, owner_id=context.large_user_id,
+                              member_id=context.shared_item_member_id, connection=context.connection)
+
+
+@benchmark('database.delete_shared_item', setup=_create_throwaway_shared_item)
+def _delete_shared_item(context: BenchmarkContext, item_id: int):
+    delete_shared_item(item_id=item_id, owner_id=context.large_user_id, connection=context.connection)
+
+
+@benchmark('database.get_shared_items_by_user_id')
+def _get_shared_items_by_user_id(context: BenchmarkContext, _):
+    context.shared_item_id()
+    get_shared_items_by_user_id(user_id=context.shared_item_member_id, connection=context.connection)
+
+
+@benchmark('database.get_shared_item_by_name_and_user_id')
+def _get_shared_item_by_name_and_user_id(context: BenchmarkContext, _):
+    context.shared_item_id()
+    get_shared_item_by_name_and_user_id(name='Shared item', user_id=context.shared_item_member_id,
+                                        connection=context.connection)
+
+
+@benchmark('database.get_decrypted_shared_item_password')
+def _get_decrypted_shared_item_password(context: BenchmarkContext, _):
+    get_decrypted_shared_item_password(item_id=context.shared_item_id(), user_id=context.shared_item_member_id,
+                                       master_password=context.master_password, connection=context.connection)
+
+
+@benchmark('database.add_attachment', setup=lambda context: io.BytesIO(context.attachment_content))
+def _add_attachment(context: BenchmarkContext, content: io.BytesIO):
+    add_attachment(context.sample_account_id, context.master_password, f'Attachment {context.unique_suffix()}', content,
+                   context.connection)
+
+
+@benchmark('database.add_note')
+def _add_note(context: BenchmarkContext, _):
+    add_note(context.sample_account_id, context.master_password, f'Note {context.unique_suffix()}',
+             context.plaintext * 100, context.connection)
+
+
+@benchmark('database.get_attachments_by_account_id')
+def _get_attachments_by_account_id(context: BenchmarkContext, _):
+    context.attachment_id()
+    get_attachments_by_account_id(context.sample_account_id, context.connection)
+
+
+@benchmark('database.get_attachment_id_by_name_and_account_id')
+def _get_attachment_id_by_name_and_account_id(context: BenchmarkContext, _):
+    context.attachment_id()
+    get_attachment_id_by_name_and_account_id('Attachment', context.sample_account_id, context.connection)
+
+
+# Reads every chunk, as writing the attachment out would, so the peak memory is about one chunk
+@benchmark('database.read_attachment')
+def _read_attachment(context: BenchmarkContext, _):
+    for _ in read_attachment(context.attachment_id(), context.master_password, context.connection):
+        pass
+
+
+@benchmark('database.get_decrypted_note')
+def _get_decrypted_note(context: BenchmarkContext, _):
+    context.attachment_id()
+    get_decrypted_note(context.note_id, context.master_password, context.connection)
+
+
+def _add_throwaway_attachment(context: BenchmarkContext) -> int:
+    return add_attachment(context.sample_account_id, context.master_password, f'Throwaway {context.unique_suffix()}',
+                          io.BytesIO(context.attachment_content), context.connection)
+
+
+@benchmark('database.delete_attachment', setup=_add_throwaway_attachment)
+def _delete_attachment(context: BenchmarkContext, attachment_id: int):
+    delete_attachment(attachment_id, context.connection)
+
+
+@benchmark('database.get_current_revision')
+def _get_current_revision(context: BenchmarkContext, _):
+    get_current_revision(connection=context.connection)
+
+
+@benchmark('database.changes_since', setup=_change_one_account)
+def _changes_since(context: BenchmarkContext, revision: int):
+    changes_since(user_id=context.large_user_id, revision=revision, connection=context.connection)
+
+
+def _supersede_one_change(context: BenchmarkContext):
+    edit_account(account_id=_create_throwaway_account(context), connection=context.connection, username='edited')
+
+
+# Scans the whole journal, which holds (at least) one entry per Account
+@benchmark('database.compact_account_changes', setup=_supersede_one_change)
+def _compact_account_changes(context: BenchmarkContext, _):
+    compact_account_changes(connection=context.connection)
+
+
+@benchmark('database.is_valid_login')
+def _is_valid_login(context: BenchmarkContext, _):
+    is_valid_login(email=context.large_user_email, entered_password=context.master_password,
+                   connection=context.connection)
+
+
+@benchmark('database.rehash_and_reencrypt_passwords')
+def _rehash_and_reencrypt_passwords(context: BenchmarkContext, _):
+    rehash_and_reencrypt_passwords(user_id=context.small_user_id, entered_password=context.master_password,
+                                   connection=context.connection)
+
+
+# Registered after the benchmarks of the sealed User, whose metadata cannot be read once this has run
+@benchmark('database.forget_unlocked_keys')
+def _forget_unlocked_keys(context: BenchmarkContext, _):
+    forget_unlocked_keys()
+
+
+@benchmark('database.db_setup')
+def _db_setup(context: BenchmarkContext, _):
+    connection, cursor = db_setup()
+    cursor.close()
+    connection.close()
+
+
+# Import, export, and search benchmarks (mirroring the corresponding GUI and CLI paths):
+
+@benchmark('import.csv', setup=_create_throwaway_user)
+def _import_csv(context: BenchmarkContext, user_id: int):
+    import_accounts_from_csv(csv_path=context.import_csv_name, user_id=user_id,
+                             master_password=context.master_password, connection=context.connection)
+
+
+@benchmark('import.detected_format', setup=_create_throwaway_user)
+def _import_detected_format(context: BenchmarkContext, user_id: int):
+    import_accounts_from_file(path=context.import_csv_name, user_id=user_id, master_password=context.master_password,
+                              connection=context.connection)
+
+
+def _take_full_backup(context: BenchmarkContext):
+    create_backup(context.connection, os.path.join(os.path.dirname(context.db_name), 'backups'),
+                  context.master_password, incremental=False, keep_chains=1)
+
+
+@benchmark('backup.full')
+def _backup_full(context: BenchmarkContext, _):
+    _take_full_backup(context)
+
+
+# Incremental on top of a fresh full backup, so this times the snapshot and diff with few or no changed pages
+@benchmark('backup.incremental', setup=_take_full_backup)
+def _backup_incremental(context: BenchmarkContext, _):
+    create_backup(context.connection, os.path.join(os.path.dirname(context.db_name), 'backups'),
+                  context.master_password, keep_chains=1)
+
+
+# Decrypts the whole vault into memory (one Argon2 run and a pass over the database)
+@benchmark('encrypted_vault.open', setup=lambda context: context.encrypted_vault_name())
+def _open_encrypted_vault(context: BenchmarkContext, vault_name: str):
+    EncryptedVault(vault_name, context.master_password).close()
+
+
+def _open_and_change_encrypted_vault(context: BenchmarkContext) -> EncryptedVault:
+    vault = EncryptedVault(context.encrypted_vault_name(), context.master_password)
+    vault.connection.execute("INSERT INTO users VALUES (NULL, ?, 'unused')", (_unique_email(context),))
+    vault.connection.commit()
+
+    return vault
+
+
+# Rewrites the whole vault, since one change has to be saved
+@benchmark('encrypted_vault.save', setup=_open_and_change_encrypted_vault)
+def _save_encrypted_vault(context: BenchmarkContext, vault: EncryptedVault):
+    vault.close()
+
+
+def _remove_sharded_vault(context: BenchmarkContext) -> str:
+    path = os.path.join(os.path.dirname(context.db_name), f'shards_{context.account_count}')
+    shutil.rmtree(path, ignore_errors=True)
+    context.connection.commit()
+
+    return path
+
+
+# Copies every row of every User (the synthetic ones, and those the other benchmarks created) to their own shard
+@benchmark('sharded_vault.shard_database_file', setup=_remove_sharded_vault)
+def _shard_database_file(context: BenchmarkContext, path: str):
+    shard_database_file(context.db_name, path)
+
+
+# Utils.storage benchmarks, which run the same workloads against each backend:
+
+def _register_storage_benchmarks(backend_name: str):
+    def add_throwaway_account(context: BenchmarkContext) -> int:
+        backend, user_id = context.storage_backend(backend_name)
+
+        return backend.add_account(user_id, f'Storage throwaway {context.unique_suffix()}', None, 'throwaway',
+                                   (context.ciphertext, context.salt, context.nonce, context.tag))
+
+    @benchmark(f'storage.{backend_name}.add_account')
+    def _add_account(context: BenchmarkContext, _):
+        add_throwaway_account(context)
+
+    @benchmark(f'storage.{backend_name}.update_account', setup=add_throwaway_account)
+    def _update_account(context: BenchmarkContext, account_id: int):
+        context.storage_backend(backend_name)[0].update_account(account_id, username='edited')
+
+    @benchmark(f'storage.{backend_name}.delete_account', setup=add_throwaway_account)
+    def _delete_account(context: BenchmarkContext, account_id: int):
+        context.storage_backend(backend_name)[0].delete_account(account_id)
+
+    @benchmark(f'storage.{backend_name}.get_account_id_by_name')
+    def _get_account_id_by_name(context: BenchmarkContext, _):
+        backend, user_id = context.storage_backend(backend_name)
+        backend.get_account_id_by_name(user_id, context.sample_account_name)
+
+    @benchmark(f'storage.{backend_name}.get_account', setup=lambda context: context.storage_backend(backend_name)[0]
+               .get_account_id_by_name(context.storage_backend(backend_name)[1], context.sample_account_name))
+    def _get_account(context: BenchmarkContext, account_id: int):
+        context.storage_backend(backend_name)[0].get_account(account_id)
+
+    @benchmark(f'storage.{backend_name}.list_accounts')
+    def _list_accounts(context: BenchmarkContext, _):
+        backend, user_id = context.storage_backend(backend_name)
+        backend.list_accounts(user_id)
+
+    @benchmark(f'storage.{backend_name}.search_accounts')
+    def _search_accounts(context: BenchmarkContext, _):
+        backend, user_id = context.storage_backend(backend_name)
+        backend.search_accounts(user_id, 'google')
+
+
+for _backend_name in ('sqlite', 'log'):
+    _register_storage_benchmarks(_backend_name)
+
+
+# Replays the whole log into the index
+@benchmark('storage.log.open')
+def _open_log(context: BenchmarkContext, _):
+    LogStructuredBackend(context.storage_backend('log')[0].path).close()
+
+
+def _update_one_logged_account(context: BenchmarkContext):
+    backend, user_id = context.storage_backend('log')
+    backend.update_account(backend.list_accounts(user_id)[0].id, username=f'edited {context.unique_suffix()}')
+
+
+# Rewrites the whole log, which has one superseded record
+@benchmark('storage.log.compact', setup=_update_one_logged_account)
+def _compact_log(context: BenchmarkContext, _):
+    context.storage_backend('log')[0].compact()
+
+
+# After the first call, which compares every Account, this times a sync with no changes
+@benchmark('sync.vaults')
+def _sync_vaults(context: BenchmarkContext, _):
+    sync_vaults(context.connection, context.sync_peer_name(), context.large_user_email, context.master_password)
+
+
+@benchmark('export.csv')
+def _export_csv(context: BenchmarkContext, _):
+    export_accounts_to_csv(csv_path=os.devnull, user_id=context.small_user_id, master_password=context.master_password,
+                           connection=context.connection)
+
+
+@benchmark('export.ndjson')
+def _export_ndjson(context: BenchmarkContext, _):
+    export_accounts_to_ndjson(ndjson_path=os.devnull, user_id=context.small_user_id,
+                              master_password=context.master_password, connection=context.connection)
+
+
+@benchmark('export.encrypted')
+def _export_encrypted(context: BenchmarkContext, _):
+    export_accounts_encrypted(path=os.path.join(os.path.dirname(context.db_name), 'export.ppm'),
+                              user_id=context.small_user_id, master_password=context.master_password,
+                              connection=context.connection)
+
+
+@benchmark('search.filter_account_names')
+def _search_filter_account_names(context: BenchmarkContext, _):
+    query = 'bank'
+    accounts = get_all_account_names_urls_and_usernames_by_user_id(user_id=context.large_user_id,
+                                                                   connection=context.connection)
+    [account for account in accounts if query in account[0].lower()]
+
+
+@benchmark('search.url_scan')
+def _search_url_scan(context: BenchmarkContext, _):
+    # What matching a page url looked like without the url index: every url of the User compared by domain
+    accounts = get_all_account_ids_names_urls_and_usernames_by_user_id(user_id=context.large_user_id,
+                                                                       connection=context.connection)
+    [account for account in accounts if account[2] and 'google.com' in account[2].lower()]
+
+
+@benchmark('search.reused_passwords_by_decryption')
+def _search_reused_passwords_by_decryption(context: BenchmarkContext, _):
+    # What finding reused passwords looked like without the fingerprints: one Argon2 run per Account
+    passwords = get_all_decrypted_account_passwords_by_user_id(user_id=context.small_user_id,
+                                                               master_password=context.master_password,
+                                                               connection=context.connection)
+    seen = {}
+    [seen.setdefault(password, []).append(account_id) for account_id, password in passwords.items()]
+
+
+@benchmark('search.sql_like')
+def _search_sql_like(context: BenchmarkContext, _):
+    cursor = context.connection.cursor()
+    cursor.execute("SELECT name, url, username FROM accounts WHERE user_id=? AND name LIKE ?",
+                   (context.large_user_id, '%bank%'))
+    cursor.fetchall()
+    cursor.close()
+
+
+@benchmark('check.vault')
+def _check_vault(context: BenchmarkContext, _):
+    check_vault(user_id=context.small_user_id, master_password=context.master_password,
+                connection=context.connection, workers=1)
+
+
+@benchmark('breach.check_password')
+def _breach_check_password(context: BenchmarkContext, _):
+    context.breached_password_file().count(context.plaintext)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = ArgumentParser(description='Run the Personal Password Manager benchmarks against synthetic vaults.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000],
+                        help='numbers of accounts in the synthetic vaults (default: 1000)')
+    parser.add_argument('--repeat', type=int, default=5, help='timed repeats per benchmark (default: 5)')
+    parser.add_argument('--kdf-sample', type=int, default=8,
+                        help='accounts used by benchmarks that run Argon2 once per account (default: 8)')
+    parser.add_argument('--key-pool', type=int, default=4,
+                        help='Argon2-derived keys the synthetic rows are encrypted with (default: 4)')
+    parser.add_argument('--filter', help='only run benchmarks whose name contains this string')
+    parser.add_argument('--directory', help='keep the synthetic vault files in this directory')
+    parser.add_argument('--output', help='write the results as JSON to this file')
+    parser.add_argument('--baseline', help='compare against the results JSON saved in this file')
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                        help='relative slowdown reported as a regression (default: 0.1)')
+    args = parser.parse_args(argv)
+
+    results = run_benchmarks(args.sizes, repeat=args.repeat, kdf_sample_size=args.kdf_sample,
+                             key_pool_size=args.key_pool, name_filter=args.filter, directory=args.directory,
+                             progress=lambda message: print(f'Running {message}', flush=True))
+
+    for record in results['results']:
+        print(f"{record['name']:<60} {record['accounts']:>9} accounts  median {record['median_s'] * 1000:>11.3f} ms  "
+              f"peak {record['peak_memory_bytes'] / 1024:>10.1f} KiB")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as output_file:
+            json.dump(results, output_file, indent=2)
+
+    if not args.baseline:
+        return 0
+
+    with open(args.baseline, 'r', encoding='utf-8') as baseline_file:
+        baseline = json.load(baseline_file)
+
+    comparisons = compare_to_baseline(results, baseline, tolerance=args.tolerance)
+
+    for comparison in comparisons:
+        ratio = f"{comparison['ratio']:.2f}x" if comparison['ratio'] is not None else '-'
+        print(f"{comparison['status']:<12} {comparison['name']:<60} {comparison['accounts']:>9} accounts  {ratio}")
+
+    return 1 if any(comparison['status'] == 'regression' for comparison in comparisons) else 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,390 @@
+import json
+import os
+import random
+import sqlite3
+import statistics
+import tempfile
+import threading
+from argparse import ArgumentParser
+from time import perf_counter, sleep
+from typing import Callable, Dict, List, Optional, Any
+
+from Agent.agent import VaultAgent
+from Agent.client import AgentClient
+from Benchmarks.synthetic_vault import create_synthetic_vault_file, DEFAULT_MASTER_PASSWORD
+from Utils.database import get_all_account_names_urls_and_usernames_by_user_id, \
+    get_all_account_ids_names_urls_and_usernames_by_user_id, get_account_id_by_account_name_and_user_id, \
+    get_account_name_url_and_username_by_account_id, get_decrypted_account_password, edit_account, create_account
+
+# A load generator that simulates concurrent sessions (like several GUI, CLI, and agent clients) sharing one vault
+# file. Each session is a thread with its own connection that repeatedly picks an operation from a weighted mix, runs
+# it, and then thinks for an exponentially distributed time. Usage:
+#
+#   python -m Benchmarks.load_test --sessions 8 --duration 30 --mix lookup=60,list=5,reveal=20,edit=10,import=5
+#   python -m Benchmarks.load_test --sessions 8 --agent --journal-mode wal --output load.json
+#
+# The connections are opened with a busy timeout of --busy-timeout-ms (0 by default), so that SQLITE_BUSY surfaces
+# as "database is locked"; the operation is then rolled back and retried with exponential backoff, and the retries
+# and the time spent waiting for the lock are reported along with the throughput and latency percentiles of each
+# operation. Reveals run Argon2 per call unless --agent is passed, in which case they go through an in-process agent.
+#
+# Argon2, SQLite, and the socket I/O all release the GIL, so threads are enough to generate real contention.
+
+OPERATIONS = ('list', 'lookup', 'reveal', 'edit', 'import')
+DEFAULT_MIX = {'lookup': 60, 'list': 5, 'reveal': 20, 'edit': 10, 'import': 5}
+
+INITIAL_BACKOFF_SECONDS = 0.001
+MAX_BACKOFF_SECONDS = 0.1
+
+
+def parse_mix(mix: str) -> Dict[str, float]:
+    """
+    Parses an operation mix such as "lookup=60,edit=10" into weights by operation.
+    :raise ValueError: if an operation is unknown or a weight is not a non-negative number
+    """
+    weights = {}
+
+    for entry in mix.split(','):
+        operation, _, weight = entry.partition('=')
+        operation = operation.strip()
+
+        if operation not in OPERATIONS:
+            raise ValueError(f'Unknown operation in the mix: {operation} (expected one of {", ".join(OPERATIONS)})')
+
+        weights[operation] = float(weight)
+
+        if weights[operation] < 0:
+            raise ValueError(f'The weight of {operation} must not be negative')
+
+    if not any(weights.values()):
+        raise ValueError('At least one operation must have a positive weight')
+
+    return weights
+
+
+def is_busy_error(error: sqlite3.OperationalError) -> bool:
+    """
+    Returns whether the given error is SQLITE_BUSY or SQLITE_LOCKED, i.e. whether retrying can succeed.
+    """
+    message = str(error).lower()
+
+    return 'locked' in message or 'busy' in message
+
+
+def latency_summary(latencies: List[float]) -> Dict[str, float]:
+    """
+    Returns the mean, p50, p95, p99, and max of the given latencies (in seconds) in milliseconds.
+    """
+    if not latencies:
+        return {}
+
+    latencies = sorted(latencies)
+
+    if len(latencies) > 1:
+        percentiles = statistics.quantiles(latencies, n=100, method='inclusive')
+        p50, p95, p99 = percentiles[49], percentiles[94], percentiles[98]
+    else:
+        p50 = p95 = p99 = latencies[0]
+
+    return {'mean_ms': statistics.fmean(latencies) * 1000, 'p50_ms': p50 * 1000, 'p95_ms': p95 * 1000,
+            'p99_ms': p99 * 1000, 'max_ms': latencies[-1] * 1000}
+
+
+class OperationStats:
+    def __init__(self):
+        self.latencies: List[float] = []
+        self.errors = 0
+        self.busy_retries = 0
+        self.lock_wait = 0.0
+
+    def merge(self, other: 'OperationStats'):
+        self.latencies.extend(other.latencies)
+        self.errors += other.errors
+        self.busy_retries += other.busy_retries
+        self.lock_wait += other.lock_wait
+
+    def summary(self, duration: float) -> Dict[str, Any]:
+        return {'count': len(self.latencies), 'throughput_ops_per_s': len(self.latencies) / duration,
+                'errors': self.errors, 'busy_retries': self.busy_retries, 'lock_wait_s': self.lock_wait,
+                **latency_summary(self.latencies)}
+
+
+class Session:
+    """
+    One simulated client: its own connection (and agent client), random generator, and statistics.
+    """
+    def __init__(self, index: int, db_name: str, user_id: int, accounts: List[tuple], master_password: str,
+                 busy_timeout_ms: float, seed: int, agent_socket: Optional[str] = None):
+        self.index = index
+        self.db_name = db_name
+        self.user_id = user_id
+        self.accounts = accounts
+        self.master_password = master_password
+        self.busy_timeout_ms = busy_timeout_ms
+        self.rng = random.Random(seed * 1_000_003 + index)
+        self.agent_socket = agent_socket
+        self.stats: Dict[str, OperationStats] = {operation: OperationStats() for operation in OPERATIONS}
+
+        self.connection: Optional[sqlite3.Connection] = None
+        self.agent_client: Optional[AgentClient] = None
+        self._imported = 0
+
+    def open(self):
+        # Connections must be opened on the thread that uses them
+        self.connection = sqlite3.connect(self.db_name, timeout=self.busy_timeout_ms / 1000)
+
+        if self.agent_socket:
+            self.agent_client = AgentClient(self.agent_socket)
+
+    def close(self):
+        if self.agent_client is not None:
+            self.agent_client.close()
+
+        if self.connection is not None:
+            self.connection.close()
+
+    def _random_account(self) -> tuple:
+        return self.accounts[self.rng.randrange(len(self.accounts))]
+
+    def list_accounts(self):
+        get_all_account_names_urls_and_usernames_by_user_id(self.user_id, self.connection)
+
+    def lookup(self):
+        _, name, _, _ = self._random_account()
+        account_id = get_account_id_by_account_name_and_user_id(name, self.user_id, self.connection)
+        get_account_name_url_and_username_by_account_id(account_id, self.connection)
+
+    def reveal(self):
+        account_id, name, _, _ = self._random_account()
+
+        if self.agent_client is not None:
+            self.agent_client.get(name)
+        else:
+            get_decrypted_account_password(account_id, self.master_password, self.connection)
+
+    def edit(self):
+        account_id, _, _, _ = self._random_account()
+        edit_account(account_id=account_id, connection=self.connection,
+                     username=f'load-test-{self.index}-{self.rng.randrange(1_000_000)}@example.com')
+
+    def import_account(self):
+        self._imported += 1
+        create_account(user_id=self.user_id, master_password=self.master_password,
+                       name=f'Load test import {self.index}-{self._imported}-{self.rng.randrange(1_000_000)}',
+                       url=None, username='imported@example.com', password='ImportedPassword',
+                       connection=self.connection)
+
+    def run_operation(self, operation: str):
+        """
+        Runs the given operation, retrying it with exponential backoff while the database is busy, and records its
+        latency (including the retries) or its error.
+        """
+        function: Callable[[], None] = {'list': self.list_accounts, 'lookup': self.lookup, 'reveal': self.reveal,
+                                        'edit': self.edit, 'import': self.import_account}[operation]
+        stats = self.stats[operation]
+        backoff = INITIAL_BACKOFF_SECONDS
+        start = perf_counter()
+        busy_since = None
+
+        while True:
+            try:
+                function()
+            except sqlite3.OperationalError as e:
+                if self.connection.in_transaction:
+                    self.connection.rollback()
+
+                if not is_busy_error(e):
+                    stats.errors += 1
+                    return
+
+                if busy_since is None:
+                    busy_since = perf_counter()
+
+                stats.busy_retries += 1
+                sleep(backoff * (0.5 + self.rng.random()))
+                backoff = min(backoff * 2, MAX_BACKOFF_SECONDS)
+                continue
+            except Exception:
+                if self.connection.in_transaction:
+                    self.connection.rollback()
+
+                stats.errors += 1
+                return
+
+            break
+
+        end = perf_counter()
+
+        if busy_since is not None:
+            stats.lock_wait += end - busy_since
+
+        stats.latencies.append(end - start)
+
+
+def _run_session(session: Session, weights: Dict[str, float], think_time_ms: float, barrier: threading.Barrier,
+                 stop: threading.Event):
+    session.open()
+    operations = list(weights)
+    operation_weights = list(weights.values())
+
+    try:
+        barrier.wait()
+
+        while not stop.is_set():
+            session.run_operation(session.rng.choices(operations, weights=operation_weights)[0])
+
+            if think_time_ms > 0:
+                stop.wait(session.rng.expovariate(1000 / think_time_ms))
+    finally:
+        session.close()
+
+
+def run_load_test(db_name: str, user_id: int, sessions: int = 4, duration: float = 10.0,
+                  mix: Optional[Dict[str, float]] = None, think_time_ms: float = 50.0, busy_timeout_ms: float = 0,
+                  master_password: str = DEFAULT_MASTER_PASSWORD, agent_socket: Optional[str] = None,
+                  seed: int = 0) -> Dict[str, Any]:
+    """
+    Runs concurrent sessions against the vault of the given User and returns the report.
+    :param db_name: the path of the database file
+    :param user_id: the id of the User whose vault the sessions use
+    :param sessions: the number of concurrent sessions
+    :param duration: how long the sessions run, in seconds
+    :param mix: the weights of the operations (defaults to DEFAULT_MIX)
+    :param think_time_ms: the mean of the exponentially distributed pause after each operation
+    :param busy_timeout_ms: how long SQLite itself waits for a lock before raising SQLITE_BUSY
+    :param master_password: the User's master password
+    :param agent_socket: the socket of an agent unlocked for the User; reveals go through it if given
+    :param seed: the seed for the sessions' random generators
+    :return: the configuration, the totals, and the statistics of each operation
+    :raise ValueError: if the User has no Accounts
+    """
+    weights = {operation: weight for operation, weight in (mix or DEFAULT_MIX).items() if weight > 0}
+
+    connection = sqlite3.connect(db_name)
+    accounts = get_all_account_ids_names_urls_and_usernames_by_user_id(user_id, connection)
+    journal_mode = connection.execute("PRAGMA journal_mode").fetchone()[0]
+    connection.close()
+
+    if not accounts:
+        raise ValueError(f'The User with the given id ({user_id}) has no Accounts to load test')
+
+    session_list = [Session(index, db_name, user_id, accounts, master_password, busy_timeout_ms, seed, agent_socket)
+                    for index in range(sessions)]
+    barrier = threading.Barrier(sessions + 1)
+    stop = threading.Event()
+    threads = [threading.Thread(target=_run_session, args=(session, weights, think_time_ms, barrier, stop),
+                                name=f'LoadTestSession{session.index}', daemon=True)
+               for session in session_list]
+
+    for thread in threads:
+        thread.start()
+
+    # Every session has opened its connection once the barrier is passed
+    barrier.wait()
+    start = perf_counter()
+    sleep(duration)
+    stop.set()
+
+    for thread in threads:
+        thread.join()
+
+    elapsed = perf_counter() - start
+
+    by_operation: Dict[str, OperationStats] = {operation: OperationStats() for operation in weights}
+    total = OperationStats()
+
+    for session in session_list:
+        for operation in weights:
+            by_operation[operation].merge(session.stats[operation])
+            total.merge(session.stats[operation])
+
+    return {'config': {'sessions': sessions, 'duration_s': duration, 'mix': weights, 'think_time_ms': think_time_ms,
+                       'busy_timeout_ms': busy_timeout_ms, 'journal_mode': journal_mode,
+                       'agent': agent_socket is not None, 'accounts': len(accounts)},
+            'elapsed_s': elapsed,
+            'total': total.summary(elapsed),
+            'operations': {operation: stats.summary(elapsed) for operation, stats in by_operation.items()}}
+
+
+def _format_row(name: str, summary: Dict[str, Any]) -> str:
+    if not summary['count']:
+        return f"{name:<8} {0:>8}"
+
+    return (f"{name:<8} {summary['count']:>8} {summary['throughput_ops_per_s']:>9.1f}/s  "
+            f"p50 {summary['p50_ms']:>9.2f} ms  p95 {summary['p95_ms']:>9.2f} ms  p99 {summary['p99_ms']:>9.2f} ms  "
+            f"errors {summary['errors']:>4}  busy retries {summary['busy_retries']:>6}  "
+            f"lock wait {summary['lock_wait_s'] * 1000:>9.1f} ms")
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = ArgumentParser(description='Run concurrent sessions against a synthetic Personal Password Manager vault.')
+    parser.add_argument('--accounts', type=int, default=1000, help='accounts in the synthetic vault (default: 1000)')
+    parser.add_argument('--sessions', type=int, default=4, help='concurrent sessions (default: 4)')
+    parser.add_argument('--duration', type=float, default=10, help='seconds to run (default: 10)')
+    parser.add_argument('--mix', default=','.join(f'{operation}={weight}' for operation, weight in DEFAULT_MIX.items()),
+                        help=f'operation weights, from {", ".join(OPERATIONS)} (default: %(default)s)')
+    parser.add_argument('--think-ms', type=float, default=50,
+                        help='mean think time between the operations of a session (default: 50)')
+    parser.add_argument('--busy-timeout-ms', type=float, default=0,
+                        help='how long SQLite waits for a lock before reporting SQLITE_BUSY (default: 0)')
+    parser.add_argument('--journal-mode', choices=('delete', 'wal'), help='set the journal mode of the vault')
+    parser.add_argument('--agent', action='store_true', help='serve reveals from an in-process agent')
+    parser.add_argument('--key-pool', type=int, default=4,
+                        help='Argon2-derived keys the synthetic rows are encrypted with (default: 4)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--directory', help='keep the synthetic vault file in this directory')
+    parser.add_argument('--output', help='write the report as JSON to this file')
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as temporary_directory:
+        directory = args.directory or temporary_directory
+        os.makedirs(directory, exist_ok=True)
+        db_name = os.path.join(directory, f'load_test_{args.accounts}.sqlite3')
+
+        if os.path.exists(db_name):
+            os.remove(db_name)
+
+        print(f'Generating a synthetic vault with {args.accounts} accounts', flush=True)
+        user_id, _ = create_synthetic_vault_file(db_name, args.accounts, kdf_sample_size=1,
+                                                 key_pool_size=args.key_pool, seed=args.seed)
+
+        if args.journal_mode:
+            connection = sqlite3.connect(db_name)
+            connection.execute(f"PRAGMA journal_mode={args.journal_mode}")
+            connection.close()
+
+        agent = None
+        agent_thread = None
+
+        if args.agent:
+            agent = VaultAgent(database=db_name, email=f'large{args.seed}@example.com',
+                               master_password=DEFAULT_MASTER_PASSWORD,
+                               socket_path=os.path.join(directory, 'load_test_agent.sock'))
+            agent_thread = threading.Thread(target=agent.run, daemon=True)
+            agent_thread.start()
+            agent.ready.wait()
+
+        try:
+            report = run_load_test(db_name, user_id, sessions=args.sessions, duration=args.duration,
+                                   mix=parse_mix(args.mix), think_time_ms=args.think_ms,
+                                   busy_timeout_ms=args.busy_timeout_ms,
+                                   agent_socket=agent.socket_path if agent is not None else None, seed=args.seed)
+        finally:
+            if agent is not None:
+                agent.stop()
+                agent_thread.join()
+
+    for operation, summary in report['operations'].items():
+        print(_format_row(operation, summary))
+
+    print(_format_row('total', report['total']))
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as output_file:
+            json.dump(report, output_file, indent=2)
+
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,219 @@
+import os
+import random
+import sqlite3
+from sqlite3 import Connection
+from string import ascii_letters, digits, punctuation
+from typing import List, Optional, Tuple, Iterator, Dict
+
+from argon2 import PasswordHasher
+
+from Database.database_setup import setup_database
+from Utils.cryptography import derive_256_bit_salt_and_key, encrypt_aes_256_gcm, derive_subkey, keyed_fingerprint
+from Utils.database import index_account_urls, FINGERPRINT_KEY_PURPOSE
+
+# Synthetic vault generator used by the benchmarks.
+#
+# Account names and urls follow a Zipf-like popularity distribution (a handful of sites like email providers and
+# social networks appear in most real vaults, followed by a long tail of one-off sites). Every row is encrypted on its
+# own with a fresh nonce, exactly like create_account would do. Deriving a new Argon2 key per row would make a vault of
+# a million rows take days to generate, so rows draw their salt and key from a pool of derived keys instead. Every row
+# still decrypts with get_decrypted_account_password and the master password. A share of the Accounts reuse an earlier
+# password, as people do, and every Account gets its password fingerprint.
+
+DEFAULT_MASTER_PASSWORD = 'SyntheticMasterPassword'
+
+POPULAR_SITES = ['Google', 'Facebook', 'Amazon', 'Apple', 'Microsoft', 'Netflix', 'Twitter', 'Instagram', 'LinkedIn',
+                 'Reddit', 'GitHub', 'Yahoo', 'Outlook', 'Spotify', 'PayPal', 'Dropbox', 'Discord', 'Twitch', 'Steam',
+                 'eBay', 'Slack', 'Zoom', 'Adobe', 'Pinterest', 'Tumblr', 'Wikipedia', 'StackOverflow', 'Hulu',
+                 'Airbnb', 'Uber']
+
+TAIL_WORDS = ['Acme', 'Blue', 'Cloud', 'Data', 'Echo', 'Forge', 'Green', 'Harbor', 'Iron', 'Jade', 'Kite', 'Lumen',
+              'Maple', 'North', 'Orbit', 'Pixel', 'Quartz', 'River', 'Summit', 'Tide', 'Union', 'Vertex', 'Willow',
+              'Xenon', 'Yield', 'Zephyr']
+
+TAIL_SUFFIXES = ['Bank', 'Books', 'Cloud', 'Credit', 'Energy', 'Forum', 'Games', 'Health', 'Insurance', 'Labs', 'Mail',
+                 'Market', 'Media', 'Mobile', 'News', 'Pay', 'Shop', 'Store', 'Travel', 'Works']
+
+TOP_LEVEL_DOMAINS = ['com', 'com', 'com', 'com', 'org', 'net', 'io', 'co.uk', 'de', 'com.au', 'ca', 'fr']
+
+URL_SUBDOMAINS = ['www', 'www', 'www', 'login', 'accounts', 'auth', 'my', 'secure', 'app']
+
+URL_PATHS = ['', '', '', '/login', '/signin', '/account', '/accounts/login?next=%2F', '/users/sign_in']
+
+USERNAME_DOMAINS = ['gmail.com', 'outlook.com', 'yahoo.com', 'icloud.com', 'proton.me', 'example.com']
+
+PASSWORD_ALPHABET = ascii_letters + digits + punctuation
+
+INSERT_BATCH_SIZE = 10_000
+
+
+def zipf_weights(count: int, exponent: float = 1.1) -> List[float]:
+    """
+    Returns Zipf-like weights for the given number of ranked items, so that the first items are picked far more often
+    than the last ones.
+    :param count: the number of ranked items
+    :param exponent: the skew of the distribution (higher means the most popular items dominate more)
+    :return: the weights in rank order
+    """
+    return [1 / (rank ** exponent) for rank in range(1, count + 1)]
+
+
+def generate_account_fields(account_count: int, seed: int = 0, url_probability: float = 0.85,
+                            popular_site_probability: float = 0.35, reuse_probability: float = 0.1)\
+        -> Iterator[Tuple[str, Optional[str], str, str]]:
+    """
+    Generates the plaintext name, url, username, and password for the given number of synthetic Accounts. Account names
+    are unique (case-insensitively) within the generated set, as the accounts table requires per User.
+    :param account_count: the number of Accounts to generate
+    :param seed: the seed for the random generator, so that the same vault can be regenerated
+    :param url_probability: the probability that an Account has a url
+    :param popular_site_probability: the probability that an Account is for one of the popular sites
+    :param reuse_probability: the probability that an Account reuses one of the few most recent distinct passwords
+    :return: an iterator of (name, url, username, password) tuples
+    """
+    rng = random.Random(seed)
+    popular_weights = zipf_weights(len(POPULAR_SITES))
+    tail_word_weights = zipf_weights(len(TAIL_WORDS), exponent=0.6)
+    used_names: Dict[str, int] = {}
+    recent_passwords: List[str] = []
+
+    for i in range(account_count):
+        if rng.random() < popular_site_probability:
+            base_name = rng.choices(POPULAR_SITES, weights=popular_weights)[0]
+            domain = f'{base_name.lower()}.com'
+        else:
+            word = rng.choices(TAIL_WORDS, weights=tail_word_weights)[0]
+            suffix = rng.choice(TAIL_SUFFIXES)
+            base_name = f'{word} {suffix} {rng.randrange(1, 10_000)}'
+            domain = f'{word.lower()}{suffix.lower()}{rng.randrange(1, 10_000)}.{rng.choice(TOP_LEVEL_DOMAINS)}'
+
+        # Users commonly have several accounts on the same popular site, which need distinct names
+        name_key = base_name.lower()
+        occurrences = used_names.get(name_key, 0) + 1
+        used_names[name_key] = occurrences
+        name = base_name if occurrences == 1 else f'{base_name} ({occurrences})'
+
+        if rng.random() < url_probability:
+            url = f'https://{rng.choice(URL_SUBDOMAINS)}.{domain}{rng.choice(URL_PATHS)}'
+        else:
+            url = None
+
+        username = f'user{i}.{rng.randrange(1_000_000)}@{rng.choice(USERNAME_DOMAINS)}'
+
+        if recent_passwords and rng.random() < reuse_probability:
+            password = rng.choice(recent_passwords)
+        else:
+            password = ''.join(rng.choice(PASSWORD_ALPHABET) for _ in range(rng.randrange(8, 33)))
+            recent_passwords = (recent_passwords + [password])[-8:]
+
+        yield name, url, username, password
+
+
+def derive_key_pool(master_password: str, key_pool_size: int) -> List[Tuple[bytes, bytes]]:
+    """
+    Derives the given number of (salt, key) pairs from the master password, each with a fresh random salt.
+    :param master_password: the master password of the synthetic User
+    :param key_pool_size: the number of (salt, key) pairs to derive
+    :return: the list of (salt, key) pairs
+    """
+    if key_pool_size < 1:
+        raise ValueError(f'The key pool size must be at least 1 (got {key_pool_size})')
+
+    return [derive_256_bit_salt_and_key(master_password) for _ in range(key_pool_size)]
+
+
+def generate_synthetic_vault(connection: Connection, account_count: int, email: str = 'synthetic@example.com',
+                             master_password: str = DEFAULT_MASTER_PASSWORD, key_pool_size: int = 4, seed: int = 0,
+                             url_probability: float = 0.85, popular_site_probability: float = 0.35) -> int:
+    """
+    Creates a User with the given email and master password and fills their vault with the given number of synthetic,
+    individually encrypted Accounts. Returns the id of the created User.
+    :param connection: the database connection to use (the tables must already exist)
+    :param account_count: the number of Accounts to generate
+    :param email: the email of the synthetic User
+    :param master_password: the master password of the synthetic User
+    :param key_pool_size: the number of Argon2-derived (salt, key) pairs the rows draw from
+    :param seed: the seed for the random generator, so that the same vault can be regenerated
+    :param url_probability: the probability that an Account has a url
+    :param popular_site_probability: the probability that an Account is for one of the popular sites
+    :return: the id of the created User
+    :raise ValueError: if the key pool size is less than 1
+    """
+    key_pool = derive_key_pool(master_password, key_pool_size)
+    rng = random.Random(seed)
+
+    cursor = connection.cursor()
+
+    ph = PasswordHasher()
+    cursor.execute("INSERT INTO users VALUES (:id, :email, :password) RETURNING id",
+                   {'id': None, 'email': email, 'password': ph.hash(master_password)})
+    user_id = cursor.fetchone()[0]
+
+    user_key_salt = os.urandom(16)
+    cursor.execute("INSERT INTO user_keys VALUES (?, ?)", (user_id, user_key_salt))
+    fingerprint_key = derive_subkey(derive_256_bit_salt_and_key(master_password, user_key_salt)[1],
+                                    FINGERPRINT_KEY_PURPOSE)
+
+    insert_query = """INSERT INTO accounts VALUES (:id, :name, :url, :username, :password, :salt, :nonce, :tag,
+    :user_id)"""
+    fingerprint_query = """INSERT INTO account_fingerprints SELECT id, user_id, :fingerprint FROM accounts
+    WHERE user_id=:user_id AND name=:name"""
+    batch = []
+
+    for name, url, username, password in generate_account_fields(account_count, seed=seed,
+                                                                 url_probability=url_probability,
+                                                                 popular_site_probability=popular_site_probability):
+        salt, key = key_pool[rng.randrange(key_pool_size)]
+        encrypted_password, nonce, tag = encrypt_aes_256_gcm(key, password)
+
+        batch.append({'id': None, 'name': name, 'url': url, 'username': username, 'password': encrypted_password,
+                      'salt': salt, 'nonce': nonce, 'tag': tag, 'user_id': user_id,
+                      'fingerprint': keyed_fingerprint(fingerprint_key, password)})
+
+        if len(batch) >= INSERT_BATCH_SIZE:
+            cursor.executemany(insert_query, batch)
+            cursor.executemany(fingerprint_query, batch)
+            batch = []
+
+    if batch:
+        cursor.executemany(insert_query, batch)
+        cursor.executemany(fingerprint_query, batch)
+
+    connection.commit()
+    cursor.close()
+
+    index_account_urls(connection, user_id=user_id)
+
+    return user_id
+
+
+def create_synthetic_vault_file(db_name: str, account_count: int, kdf_sample_size: int = 8,
+                                master_password: str = DEFAULT_MASTER_PASSWORD, key_pool_size: int = 4,
+                                seed: int = 0) -> Tuple[int, int]:
+    """
+    Creates (or extends) the database file with the given name and generates two synthetic Users in it: a large User
+    with the given number of Accounts, and a small User with kdf_sample_size Accounts for the operations that run
+    Argon2 once per Account (which would otherwise take hours on a large vault). Returns both User ids.
+    :param db_name: the path of the database file to create
+    :param account_count: the number of Accounts for the large User
+    :param kdf_sample_size: the number of Accounts for the small User
+    :param master_password: the master password of both Users
+    :param key_pool_size: the number of Argon2-derived (salt, key) pairs the rows draw from
+    :param seed: the seed for the random generator, so that the same vault can be regenerated
+    :return: the ids of the large and the small User, in that order
+    """
+    setup_database(db_name)
+
+    connection = sqlite3.connect(db_name)
+    connection.execute("PRAGMA foreign_keys = ON;")
+
+    try:
+        large_user_id = generate_synthetic_vault(connection, account_count, email=f'large{seed}@example.com',
+                                                 master_password=master_password, key_pool_size=key_pool_size,
+                                                 seed=seed)
+        small_user_id = generate_synthetic_vault(connection, kdf_sample_size, email=f'small{seed}@example.com',
+                                                 master_password=master_password, key_pool_size=1, seed=seed + 1)
+    finally:
+        connection.close()
+
+    return large_user_id, small_user_id
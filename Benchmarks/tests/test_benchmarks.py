@@ -0,0 +1,141 @@
+import inspect
+import os
+import sqlite3
+import tempfile
+import unittest
+
+import Utils.cryptography
+import Utils.database
+from Benchmarks.benchmarks import BENCHMARKS, compare_to_baseline, run_benchmarks
+from Benchmarks.synthetic_vault import generate_account_fields, generate_synthetic_vault, create_synthetic_vault_file
+from Utils.database import db_setup, get_decrypted_account_password, get_all_account_names_urls_and_usernames_by_user_id
+
+
+class SyntheticVaultTests(unittest.TestCase):
+    def setUp(self) -> None:
+        self.connection, self.cursor = db_setup()
+
+    def tearDown(self) -> None:
+        self.cursor.close()
+        self.connection.close()
+
+    def test_generate_account_fields_is_repeatable(self):
+        """
+        The same seed generates the same Accounts and a different seed generates different ones.
+        """
+        self.assertEqual(list(generate_account_fields(200, seed=7)), list(generate_account_fields(200, seed=7)))
+        self.assertNotEqual(list(generate_account_fields(200, seed=7)), list(generate_account_fields(200, seed=8)))
+
+    def test_generate_account_fields_unique_names(self):
+        """
+        Account names are unique case-insensitively, as required by UNIQUE(name, user_id) with COLLATE NOCASE.
+        """
+        names = [name.lower() for name, url, username, password in generate_account_fields(5000)]
+
+        self.assertEqual(len(names), len(set(names)))
+
+    def test_generate_account_fields_distributions(self):
+        """
+        Setting the url and popular site probabilities to their extremes removes urls or the long tail of sites.
+        """
+        for name, url, username, password in generate_account_fields(200, url_probability=0,
+                                                                     popular_site_probability=1):
+            self.assertIsNone(url)
+            self.assertNotRegex(name, r'\d{1,4}$')
+
+    def test_generate_synthetic_vault(self):
+        """
+        Generates the requested number of Accounts, each of which decrypts with the master password.
+        """
+        user_id = generate_synthetic_vault(self.connection, 300, master_password='Master', key_pool_size=1)
+
+        accounts = get_all_account_names_urls_and_usernames_by_user_id(user_id, self.connection)
+        self.assertEqual(300, len(accounts))
+
+        expected_passwords = [password for name, url, username, password in generate_account_fields(300)]
+        self.cursor.execute("SELECT id FROM accounts WHERE user_id=? ORDER BY id", (user_id,))
+        account_ids = [row[0] for row in self.cursor.fetchall()]
+
+        for index in (0, 299):
+            self.assertEqual(expected_passwords[index],
+                             get_decrypted_account_password(account_ids[index], 'Master', self.connection))
+
+    def test_generate_synthetic_vault_rows_have_unique_nonces(self):
+        """
+        Rows sharing a key from the pool are still encrypted individually.
+        """
+        generate_synthetic_vault(self.connection, 100, key_pool_size=1)
+
+        self.cursor.execute("SELECT COUNT(DISTINCT nonce), COUNT(DISTINCT salt) FROM accounts")
+
+        self.assertEqual((100, 1), self.cursor.fetchone())
+
+    def test_generate_synthetic_vault_invalid_key_pool_size(self):
+        """
+        Raises ValueError when the key pool is empty.
+        """
+        try:
+            generate_synthetic_vault(self.connection, 10, key_pool_size=0)
+        except ValueError as e:
+            self.assertEqual('The key pool size must be at least 1 (got 0)', str(e))
+        else:
+            self.fail('ValueError should have been raised for an empty key pool')
+
+    def test_create_synthetic_vault_file(self):
+        """
+        Creates a database file with a large and a small synthetic User.
+        """
+        with tempfile.TemporaryDirectory() as directory:
+            db_name = os.path.join(directory, 'vault.sqlite3')
+            large_user_id, small_user_id = create_synthetic_vault_file(db_name, 50, kdf_sample_size=3,
+                                                                       key_pool_size=1)
+
+            connection = sqlite3.connect(db_name)
+            cursor = connection.cursor()
+            cursor.execute("SELECT user_id, COUNT(*) FROM accounts GROUP BY user_id ORDER BY user_id")
+            counts = cursor.fetchall()
+            cursor.close()
+            connection.close()
+
+        self.assertEqual([(large_user_id, 50), (small_user_id, 3)], counts)
+
+
+class BenchmarkTests(unittest.TestCase):
+    def test_every_public_util_function_has_a_benchmark(self):
+        """
+        Every public function defined in Utils.database and Utils.cryptography is covered by a benchmark.
+        """
+        for module, prefix in ((Utils.database, 'database'), (Utils.cryptography, 'cryptography')):
+            for name, function in inspect.getmembers(module, inspect.isfunction):
+                if function.__module__ == module.__name__ and not name.startswith('_'):
+                    self.assertIn(f'{prefix}.{name}', BENCHMARKS)
+
+    def test_run_benchmarks(self):
+        """
+        Produces one record per benchmark and size, with timing and memory statistics.
+        """
+        results = run_benchmarks([20, 40], repeat=2, kdf_sample_size=1, key_pool_size=1,
+                                 name_filter='database.get_account_id_by')
+
+        self.assertEqual([20, 40], [record['accounts'] for record in results['results']])
+
+        for record in results['results']:
+            self.assertEqual('database.get_account_id_by_account_name_and_user_id', record['name'])
+            self.assertLessEqual(record['min_s'], record['median_s'])
+            self.assertGreater(record['peak_memory_bytes'], 0)
+
+    def test_compare_to_baseline(self):
+        """
+        Reports regressions and improvements beyond the tolerance, unchanged results within it, and new benchmarks.
+        """
+        def document(medians):
+            return {'results': [{'name': name, 'accounts': 1000, 'median_s': median} for name, median in medians]}
+
+        baseline = document([('slower', 1.0), ('faster', 1.0), ('same', 1.0)])
+        results = document([('slower', 1.5), ('faster', 0.5), ('same', 1.05), ('added', 1.0)])
+
+        statuses = {comparison['name']: comparison['status']
+                    for comparison in compare_to_baseline(results, baseline, tolerance=0.1)}
+
+        self.assertEqual({'slower': 'regression', 'faster': 'improvement', 'same': 'unchanged', 'added': 'new'},
+                         statuses)
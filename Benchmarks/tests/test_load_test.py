@@ -0,0 +1,80 @@
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import unittest
+
+from Benchmarks.load_test import parse_mix, latency_summary, run_load_test, Session, DEFAULT_MIX
+from Benchmarks.synthetic_vault import create_synthetic_vault_file, DEFAULT_MASTER_PASSWORD
+
+
+class LoadTestTests(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls) -> None:
+        cls.directory = tempfile.TemporaryDirectory()
+        cls.db_name = os.path.join(cls.directory.name, 'load_test.sqlite3')
+        cls.user_id, _ = create_synthetic_vault_file(cls.db_name, 50, kdf_sample_size=1, key_pool_size=1)
+
+    @classmethod
+    def tearDownClass(cls) -> None:
+        cls.directory.cleanup()
+
+    def test_parse_mix(self):
+        self.assertEqual({'lookup': 60.0, 'edit': 5.5}, parse_mix('lookup=60, edit=5.5'))
+
+        for mix in ('unknown=1', 'lookup=-1', 'lookup=0', 'lookup=abc'):
+            with self.assertRaises(ValueError):
+                parse_mix(mix)
+
+    def test_latency_summary(self):
+        summary = latency_summary([i / 1000 for i in range(1, 101)])
+
+        self.assertAlmostEqual(50.5, summary['p50_ms'])
+        self.assertAlmostEqual(95.05, summary['p95_ms'])
+        self.assertAlmostEqual(99.01, summary['p99_ms'])
+        self.assertAlmostEqual(100, summary['max_ms'])
+        self.assertEqual({}, latency_summary([]))
+
+    def test_run_load_test_report(self):
+        """
+        Concurrent sessions run the mixed operations and the report has the totals and each operation's statistics.
+        """
+        report = run_load_test(self.db_name, self.user_id, sessions=3, duration=0.5,
+                               mix={'lookup': 10, 'list': 2, 'edit': 3, 'reveal': 0}, think_time_ms=1)
+
+        self.assertEqual({'lookup', 'list', 'edit'}, set(report['operations']))
+        self.assertEqual(0, report['total']['errors'])
+        self.assertEqual(report['total']['count'], sum(stats['count'] for stats in report['operations'].values()))
+        self.assertGreater(report['operations']['lookup']['count'], 0)
+        self.assertLessEqual(report['total']['p50_ms'], report['total']['p95_ms'])
+        self.assertLessEqual(report['total']['p95_ms'], report['total']['p99_ms'])
+
+    def test_busy_database_is_retried_and_lock_wait_recorded(self):
+        """
+        An edit that hits SQLITE_BUSY while another connection holds the write lock is retried until it succeeds.
+        """
+        session = Session(0, self.db_name, self.user_id, [(1, 'Company', None, 'user')], DEFAULT_MASTER_PASSWORD,
+                          busy_timeout_ms=0, seed=0)
+        session.open()
+
+        blocker = sqlite3.connect(self.db_name, check_same_thread=False)
+        blocker.execute("BEGIN IMMEDIATE")
+        threading.Timer(0.2, blocker.commit).start()
+
+        start = time.perf_counter()
+        session.run_operation('edit')
+        elapsed = time.perf_counter() - start
+
+        session.close()
+        blocker.close()
+
+        stats = session.stats['edit']
+
+        self.assertEqual((1, 0), (len(stats.latencies), stats.errors))
+        self.assertGreater(stats.busy_retries, 0)
+        self.assertGreater(stats.lock_wait, 0.1)
+        self.assertGreaterEqual(elapsed, 0.2)
+
+    def test_default_mix_only_has_known_operations(self):
+        self.assertEqual(DEFAULT_MIX, parse_mix(','.join(f'{key}={value}' for key, value in DEFAULT_MIX.items())))
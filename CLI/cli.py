@@ -0,0 +1,974 @@
+import json
+import os
+import sys
+import threading
+from argparse import ArgumentParser, Namespace
+from getpass import getpass
+from sqlite3 import Connection, IntegrityError
+from typing import Dict, List, Optional, Tuple
+
+from argon2.exceptions import VerificationError, InvalidHashError
+
+from Agent.client import AgentClient, AgentError
+from Agent.protocol import DEFAULT_IDLE_TIMEOUT
+from config import DB_NAME, BREACHED_PASSWORDS_PATH, BACKUP_DIR, BACKUP_KEEP_CHAINS
+from Database.database_setup import setup_database
+from Utils.database import is_valid_login, get_user_id_by_email, create_account, edit_account, delete_account, \
+    get_account_id_by_account_name_and_user_id, get_account_name_url_and_username_by_account_id, \
+    get_all_account_names_urls_and_usernames_by_user_id, get_decrypted_account_password, find_accounts_for_url, \
+    get_all_account_ids_names_urls_and_usernames_by_user_id, fingerprint_account_passwords, \
+    get_reused_account_passwords_by_user_id, get_account_version, search_accounts, seal_account_metadata, \
+    create_shared_item, add_shared_item_member, remove_shared_item_member, delete_shared_item, \
+    get_shared_item_by_name_and_user_id, get_decrypted_shared_item_password, add_attachment, add_note, \
+    get_attachments_by_account_id, get_attachment_id_by_name_and_account_id, read_attachment, get_decrypted_note, \
+    delete_attachment
+from Utils.import_export import import_accounts_from_csv, export_accounts_to_csv, write_accounts_to_csv, \
+    import_accounts_from_ndjson, export_accounts_to_ndjson, is_ndjson_path, NDJSON_FIRST_ACCOUNT_LINE
+from Utils.importers import IMPORTERS, import_accounts_from_file
+from Utils.sql_trace import connect
+
+# A headless command-line interface to the password manager, for scripting and one-off lookups. It is built on the
+# same Utils functions as the GUI, but must not import Tk, customtkinter, or the win32 modules, so that it starts
+# quickly and also works on machines without a display. pyperclip is only imported when --clipboard is used.
+#
+# The email can be given with --email or the PPM_EMAIL environment variable, and the master password with the
+# PPM_MASTER_PASSWORD environment variable; otherwise the master password is prompted for. With --agent, list, search,
+# match, and get are served by a running agent (started with the agent command) instead, without running Argon2.
+#
+# With --vault (or the PPM_VAULT environment variable), the commands run against an encrypted vault file (see
+# Utils.encrypted_vault) instead of the database, whose password is read from the PPM_VAULT_PASSWORD environment
+# variable or prompted for. The vault is saved once the command is done, if it changed anything.
+#
+# With --shards (or the PPM_SHARDS environment variable), the commands run against the shard of the User with the given
+# email in a sharded vault directory (see Utils.sharded_vault), which shard-database writes from a database.
+#
+# Only what every command needs (Utils.database, and the import formats and defaults the parser shows) is imported
+# with the module. The agent (asyncio), the vault check (multiprocessing), backups, sync, breach checks, encrypted
+# exports, encrypted and sharded vaults are imported by the commands that use them, so that a lookup does not pay for
+# them on every run.
+
+EMAIL_ENV_VAR = 'PPM_EMAIL'
+MASTER_PASSWORD_ENV_VAR = 'PPM_MASTER_PASSWORD'
+EXPORT_PASSWORD_ENV_VAR = 'PPM_EXPORT_PASSWORD'
+BACKUP_PASSWORD_ENV_VAR = 'PPM_BACKUP_PASSWORD'
+VAULT_ENV_VAR = 'PPM_VAULT'
+VAULT_PASSWORD_ENV_VAR = 'PPM_VAULT_PASSWORD'
+SHARDS_ENV_VAR = 'PPM_SHARDS'
+
+ACCOUNT_FIELDS = ('name', 'url', 'username', 'password')
+
+
+class CLIError(Exception):
+    """
+    An error that is reported to the user as a message instead of a traceback.
+    """
+
+
+def _read_master_password() -> str:
+    master_password = os.environ.get(MASTER_PASSWORD_ENV_VAR)
+
+    if master_password is None:
+        master_password = getpass('Master password: ')
+
+    return master_password
+
+
+def _read_export_password(args: Namespace) -> Optional[str]:
+    """
+    Returns the password of an encrypted export, or None to use the master password.
+    """
+    if args.prompt_export_password:
+        return getpass('Export password: ')
+
+    return os.environ.get(EXPORT_PASSWORD_ENV_VAR)
+
+
+def _read_backup_password() -> str:
+    backup_password = os.environ.get(BACKUP_PASSWORD_ENV_VAR)
+
+    if backup_password is None:
+        backup_password = getpass('Backup password: ')
+
+    return backup_password
+
+
+def _read_vault_password() -> str:
+    vault_password = os.environ.get(VAULT_PASSWORD_ENV_VAR)
+
+    if vault_password is None:
+        vault_password = getpass('Vault password: ')
+
+    return vault_password
+
+
+def _unlock(args: Namespace, connection: Connection) -> Tuple[int, str]:
+    """
+    Verifies the master password of the User with the given email and returns the User's id and master password.
+    :raise CLIError: if no email was given or the login is not valid
+    """
+    if not args.email:
+        raise CLIError(f'An email must be given with --email or the {EMAIL_ENV_VAR} environment variable')
+
+    master_password = _read_master_password()
+
+    try:
+        valid_login = is_valid_login(email=args.email, entered_password=master_password, connection=connection)
+    except (VerificationError, InvalidHashError):
+        valid_login = False
+
+    if not valid_login:
+        raise CLIError('Invalid email or master password')
+
+    return get_user_id_by_email(args.email, connection), master_password
+
+
+def _get_account_id(name: str, user_id: int, connection: Connection) -> int:
+    account_id = get_account_id_by_account_name_and_user_id(name, user_id, connection)
+
+    if account_id is None:
+        raise CLIError(f'There is no Account named {name}')
+
+    return account_id
+
+
+def _get_user_id(email: str, connection: Connection) -> int:
+    user_id = get_user_id_by_email(email, connection)
+
+    if user_id is None:
+        raise CLIError(f'There is no User with the email {email}')
+
+    return user_id
+
+
+def _get_owned_shared_item_id(name: str, user_id: int, connection: Connection) -> Optional[int]:
+    shared_item = get_shared_item_by_name_and_user_id(name, user_id, connection)
+
+    return shared_item[0] if shared_item is not None and shared_item[4] == user_id else None
+
+
+def _print_accounts(accounts: List[Tuple[str, Optional[str], str]]):
+    for name, url, username in accounts:
+        print(f"{name}\t{url or ''}\t{username}")
+
+
+def _copy_to_clipboard(text: str):
+    try:
+        from pyperclip import copy, PyperclipException
+    except ImportError:
+        raise CLIError('Copying to the clipboard requires pyperclip')
+
+    try:
+        copy(text)
+    except PyperclipException as e:
+        raise CLIError(f'Could not copy to the clipboard: {e}')
+
+
+def _agent_client(args: Namespace) -> AgentClient:
+    return AgentClient(socket_path=args.socket)
+
+
+def agent_command(args: Namespace, connection: Connection) -> int:
+    from Agent.agent import VaultAgent
+    from Utils.sharded_vault import shard_name
+
+    if not args.email:
+        raise CLIError(f'An email must be given with --email or the {EMAIL_ENV_VAR} environment variable')
+
+    # The agent opens its own connection, so it is given the User's shard if the vault is sharded
+    database = os.path.join(args.shards, shard_name(get_user_id_by_email(args.email, connection))) if args.shards \
+        else args.database
+    agent = VaultAgent(database=database, email=args.email, master_password=_read_master_password(),
+                       socket_path=args.socket, idle_timeout=args.idle_timeout, prefetch=not args.no_prefetch)
+
+    def announce():
+        agent.ready.wait()
+
+        if agent.start_error is None:
+            print(f'Agent listening on {agent.socket_path}', flush=True)
+
+    threading.Thread(target=announce, daemon=True).start()
+
+    try:
+        agent.run()
+    except KeyboardInterrupt:
+        pass
+
+    return 0
+
+
+def lock_command(args: Namespace, connection: Connection) -> int:
+    with _agent_client(args) as client:
+        client.lock()
+
+    print('Locked')
+
+    return 0
+
+
+def unlock_command(args: Namespace, connection: Connection) -> int:
+    _unlock(args, connection)
+    print('Unlocked')
+
+    return 0
+
+
+def list_command(args: Namespace, connection: Connection) -> int:
+    if args.agent:
+        with _agent_client(args) as client:
+            _print_accounts(client.list_accounts())
+
+        return 0
+
+    user_id, _ = _unlock(args, connection)
+    _print_accounts(get_all_account_names_urls_and_usernames_by_user_id(user_id, connection) or [])
+
+    return 0
+
+
+def search_command(args: Namespace, connection: Connection) -> int:
+    if args.agent:
+        with _agent_client(args) as client:
+            _print_accounts(client.search(args.query))
+
+        return 0
+
+    user_id, _ = _unlock(args, connection)
+    _print_accounts([account[1:] for account in search_accounts(user_id, args.query, connection)])
+
+    return 0
+
+
+def match_command(args: Namespace, connection: Connection) -> int:
+    if args.agent:
+        with _agent_client(args) as client:
+            _print_accounts(client.match(args.url))
+
+        return 0
+
+    user_id, _ = _unlock(args, connection)
+    _print_accounts([account[1:] for account in find_accounts_for_url(user_id, args.url, connection)])
+
+    return 0
+
+
+def get_command(args: Namespace, connection: Connection) -> int:
+    if args.agent:
+        with _agent_client(args) as client:
+            value = client.get(args.name, field=args.field)
+    else:
+        value = _get_account_field(args, connection)
+
+    if args.clipboard:
+        _copy_to_clipboard(value)
+        print(f'Copied the {args.field} of {args.name} to the clipboard', file=sys.stderr)
+    else:
+        print(value)
+
+    return 0
+
+
+def _get_account_field(args: Namespace, connection: Connection) -> str:
+    user_id, master_password = _unlock(args, connection)
+    account_id = get_account_id_by_account_name_and_user_id(args.name, user_id, connection)
+
+    # The User's own Accounts come first, then the items shared with them
+    if account_id is None:
+        shared_item = get_shared_item_by_name_and_user_id(args.name, user_id, connection)
+
+        if shared_item is None:
+            raise CLIError(f'There is no Account named {args.name}')
+
+        item_id, name, url, username, _ = shared_item
+
+        if args.field == 'password':
+            return get_decrypted_shared_item_password(item_id, user_id, master_password, connection)
+
+        return {'name': name, 'url': url, 'username': username}[args.field] or ''
+
+    if args.field == 'password':
+        value = get_decrypted_account_password(account_id, master_password, connection)
+    else:
+        name, url, username = get_account_name_url_and_username_by_account_id(account_id, connection)
+        value = {'name': name, 'url': url, 'username': username}[args.field] or ''
+
+    return value
+
+
+def add_command(args: Namespace, connection: Connection) -> int:
+    user_id, master_password = _unlock(args, connection)
+    password = args.password if args.password is not None else getpass(f'Password for {args.name}: ')
+
+    create_account(user_id=user_id, master_password=master_password, name=args.name, url=args.url,
+                   username=args.username, password=password, connection=connection)
+    print(f'Added {args.name}')
+
+    return 0
+
+
+def edit_command(args: Namespace, connection: Connection) -> int:
+    user_id, master_password = _unlock(args, connection)
+    account_id = _get_account_id(args.name, user_id, connection)
+    # So that a change made by another process while the new password is prompted for is not overwritten
+    version = get_account_version(account_id, connection)
+
+    password = args.password
+
+    if password is None and args.prompt_password:
+        password = getpass(f'New password for {args.name}: ')
+
+    if not any((args.new_name, args.url, args.username, password)):
+        raise CLIError('Nothing to edit; pass at least one of --new-name, --url, --username, or --password')
+
+    edit_account(account_id=account_id, connection=connection, master_password=master_password, name=args.new_name,
+                 url=args.url, username=args.username, password=password, expected_version=version)
+    print(f'Edited {args.new_name or args.name}')
+
+    return 0
+
+
+def delete_command(args: Namespace, connection: Connection) -> int:
+    user_id, _ = _unlock(args, connection)
+    account_id = get_account_id_by_account_name_and_user_id(args.name, user_id, connection)
+    shared_item_id = _get_owned_shared_item_id(args.name, user_id, connection) if account_id is None else None
+
+    if account_id is None and shared_item_id is None:
+        raise CLIError(f'There is no Account named {args.name}')
+
+    version = get_account_version(account_id, connection) if account_id is not None else None
+    attachment_count = len(get_attachments_by_account_id(account_id, connection)) if account_id is not None else 0
+    prompt = f'Delete {args.name} and its {attachment_count} attachments?' if attachment_count else \
+        f'Delete {args.name}?'
+
+    if not args.yes and input(f'{prompt} [y/N] ').strip().lower() not in ('y', 'yes'):
+        print('Not deleted')
+        return 1
+
+    if account_id is not None:
+        delete_account(account_id, connection, expected_version=version)
+    else:
+        delete_shared_item(shared_item_id, user_id, connection)
+
+    print(f'Deleted {args.name}')
+
+    return 0
+
+
+def share_command(args: Namespace, connection: Connection) -> int:
+    user_id, master_password = _unlock(args, connection)
+    member_ids = [_get_user_id(email, connection) for email in args.emails]
+    shared_item_id = _get_owned_shared_item_id(args.name, user_id, connection)
+
+    if shared_item_id is not None:
+        for member_id in member_ids:
+            add_shared_item_member(shared_item_id, user_id, master_password, member_id, connection)
+    else:
+        # An Account is not moved into a shared item, since the GUI, the exports, sync, and the checks only read
+        # Accounts, so a new item is created from the given fields instead
+        if get_account_id_by_account_name_and_user_id(args.name, user_id, connection) is not None:
+            raise CLIError(f'{args.name} is an account, which cannot be shared yet; share a new item under another '
+                           f'name instead')
+
+        if not args.username:
+            raise CLIError('A new shared item needs a --username')
+
+        password = args.password if args.password is not None else getpass(f'Password for {args.name}: ')
+
+        create_shared_item(user_id, master_password, args.name, args.url, args.username, password, member_ids,
+                           connection)
+
+    print(f'Shared {args.name} with {", ".join(args.emails)}')
+
+    return 0
+
+
+def unshare_command(args: Namespace, connection: Connection) -> int:
+    user_id, _ = _unlock(args, connection)
+    shared_item_id = _get_owned_shared_item_id(args.name, user_id, connection)
+
+    if shared_item_id is None:
+        raise CLIError(f'You do not share an item named {args.name}')
+
+    for email in args.emails:
+        remove_shared_item_member(shared_item_id, user_id, _get_user_id(email, connection), connection)
+
+    print(f'Stopped sharing {args.name} with {", ".join(args.emails)}')
+
+    return 0
+
+
+def attach_command(args: Namespace, connection: Connection) -> int:
+    user_id, master_password = _unlock(args, connection)
+    account_id = _get_account_id(args.name, user_id, connection)
+    attachment_name = args.attachment_name or os.path.basename(args.file)
+
+    with open(args.file, 'rb') as content:
+        add_attachment(account_id, master_password, attachment_name, content, connection)
+
+    print(f'Attached {attachment_name} to {args.name}')
+
+    return 0
+
+
+def note_command(args: Namespace, connection: Connection) -> int:
+    user_id, master_password = _unlock(args, connection)
+    account_id = _get_account_id(args.name, user_id, connection)
+    text = args.text if args.text is not None else sys.stdin.read()
+
+    add_note(account_id, master_password, args.title, text, connection)
+    print(f'Added the note {args.title} to {args.name}')
+
+    return 0
+
+
+def attachments_command(args: Namespace, connection: Connection) -> int:
+    user_id, _ = _unlock(args, connection)
+
+    for _, name, kind, size in get_attachments_by_account_id(_get_account_id(args.name, user_id, connection),
+                                                             connection):
+        print(f'{name}\t{kind}\t{size}')
+
+    return 0
+
+
+def _get_attachment_id(args: Namespace, user_id: int, connection: Connection) -> int:
+    attachment_id = get_attachment_id_by_name_and_account_id(args.attachment,
+                                                             _get_account_id(args.name, user_id, connection),
+                                                             connection)
+
+    if attachment_id is None:
+        raise CLIError(f'{args.name} has no attachment named {args.attachment}')
+
+    return attachment_id
+
+
+def read_attachment_command(args: Namespace, connection: Connection) -> int:
+    user_id, master_password = _unlock(args, connection)
+    attachment_id = _get_attachment_id(args, user_id, connection)
+
+    # A file that is not text is refused (see get_decrypted_note) instead of being printed
+    if not args.output:
+        print(get_decrypted_note(attachment_id, master_password, connection), end='')
+
+        return 0
+
+    chunks = read_attachment(attachment_id, master_password, connection)
+
+    # Written next to the output and renamed once every chunk is verified, so a failed read leaves nothing behind
+    partial_path = f'{args.output}.partial'
+
+    try:
+        with open(partial_path, 'wb') as output:
+            for chunk in chunks:
+                output.write(chunk)
+
+        os.replace(partial_path, args.output)
+    except BaseException:
+        if os.path.exists(partial_path):
+            os.remove(partial_path)
+
+        raise
+
+    print(f'Wrote {args.attachment} to {args.output}', file=sys.stderr)
+
+    return 0
+
+
+def detach_command(args: Namespace, connection: Connection) -> int:
+    user_id, _ = _unlock(args, connection)
+    attachment_id = _get_attachment_id(args, user_id, connection)
+
+    prompt = f'Delete {args.attachment} from {args.name}? [y/N] '
+
+    if not args.yes and input(prompt).strip().lower() not in ('y', 'yes'):
+        print('Not deleted')
+        return 1
+
+    delete_attachment(attachment_id, connection)
+    print(f'Deleted {args.attachment} from {args.name}')
+
+    return 0
+
+
+def _import_ndjson(args: Namespace, user_id: int, master_password: str, connection: Connection)\
+        -> Tuple[List[int], List[Dict[str, Optional[str]]]]:
+    account_ids = []
+    unimportable_accounts = []
+    next_line = args.start_line
+
+    try:
+        for last_line, results in import_accounts_from_ndjson(
+                ndjson_path=args.file, user_id=user_id, master_password=master_password, connection=connection,
+                start_line=args.start_line):
+            next_line = last_line + 1
+
+            for _, account_id, account in results:
+                if account_id is None:
+                    unimportable_accounts.append(account)
+                else:
+                    account_ids.append(account_id)
+    except (ValueError, KeyboardInterrupt):
+        print(f'Imported {len(account_ids)} accounts before stopping; resume with --start-line {next_line}',
+              file=sys.stderr)
+        raise
+
+    return account_ids, unimportable_accounts
+
+
+def import_command(args: Namespace, connection: Connection) -> int:
+    from Utils.encrypted_export import import_accounts_from_encrypted_export, is_encrypted_export
+
+    user_id, master_password = _unlock(args, connection)
+
+    if args.format:
+        account_ids, unimportable_accounts = import_accounts_from_file(path=args.file, user_id=user_id,
+                                                                       master_password=master_password,
+                                                                       connection=connection,
+                                                                       importer_name=args.format)
+    elif is_ndjson_path(args.file):
+        account_ids, unimportable_accounts = _import_ndjson(args, user_id, master_password, connection)
+    elif is_encrypted_export(args.file):
+        account_ids, unimportable_accounts = import_accounts_from_encrypted_export(
+            path=args.file, user_id=user_id, master_password=master_password, connection=connection,
+            export_password=_read_export_password(args))
+    else:
+        try:
+            account_ids, unimportable_accounts = import_accounts_from_csv(csv_path=args.file, user_id=user_id,
+                                                                          master_password=master_password,
+                                                                          connection=connection)
+        except (ValueError, UnicodeDecodeError):
+            # Not a CSV file in this program's format, so it may be the export of another password manager
+            account_ids, unimportable_accounts = import_accounts_from_file(path=args.file, user_id=user_id,
+                                                                           master_password=master_password,
+                                                                           connection=connection)
+    print(f'Imported {len(account_ids)} accounts')
+
+    if unimportable_accounts:
+        print(f'{len(unimportable_accounts)} accounts could not be imported (missing info or duplicate names)',
+              file=sys.stderr)
+
+        if args.unimportable:
+            write_accounts_to_csv(args.unimportable, unimportable_accounts)
+        else:
+            for account in unimportable_accounts:
+                print(f"  {account['name']}", file=sys.stderr)
+
+        return 1
+
+    return 0
+
+
+def export_command(args: Namespace, connection: Connection) -> int:
+    from Utils.encrypted_export import export_accounts_encrypted
+
+    user_id, master_password = _unlock(args, connection)
+
+    if args.encrypted:
+        count = export_accounts_encrypted(path=args.file, user_id=user_id, master_password=master_password,
+                                          connection=connection, export_password=_read_export_password(args),
+                                          compress=not args.no_compression)
+    elif is_ndjson_path(args.file):
+        count = export_accounts_to_ndjson(ndjson_path=args.file, user_id=user_id, master_password=master_password,
+                                          connection=connection, start_line=args.start_line) - args.start_line
+    else:
+        count = export_accounts_to_csv(csv_path=args.file, user_id=user_id, master_password=master_password,
+                                       connection=connection)
+
+    print(f'Exported {count} accounts to {args.file}')
+
+    return 0
+
+
+def breach_convert_command(args: Namespace, connection: Connection) -> int:
+    from Utils.breach_check import convert_hash_dump
+
+    count = convert_hash_dump(args.dump_file, args.output, chunk_records=args.chunk_records)
+    print(f'Wrote {count} hashes to {args.output}')
+
+    return 0
+
+
+def breach_check_command(args: Namespace, connection: Connection) -> int:
+    from Utils.breach_check import find_breached_account_passwords, BreachedPasswordFile
+
+    if not os.path.isfile(args.corpus):
+        raise CLIError(f'There is no breached-password corpus at {args.corpus} (see the breach-convert command)')
+
+    user_id, master_password = _unlock(args, connection)
+
+    with BreachedPasswordFile(args.corpus, use_bloom_filter=args.bloom_filter) as breached_password_file:
+        breached = find_breached_account_passwords(user_id, master_password, connection, breached_password_file)
+
+    for account_id, name, _, _ in get_all_account_ids_names_urls_and_usernames_by_user_id(user_id, connection) or []:
+        if account_id in breached:
+            print(f'{name}\t{breached[account_id]}')
+
+    print(f'{len(breached)} breached passwords', file=sys.stderr)
+
+    return 1 if breached else 0
+
+
+def reused_command(args: Namespace, connection: Connection) -> int:
+    user_id, master_password = _unlock(args, connection)
+
+    # Only the Accounts without a fingerprint yet are decrypted
+    fingerprint_account_passwords(user_id, master_password, connection)
+    groups = get_reused_account_passwords_by_user_id(user_id, connection)
+
+    for group in groups:
+        print('\t'.join(name for _, name in group))
+
+    print(f'{len(groups)} reused passwords', file=sys.stderr)
+
+    return 1 if groups else 0
+
+
+def check_command(args: Namespace, connection: Connection) -> int:
+    from Utils.vault_check import check_vault
+
+    user_id, master_password = _unlock(args, connection)
+
+    def progress(checked: int, total: int):
+        print(f'\rChecked {checked}/{total} accounts', end='\n' if checked == total else '', file=sys.stderr,
+              flush=True)
+
+    report = check_vault(user_id, master_password, connection, workers=args.workers,
+                         progress=None if args.no_progress else progress, quick=args.quick)
+
+    print(json.dumps(report, indent=2))
+
+    return 0 if report['ok'] else 1
+
+
+def _print_pages_copied(copied: int, total: int):
+    print(f'\rCopied {copied}/{total} pages', end='\n' if copied == total else '', file=sys.stderr, flush=True)
+
+
+def backup_command(args: Namespace, connection: Connection) -> int:
+    from Utils.backup import create_backup
+
+    backup_path = create_backup(connection, args.directory, _read_backup_password(), incremental=not args.full,
+                                keep_chains=args.keep, progress=None if args.no_progress else _print_pages_copied)
+
+    print(backup_path)
+
+    return 0
+
+
+def restore_command(args: Namespace, connection: Connection) -> int:
+    from Utils.backup import restore_backup, verify_backup
+
+    if args.verify_only:
+        manifest = verify_backup(args.backup, _read_backup_password())
+        print(f'Verified {manifest["name"]} ({manifest["page_count"]} pages)')
+    else:
+        manifest = restore_backup(args.backup, _read_backup_password(), connection,
+                                  progress=None if args.no_progress else _print_pages_copied)
+        print(f'Restored {manifest["name"]} ({manifest["page_count"]} pages)')
+
+    return 0
+
+
+def sync_command(args: Namespace, connection: Connection) -> int:
+    from Utils.sync import sync_vaults
+
+    if not args.email:
+        raise CLIError(f'An email must be given with --email or the {EMAIL_ENV_VAR} environment variable')
+
+    report = sync_vaults(connection, args.peer, args.email, _read_master_password(), prefer=args.prefer)
+
+    print(json.dumps(report, indent=2))
+
+    return 1 if report['conflicts'] and not args.prefer else 0
+
+
+def seal_command(args: Namespace, connection: Connection) -> int:
+    user_id, master_password = _unlock(args, connection)
+    print(f'Sealed {seal_account_metadata(user_id, master_password, connection)} accounts')
+
+    return 0
+
+
+def encrypt_database_command(args: Namespace, connection: Connection) -> int:
+    from Utils.encrypted_vault import encrypt_database_file
+
+    if args.vault:
+        raise CLIError('The vault is already encrypted; pass the database to encrypt with --database instead')
+
+    # Committed changes are all in the database file, which is read by its own connection
+    encrypt_database_file(args.database, args.vault_path, _read_vault_password())
+    print(f'Encrypted {args.database} to {args.vault_path}; open it with --vault {args.vault_path}')
+
+    return 0
+
+
+def shard_database_command(args: Namespace, connection: Connection) -> int:
+    from Utils.sharded_vault import shard_database_file
+
+    if args.vault or args.shards:
+        raise CLIError('Only a database can be sharded; pass it with --database instead')
+
+    user_count = shard_database_file(args.database, args.shards_path)
+    print(f'Sharded {args.database} into {args.shards_path} ({user_count} users); open it with --shards '
+          f'{args.shards_path}')
+
+    return 0
+
+
+def build_parser() -> ArgumentParser:
+    parser = ArgumentParser(prog='python -m CLI', description='Personal Password Manager command-line interface.')
+    parser.add_argument('--database', default=DB_NAME, help='the database file (default: the application database)')
+    parser.add_argument('--vault', default=os.environ.get(VAULT_ENV_VAR),
+                        help=f'use this encrypted vault file instead of the database (created if needed; default: the '
+                             f'{VAULT_ENV_VAR} environment variable)')
+    parser.add_argument('--shards', default=os.environ.get(SHARDS_ENV_VAR),
+                        help=f'use the shard of the --email User in this sharded vault directory instead of the '
+                             f'database (default: the {SHARDS_ENV_VAR} environment variable)')
+    parser.add_argument('--email', default=os.environ.get(EMAIL_ENV_VAR),
+                        help=f'the login email (default: the {EMAIL_ENV_VAR} environment variable)')
+    parser.add_argument('--agent', action='store_true',
+                        help='serve list, search, match, and get from the running agent')
+    parser.add_argument('--socket', help='the agent socket (default: the PPM_AGENT_SOCKET environment variable or a '
+                                         'per-user path)')
+
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    commands.add_parser('unlock', help='verify the master password').set_defaults(handler=unlock_command)
+
+    agent = commands.add_parser('agent', help='unlock the vault and serve lookups over a Unix socket until locked')
+    agent.add_argument('--idle-timeout', type=float, default=DEFAULT_IDLE_TIMEOUT,
+                       help=f'lock after this many seconds without a request (default: {DEFAULT_IDLE_TIMEOUT})')
+    agent.add_argument('--no-prefetch', action='store_true',
+                       help='only derive the keys of the Accounts that are looked up')
+    agent.set_defaults(handler=agent_command)
+
+    commands.add_parser('lock', help='lock and stop the running agent').set_defaults(handler=lock_command)
+    commands.add_parser('list', help='list the accounts (name, url, username)').set_defaults(handler=list_command)
+
+    search = commands.add_parser('search', help='list the accounts whose name, url, or username contains the query '
+                                                '(or, once sealed, has all the words of the query)')
+    search.add_argument('query')
+    search.set_defaults(handler=search_command)
+
+    match = commands.add_parser('match', help='list the accounts for the site of a url, those on the same host first')
+    match.add_argument('url')
+    match.set_defaults(handler=match_command)
+
+    get = commands.add_parser('get', help='print a field of an account (the password by default)')
+    get.add_argument('name')
+    get.add_argument('--field', choices=ACCOUNT_FIELDS, default='password')
+    get.add_argument('--clipboard', action='store_true', help='copy the field to the clipboard instead of printing it')
+    get.set_defaults(handler=get_command)
+
+    add = commands.add_parser('add', help='add an account')
+    add.add_argument('name')
+    add.add_argument('--url')
+    add.add_argument('--username', required=True)
+    add.add_argument('--password', help='the account password (prompted for if not given)')
+    add.set_defaults(handler=add_command)
+
+    edit = commands.add_parser('edit', help='edit an account')
+    edit.add_argument('name')
+    edit.add_argument('--new-name')
+    edit.add_argument('--url')
+    edit.add_argument('--username')
+    edit.add_argument('--password')
+    edit.add_argument('--prompt-password', action='store_true', help='prompt for the new account password')
+    edit.set_defaults(handler=edit_command)
+
+    delete = commands.add_parser('delete', help='delete an account (or an item you share)')
+    delete.add_argument('name')
+    delete.add_argument('--yes', action='store_true', help='do not ask for confirmation')
+    delete.set_defaults(handler=delete_command)
+
+    share = commands.add_parser('share', help='share an item with other users, who must have logged in once since '
+                                              'sharing was added (a new item is created from --url, --username, and '
+                                              '--password; accounts cannot be shared yet)')
+    share.add_argument('name')
+    share.add_argument('emails', nargs='+', metavar='email')
+    share.add_argument('--url', help='the url of a new shared item')
+    share.add_argument('--username', help='the username of a new shared item')
+    share.add_argument('--password', help='the password of a new shared item (prompted for if not given)')
+    share.set_defaults(handler=share_command)
+
+    unshare = commands.add_parser('unshare', help='stop sharing an item with other users (delete it to stop sharing it '
+                                                  'with everyone)')
+    unshare.add_argument('name')
+    unshare.add_argument('emails', nargs='+', metavar='email')
+    unshare.set_defaults(handler=unshare_command)
+
+    attach = commands.add_parser('attach', help='attach a file to an account, which is encrypted and stored in '
+                                                'chunks')
+    attach.add_argument('name')
+    attach.add_argument('file')
+    attach.add_argument('--as', dest='attachment_name', help='the name of the attachment (default: the file name)')
+    attach.set_defaults(handler=attach_command)
+
+    note = commands.add_parser('note', help='add a note to an account, as an attachment')
+    note.add_argument('name')
+    note.add_argument('title')
+    note.add_argument('--text', help='the text of the note (read from stdin if not given)')
+    note.set_defaults(handler=note_command)
+
+    attachments = commands.add_parser('attachments', help='list the attachments of an account (name, kind, size)')
+    attachments.add_argument('name')
+    attachments.set_defaults(handler=attachments_command)
+
+    read_attachment_parser = commands.add_parser('read-attachment', help='print a note or text attachment of an '
+                                                                         'account, or write an attachment to a file')
+    read_attachment_parser.add_argument('name')
+    read_attachment_parser.add_argument('attachment')
+    read_attachment_parser.add_argument('--output', help='the file to write the attachment to')
+    read_attachment_parser.set_defaults(handler=read_attachment_command)
+
+    detach = commands.add_parser('detach', help='delete an attachment of an account')
+    detach.add_argument('name')
+    detach.add_argument('attachment')
+    detach.add_argument('--yes', action='store_true', help='do not ask for confirmation')
+    detach.set_defaults(handler=detach_command)
+
+    import_parser = commands.add_parser('import', help='import accounts from a CSV file (name, url, username, '
+                                                       'password), an NDJSON file (.ndjson or .jsonl), an encrypted '
+                                                       'export, or the export of another password manager')
+    import_parser.add_argument('file')
+    import_parser.add_argument('--format', choices=list(IMPORTERS),
+                               help='the format of another password manager\'s export (default: detected from the '
+                                    'file)')
+    import_parser.add_argument('--start-line', type=int, default=NDJSON_FIRST_ACCOUNT_LINE,
+                               help='resume an NDJSON import at this line')
+    import_parser.add_argument('--prompt-export-password', action='store_true',
+                               help=f'prompt for the password of an encrypted export (default: the '
+                                    f'{EXPORT_PASSWORD_ENV_VAR} environment variable or the master password)')
+    import_parser.add_argument('--unimportable', help='write the accounts that could not be imported to this CSV file')
+    import_parser.set_defaults(handler=import_command)
+
+    export = commands.add_parser('export', help='export the accounts, with their passwords, to a CSV file, an NDJSON '
+                                                'file (.ndjson or .jsonl), or an encrypted export')
+    export.add_argument('file')
+    export.add_argument('--start-line', type=int, default=NDJSON_FIRST_ACCOUNT_LINE,
+                        help='resume an NDJSON export at this line')
+    export.add_argument('--encrypted', action='store_true', help='write an encrypted export instead of a CSV file')
+    export.add_argument('--no-compression', action='store_true', help='do not compress an encrypted export')
+    export.add_argument('--prompt-export-password', action='store_true',
+                        help=f'prompt for the password to encrypt the export with (default: the '
+                             f'{EXPORT_PASSWORD_ENV_VAR} environment variable or the master password)')
+    export.set_defaults(handler=export_command)
+
+    breach_convert = commands.add_parser('breach-convert', help='convert a text dump of SHA-1 hashes ("HASH" or '
+                                                                '"HASH:COUNT" lines) into a breached-password corpus')
+    breach_convert.add_argument('dump_file')
+    breach_convert.add_argument('--output', default=BREACHED_PASSWORDS_PATH,
+                                help='the corpus file to write (default: the one the GUI and breach-check use)')
+    breach_convert.add_argument('--chunk-records', type=int, default=1_000_000,
+                                help='hashes sorted in memory at a time (default: 1000000)')
+    breach_convert.set_defaults(handler=breach_convert_command)
+
+    breach_check = commands.add_parser('breach-check', help='list the accounts whose password is in the '
+                                                            'breached-password corpus, with its breach count')
+    breach_check.add_argument('--corpus', default=BREACHED_PASSWORDS_PATH, help='the corpus file')
+    breach_check.add_argument('--bloom-filter', action='store_true',
+                              help='front the corpus with an in-memory Bloom filter')
+    breach_check.set_defaults(handler=breach_check_command)
+
+    check = commands.add_parser('check', help='check the database and that every account password decrypts, and print '
+                                              'a JSON report')
+    check.add_argument('--workers', type=int, help='worker processes (default: the number of CPUs)')
+    check.add_argument('--quick', action='store_true', help='run PRAGMA quick_check instead of integrity_check')
+    check.add_argument('--no-progress', action='store_true', help='do not report the progress on stderr')
+    check.set_defaults(handler=check_command)
+
+    commands.add_parser('reused', help='list the groups of accounts that share a password, one group per line')\
+        .set_defaults(handler=reused_command)
+
+    backup = commands.add_parser('backup', help=f'take an encrypted backup of the whole database, incremental if '
+                                                f'possible, and print its path (the password is read from the '
+                                                f'{BACKUP_PASSWORD_ENV_VAR} environment variable or prompted for)')
+    backup.add_argument('--directory', default=BACKUP_DIR, help='the backup directory (default: the application one)')
+    backup.add_argument('--full', action='store_true', help='start a new chain with a full backup')
+    backup.add_argument('--keep', type=int, default=BACKUP_KEEP_CHAINS,
+                        help=f'the number of chains (a full backup and its incremental backups) to keep '
+                             f'(default: {BACKUP_KEEP_CHAINS})')
+    backup.add_argument('--no-progress', action='store_true', help='do not report the progress on stderr')
+    backup.set_defaults(handler=backup_command)
+
+    restore = commands.add_parser('restore', help='verify a backup and replace the whole database with it (the other '
+                                                  'backups of its chain must be in the same directory)')
+    restore.add_argument('backup')
+    restore.add_argument('--verify-only', action='store_true', help='only verify the backup')
+    restore.add_argument('--no-progress', action='store_true', help='do not report the progress on stderr')
+    restore.set_defaults(handler=restore_command)
+
+    sync = commands.add_parser('sync', help='sync the accounts with another vault file in both directions (created if '
+                                            'needed), and print a JSON report of the accounts pulled, pushed, and in '
+                                            'conflict')
+    sync.add_argument('peer', help='the other vault file')
+    sync.add_argument('--prefer', choices=('local', 'remote'),
+                      help='resolve the accounts changed differently in both vaults in favor of this one (default: '
+                           'report them and leave them as they are)')
+    sync.set_defaults(handler=sync_command)
+
+    commands.add_parser('seal', help='encrypt the name, url, and username of every account, which are then searched '
+                                     'by whole words through a keyed index')\
+        .set_defaults(handler=seal_command)
+
+    encrypt_database = commands.add_parser('encrypt-database',
+                                           help=f'write the whole database to an encrypted vault file, to use with '
+                                                f'--vault (the password is read from the {VAULT_PASSWORD_ENV_VAR} '
+                                                f'environment variable or prompted for)')
+    encrypt_database.add_argument('vault_path', help='the encrypted vault file to create')
+    encrypt_database.set_defaults(handler=encrypt_database_command)
+
+    shard_database = commands.add_parser('shard-database',
+                                         help='write the database to a sharded vault directory, with a database file '
+                                              'per user, to use with --shards (items shared between users are only '
+                                              'kept by their owner)')
+    shard_database.add_argument('shards_path', help='the sharded vault directory to create')
+    shard_database.set_defaults(handler=shard_database_command)
+
+    return parser
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = build_parser().parse_args(argv)
+
+    try:
+        if args.vault and args.shards:
+            raise ValueError('--vault and --shards cannot be used together')
+
+        if args.vault:
+            from Utils.encrypted_vault import EncryptedVault
+
+            vault = EncryptedVault(args.vault, _read_vault_password())
+            connection = vault.connection
+        elif args.shards:
+            if not args.email:
+                raise ValueError(f'An email must be given with --email or the {EMAIL_ENV_VAR} environment variable '
+                                 f'to use --shards')
+
+            from Utils.sharded_vault import ShardedVault
+
+            vault = ShardedVault(args.shards)
+
+            try:
+                connection = vault.connect_by_email(args.email)
+            except ValueError:
+                vault.close()
+                raise
+        else:
+            vault = None
+            setup_database(args.database)
+            connection = connect(args.database)
+    except (ValueError, OSError) as e:
+        print(f'Error: {e}', file=sys.stderr)
+        return 1
+
+    try:
+        try:
+            return args.handler(args, connection)
+        finally:
+            if vault is None:
+                connection.close()
+            else:
+                vault.close()
+    except (CLIError, AgentError, ValueError, IntegrityError, OSError) as e:
+        print(f'Error: {e}', file=sys.stderr)
+        return 1
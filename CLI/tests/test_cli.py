@@ -0,0 +1,361 @@
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import unittest
+from contextlib import redirect_stdout, redirect_stderr
+from unittest import mock
+
+from config import ROOT_DIR
+from Agent.agent import VaultAgent
+from CLI.cli import main, MASTER_PASSWORD_ENV_VAR, EXPORT_PASSWORD_ENV_VAR, BACKUP_PASSWORD_ENV_VAR, \
+    VAULT_PASSWORD_ENV_VAR
+from Database.database_setup import setup_database
+from Utils.database import create_user
+from Utils.sql_trace import connect
+
+# Generous enough for a slow CI machine, but far below the GUI's startup time
+IMPORT_TIME_BUDGET_SECONDS = 0.5
+
+
+class CLITests(unittest.TestCase):
+    def setUp(self) -> None:
+        self.directory = tempfile.TemporaryDirectory()
+        self.database = os.path.join(self.directory.name, 'vault.sqlite3')
+        self.environment = mock.patch.dict(os.environ, {MASTER_PASSWORD_ENV_VAR: 'MasterPassword'})
+        self.environment.start()
+
+        setup_database(self.database)
+        connection = connect(self.database)
+        create_user(email='cli@gmail.com', password='MasterPassword', connection=connection)
+        connection.close()
+
+    def tearDown(self) -> None:
+        self.environment.stop()
+        self.directory.cleanup()
+
+    def run_cli(self, *argv: str):
+        stdout, stderr = io.StringIO(), io.StringIO()
+
+        with redirect_stdout(stdout), redirect_stderr(stderr):
+            exit_code = main(['--database', self.database, '--email', 'cli@gmail.com', *argv])
+
+        return exit_code, stdout.getvalue(), stderr.getvalue()
+
+    def test_import_time_budget(self):
+        """
+        Importing the CLI does not import Tk, the win32 modules, or the subsystems that only some commands use, and
+        stays within the import-time budget.
+        """
+        code = ('import sys, time; start = time.perf_counter(); import CLI.cli; elapsed = time.perf_counter() - start; '
+                'print(elapsed); print(",".join(sorted(m for m in sys.modules if m.split(".")[0] in '
+                '("tkinter", "_tkinter", "customtkinter", "win32gui", "win32print", "pyperclip", "asyncio", '
+                '"multiprocessing") or m in ("Agent.agent", "Utils.backup", "Utils.breach_check", '
+                '"Utils.encrypted_export", "Utils.encrypted_vault", "Utils.sharded_vault", "Utils.sync", '
+                '"Utils.vault_check"))))')
+
+        # The best of a few runs, so that a single cold cache does not fail the test
+        timings = []
+
+        for _ in range(3):
+            output = subprocess.run([sys.executable, '-c', code], cwd=ROOT_DIR, capture_output=True, text=True,
+                                    check=True).stdout.splitlines()
+            timings.append(float(output[0]))
+            self.assertEqual('', output[1] if len(output) > 1 else '')
+
+        self.assertLess(min(timings), IMPORT_TIME_BUDGET_SECONDS)
+
+    def test_add_get_list_search_edit_delete(self):
+        self.assertEqual(0, self.run_cli('add', 'Company', '--url', 'https://company.com', '--username', 'user',
+                                         '--password', 'AccountPassword')[0])
+        self.assertEqual(0, self.run_cli('add', 'Bank', '--username', 'banker', '--password', 'BankPassword')[0])
+
+        self.assertEqual((0, 'AccountPassword\n', ''), self.run_cli('get', 'Company'))
+        self.assertEqual((0, 'https://company.com\n', ''), self.run_cli('get', 'company', '--field', 'url'))
+        self.assertEqual((0, 'Company\thttps://company.com\tuser\nBank\t\tbanker\n', ''), self.run_cli('list'))
+        self.assertEqual((0, 'Bank\t\tbanker\n', ''), self.run_cli('search', 'BANK'))
+        self.assertEqual((0, 'Company\thttps://company.com\tuser\n', ''),
+                         self.run_cli('match', 'https://login.company.com/'))
+
+        self.assertEqual(0, self.run_cli('edit', 'Company', '--new-name', 'Company 2', '--password', 'Changed')[0])
+        self.assertEqual((0, 'Changed\n', ''), self.run_cli('get', 'Company 2'))
+
+        self.assertEqual(0, self.run_cli('delete', 'Company 2', '--yes')[0])
+        self.assertEqual((0, 'Bank\t\tbanker\n', ''), self.run_cli('list'))
+
+    def test_errors(self):
+        """
+        Errors are reported on stderr with exit code 1 instead of a traceback.
+        """
+        exit_code, _, stderr = self.run_cli('get', 'Missing')
+        self.assertEqual(1, exit_code)
+        self.assertIn('There is no Account named Missing', stderr)
+
+        self.run_cli('add', 'Company', '--username', 'user', '--password', 'AccountPassword')
+        exit_code, _, stderr = self.run_cli('add', 'company', '--username', 'user', '--password', 'AccountPassword')
+        self.assertEqual(1, exit_code)
+        self.assertTrue(stderr.startswith('Error: '))
+
+        with mock.patch.dict(os.environ, {MASTER_PASSWORD_ENV_VAR: 'WrongPassword'}):
+            exit_code, stdout, stderr = self.run_cli('list')
+
+        self.assertEqual((1, ''), (exit_code, stdout))
+        self.assertIn('Invalid email or master password', stderr)
+
+    def test_import_other_password_manager_export(self):
+        import_path = os.path.join(self.directory.name, 'bitwarden.json')
+
+        with open(import_path, 'w', encoding='utf-8') as import_file:
+            import_file.write('{"encrypted": false, "items": [{"type": 1, "name": "Company", "login": {"uris": '
+                              '[{"uri": "https://company.com"}], "username": "user", "password": "AccountPassword"}}]}')
+
+        self.assertEqual((0, 'Imported 1 accounts\n', ''), self.run_cli('import', import_path))
+        self.assertEqual((0, 'AccountPassword\n', ''), self.run_cli('get', 'Company'))
+
+        self.assertNotEqual(0, self.run_cli('import', import_path, '--format', 'keepass-xml')[0])
+
+    def test_backup_and_restore(self):
+        backup_directory = os.path.join(self.directory.name, 'backups')
+        self.run_cli('add', 'Company', '--username', 'user', '--password', 'AccountPassword')
+
+        with mock.patch.dict(os.environ, {BACKUP_PASSWORD_ENV_VAR: 'BackupPassword'}):
+            exit_code, stdout, _ = self.run_cli('backup', '--directory', backup_directory, '--no-progress')
+            self.assertEqual(0, exit_code)
+
+            self.run_cli('delete', 'Company', '--yes')
+            self.assertEqual((0, '', ''), self.run_cli('list'))
+
+            self.assertEqual(0, self.run_cli('restore', stdout.strip(), '--verify-only')[0])
+            self.assertEqual(0, self.run_cli('restore', stdout.strip(), '--no-progress')[0])
+
+        self.assertEqual((0, 'Company\t\tuser\n', ''), self.run_cli('list'))
+
+    def test_encrypted_vault(self):
+        vault_path = os.path.join(self.directory.name, 'vault.ppmvault')
+        self.run_cli('add', 'Company', '--username', 'user', '--password', 'AccountPassword')
+
+        with mock.patch.dict(os.environ, {VAULT_PASSWORD_ENV_VAR: 'VaultPassword'}):
+            self.assertEqual(0, self.run_cli('encrypt-database', vault_path)[0])
+            self.assertEqual(0, self.run_cli('--vault', vault_path, 'add', 'Other', '--username', 'other',
+                                             '--password', 'OtherPassword')[0])
+            self.assertEqual((0, 'Company\t\tuser\nOther\t\tother\n', ''),
+                             self.run_cli('--vault', vault_path, 'list'))
+            self.assertEqual((0, 'OtherPassword\n', ''), self.run_cli('--vault', vault_path, 'get', 'Other'))
+
+        self.assertEqual((0, 'Company\t\tuser\n', ''), self.run_cli('list'))
+
+        with open(vault_path, 'rb') as vault_file:
+            self.assertNotIn(b'cli@gmail.com', vault_file.read())
+
+        with mock.patch.dict(os.environ, {VAULT_PASSWORD_ENV_VAR: 'WrongPassword'}):
+            self.assertEqual(1, self.run_cli('--vault', vault_path, 'list')[0])
+
+    def test_sharded_vault(self):
+        shards_path = os.path.join(self.directory.name, 'shards')
+        self.run_cli('add', 'Company', '--username', 'user', '--password', 'AccountPassword')
+
+        self.assertEqual(0, self.run_cli('shard-database', shards_path)[0])
+        self.assertEqual(0, self.run_cli('--shards', shards_path, 'add', 'Other', '--username', 'other',
+                                         '--password', 'OtherPassword')[0])
+        self.assertEqual((0, 'Company\t\tuser\nOther\t\tother\n', ''), self.run_cli('--shards', shards_path, 'list'))
+        self.assertEqual((0, 'OtherPassword\n', ''), self.run_cli('--shards', shards_path, 'get', 'Other'))
+
+        self.assertEqual((0, 'Company\t\tuser\n', ''), self.run_cli('list'))
+        self.assertEqual(1, self.run_cli('shard-database', shards_path)[0])
+        self.assertEqual(1, self.run_cli('--shards', shards_path, '--email', 'other@gmail.com', 'list')[0])
+
+    def test_sync(self):
+        peer_path = os.path.join(self.directory.name, 'peer.sqlite3')
+        self.run_cli('add', 'Company', '--username', 'user', '--password', 'AccountPassword')
+
+        exit_code, stdout, _ = self.run_cli('sync', peer_path)
+        self.assertEqual((0, ['Company']), (exit_code, json.loads(stdout)['pushed']))
+
+        self.assertEqual((0, 'AccountPassword\n', ''), self.run_cli('--database', peer_path, 'get', 'Company'))
+
+    def test_seal(self):
+        self.run_cli('add', 'Company', '--url', 'https://company.com', '--username', 'user', '--password', 'Password')
+
+        self.assertEqual((0, 'Sealed 1 accounts\n', ''), self.run_cli('seal'))
+        self.assertEqual((0, 'Company\thttps://company.com\tuser\n', ''), self.run_cli('search', 'company'))
+        self.assertEqual((0, '', ''), self.run_cli('search', 'comp'))
+        self.assertEqual((0, 'Password\n', ''), self.run_cli('get', 'company'))
+
+    def test_share_and_unshare(self):
+        connection = connect(self.database)
+        create_user(email='friend@gmail.com', password='MasterPassword', connection=connection)
+        connection.close()
+
+        share_company = ('share', 'Company', 'friend@gmail.com', '--url', 'https://company.com', '--username', 'user',
+                         '--password', 'Password')
+
+        # The friend has no key pair until they log in once
+        self.assertEqual(1, self.run_cli(*share_company)[0])
+        self.assertEqual((0, '', ''), self.run_cli('--email', 'friend@gmail.com', 'list'))
+
+        # Accounts are not moved into shared items, and a new item needs a username
+        self.run_cli('add', 'Bank', '--username', 'banker', '--password', 'BankPassword')
+        self.assertEqual(1, self.run_cli('share', 'Bank', 'friend@gmail.com', '--username', 'banker')[0])
+        self.assertEqual(1, self.run_cli('share', 'Company', 'friend@gmail.com', '--password', 'Password')[0])
+        self.assertEqual((0, 'Bank\t\tbanker\n', ''), self.run_cli('list'))
+
+        self.assertEqual((0, 'Shared Company with friend@gmail.com\n', ''), self.run_cli(*share_company))
+        self.assertEqual((0, 'Bank\t\tbanker\nCompany\thttps://company.com\tuser\n', ''), self.run_cli('list'))
+        self.assertEqual((0, 'Password\n', ''), self.run_cli('--email', 'friend@gmail.com', 'get', 'company'))
+
+        self.assertEqual(0, self.run_cli('unshare', 'Company', 'friend@gmail.com')[0])
+        self.assertEqual(1, self.run_cli('--email', 'friend@gmail.com', 'get', 'Company')[0])
+        self.assertEqual((0, 'Password\n', ''), self.run_cli('get', 'Company'))
+
+        self.assertEqual((0, 'Deleted Company\n', ''), self.run_cli('delete', 'Company', '--yes'))
+        self.assertEqual((0, 'Bank\t\tbanker\n', ''), self.run_cli('list'))
+
+    def test_attachments(self):
+        key_path = os.path.join(self.directory.name, 'id_ed25519')
+        output_path = os.path.join(self.directory.name, 'restored')
+
+        with open(key_path, 'wb') as key_file:
+            key_file.write(b'\x00\xffkey')
+
+        self.run_cli('add', 'Server', '--username', 'root', '--password', 'Password')
+
+        self.assertEqual((0, 'Attached id_ed25519 to Server\n', ''), self.run_cli('attach', 'Server', key_path))
+        self.assertEqual(0, self.run_cli('note', 'Server', 'Recovery codes', '--text', 'code 1\ncode 2\n')[0])
+        self.assertEqual((0, 'id_ed25519\tfile\t5\nRecovery codes\tnote\t14\n', ''),
+                         self.run_cli('attachments', 'server'))
+
+        self.assertEqual((0, 'code 1\ncode 2\n', ''), self.run_cli('read-attachment', 'Server', 'recovery codes'))
+        self.assertEqual(1, self.run_cli('read-attachment', 'Server', 'id_ed25519')[0])
+        self.assertEqual(0, self.run_cli('read-attachment', 'Server', 'id_ed25519', '--output', output_path)[0])
+
+        with open(output_path, 'rb') as output_file:
+            self.assertEqual(b'\x00\xffkey', output_file.read())
+
+        self.assertEqual((0, 'Deleted id_ed25519 from Server\n', ''),
+                         self.run_cli('detach', 'Server', 'id_ed25519', '--yes'))
+        self.assertEqual(1, self.run_cli('detach', 'Server', 'id_ed25519', '--yes')[0])
+        self.assertEqual((0, 'Recovery codes\tnote\t14\n', ''), self.run_cli('attachments', 'Server'))
+
+    def test_import_and_export(self):
+        import_path = os.path.join(self.directory.name, 'import.csv')
+        export_path = os.path.join(self.directory.name, 'export.csv')
+
+        with open(import_path, 'w', encoding='utf-8') as import_file:
+            import_file.write('name,url,username,password\nCompany,https://company.com,user,AccountPassword\n'
+                              'Company,,duplicate,Password\n')
+
+        exit_code, stdout, stderr = self.run_cli('import', import_path)
+        self.assertEqual((1, 'Imported 1 accounts\n'), (exit_code, stdout))
+        self.assertIn('1 accounts could not be imported', stderr)
+
+        self.assertEqual(0, self.run_cli('export', export_path)[0])
+
+        with open(export_path, 'r', encoding='utf-8-sig') as export_file:
+            self.assertEqual('name,url,username,password\nCompany,https://company.com,user,AccountPassword\n',
+                             export_file.read())
+
+    def test_lookups_through_the_agent(self):
+        """
+        With --agent, list, search, and get are served by the running agent without the master password.
+        """
+        self.run_cli('add', 'Company', '--username', 'user', '--password', 'AccountPassword')
+
+        socket_path = os.path.join(self.directory.name, 'agent.sock')
+        agent = VaultAgent(database=self.database, email='cli@gmail.com', master_password='MasterPassword',
+                           socket_path=socket_path)
+        thread = threading.Thread(target=agent.run, daemon=True)
+        thread.start()
+        agent.ready.wait()
+
+        with mock.patch.dict(os.environ, {MASTER_PASSWORD_ENV_VAR: 'WrongPassword'}):
+            self.assertEqual((0, 'AccountPassword\n', ''), self.run_cli('--agent', '--socket', socket_path, 'get',
+                                                                        'Company'))
+            self.assertEqual((0, 'Company\t\tuser\n', ''), self.run_cli('--agent', '--socket', socket_path, 'list'))
+            self.assertEqual((0, 'Locked\n', ''), self.run_cli('--socket', socket_path, 'lock'))
+
+        thread.join(timeout=5)
+        self.assertFalse(thread.is_alive())
+
+        exit_code, _, stderr = self.run_cli('--agent', '--socket', socket_path, 'list')
+        self.assertEqual(1, exit_code)
+        self.assertIn('Could not connect to the agent', stderr)
+
+    def test_breach_convert_and_check(self):
+        dump_path = os.path.join(self.directory.name, 'dump.txt')
+        corpus_path = os.path.join(self.directory.name, 'corpus.bin')
+
+        with open(dump_path, 'w', encoding='utf-8') as dump_file:
+            dump_file.write('5BAA61E4C9B93F3F0682250B6CF8331B7EE68FD8:3861493\n')
+
+        self.assertEqual((0, 'Wrote 1 hashes to ' + corpus_path + '\n', ''),
+                         self.run_cli('breach-convert', dump_path, '--output', corpus_path))
+
+        self.run_cli('add', 'Safe', '--username', 'user', '--password', 'Xk9vQ2pL7mN4rT1')
+        self.assertEqual((0, '', '0 breached passwords\n'), self.run_cli('breach-check', '--corpus', corpus_path))
+
+        self.run_cli('add', 'Breached', '--username', 'user', '--password', 'password')
+        self.assertEqual((1, 'Breached\t3861493\n', '1 breached passwords\n'),
+                         self.run_cli('breach-check', '--corpus', corpus_path, '--bloom-filter'))
+
+    def test_reused(self):
+        self.run_cli('add', 'Company', '--username', 'user', '--password', 'Reused')
+        self.run_cli('add', 'Bank', '--username', 'user', '--password', 'Unique')
+        self.assertEqual((0, '', '0 reused passwords\n'), self.run_cli('reused'))
+
+        self.run_cli('add', 'Shop', '--username', 'user', '--password', 'Reused')
+        self.assertEqual((1, 'Company\tShop\n', '1 reused passwords\n'), self.run_cli('reused'))
+
+    def test_check(self):
+        self.run_cli('add', 'Company', '--username', 'user', '--password', 'AccountPassword')
+
+        exit_code, stdout, stderr = self.run_cli('check', '--workers', '1')
+        self.assertEqual(0, exit_code)
+        self.assertTrue(json.loads(stdout)['ok'])
+        self.assertTrue(stderr.endswith('Checked 1/1 accounts\n'))
+
+        connection = connect(self.database)
+        connection.execute("UPDATE accounts SET nonce=x'00'")
+        connection.commit()
+        connection.close()
+
+        exit_code, stdout, _ = self.run_cli('check', '--workers', '1', '--no-progress')
+        self.assertEqual(1, exit_code)
+        self.assertEqual('malformed nonce (1 bytes)', json.loads(stdout)['bad_accounts'][0]['error'])
+
+    def test_encrypted_export_and_import(self):
+        export_path = os.path.join(self.directory.name, 'export.ppm')
+        self.run_cli('add', 'Company', '--url', 'https://company.com', '--username', 'user', '--password', 'Pässword')
+
+        with mock.patch.dict(os.environ, {EXPORT_PASSWORD_ENV_VAR: 'ExportPassword'}):
+            self.assertEqual((0, f'Exported 1 accounts to {export_path}\n', ''),
+                             self.run_cli('export', export_path, '--encrypted'))
+
+            self.run_cli('delete', 'Company', '--yes')
+            self.assertEqual((0, 'Imported 1 accounts\n', ''), self.run_cli('import', export_path))
+
+        self.assertEqual((0, 'Pässword\n', ''), self.run_cli('get', 'Company'))
+
+        exit_code, _, stderr = self.run_cli('import', export_path)
+        self.assertEqual(1, exit_code)
+        self.assertIn('could not be authenticated', stderr)
+
+    def test_ndjson_export_and_import(self):
+        export_path = os.path.join(self.directory.name, 'export.ndjson')
+        self.run_cli('add', 'Company', '--url', '', '--username', 'user', '--password', 'AccountPassword')
+        self.run_cli('add', 'Bank', '--username', 'banker', '--password', 'BankPassword')
+
+        self.assertEqual((0, f'Exported 2 accounts to {export_path}\n', ''), self.run_cli('export', export_path))
+
+        with open(export_path, 'a', encoding='utf-8') as export_file:
+            export_file.write('not json\n')
+
+        self.run_cli('delete', 'Company', '--yes')
+        exit_code, stdout, stderr = self.run_cli('import', export_path)
+        self.assertEqual((1, ''), (exit_code, stdout))
+        self.assertIn('resume with --start-line 4', stderr)
+        self.assertIn('Line 4 is not valid JSON', stderr)
+
+        self.assertEqual((0, 'Bank\t\tbanker\nCompany\t\tuser\n', ''), self.run_cli('list'))
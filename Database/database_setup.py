@@ -1,6 +1,8 @@
 import sqlite3
 
 from config import DB_NAME
+from Utils.database import ACCOUNT_URLS_SCHEMA, ACCOUNT_FINGERPRINTS_SCHEMA, ACCOUNT_CHANGES_SCHEMA, \
+    ACCOUNT_METADATA_SCHEMA, SHARED_ITEMS_SCHEMA, ATTACHMENTS_SCHEMA, index_account_urls, compact_account_changes
 
 
 # Database structure:
@@ -8,13 +10,55 @@ from config import DB_NAME
 #
 # Accounts - id, name (unique together with User), url (optional), username, password (ciphertext),
 # salt (of the hash used to derive the encryption key from the plaintext User password), nonce, tag, fk:User (user_id)
+#
+# Account urls - fk:Account (account_id), user_id, host, domain (registrable), the index behind find_accounts_for_url
+#
+# User keys - fk:User (user_id), salt (of the Argon2 key the User's password fingerprint key is derived from)
+#
+# Account fingerprints - fk:Account (account_id), user_id, fingerprint (keyed HMAC of the plaintext Account password)
+#
+# Account changes - revision (autoincrement), account_id, user_id, operation (insert, update, or delete), the change
+# journal behind changes_since, written by triggers
+#
+# Sealed users - fk:User (user_id), the Users whose Account metadata is sealed (see seal_account_metadata)
+#
+# Account metadata - fk:Account (account_id), user_id, metadata (ciphertext of the name, url, and username of a sealed
+# Account), nonce, tag
+#
+# Account metadata tokens - fk:Account (account_id), user_id, token (keyed HMAC of a word of a sealed Account), the
+# blind index behind search_accounts
+#
+# User key pairs - fk:User (user_id), public_key (X25519), private_key (ciphertext), nonce, tag
+#
+# Shared items - id, fk:User (owner_id), name (unique together with the owner), url (optional), username, password
+# (ciphertext, under the item key), nonce, tag
+#
+# Shared item members - fk:Shared item (item_id), fk:User (user_id), wrapped_key (the item key, wrapped for the User's
+# public key)
+#
+# Attachments - id, fk:Account (account_id), user_id, name (unique together with the Account), kind (file or note),
+# size, chunk_count, key (ciphertext of the attachment key), nonce, tag
+#
+# Attachment chunks - fk:Attachment (attachment_id), chunk_index, ciphertext (of a chunk of the content, under the
+# attachment key), tag
 
-def setup_database():
+def setup_database(db_name: str = DB_NAME):
     """
     Connect to the database and setup tables if needed
+    :param db_name: the path of the database file to set up (defaults to the application database)
     """
-    connection = sqlite3.connect(DB_NAME)
+    connection = sqlite3.connect(db_name)
+
+    setup_tables(connection)
+
+    connection.close()
+
 
+def setup_tables(connection: sqlite3.Connection):
+    """
+    Setup the tables of the database of the given connection if needed (e.g. of an in-memory database)
+    :param connection: the connection to the database to set up
+    """
     cursor = connection.cursor()
     cursor.execute("PRAGMA foreign_keys = ON;")
 
@@ -38,7 +82,13 @@ def setup_database():
                     UNIQUE(name, user_id)
                     ) STRICT ;""")
 
+    for statement in ACCOUNT_URLS_SCHEMA + ACCOUNT_FINGERPRINTS_SCHEMA + ACCOUNT_CHANGES_SCHEMA + \
+            ACCOUNT_METADATA_SCHEMA + SHARED_ITEMS_SCHEMA + ATTACHMENTS_SCHEMA:
+        cursor.execute(statement)
+
     connection.commit()
 
+    index_account_urls(connection)
+    compact_account_changes(connection)
+
     cursor.close()
-    connection.close()
@@ -0,0 +1,336 @@
+import json
+import os
+import sys
+import threading
+import traceback
+from collections import deque
+from contextlib import contextmanager
+from functools import wraps
+from statistics import quantiles
+from time import perf_counter
+from typing import Dict, List, Optional, Any, Iterator, Callable
+
+# Diagnostics mode for the GUI: a watchdog that measures Tk event-loop latency and captures the main thread's Python
+# stack whenever the event loop stalls, plus startup phase timings (imports, setup_database, login verify,
+# setup_treeview, first paint). Everything is written as a Chrome trace event file, which chrome://tracing, Perfetto,
+# and speedscope load directly; the stall stacks are also written in the folded format used by flamegraph.pl.
+#
+# This module only uses the standard library and is imported before anything else in gui.py, so that the import phase
+# can be timed. Set PPM_GUI_DIAGNOSTICS=1 to enable it; PPM_GUI_DIAGNOSTICS_TRACE sets the trace file (default
+# ppm_gui_trace.json) and PPM_GUI_STALL_THRESHOLD_MS the stall threshold (default 200).
+
+ENABLED_ENV_VAR = 'PPM_GUI_DIAGNOSTICS'
+TRACE_PATH_ENV_VAR = 'PPM_GUI_DIAGNOSTICS_TRACE'
+STALL_THRESHOLD_ENV_VAR = 'PPM_GUI_STALL_THRESHOLD_MS'
+
+DEFAULT_HEARTBEAT_INTERVAL_MS = 50
+DEFAULT_STALL_THRESHOLD_MS = 200
+
+# Heartbeats later than this are added to the trace as event-loop latency counter samples
+LATENCY_COUNTER_MIN_MS = 10
+
+PROCESS_START = perf_counter()
+
+
+class TraceRecorder:
+    """
+    Records Chrome trace events (timestamps in microseconds since this module was imported).
+    """
+    def __init__(self):
+        self.events: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+
+    @staticmethod
+    def _microseconds(timestamp: float) -> float:
+        return (timestamp - PROCESS_START) * 1_000_000
+
+    def _add(self, event: Dict[str, Any]):
+        event.setdefault('pid', self._pid)
+        event.setdefault('tid', threading.get_ident())
+
+        with self._lock:
+            self.events.append(event)
+
+    def complete(self, name: str, start: float, end: float, category: str = 'startup',
+                 args: Optional[Dict[str, Any]] = None, tid: Optional[int] = None):
+        """
+        Records a span between the given perf_counter timestamps.
+        """
+        event = {'name': name, 'cat': category, 'ph': 'X', 'ts': self._microseconds(start),
+                 'dur': (end - start) * 1_000_000, 'args': args or {}}
+
+        if tid is not None:
+            event['tid'] = tid
+
+        self._add(event)
+
+    def instant(self, name: str, timestamp: Optional[float] = None, category: str = 'startup',
+                args: Optional[Dict[str, Any]] = None):
+        self._add({'name': name, 'cat': category, 'ph': 'i', 's': 'p',
+                   'ts': self._microseconds(timestamp if timestamp is not None else perf_counter()),
+                   'args': args or {}})
+
+    def counter(self, name: str, values: Dict[str, float], timestamp: Optional[float] = None):
+        self._add({'name': name, 'ph': 'C',
+                   'ts': self._microseconds(timestamp if timestamp is not None else perf_counter()), 'args': values})
+
+    @contextmanager
+    def phase(self, name: str, category: str = 'startup') -> Iterator[None]:
+        start = perf_counter()
+
+        try:
+            yield
+        finally:
+            self.complete(name, start, perf_counter(), category=category)
+
+    def dump(self, path: str, metadata: Optional[Dict[str, Any]] = None):
+        with self._lock:
+            events = list(self.events)
+
+        with open(path, 'w', encoding='utf-8') as trace_file:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms', 'otherData': metadata or {}}, trace_file)
+
+
+class StallWatchdog:
+    """
+    Measures the latency of the Tk event loop with a heartbeat scheduled through after(), and samples the main
+    thread's stack from a watchdog thread while the heartbeat is late by more than the stall threshold.
+    """
+    def __init__(self, root, trace: TraceRecorder, heartbeat_interval_ms: int = DEFAULT_HEARTBEAT_INTERVAL_MS,
+                 stall_threshold_ms: float = DEFAULT_STALL_THRESHOLD_MS, max_latency_samples: int = 100_000):
+        """
+        :param root: the Tk root (anything with after and after_cancel) whose event loop is watched
+        :param trace: the recorder the stalls and latency samples are added to
+        :param heartbeat_interval_ms: how often the heartbeat is scheduled
+        :param stall_threshold_ms: how late the heartbeat must be for the event loop to count as stalled
+        :param max_latency_samples: how many of the most recent latency samples are kept for the summary
+        """
+        self.root = root
+        self.trace = trace
+        self.heartbeat_interval = heartbeat_interval_ms / 1000
+        self.stall_threshold = stall_threshold_ms / 1000
+        self.latencies = deque(maxlen=max_latency_samples)
+        self.stalls: List[Dict[str, Any]] = []
+
+        self._heartbeat_interval_ms = heartbeat_interval_ms
+        self._main_thread_id = None
+        self._last_beat = None
+        self._after_id = None
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._stall_samples: List[List[str]] = []
+
+    def start(self):
+        """
+        Starts the heartbeat and the watchdog thread. Must be called from the thread running the Tk event loop.
+        """
+        self._main_thread_id = threading.get_ident()
+        self._last_beat = perf_counter()
+        self._after_id = self.root.after(self._heartbeat_interval_ms, self._beat)
+
+        self._thread = threading.Thread(target=self._watch, name='TkStallWatchdog', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+        if self._after_id is not None:
+            try:
+                self.root.after_cancel(self._after_id)
+            except Exception:
+                # The root might already be destroyed
+                pass
+
+            self._after_id = None
+
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _beat(self):
+        now = perf_counter()
+
+        with self._lock:
+            expected = self._last_beat + self.heartbeat_interval
+            latency = max(now - expected, 0.0)
+            stall_samples = self._stall_samples
+            self._stall_samples = []
+            self._last_beat = now
+
+        self.latencies.append(latency)
+
+        if latency * 1000 >= LATENCY_COUNTER_MIN_MS:
+            self.trace.counter('event_loop_latency', {'ms': latency * 1000}, timestamp=now)
+
+        if stall_samples:
+            stall = {'start': expected, 'end': now, 'ms': latency * 1000, 'stacks': stall_samples}
+            self.stalls.append(stall)
+            self.trace.complete('main thread stall', expected, now, category='stall', tid=self._main_thread_id,
+                                args={'ms': latency * 1000, 'stack': ''.join(stall_samples[0]),
+                                      'samples': len(stall_samples)})
+
+        if not self._stop.is_set():
+            self._after_id = self.root.after(self._heartbeat_interval_ms, self._beat)
+
+    def _watch(self):
+        sample_interval = min(self.stall_threshold / 2, self.heartbeat_interval)
+
+        while not self._stop.wait(sample_interval):
+            with self._lock:
+                overdue = perf_counter() - self._last_beat - self.heartbeat_interval
+
+            if overdue < self.stall_threshold:
+                continue
+
+            frame = sys._current_frames().get(self._main_thread_id)
+
+            if frame is None:
+                continue
+
+            stack = traceback.format_stack(frame)
+
+            with self._lock:
+                self._stall_samples.append(stack)
+
+    def latency_summary(self) -> Dict[str, float]:
+        """
+        Returns the number of heartbeats and the mean, p50, p99, and max event-loop latency in milliseconds.
+        """
+        latencies = sorted(self.latencies)
+
+        if not latencies:
+            return {'heartbeats': 0}
+
+        if len(latencies) > 1:
+            percentiles = quantiles(latencies, n=100, method='inclusive')
+            p50, p99 = percentiles[49], percentiles[98]
+        else:
+            p50 = p99 = latencies[0]
+
+        return {'heartbeats': len(latencies),
+                'mean_ms': sum(latencies) / len(latencies) * 1000,
+                'p50_ms': p50 * 1000,
+                'p99_ms': p99 * 1000,
+                'max_ms': latencies[-1] * 1000,
+                'stalls': len(self.stalls)}
+
+    def folded_stacks(self) -> Dict[str, int]:
+        """
+        Returns the sampled stall stacks in the folded format (frames joined by ';', outermost first) with the number
+        of samples of each, as used by flamegraph.pl and speedscope.
+        """
+        folded: Dict[str, int] = {}
+
+        for stall in self.stalls:
+            for stack in stall['stacks']:
+                frames = [entry.strip().splitlines()[0].replace(';', ':') for entry in stack]
+                key = ';'.join(frames)
+                folded[key] = folded.get(key, 0) + 1
+
+        return folded
+
+
+class GUIDiagnostics:
+    """
+    The diagnostics of one GUI process. When disabled, phase() and the other methods do nothing, so that the GUI can
+    call them unconditionally.
+    """
+    def __init__(self, enabled: bool, trace_path: str = 'ppm_gui_trace.json',
+                 stall_threshold_ms: float = DEFAULT_STALL_THRESHOLD_MS):
+        self.enabled = enabled
+        self.trace_path = trace_path
+        self.stall_threshold_ms = stall_threshold_ms
+        self.trace = TraceRecorder()
+        self.watchdog: Optional[StallWatchdog] = None
+
+    @classmethod
+    def from_environment(cls) -> 'GUIDiagnostics':
+        return cls(enabled=os.environ.get(ENABLED_ENV_VAR, '') not in ('', '0'),
+                   trace_path=os.environ.get(TRACE_PATH_ENV_VAR, 'ppm_gui_trace.json'),
+                   stall_threshold_ms=float(os.environ.get(STALL_THRESHOLD_ENV_VAR, DEFAULT_STALL_THRESHOLD_MS)))
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        """
+        Records the enclosed block as a startup phase.
+        """
+        if not self.enabled:
+            yield
+            return
+
+        with self.trace.phase(name):
+            yield
+
+    def record_phase(self, name: str, start: float, end: Optional[float] = None):
+        """
+        Records a startup phase between the given perf_counter timestamps (until now if end is not provided).
+        """
+        if self.enabled:
+            self.trace.complete(name, start, end if end is not None else perf_counter())
+
+    def start_watchdog(self, root):
+        """
+        Starts watching the event loop of the given Tk root. Must be called from the thread running the event loop.
+        """
+        if not self.enabled:
+            return
+
+        self.watchdog = StallWatchdog(root, self.trace, stall_threshold_ms=self.stall_threshold_ms)
+        self.watchdog.start()
+
+    def mark_first_paint(self, root, since: float):
+        """
+        Records the first paint of the given window once Tk has processed the pending redraws, as a phase starting at
+        the given perf_counter timestamp, along with the time to interactive since the process started.
+        """
+        if not self.enabled:
+            return
+
+        def painted():
+            now = perf_counter()
+            self.trace.complete('first paint', since, now)
+            self.trace.instant('interactive', timestamp=now,
+                               args={'time_to_interactive_ms': (now - PROCESS_START) * 1000})
+
+        # Idle callbacks run after the redraws Tk has already scheduled as idle work
+        root.after_idle(painted)
+
+    def finish(self):
+        """
+        Stops the watchdog and writes the trace file (and the folded stall stacks next to it, if there were stalls).
+        """
+        if not self.enabled:
+            return
+
+        metadata = {}
+
+        if self.watchdog is not None:
+            self.watchdog.stop()
+            metadata['event_loop_latency'] = self.watchdog.latency_summary()
+            folded = self.watchdog.folded_stacks()
+
+            if folded:
+                with open(f'{os.path.splitext(self.trace_path)[0]}.folded', 'w', encoding='utf-8') as folded_file:
+                    folded_file.writelines(f'{stack} {count}\n' for stack, count in folded.items())
+
+        self.trace.dump(self.trace_path, metadata=metadata)
+
+
+diagnostics = GUIDiagnostics.from_environment()
+
+
+def timed(name: str) -> Callable:
+    """
+    Decorator that records each call of the decorated function as a phase while diagnostics are enabled.
+    """
+    def decorator(function: Callable) -> Callable:
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            with diagnostics.phase(name):
+                return function(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
@@ -1,8 +1,10 @@
-from csv import DictReader, DictWriter, writer as csv_writer
+# Imported first so that the time spent importing everything else can be recorded
+from GUI.diagnostics import diagnostics, timed, PROCESS_START
+
 from secrets import choice
-from sqlite3 import connect, IntegrityError
 from string import ascii_letters, digits
 from sys import platform
+from time import perf_counter
 from tkinter import Event, StringVar
 from tkinter.constants import CENTER, VERTICAL, HORIZONTAL, END
 from tkinter.font import Font, nametofont
@@ -17,12 +19,20 @@ from win32gui import GetDC
 from win32print import GetDeviceCaps
 
 from Database.database_setup import setup_database
-from config import DB_NAME, VALID_EMAIL_PATTERN
+from config import DB_NAME, VALID_EMAIL_PATTERN, BREACHED_PASSWORDS_PATH, EXTERNAL_CHANGES_POLL_INTERVAL_MS
 from re import match as regex_match
-from Utils.database import get_all_account_names_urls_and_usernames_by_user_id, get_decrypted_account_password, \
+from Utils.breach_check import open_breached_password_file
+from Utils.change_watcher import VaultChangeWatcher
+from Utils.import_export import import_accounts_from_csv, export_accounts_to_csv, write_accounts_to_csv, \
+    import_accounts_from_ndjson, export_accounts_to_ndjson, is_ndjson_path
+from Utils.importers import import_accounts_from_file, supported_extensions
+from Utils.sql_trace import connect
+from Utils.database import get_all_account_ids_names_urls_and_usernames_by_user_id, get_decrypted_account_password, \
     get_account_id_by_account_name_and_user_id, get_user_id_by_email, is_valid_login, create_user, create_account, \
-    get_account_name_url_and_username_by_account_id, edit_account, delete_account
+    get_account_name_url_and_username_by_account_id, edit_account, delete_account, ChangeJournalCompactedError, \
+    get_account_version, AccountVersionConflictError
 
+diagnostics.record_phase('imports', PROCESS_START)
 
 # Static methods and setup for dark/light mode styles for customtkinter and the Treeview:
 
@@ -241,12 +251,18 @@ class App(customtkinter.CTk):
         self.current_user_email = None
         self.master_password = None
         self.current_generated_password = None
+        self.breached_password_file = None
+        self.account_id_to_iid = {}
+        self.account_id_to_written_version = {}
+        self.change_watcher = None
+        self._poll_external_changes_job = None
 
+    @timed('setup_treeview')
     def setup_treeview(self, user_id: int, user_email: str, master_password: str):
         """
         Initializes the treeview to display all the Accounts a user has. The password field is initially hidden
         until clicked on, causing it to decrypt the password at the moment. If clicked on again, the field is
-        once again hidden.
+        once again hidden. Also starts polling for the changes other processes make to the Accounts.
         :param user_id: the id of the current User
         :param user_email: the email of the current User
         :param master_password: the master password of the current User, obtained only when entered during login
@@ -285,8 +301,22 @@ class App(customtkinter.CTk):
         self.tree.heading('username', text='username')
         self.tree.heading('password', text='Password')
 
+        self._load_accounts_into_treeview()
+
+        if self._poll_external_changes_job is None:
+            self._poll_external_changes_job = self.after(EXTERNAL_CHANGES_POLL_INTERVAL_MS,
+                                                         self._poll_external_changes)
+
+    def _load_accounts_into_treeview(self):
+        """
+        Adds all the current User's Accounts to the (empty) treeview and sets the column minwidths to fit them.
+        """
+        # Started before the Accounts are read, so that the changes committed while they are read are not missed
+        self.change_watcher = VaultChangeWatcher(self.current_user, self.connection)
+
         # Collect account data from database
-        accounts = get_all_account_names_urls_and_usernames_by_user_id(user_id=user_id, connection=self.connection)
+        accounts = get_all_account_ids_names_urls_and_usernames_by_user_id(user_id=self.current_user,
+                                                                           connection=self.connection)
 
         if not accounts:
             return
@@ -300,7 +330,7 @@ class App(customtkinter.CTk):
         password_item_width = (Font().measure(text=self.PASSWORD_HIDDEN_TEXT, displayof=self.tree) * self.scaling_factor).__round__()
 
         # Add data to the treeview and get the longest item width for each column
-        for account in accounts:
+        for account_id, *account in accounts:
             # Setup for shortening potential urls
             if account[1] is None:
                 shortened_url = ''
@@ -320,6 +350,8 @@ class App(customtkinter.CTk):
             # when copied.
             iid = self.tree.insert('', END, values=(account[0], shortened_url, account[2], self.PASSWORD_HIDDEN_TEXT,))
 
+            self.account_id_to_iid[account_id] = iid
+
             if account[1]:
                 self.treeview_iid_to_full_url_dict[iid] = account[1]
 
@@ -328,6 +360,150 @@ class App(customtkinter.CTk):
         self.tree.column('username', minwidth=longest_username_item_width)
         self.tree.column('password', minwidth=password_item_width)
 
+    def _poll_external_changes(self):
+        """
+        Applies the changes other processes committed to the current User's Accounts since the last poll to the
+        treeview and schedules the next poll. Checking for changes only reads PRAGMA data_version, so polling an
+        unchanged vault costs next to nothing.
+        """
+        self._refresh_external_changes()
+
+        self._poll_external_changes_job = self.after(EXTERNAL_CHANGES_POLL_INTERVAL_MS, self._poll_external_changes)
+
+    def _refresh_external_changes(self):
+        """
+        Applies the changes other processes committed to the current User's Accounts since the last poll to the
+        treeview, row by row.
+        """
+        try:
+            changes = self.change_watcher.poll()
+        except ChangeJournalCompactedError:
+            # The changes since the last poll are no longer all known, so every Account is reloaded instead
+            self._reload_treeview()
+        else:
+            if changes:
+                self._apply_account_changes(changes)
+
+    def _displayed_version(self, account_id: int) -> int:
+        """
+        Returns a version the given Account's row is up-to-date with: the revision the rows were last refreshed at,
+        or the version of this window's own latest write to the Account, whichever is later. An edit or deletion
+        expecting it is refused if another process changed the Account since, instead of overwriting that change.
+        """
+        return max(self.change_watcher.revision, self.account_id_to_written_version.get(account_id, 0))
+
+    def _handle_account_version_conflict(self):
+        """
+        Shows the changes another process made to the Accounts and tells the user to check them before trying again.
+        """
+        self._refresh_external_changes()
+
+        MessageGUI(title='Account changed elsewhere',
+                   message_line_1='This account was changed by another program since it was displayed.',
+                   message_line_2='The table now shows the current info, please check it and try again.')
+
+    def _apply_account_changes(self, changes: dict):
+        """
+        Updates the treeview rows of the changed Accounts, adds the rows of the new ones, and removes the rows of the
+        deleted ones, leaving every other row (and its shown password) as it is.
+        :param changes: the changes, as returned by changes_since
+        """
+        for account_id in changes['deleted']:
+            iid = self.account_id_to_iid.pop(account_id, None)
+            self.account_id_to_written_version.pop(account_id, None)
+
+            if iid is not None:
+                self._remove_account_row(iid)
+
+        for account_id, name, url, username in changes['changed']:
+            iid = self.account_id_to_iid.get(account_id)
+
+            if iid is None:
+                self.account_id_to_iid[account_id] = self._insert_account_row(name, url, username)
+            else:
+                self._update_account_row(iid, name, url, username)
+
+        # Filter again, so that the added and renamed Accounts are filtered too
+        if self.entry.get():
+            self._filter_accounts()
+
+    def _insert_account_row(self, name: str, url: Optional[str], username: str) -> str:
+        """
+        Adds a row for the Account with the given info at the end of the treeview and returns its iid.
+        """
+        if url is None:
+            shortened_url = ''
+        else:
+            shortened_url = url[0:20] + '...' if len(url) >= 23 else url
+
+        iid = self.tree.insert(parent='', index='end', values=(name, shortened_url, username,
+                                                               self.PASSWORD_HIDDEN_TEXT,))
+
+        if url:
+            self.treeview_iid_to_full_url_dict[iid] = url
+
+        self.adjust_column_minwidth_to_fit_entry(cell_text=name, column_name='account')
+        self.adjust_column_minwidth_to_fit_entry(cell_text=shortened_url, column_name='url')
+        self.adjust_column_minwidth_to_fit_entry(cell_text=username, column_name='username')
+
+        return iid
+
+    def _update_account_row(self, iid: str, name: str, url: Optional[str], username: str):
+        """
+        Sets the row with the given iid to the given Account info. The password is hidden again, since it may have
+        changed.
+        """
+        if url is None:
+            shortened_url = ''
+            self.treeview_iid_to_full_url_dict.pop(iid, None)
+        else:
+            shortened_url = url[0:20] + '...' if len(url) >= 23 else url
+            self.treeview_iid_to_full_url_dict[iid] = url
+
+        self.tree.item(iid, values=(name, shortened_url, username, self.PASSWORD_HIDDEN_TEXT,))
+
+        self.adjust_column_minwidth_to_fit_entry(cell_text=name, column_name='account')
+        self.adjust_column_minwidth_to_fit_entry(cell_text=shortened_url, column_name='url')
+        self.adjust_column_minwidth_to_fit_entry(cell_text=username, column_name='username')
+
+        if self.selected_row_info_dict and self.selected_row_info_dict['iid'] == iid:
+            self.selected_row_info_dict = self.tree.set(iid)
+            self.selected_row_info_dict['iid'] = iid
+
+    def _remove_account_row(self, iid: str):
+        """
+        Removes the row with the given iid from the treeview, whether it is currently filtered out or not.
+        """
+        self.tree.delete(iid)
+        self.treeview_iid_to_full_url_dict.pop(iid, None)
+
+        if self.current_treeview_filter:
+            self.current_treeview_filter = [account_and_index for account_and_index in self.current_treeview_filter
+                                            if account_and_index[0] != iid]
+
+        if self.selected_row_info_dict and self.selected_row_info_dict['iid'] == iid:
+            self.selected_row_info_dict = None
+
+    def _reload_treeview(self):
+        """
+        Replaces every row of the treeview with the current User's Accounts as they are now in the database.
+        """
+        self.tree.delete(*self.tree.get_children())
+
+        if self.current_treeview_filter:
+            self.tree.delete(*[account_and_index[0] for account_and_index in self.current_treeview_filter])
+
+        self.current_treeview_filter = None
+        self.selected_row_info_dict = None
+        self.treeview_iid_to_full_url_dict = {'': ''}
+        self.account_id_to_iid = {}
+        self.account_id_to_written_version = {}
+
+        self._load_accounts_into_treeview()
+
+        if self.entry.get():
+            self._filter_accounts()
+
     def item_selected(self, event):
         """
         Dictates response to selecting an item in the treeview using mouse input. When selecting a column heading,
@@ -446,6 +622,9 @@ class App(customtkinter.CTk):
 
         iid = self.tree.insert(parent='', index='end', values=(account[0], shortened_url, account[2], account[3],))
 
+        self.account_id_to_iid[account_id] = iid
+        self.account_id_to_written_version[account_id] = get_account_version(account_id, self.connection)
+
         if account[1]:
             self.treeview_iid_to_full_url_dict[iid] = account[1]
 
@@ -541,8 +720,13 @@ class App(customtkinter.CTk):
         :param username: the name to change the Account username to or None if the previous username should remain
         :param password: the name to change the Account password to or None if the previous password should remain
         """
-        edit_account(account_id=account_id, master_password=self.master_password, name=name, url=url,
-                     username=username, password=password, connection=self.connection)
+        try:
+            self.account_id_to_written_version[account_id] = edit_account(
+                account_id=account_id, master_password=self.master_password, name=name, url=url, username=username,
+                password=password, connection=self.connection, expected_version=self._displayed_version(account_id))
+        except AccountVersionConflictError:
+            self._handle_account_version_conflict()
+            return
 
         account = (get_account_name_url_and_username_by_account_id(account_id, self.connection) +
                    (self.PASSWORD_HIDDEN_TEXT, ))
@@ -604,12 +788,19 @@ class App(customtkinter.CTk):
         account_id = get_account_id_by_account_name_and_user_id(account_name=self.selected_row_info_dict['account'],
                                                                 user_id=self.current_user, connection=self.connection)
 
-        delete_account(account_id=account_id, connection=self.connection)
+        try:
+            delete_account(account_id=account_id, connection=self.connection,
+                           expected_version=self._displayed_version(account_id))
+        except AccountVersionConflictError:
+            self._handle_account_version_conflict()
+            return
 
         # Remove from treeview
         iid = self.selected_row_info_dict['iid']
 
         self.tree.delete(iid)
+        self.account_id_to_iid.pop(account_id, None)
+        self.account_id_to_written_version.pop(account_id, None)
 
         self.selected_row_info_dict = None
 
@@ -617,15 +808,22 @@ class App(customtkinter.CTk):
 
     def regenerate_password_button_event(self):
         """
-        Generate a random, 15 character, multi-case, alphanumeric password using the python secrets library.
-        Assign this password to the selected account row if the user confirms they have changed the actual
-        account password accordingly, otherwise do not change the password.
+        Generate a random, 15 character, multi-case, alphanumeric password using the python secrets library, which is
+        not in the breached-password corpus if there is one. Assign this password to the selected account row if the
+        user confirms they have changed the actual account password accordingly, otherwise do not change the password.
         """
         if not self.selected_row_info_dict:
             MessageGUI(title='No account selected', message_line_1='No account is currently selected.',
                        message_line_2='Please select an account first and try again.')
             return
 
+        # The breached-password corpus is optional and only opened (memory-mapped) the first time it is needed
+        if self.breached_password_file is None:
+            try:
+                self.breached_password_file = open_breached_password_file(BREACHED_PASSWORDS_PATH)
+            except ValueError:
+                pass
+
         alphabet = ascii_letters + digits
         while True:
             password = ''.join(choice(alphabet) for i in range(15))
@@ -633,6 +831,7 @@ class App(customtkinter.CTk):
                     sum(c.islower() for c in password) >= 3
                     and sum(c.isupper() for c in password) >= 3
                     and sum(c.isdigit() for c in password) >= 3
+                    and (self.breached_password_file is None or password not in self.breached_password_file)
             ):
                 break
 
@@ -661,8 +860,11 @@ class App(customtkinter.CTk):
         account_id = get_account_id_by_account_name_and_user_id(account_name=self.selected_row_info_dict['account'],
                                                                 user_id=self.current_user, connection=self.connection)
 
-        edit_account(account_id=account_id, master_password=self.master_password,
-                     password=self.current_generated_password, connection=self.connection)
+        # Not conditional on the displayed version: the user has already set this password on the actual account, so
+        # it has to be saved even if the Account was changed elsewhere
+        self.account_id_to_written_version[account_id] = edit_account(
+            account_id=account_id, master_password=self.master_password, password=self.current_generated_password,
+            connection=self.connection)
 
         iid = self.selected_row_info_dict['iid']
 
@@ -684,74 +886,97 @@ class App(customtkinter.CTk):
 
     def import_accounts_button_event_confirm(self):
         """
-        Import the Accounts from the file specified by the user if possible. Currently just supports CSV files.
-        If the file isn't formatted as necessary due to missing necessary column names, prompts the user to
-        change the column names accordingly.
+        Import the Accounts from the file specified by the user if possible. Supports CSV and NDJSON files, and the
+        exports of other password managers (Bitwarden, KeePass, 1Password, and browsers), whose format is detected.
+        If the file is in none of these formats, prompts the user to change the CSV column names accordingly.
         """
         # Get the desired file from the user
-        csv_file_original = customtkinter.filedialog.askopenfile(title='Select accounts CSV file',
+        csv_file_original = customtkinter.filedialog.askopenfile(title='Select accounts CSV or NDJSON file',
                                                                  filetypes=(('.csv (Microsoft Excel Comma Separated '
                                                                              'Values File)',
-                                                                             '*.csv'),))
+                                                                             '*.csv'),
+                                                                            ('.ndjson (Newline Delimited JSON File)',
+                                                                             '*.ndjson *.jsonl'),
+                                                                            ('Other password manager export',
+                                                                             ' '.join(f'*{extension}' for extension
+                                                                                      in supported_extensions()))))
 
         if not csv_file_original:
             return
 
         csv_file_original.close()
 
-        # If the user provided a file to import from, we've already closed it and will now reopen it with its
-        # name as a workaround to customtkinter's filedialog not letting us specify an encoding
-        if csv_file_original:
-            with open(file=csv_file_original.name, mode='r', encoding='utf-8-sig') as csv_file:
-                self.accounts_that_could_not_be_added = []
-                reader = DictReader(csv_file)
-
-                if not (
-                        reader.fieldnames.__contains__('name')
-                        and reader.fieldnames.__contains__('username')
-                        and reader.fieldnames.__contains__('password')
-                ):
-                    MessageGUI(title='Import error', message_line_1='Please format the CSV file to have at '
-                                                                    'least these exact column names - url column is '
-                                                                    'optional: ',
-                               message_line_2='name, url, username, password')
-                    return
-
-                for row in reader:
-                    name = row['name']
-                    url = row['url'] if reader.fieldnames.__contains__('url') else None
-                    username = row['username']
-                    password = row['password']
-
-                    try:
-                        account_id = create_account(user_id=self.current_user, master_password=self.master_password,
-                                                    name=name, url=url, username=username,
-                                                    password=password, connection=self.connection)
-
-                        account = (get_account_name_url_and_username_by_account_id(account_id, self.connection) +
-                                   (self.PASSWORD_HIDDEN_TEXT,))
-
-                        if url is None:
-                            shortened_url = ''
-                        else:
-                            shortened_url = url[0:20] + '...' if len(url) >= 23 else url
-
-                        iid = self.tree.insert(parent='', index='end',
-                                               values=(account[0], shortened_url, account[2], account[3],))
-
-                        if account[1]:
-                            self.treeview_iid_to_full_url_dict[iid] = account[1]
-
-                    except (ValueError, IntegrityError):
-                        # If all are empty, skip/only consider an Account not addable if there is at least
-                        # one field value (we want to ignore empty csv rows)
-                        if not (name == '' and url == '' and username == '' and password == ''):
-                            self.accounts_that_could_not_be_added.append({'name': name, 'url': url, 'username': username,
-                                                                     'password': password})
-
-                csv_file.close()
-
-            self.handle_unimportable_accounts()
+        if is_ndjson_path(csv_file_original.name):
+            self.import_accounts_from_ndjson(csv_file_original.name)
+            return
+
+        # The file is reopened by name as a workaround to customtkinter's filedialog not letting us specify an encoding
+        try:
+            account_ids, self.accounts_that_could_not_be_added = import_accounts_from_csv(
+                csv_path=csv_file_original.name, user_id=self.current_user, master_password=self.master_password,
+                connection=self.connection)
+        except (ValueError, UnicodeDecodeError):
+            try:
+                account_ids, self.accounts_that_could_not_be_added = import_accounts_from_file(
+                    path=csv_file_original.name, user_id=self.current_user, master_password=self.master_password,
+                    connection=self.connection)
+            except ValueError as e:
+                MessageGUI(title='Import error', message_line_1='Please format the CSV file to have at '
+                                                                'least these exact column names - url column is '
+                                                                'optional: name, url, username, password',
+                           message_line_2=str(e))
+                return
+
+        for account_id in account_ids:
+            self.insert_imported_account(account_id)
+
+        self.handle_unimportable_accounts()
+
+    def import_accounts_from_ndjson(self, ndjson_path: str):
+        """
+        Import the Accounts from the given NDJSON file, showing each batch in the table as soon as it is added. If a
+        line is invalid, the Accounts before it stay imported and the user is told which line to fix.
+        """
+        self.accounts_that_could_not_be_added = []
+
+        try:
+            for _, results in import_accounts_from_ndjson(
+                    ndjson_path=ndjson_path, user_id=self.current_user, master_password=self.master_password,
+                    connection=self.connection):
+                for _, account_id, account in results:
+                    if account_id is None:
+                        self.accounts_that_could_not_be_added.append(account)
+                    else:
+                        self.insert_imported_account(account_id)
+
+                self.update_idletasks()
+        except ValueError as e:
+            MessageGUI(title='Import error', message_line_1='The NDJSON file could not be fully imported:',
+                       message_line_2=str(e))
+
+        self.handle_unimportable_accounts()
+
+    def insert_imported_account(self, account_id: int):
+        """
+        Add the imported Account with the given id to the table of Accounts.
+        """
+        account = (get_account_name_url_and_username_by_account_id(account_id, self.connection) +
+                   (self.PASSWORD_HIDDEN_TEXT,))
+
+        url = account[1]
+
+        if url is None:
+            shortened_url = ''
+        else:
+            shortened_url = url[0:20] + '...' if len(url) >= 23 else url
+
+        iid = self.tree.insert(parent='', index='end', values=(account[0], shortened_url, account[2], account[3],))
+
+        self.account_id_to_iid[account_id] = iid
+        self.account_id_to_written_version[account_id] = get_account_version(account_id, self.connection)
+
+        if account[1]:
+            self.treeview_iid_to_full_url_dict[iid] = account[1]
 
     def handle_unimportable_accounts(self):
         """
@@ -784,16 +1009,7 @@ class App(customtkinter.CTk):
         if len(filename) == 0:
             return
 
-        with open(filename + file_extension, 'w') as destination_file:
-            header_writer = csv_writer(destination_file)
-            header_writer.writerow(('name', 'url', 'username', 'password',))
-
-            writer = DictWriter(destination_file, fieldnames=['name', 'url', 'username', 'password'],
-                                lineterminator='\n')
-
-            writer.writerows(self.accounts_that_could_not_be_added)
-
-            destination_file.close()
+        write_accounts_to_csv(csv_path=filename + file_extension, accounts=self.accounts_that_could_not_be_added)
 
     def export_accounts_button_event(self):
         """
@@ -806,9 +1022,9 @@ class App(customtkinter.CTk):
 
     def export_accounts_button_event_confirm(self):
         """
-        Export the current user's Accounts in the password manager if they have any to a CSV file.
+        Export the current user's Accounts in the password manager if they have any to a CSV file, or to an NDJSON file
+        if the user picks a file name ending in .ndjson or .jsonl.
         """
-        accounts_to_export = [{}]
         accounts = self.tree.get_children()
 
         if len(accounts) == 0:
@@ -816,7 +1032,8 @@ class App(customtkinter.CTk):
             return
 
         filename = customtkinter.filedialog.asksaveasfilename(
-            filetypes=(('.csv (Microsoft Excel Comma Separated Values File)', '*.csv'),)
+            filetypes=(('.csv (Microsoft Excel Comma Separated Values File)', '*.csv'),
+                       ('.ndjson (Newline Delimited JSON File)', '*.ndjson *.jsonl'))
         )
 
         file_extension = '.csv'
@@ -825,34 +1042,15 @@ class App(customtkinter.CTk):
         if len(filename) == 0:
             return
 
-        for account in accounts:
-            item = self.tree.item(account)
-            account_name = item['values'][0]
-            account_url = item['values'][1]
-            account_username = item['values'][2]
-            account_password = item['values'][3]
-
-            if account_password == self.PASSWORD_HIDDEN_TEXT:
-                account_id = get_account_id_by_account_name_and_user_id(account_name, self.current_user, self.connection)
-                account_password = get_decrypted_account_password(account_id, self.master_password, self.connection)
-
-            accounts_to_export.append({'name': account_name, 'url': account_url, 'username': account_username,
-                                       'password': account_password})
-
-        if filename:
-            with open(filename + file_extension, 'w', encoding='utf-8-sig') as destination_file:
-                header_writer = csv_writer(destination_file)
-                header_writer.writerow(('name', 'url', 'username', 'password',))
-
-                writer = DictWriter(destination_file, fieldnames=['name', 'url', 'username', 'password'],
-                                    lineterminator='\n')
-
-                writer.writerows(accounts_to_export)
-
-                destination_file.close()
+        if is_ndjson_path(filename):
+            export_accounts_to_ndjson(ndjson_path=filename, user_id=self.current_user,
+                                      master_password=self.master_password, connection=self.connection)
+        else:
+            export_accounts_to_csv(csv_path=filename + file_extension, user_id=self.current_user,
+                                   master_password=self.master_password, connection=self.connection)
 
-                MessageGUI(title='Passwords successfully exported', message_line_1=f'Your passwords have been exported to '
-                                                                                   f'{filename}.')
+        MessageGUI(title='Passwords successfully exported', message_line_1=f'Your passwords have been exported to '
+                                                                           f'{filename}.')
 
 
 class LoginGUI(customtkinter.CTkToplevel):
@@ -920,10 +1118,16 @@ class LoginGUI(customtkinter.CTkToplevel):
 
         if not user_id:
             SignupGUI(self)
+            return
+
+        with diagnostics.phase('login verify'):
+            valid_login = is_valid_login(self.entered_email, self.entered_password, self.connection)
 
-        elif is_valid_login(self.entered_email, self.entered_password, self.connection):
+        if valid_login:
             self.parent.setup_treeview(user_id, self.entered_email, self.entered_password)
+            shown = perf_counter()
             self.parent.deiconify()
+            diagnostics.mark_first_paint(self.parent, since=shown)
             self.destroy()
         else:
             MessageGUI(title='Wrong password', message_line_1='Please check your password.')
@@ -973,7 +1177,9 @@ class SignupGUI(customtkinter.CTkToplevel):
                               connection=self.parent.connection)
 
         self.parent.parent.setup_treeview(user_id, self.parent.entered_email, self.parent.entered_password)
+        shown = perf_counter()
         self.parent.parent.deiconify()
+        diagnostics.mark_first_paint(self.parent.parent, since=shown)
         self.parent.destroy()
         self.destroy()
 
@@ -1062,7 +1268,14 @@ class CustomPositionedInputDialogue(customtkinter.CTkInputDialog):
 
 
 if __name__ == "__main__":
-    setup_database()
-    app = App()
+    with diagnostics.phase('setup_database'):
+        setup_database()
+
+    with diagnostics.phase('App.__init__'):
+        app = App()
+
+    diagnostics.start_watchdog(app)
 
     app.mainloop()
+
+    diagnostics.finish()
@@ -0,0 +1,137 @@
+import heapq
+import json
+import os
+import tempfile
+import time
+import unittest
+from itertools import count
+from time import perf_counter
+
+from GUI.diagnostics import StallWatchdog, TraceRecorder, GUIDiagnostics, PROCESS_START
+
+
+class FakeRoot:
+    """
+    A minimal stand-in for a Tk root that runs after() and after_idle() callbacks on the calling thread.
+    """
+    def __init__(self):
+        self._queue = []
+        self._ids = count()
+        self._cancelled = set()
+
+    def after(self, ms, callback):
+        after_id = next(self._ids)
+        heapq.heappush(self._queue, (perf_counter() + ms / 1000, after_id, callback))
+        return after_id
+
+    def after_idle(self, callback):
+        return self.after(0, callback)
+
+    def after_cancel(self, after_id):
+        self._cancelled.add(after_id)
+
+    def run(self, seconds: float):
+        end = perf_counter() + seconds
+
+        while perf_counter() < end:
+            if self._queue and self._queue[0][0] <= perf_counter():
+                due, after_id, callback = heapq.heappop(self._queue)
+                if after_id not in self._cancelled:
+                    callback()
+            else:
+                time.sleep(0.001)
+
+
+def blocking_work():
+    time.sleep(0.3)
+
+
+class DiagnosticsTests(unittest.TestCase):
+    def test_stall_watchdog_captures_main_thread_stack(self):
+        """
+        A callback that blocks the event loop longer than the threshold is recorded as a stall, with the main thread's
+        stack sampled while it was blocked.
+        """
+        root = FakeRoot()
+        trace = TraceRecorder()
+        watchdog = StallWatchdog(root, trace, heartbeat_interval_ms=20, stall_threshold_ms=100)
+
+        watchdog.start()
+        root.after(100, blocking_work)
+        root.run(0.6)
+        watchdog.stop()
+
+        self.assertEqual(1, len(watchdog.stalls))
+        self.assertGreaterEqual(watchdog.stalls[0]['ms'], 150)
+        self.assertIn('blocking_work', ''.join(watchdog.stalls[0]['stacks'][0]))
+
+        summary = watchdog.latency_summary()
+        self.assertEqual(1, summary['stalls'])
+        self.assertGreaterEqual(summary['max_ms'], 150)
+        self.assertLess(summary['p50_ms'], 100)
+
+        self.assertTrue(any('blocking_work' in stack for stack in watchdog.folded_stacks()))
+        self.assertIn('main thread stall', [event['name'] for event in trace.events])
+
+    def test_no_stall_when_event_loop_is_responsive(self):
+        """
+        No stall is recorded while the heartbeat keeps up.
+        """
+        root = FakeRoot()
+        watchdog = StallWatchdog(root, TraceRecorder(), heartbeat_interval_ms=20, stall_threshold_ms=100)
+
+        watchdog.start()
+        root.run(0.2)
+        watchdog.stop()
+
+        self.assertEqual([], watchdog.stalls)
+        self.assertGreater(watchdog.latency_summary()['heartbeats'], 0)
+
+    def test_disabled_diagnostics_record_nothing(self):
+        """
+        Phases, first paint, and the watchdog do nothing while diagnostics are disabled.
+        """
+        diagnostics = GUIDiagnostics(enabled=False)
+        root = FakeRoot()
+
+        with diagnostics.phase('setup_database'):
+            pass
+
+        diagnostics.record_phase('imports', PROCESS_START)
+        diagnostics.mark_first_paint(root, since=perf_counter())
+        diagnostics.start_watchdog(root)
+        root.run(0.05)
+        diagnostics.finish()
+
+        self.assertEqual([], diagnostics.trace.events)
+        self.assertIsNone(diagnostics.watchdog)
+
+    def test_startup_trace_file(self):
+        """
+        Writes the startup phases, first paint, time to interactive, and event-loop latency as a Chrome trace file.
+        """
+        with tempfile.TemporaryDirectory() as directory:
+            trace_path = os.path.join(directory, 'trace.json')
+            diagnostics = GUIDiagnostics(enabled=True, trace_path=trace_path)
+            root = FakeRoot()
+
+            diagnostics.record_phase('imports', PROCESS_START)
+
+            with diagnostics.phase('setup_database'):
+                pass
+
+            diagnostics.start_watchdog(root)
+            diagnostics.mark_first_paint(root, since=perf_counter())
+            root.run(0.1)
+            diagnostics.finish()
+
+            with open(trace_path, 'r', encoding='utf-8') as trace_file:
+                trace = json.load(trace_file)
+
+        events = {event['name']: event for event in trace['traceEvents']}
+
+        self.assertEqual('X', events['imports']['ph'])
+        self.assertEqual('X', events['setup_database']['ph'])
+        self.assertEqual('X', events['first paint']['ph'])
+        self.assertGreater(events['interactive']['args']['time_to_interactive_ms'], 0)
+        self.assertGreater(trace['otherData']['event_loop_latency']['heartbeats'], 0)
@@ -0,0 +1,357 @@
+import hashlib
+import json
+import os
+import sqlite3
+import struct
+from datetime import datetime, timezone
+from sqlite3 import Connection
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from config import BACKUP_KEEP_CHAINS
+from Utils.encrypted_export import write_encrypted_chunks, read_encrypted_chunks, EncryptedExportError, KDFParameters, \
+    DEFAULT_CHUNK_SIZE
+
+# Encrypted backups of the whole database file. A snapshot is taken with SQLite's online backup API, a few pages at a
+# time, so that it is consistent even while the app writes to the database, and so that a backup running on its own
+# connection in a background thread leaves the app responsive (the GIL is released while each step copies its pages).
+# The snapshot's pages are then stored in a file in the encrypted export container (see Utils.encrypted_export), under
+# its own magic, so they are compressed and encrypted with a key derived from the backup password:
+#
+#   first chunk: the manifest, a JSON object with the backup's name, its chain (the names of the backups it builds on,
+#                from the full backup to itself), the page size and count, and a hash of every page of the snapshot
+#   other chunks: page records, each a page number (uint32) followed by the page
+#
+# A full backup stores every page. An incremental backup stores only the pages whose hash differs from the previous
+# backup's manifest, so a small change to a large vault makes a small backup. A chain is a full backup and the
+# incremental backups after it; a new chain is started after max_incrementals incremental backups, so that restoring
+# never has to replay many files, and only the newest chains are kept. A restore replays the chain into memory and
+# verifies every page hash and SQLite's integrity check before copying it into the database, so a damaged or
+# incomplete backup never overwrites the vault.
+#
+# The snapshot and the restored database are plaintext, so they are only ever held in memory (an in-memory database,
+# serialized to bytes), never written to a file: the backup directory is the most likely place to be on external or
+# synced storage, and a crash would leave such a file behind. This takes memory proportional to the database, which a
+# password vault keeps small.
+
+BACKUP_MAGIC = b'PPMBAK\x00\x01'
+BACKUP_FORMAT = 'personal-password-manager/backup'
+BACKUP_VERSION = 1
+BACKUP_EXTENSION = '.ppmbak'
+
+FULL_BACKUP_SUFFIX = f'-full{BACKUP_EXTENSION}'
+INCREMENTAL_BACKUP_SUFFIX = f'-incremental{BACKUP_EXTENSION}'
+
+PAGE_NUMBER = struct.Struct('>I')
+
+# Pages copied per step of the online backup; smaller steps hold the database's read lock for less time
+DEFAULT_PAGES_PER_STEP = 256
+
+DEFAULT_KEEP_CHAINS = BACKUP_KEEP_CHAINS
+DEFAULT_MAX_INCREMENTALS = 6
+
+
+class BackupError(ValueError):
+    """
+    Raised when a backup cannot be restored: it is incomplete, does not belong to its chain, or does not verify.
+    """
+
+
+def _page_hash(page: bytes) -> str:
+    return hashlib.blake2b(page, digest_size=16).hexdigest()
+
+
+def _backup_name(full: bool) -> str:
+    """
+    Returns the file name of a new backup. Names sort in the order the backups were taken.
+    """
+    timestamp = datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%S%fZ')
+
+    return timestamp + (FULL_BACKUP_SUFFIX if full else INCREMENTAL_BACKUP_SUFFIX)
+
+
+def list_backups(backup_directory: str) -> List[str]:
+    """
+    Returns the paths of the backups in the given directory, oldest first.
+    """
+    if not os.path.isdir(backup_directory):
+        return []
+
+    return [os.path.join(backup_directory, name) for name in sorted(os.listdir(backup_directory))
+            if name.endswith(FULL_BACKUP_SUFFIX) or name.endswith(INCREMENTAL_BACKUP_SUFFIX)]
+
+
+def read_backup_manifest(backup_path: str, backup_password: str) -> Dict[str, Any]:
+    """
+    Returns the manifest of the backup at the given path, which only decrypts the first chunk.
+    :raise EncryptedExportError: if the file is not a backup or the password is wrong
+    :raise BackupError: if the manifest is not one of a known version
+    """
+    chunks = read_encrypted_chunks(backup_path, backup_password, workers=1, magic=BACKUP_MAGIC)
+
+    try:
+        manifest = json.loads(next(chunks))
+    finally:
+        chunks.close()
+
+    if manifest.get('format') != BACKUP_FORMAT or manifest.get('version') != BACKUP_VERSION:
+        raise BackupError(f'{backup_path} is a backup of an unknown format or version')
+
+    return manifest
+
+
+def _copy_database(source: Connection, target: Connection, pages_per_step: int,
+                   progress: Optional[Callable[[int, int], None]]) -> None:
+    """
+    Copies the database of source over that of target with the online backup API, pages_per_step pages at a time.
+    """
+    def report(_, remaining: int, total: int):
+        progress(total - remaining, total)
+
+    source.backup(target, pages=pages_per_step, progress=report if progress else None)
+
+
+def _page_hashes(database: bytes, page_size: int) -> List[str]:
+    return [_page_hash(database[offset:offset + page_size]) for offset in range(0, len(database), page_size)]
+
+
+def _page_record_chunks(database: bytes, page_size: int, page_numbers: List[int], chunk_size: int) -> Iterator[bytes]:
+    """
+    Yields the records of the given pages of the serialized database, grouped into chunks of about chunk_size bytes.
+    """
+    records = []
+    size = 0
+
+    for page_number in page_numbers:
+        records.append(PAGE_NUMBER.pack(page_number) + database[page_number * page_size:(page_number + 1) * page_size])
+        size += PAGE_NUMBER.size + page_size
+
+        if size >= chunk_size:
+            yield b''.join(records)
+            records = []
+            size = 0
+
+    if records:
+        yield b''.join(records)
+
+
+def _open_serialized(database: bytearray) -> Connection:
+    """
+    Opens the given serialized database as an in-memory database. The header is marked as using a rollback journal,
+    since an in-memory database cannot be opened in WAL mode (copying it into a database keeps that one's mode).
+    """
+    database[18:20] = b'\x01\x01'
+    connection = sqlite3.connect(':memory:')
+    connection.deserialize(database)
+
+    return connection
+
+
+def _previous_manifest(backup_directory: str, backup_password: str, max_incrementals: int)\
+        -> Optional[Dict[str, Any]]:
+    """
+    Returns the manifest of the newest backup if the next backup can be an incremental one on top of it, else None.
+    """
+    backups = list_backups(backup_directory)
+
+    if not backups:
+        return None
+
+    try:
+        manifest = read_backup_manifest(backups[-1], backup_password)
+    except (EncryptedExportError, BackupError):
+        # E.g. the backups were made with another password, so a new chain is started
+        return None
+
+    if len(manifest['chain']) > max_incrementals:
+        return None
+
+    return manifest
+
+
+def create_backup(connection: Connection, backup_directory: str, backup_password: str, incremental: bool = True,
+                  keep_chains: int = DEFAULT_KEEP_CHAINS, max_incrementals: int = DEFAULT_MAX_INCREMENTALS,
+                  pages_per_step: int = DEFAULT_PAGES_PER_STEP, progress: Optional[Callable[[int, int], None]] = None,
+                  kdf_parameters: Optional[KDFParameters] = None) -> str:
+    """
+    Takes an encrypted backup of the database of the given connection into the given directory, then removes the
+    backups of all but the newest keep_chains chains. Call it with a connection of its own to run it in a background
+    thread.
+    :param connection: the connection to the database to back up
+    :param backup_directory: the directory of the backups, which is created if needed
+    :param backup_password: the password the backup is encrypted with
+    :param incremental: whether to store only the pages that changed since the previous backup, if it can be decrypted
+    with the same password and its chain has fewer than max_incrementals incremental backups
+    :param keep_chains: the number of chains (a full backup and its incremental backups) to keep
+    :param max_incrementals: the maximum number of incremental backups in a chain
+    :param pages_per_step: the number of pages copied per step of the snapshot
+    :param progress: called with the number of pages copied so far and the total after each step of the snapshot
+    :param kdf_parameters: the Argon2id parameters (defaults to those of the master password hashes)
+    :return: the path of the new backup
+    :raise ValueError: if the backup password is an empty string
+    """
+    if not backup_password:
+        raise ValueError('The given backup_password was an empty string')
+
+    os.makedirs(backup_directory, exist_ok=True)
+    previous = _previous_manifest(backup_directory, backup_password, max_incrementals) if incremental else None
+    snapshot = sqlite3.connect(':memory:')
+
+    try:
+        _copy_database(connection, snapshot, pages_per_step, progress)
+        page_size = snapshot.execute("PRAGMA page_size").fetchone()[0]
+        database = snapshot.serialize()
+    finally:
+        snapshot.close()
+
+    page_hashes = _page_hashes(database, page_size)
+
+    if previous is not None and previous['page_size'] != page_size:
+        previous = None
+
+    if previous is None:
+        changed_pages = list(range(len(page_hashes)))
+    else:
+        previous_hashes = previous['page_hashes']
+        changed_pages = [page_number for page_number, page_hash in enumerate(page_hashes)
+                         if page_number >= len(previous_hashes) or previous_hashes[page_number] != page_hash]
+
+    name = _backup_name(full=previous is None)
+    manifest = {'format': BACKUP_FORMAT, 'version': BACKUP_VERSION, 'name': name,
+                'created': datetime.now(timezone.utc).isoformat(),
+                'chain': (previous['chain'] if previous else []) + [name], 'page_size': page_size,
+                'page_count': len(page_hashes), 'pages_stored': len(changed_pages), 'page_hashes': page_hashes}
+    backup_path = os.path.join(backup_directory, name)
+
+    def chunks() -> Iterator[bytes]:
+        yield json.dumps(manifest).encode('utf-8')
+        yield from _page_record_chunks(database, page_size, changed_pages, DEFAULT_CHUNK_SIZE)
+
+    write_encrypted_chunks(backup_path, chunks(), backup_password, kdf_parameters=kdf_parameters, magic=BACKUP_MAGIC)
+
+    rotate_backups(backup_directory, keep_chains)
+
+    return backup_path
+
+
+def rotate_backups(backup_directory: str, keep_chains: int = DEFAULT_KEEP_CHAINS) -> List[str]:
+    """
+    Removes the backups of all but the newest keep_chains chains from the given directory. A chain is a full backup
+    and the incremental backups taken after it, so the backups are grouped by name, without decrypting them.
+    :return: the paths of the removed backups
+    """
+    backups = list_backups(backup_directory)
+    full_backup_indexes = [index for index, path in enumerate(backups) if path.endswith(FULL_BACKUP_SUFFIX)]
+
+    if len(full_backup_indexes) <= keep_chains:
+        return []
+
+    removed = backups[:full_backup_indexes[-keep_chains]] if keep_chains > 0 else backups
+
+    for path in removed:
+        os.remove(path)
+
+    return removed
+
+
+def _replay_chain(backup_path: str, backup_password: str) -> Tuple[Dict[str, Any], bytearray]:
+    """
+    Rebuilds the serialized database of the given backup in memory by applying the pages of each backup of its chain
+    in order, and returns the backup's manifest and the database.
+    """
+    manifest = read_backup_manifest(backup_path, backup_password)
+    backup_directory = os.path.dirname(os.path.abspath(backup_path))
+    page_size = manifest['page_size']
+    page_count = manifest['page_count']
+    database = bytearray(page_count * page_size)
+
+    for position, name in enumerate(manifest['chain']):
+        chain_path = os.path.join(backup_directory, name)
+
+        if not os.path.exists(chain_path):
+            raise BackupError(f'The backup {name}, which {manifest["name"]} builds on, is missing')
+
+        chunks = read_encrypted_chunks(chain_path, backup_password, magic=BACKUP_MAGIC)
+
+        try:
+            chain_manifest = json.loads(next(chunks))
+
+            # A renamed or swapped file is detected by the name and chain in its (authenticated) manifest
+            if chain_manifest.get('name') != name or chain_manifest.get('chain') != manifest['chain'][:position + 1]:
+                raise BackupError(f'The backup {name} does not belong to the chain of {manifest["name"]}')
+
+            for chunk in chunks:
+                for offset in range(0, len(chunk), PAGE_NUMBER.size + page_size):
+                    page_number = PAGE_NUMBER.unpack_from(chunk, offset)[0]
+
+                    # Pages past the end were dropped when the database shrank since that backup
+                    if page_number < page_count:
+                        database[page_number * page_size:(page_number + 1) * page_size] = \
+                            chunk[offset + PAGE_NUMBER.size:offset + PAGE_NUMBER.size + page_size]
+        finally:
+            chunks.close()
+
+    return manifest, database
+
+
+def _restore(backup_path: str, backup_password: str) -> Tuple[Dict[str, Any], Connection]:
+    """
+    Replays the chain of the given backup into an in-memory database and verifies it, returning the manifest and a
+    connection to the database.
+    """
+    manifest, database = _replay_chain(backup_path, backup_password)
+
+    if _page_hashes(database, manifest['page_size']) != manifest['page_hashes']:
+        raise BackupError(f'The restored database of {manifest["name"]} does not match the hashes of its pages')
+
+    restored = _open_serialized(database)
+
+    try:
+        integrity_check = [row[0] for row in restored.execute("PRAGMA integrity_check").fetchall()]
+    except BaseException:
+        restored.close()
+        raise
+
+    if integrity_check != ['ok']:
+        restored.close()
+        raise BackupError(f'The restored database of {manifest["name"]} failed the integrity check: '
+                          + '; '.join(integrity_check))
+
+    return manifest, restored
+
+
+def verify_backup(backup_path: str, backup_password: str) -> Dict[str, Any]:
+    """
+    Restores the given backup into memory and verifies it, without touching the database.
+    :return: the backup's manifest
+    :raise BackupError: if the backup cannot be restored or does not verify
+    :raise EncryptedExportError: if a backup of the chain does not decrypt (wrong password, or modified or truncated)
+    """
+    manifest, restored = _restore(backup_path, backup_password)
+    restored.close()
+
+    return manifest
+
+
+def restore_backup(backup_path: str, backup_password: str, connection: Connection,
+                   pages_per_step: int = DEFAULT_PAGES_PER_STEP,
+                   progress: Optional[Callable[[int, int], None]] = None) -> Dict[str, Any]:
+    """
+    Restores the given backup into the database of the given connection, replacing all of its contents. The backup is
+    restored into memory and verified first, so the database is only changed if the backup is intact.
+    :param backup_path: the path of the backup to restore (its chain must be in the same directory)
+    :param backup_password: the password the backups were encrypted with
+    :param connection: the connection to the database to restore into
+    :param pages_per_step: the number of pages copied per step into the database
+    :param progress: called with the number of pages copied so far and the total after each step of the copy
+    :return: the backup's manifest
+    :raise BackupError: if the backup cannot be restored or does not verify
+    :raise EncryptedExportError: if a backup of the chain does not decrypt (wrong password, or modified or truncated)
+    """
+    manifest, restored = _restore(backup_path, backup_password)
+
+    try:
+        _copy_database(restored, connection, pages_per_step, progress)
+    finally:
+        restored.close()
+
+    return manifest
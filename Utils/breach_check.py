@@ -0,0 +1,314 @@
+import hashlib
+import heapq
+import mmap
+import os
+import struct
+import tempfile
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+from sqlite3 import Connection
+
+from Utils.database import get_all_decrypted_account_passwords_by_user_id
+
+# Offline check of passwords against a breached-password corpus, such as the SHA-1 dump of Have I Been Pwned ("HASH"
+# or "HASH:COUNT" lines). convert_hash_dump turns the text dump into a compact binary file: a 16-byte header (magic
+# and record count) followed by fixed-width records, each a 20-byte SHA-1 digest and a big-endian 4-byte count, sorted
+# by digest and without duplicates. BreachedPasswordFile memory-maps that file and binary-searches it, so a check reads
+# a few pages (around log2(n) record comparisons) and the file is never loaded into memory. An optional in-memory Bloom
+# filter answers most checks of passwords that are not breached without touching the file at all.
+
+MAGIC = b'PPMSHA1\x01'
+HEADER = struct.Struct('>8sQ')
+RECORD = struct.Struct('>20sI')
+DIGEST_SIZE = 20
+MAX_COUNT = 0xFFFFFFFF
+
+DEFAULT_CHUNK_RECORDS = 1_000_000
+DEFAULT_BLOOM_BITS_PER_ENTRY = 10
+DEFAULT_BLOOM_HASH_COUNT = 7
+
+
+def sha1_digest(password: str) -> bytes:
+    return hashlib.sha1(password.encode('utf-8')).digest()
+
+
+def _parse_dump_line(line: str, line_number: int) -> Optional[Tuple[bytes, int]]:
+    line = line.strip()
+
+    if not line:
+        return None
+
+    hex_digest, _, count = line.partition(':')
+
+    try:
+        digest = bytes.fromhex(hex_digest)
+        count = int(count) if count else 1
+    except ValueError:
+        raise ValueError(f'Line {line_number} is not a SHA-1 hash optionally followed by ":count": {line[:60]}')
+
+    if len(digest) != DIGEST_SIZE:
+        raise ValueError(f'Line {line_number} is not a SHA-1 hash optionally followed by ":count": {line[:60]}')
+
+    return digest, count
+
+
+def _read_records(path: str) -> Iterator[Tuple[bytes, int]]:
+    with open(path, 'rb') as run_file:
+        while True:
+            data = run_file.read(RECORD.size * 4096)
+
+            if not data:
+                return
+
+            yield from RECORD.iter_unpack(data)
+
+
+def _write_run(records: List[Tuple[bytes, int]], directory: str) -> str:
+    records.sort()
+    file_descriptor, path = tempfile.mkstemp(suffix='.run', dir=directory)
+
+    with os.fdopen(file_descriptor, 'wb') as run_file:
+        run_file.write(b''.join(RECORD.pack(*record) for record in records))
+
+    return path
+
+
+def _deduplicate(records: Iterable[Tuple[bytes, int]]) -> Iterator[Tuple[bytes, int]]:
+    current_digest, current_count = None, 0
+
+    for digest, count in records:
+        if digest == current_digest:
+            current_count = min(current_count + count, MAX_COUNT)
+            continue
+
+        if current_digest is not None:
+            yield current_digest, current_count
+
+        current_digest, current_count = digest, min(count, MAX_COUNT)
+
+    if current_digest is not None:
+        yield current_digest, current_count
+
+
+def convert_hash_dump(dump_path: str, output_path: str, chunk_records: int = DEFAULT_CHUNK_RECORDS) -> int:
+    """
+    Converts a text dump of SHA-1 hashes (one "HASH" or "HASH:COUNT" per line, in any order) into the sorted binary
+    format read by BreachedPasswordFile. Dumps larger than chunk_records lines are sorted externally: each chunk is
+    sorted into a temporary run file next to the output and the runs are merged, so memory stays bounded. Duplicate
+    hashes are merged by adding their counts. The output is written to a temporary file and renamed into place.
+    :param dump_path: the path of the text dump
+    :param output_path: the path of the binary file to write
+    :param chunk_records: the number of records sorted in memory at a time
+    :return: the number of distinct hashes written
+    :raise ValueError: if a line is not a SHA-1 hash optionally followed by a count
+    """
+    directory = os.path.dirname(os.path.abspath(output_path))
+    run_paths = []
+    chunk = []
+
+    try:
+        with open(dump_path, 'r', encoding='utf-8-sig') as dump_file:
+            for line_number, line in enumerate(dump_file, start=1):
+                record = _parse_dump_line(line, line_number)
+
+                if record is None:
+                    continue
+
+                chunk.append(record)
+
+                if len(chunk) >= chunk_records:
+                    run_paths.append(_write_run(chunk, directory))
+                    chunk = []
+
+        if run_paths and chunk:
+            run_paths.append(_write_run(chunk, directory))
+            chunk = []
+
+        records = heapq.merge(*(_read_records(path) for path in run_paths)) if run_paths else sorted(chunk)
+
+        file_descriptor, temporary_output_path = tempfile.mkstemp(suffix='.tmp', dir=directory)
+        record_count = 0
+
+        try:
+            with os.fdopen(file_descriptor, 'wb') as output_file:
+                output_file.write(HEADER.pack(MAGIC, 0))
+                batch = []
+
+                for record in _deduplicate(records):
+                    batch.append(RECORD.pack(*record))
+                    record_count += 1
+
+                    if len(batch) >= 4096:
+                        output_file.write(b''.join(batch))
+                        batch = []
+
+                output_file.write(b''.join(batch))
+                output_file.seek(0)
+                output_file.write(HEADER.pack(MAGIC, record_count))
+
+            os.replace(temporary_output_path, output_path)
+        except BaseException:
+            os.remove(temporary_output_path)
+            raise
+    finally:
+        for path in run_paths:
+            os.remove(path)
+
+    return record_count
+
+
+class BloomFilter:
+    """
+    A Bloom filter over SHA-1 digests. The digests are already uniformly distributed, so the bit positions are derived
+    from them directly (double hashing with two 64-bit slices) instead of hashing again.
+    """
+    def __init__(self, entry_count: int, bits_per_entry: int = DEFAULT_BLOOM_BITS_PER_ENTRY,
+                 hash_count: int = DEFAULT_BLOOM_HASH_COUNT):
+        self.bit_count = max(entry_count * bits_per_entry, 64)
+        self.hash_count = hash_count
+        self.bits = bytearray((self.bit_count + 7) // 8)
+
+    def _positions(self, digest: bytes) -> Iterator[int]:
+        first = int.from_bytes(digest[:8], 'big')
+        second = int.from_bytes(digest[8:16], 'big') | 1
+
+        for i in range(self.hash_count):
+            yield (first + i * second) % self.bit_count
+
+    def add(self, digest: bytes):
+        for position in self._positions(digest):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def might_contain(self, digest: bytes) -> bool:
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(digest))
+
+
+class BreachedPasswordFile:
+    """
+    A memory-mapped breached-password file written by convert_hash_dump. Use it as a context manager or call close().
+    """
+    def __init__(self, path: str, use_bloom_filter: bool = False,
+                 bloom_bits_per_entry: int = DEFAULT_BLOOM_BITS_PER_ENTRY):
+        """
+        :param path: the path of the file
+        :param use_bloom_filter: whether to build an in-memory Bloom filter of all the hashes (which reads the whole
+        file once and takes about bloom_bits_per_entry bits per hash) to skip the binary search for most passwords
+        that are not breached
+        :param bloom_bits_per_entry: the size of the Bloom filter per hash (10 gives about 1% false positives)
+        :raise ValueError: if the file is not a breached-password file
+        """
+        self.path = path
+        self._file = open(path, 'rb')
+
+        try:
+            size = os.fstat(self._file.fileno()).st_size
+
+            if size < HEADER.size:
+                raise ValueError(f'{path} is not a breached-password file')
+
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            magic, self.record_count = HEADER.unpack_from(self._map, 0)
+
+            if magic != MAGIC or size != HEADER.size + self.record_count * RECORD.size:
+                self._map.close()
+                raise ValueError(f'{path} is not a breached-password file')
+        except BaseException:
+            self._file.close()
+            raise
+
+        self.bloom_filter: Optional[BloomFilter] = None
+
+        if use_bloom_filter:
+            self.bloom_filter = BloomFilter(self.record_count, bits_per_entry=bloom_bits_per_entry)
+
+            for offset in range(HEADER.size, HEADER.size + self.record_count * RECORD.size, RECORD.size):
+                self.bloom_filter.add(self._map[offset:offset + DIGEST_SIZE])
+
+    def __enter__(self) -> 'BreachedPasswordFile':
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self._map.close()
+        self._file.close()
+
+    def __len__(self) -> int:
+        return self.record_count
+
+    def __contains__(self, password: str) -> bool:
+        return self.count(password) > 0
+
+    def count(self, password: str) -> int:
+        """
+        Returns how many times the given password appears in the corpus (0 if it is not breached).
+        """
+        return self.count_digest(sha1_digest(password))
+
+    def count_digest(self, digest: bytes) -> int:
+        """
+        Returns the count of the given SHA-1 digest in the corpus (0 if it is not in it).
+        """
+        if self.bloom_filter is not None and not self.bloom_filter.might_contain(digest):
+            return 0
+
+        low, high = 0, self.record_count
+
+        while low < high:
+            middle = (low + high) // 2
+            offset = HEADER.size + middle * RECORD.size
+            record_digest = self._map[offset:offset + DIGEST_SIZE]
+
+            if record_digest < digest:
+                low = middle + 1
+            elif record_digest > digest:
+                high = middle
+            else:
+                return RECORD.unpack_from(self._map, offset)[1]
+
+        return 0
+
+
+def open_breached_password_file(path: str, use_bloom_filter: bool = False) -> Optional[BreachedPasswordFile]:
+    """
+    Opens the breached-password file at the given path, or returns None if there is no file there (the check is
+    optional).
+    :raise ValueError: if the file is not a breached-password file
+    """
+    if not os.path.isfile(path):
+        return None
+
+    return BreachedPasswordFile(path, use_bloom_filter=use_bloom_filter)
+
+
+def check_passwords(passwords: Dict[int, str], breached_password_file: BreachedPasswordFile) -> Dict[int, int]:
+    """
+    Checks a batch of passwords, like the output of get_all_decrypted_account_passwords_by_user_id. The digests are
+    looked up in sorted order, so that neighbouring lookups share the pages they read.
+    :param passwords: the passwords keyed by Account id
+    :param breached_password_file: the corpus to check against
+    :return: the breach counts keyed by Account id, for the breached passwords only
+    """
+    digests = sorted((sha1_digest(password), account_id) for account_id, password in passwords.items())
+    breached = {}
+
+    for digest, account_id in digests:
+        count = breached_password_file.count_digest(digest)
+
+        if count:
+            breached[account_id] = count
+
+    return breached
+
+
+def find_breached_account_passwords(user_id: int, master_password: str, connection: Connection,
+                                    breached_password_file: BreachedPasswordFile) -> Dict[int, int]:
+    """
+    Returns the breach counts, keyed by Account id, of the Accounts of the User with the given id whose password is in
+    the breached-password corpus.
+    :raise ValueError: if there is no User with the given id or if a cryptography error occurs
+    """
+    passwords = get_all_decrypted_account_passwords_by_user_id(user_id=user_id, master_password=master_password,
+                                                               connection=connection)
+
+    return check_passwords(passwords or {}, breached_password_file)
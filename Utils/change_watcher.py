@@ -0,0 +1,67 @@
+from sqlite3 import Connection
+from typing import Dict, Any, Optional
+
+from Utils.database import get_current_revision, changes_since
+
+# Noticing the changes other processes (the CLI, another GUI, a sync or a restore) make to the vault while it is open.
+# PRAGMA data_version only changes when another connection commits to the database file, and reading it does not
+# touch the database, so polling it is cheap enough to do every second. When it changes, only the Accounts changed
+# since the revision the watcher last saw are read from the change journal (see changes_since). The watcher's own
+# connection does not change data_version, so its own writes are not reported until another connection commits, and
+# are then reported again (applying them twice must be harmless).
+
+
+class VaultChangeWatcher:
+    """
+    Tracks the changes other connections commit to the Accounts of one User.
+    """
+    def __init__(self, user_id: int, connection: Connection):
+        """
+        :param user_id: the id of the User whose Accounts are watched
+        :param connection: the connection the caller reads the vault with
+        """
+        self.user_id = user_id
+        self.connection = connection
+        self.data_version = None
+        self.revision = None
+
+        self.reset()
+
+    def _get_data_version(self) -> int:
+        cursor = self.connection.cursor()
+        cursor.execute("PRAGMA data_version")
+
+        data_version = cursor.fetchone()[0]
+
+        cursor.close()
+
+        return data_version
+
+    def reset(self) -> None:
+        """
+        Starts watching from the current state of the vault. Call it right before (re)loading every Account, so that
+        the changes committed during the load are reported by the next poll.
+        """
+        self.data_version = self._get_data_version()
+        self.revision = get_current_revision(self.connection)
+
+    def poll(self) -> Optional[Dict[str, Any]]:
+        """
+        Returns the Accounts changed since the previous poll (or reset) if another connection committed to the vault
+        since then.
+        :return: None if no other connection committed, otherwise the changes as returned by changes_since (which may
+        be empty, e.g. if only another User's Accounts changed)
+        :raise ChangeJournalCompactedError: if the changes were compacted away, in which case the caller has to reset
+        the watcher and reload every Account
+        """
+        data_version = self._get_data_version()
+
+        if data_version == self.data_version:
+            return None
+
+        changes = changes_since(self.user_id, self.revision, self.connection)
+
+        self.data_version = data_version
+        self.revision = changes['revision']
+
+        return changes
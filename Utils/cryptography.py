@@ -1,11 +1,20 @@
 import base64
+import hashlib
+import hmac
 from typing import Union, Tuple
 
 from Crypto.Cipher import AES
+from Crypto.Hash import SHA256
+from Crypto.Protocol.DH import key_agreement, import_x25519_private_key, import_x25519_public_key
+from Crypto.Protocol.KDF import HKDF
+from Crypto.PublicKey import ECC
 from Crypto.Util.Padding import pad, unpad
 from argon2 import PasswordHasher
 
+from Utils.instrumentation import instrumented
 
+
+@instrumented(bytes_argument='password')
 def derive_256_bit_salt_and_key(password: Union[str, bytes], salt: Union[str, bytes, None] = None) -> Tuple[bytes, bytes]:
     """
     Derives 256-bit key from the given password (and the given salt if provided) using Argon2, and returns the
@@ -31,6 +40,7 @@ def derive_256_bit_salt_and_key(password: Union[str, bytes], salt: Union[str, by
     return salt, key
 
 
+@instrumented(bytes_argument='plaintext')
 def encrypt_aes_256_gcm(key: bytes, plaintext: Union[bytes, str]) -> Tuple[bytes, Union[bytes, bytearray, memoryview], bytes]:
     """
     Encrypts data using AES-256-GCM utilizing PyCryptodome and returns the corresponding ciphertext, nonce, and tag.
@@ -51,6 +61,7 @@ def encrypt_aes_256_gcm(key: bytes, plaintext: Union[bytes, str]) -> Tuple[bytes
     return ciphertext, nonce, tag
 
 
+@instrumented(bytes_argument='ciphertext')
 def decrypt_aes_256_gcm(key: bytes, ciphertext: Union[bytes, bytearray, memoryview], nonce: bytes, tag: bytes) -> str:
     """
     Decrypts data using AES-256-GCM utilizing PyCryptodome, verifies the result, and returns a utf-8 string
@@ -67,3 +78,156 @@ def decrypt_aes_256_gcm(key: bytes, ciphertext: Union[bytes, bytearray, memoryvi
     plaintext = unpad(padded_data=decrypt_cipher.decrypt_and_verify(ciphertext, tag), block_size=AES.block_size)
 
     return plaintext.decode('utf-8')
+
+
+@instrumented()
+def derive_subkey(key: bytes, purpose: str) -> bytes:
+    """
+    Derives a 256-bit subkey for the given purpose from the given key using HKDF-SHA256. Subkeys derived for different
+    purposes are independent, so a single Argon2-derived key can back several uses without running Argon2 again.
+    :param key: the key to derive the subkey from (e.g. a key derived by derive_256_bit_salt_and_key)
+    :param purpose: the label of the use of the subkey
+    :return: the 256-bit subkey
+    """
+    return HKDF(master=key, key_len=32, salt=None, hashmod=SHA256, context=purpose.encode('utf-8'))
+
+
+@instrumented(bytes_argument='plaintext')
+def keyed_fingerprint(key: bytes, plaintext: Union[bytes, str]) -> bytes:
+    """
+    Returns the HMAC-SHA256 of the given plaintext under the given key: equal plaintexts have equal fingerprints, but
+    without the key a fingerprint cannot be checked against guesses of the plaintext. If the plaintext is a string, it
+    is encoded using utf-8.
+    :param key: the fingerprint key
+    :param plaintext: the data to fingerprint
+    :return: the 32-byte fingerprint
+    """
+    if isinstance(plaintext, str):
+        plaintext = plaintext.encode('utf-8')
+
+    return hmac.new(key, plaintext, hashlib.sha256).digest()
+
+
+# The layout of a wrapped key (see wrap_key): the ephemeral X25519 public key, the AES-GCM nonce and tag, then the
+# encrypted key
+X25519_KEY_SIZE = 32
+WRAPPED_KEY_NONCE_SIZE = 16
+WRAPPED_KEY_TAG_SIZE = 16
+
+
+@instrumented()
+def generate_x25519_key_pair() -> Tuple[bytes, bytes]:
+    """
+    Generates an X25519 key pair, for keys wrapped with wrap_key.
+    :return: the 32-byte private key and the 32-byte public key
+    """
+    private_key = ECC.generate(curve='Curve25519')
+
+    return private_key.seed, private_key.public_key().export_key(format='raw')
+
+
+def _wrapping_key(shared_secret: bytes, ephemeral_public_key: bytes, recipient_public_key: bytes) -> bytes:
+    return HKDF(master=shared_secret, key_len=32, salt=ephemeral_public_key + recipient_public_key, hashmod=SHA256,
+                context=b'key wrapping')
+
+
+@instrumented()
+def wrap_key(key: bytes, recipient_public_key: bytes) -> bytes:
+    """
+    Wraps (encrypts) the given key for the holder of the private key of the given X25519 public key, so that only they
+    can unwrap it (see unwrap_key). The key is encrypted with AES-256-GCM under a key derived with HKDF from an X25519
+    agreement between a new ephemeral key pair and the recipient's public key, so wrapping needs no secret of the
+    sender's.
+    :param key: the key to wrap
+    :param recipient_public_key: the recipient's 32-byte X25519 public key
+    :return: the wrapped key
+    :raise ValueError: if the public key is invalid
+    """
+    ephemeral_private_key = ECC.generate(curve='Curve25519')
+    ephemeral_public_key = ephemeral_private_key.public_key().export_key(format='raw')
+
+    wrapping_key = key_agreement(eph_priv=ephemeral_private_key,
+                                 static_pub=import_x25519_public_key(recipient_public_key),
+                                 kdf=lambda shared_secret: _wrapping_key(shared_secret, ephemeral_public_key,
+                                                                         recipient_public_key))
+
+    cipher = AES.new(key=wrapping_key, mode=AES.MODE_GCM)
+    ciphertext, tag = cipher.encrypt_and_digest(key)
+
+    return ephemeral_public_key + cipher.nonce + tag + ciphertext
+
+
+@instrumented()
+def unwrap_key(wrapped_key: bytes, private_key: bytes) -> bytes:
+    """
+    Unwraps a key wrapped with wrap_key for the public key of the given X25519 private key.
+    :param wrapped_key: the wrapped key
+    :param private_key: the recipient's 32-byte X25519 private key
+    :return: the key
+    :raise ValueError: if the wrapped key was not wrapped for this private key, or was modified or truncated
+    """
+    if len(wrapped_key) < X25519_KEY_SIZE + WRAPPED_KEY_NONCE_SIZE + WRAPPED_KEY_TAG_SIZE:
+        raise ValueError('The wrapped key is truncated')
+
+    nonce_start = X25519_KEY_SIZE
+    tag_start = nonce_start + WRAPPED_KEY_NONCE_SIZE
+    ciphertext_start = tag_start + WRAPPED_KEY_TAG_SIZE
+
+    ephemeral_public_key = wrapped_key[:nonce_start]
+    recipient_private_key = import_x25519_private_key(private_key)
+    recipient_public_key = recipient_private_key.public_key().export_key(format='raw')
+
+    wrapping_key = key_agreement(static_priv=recipient_private_key,
+                                 eph_pub=import_x25519_public_key(ephemeral_public_key),
+                                 kdf=lambda shared_secret: _wrapping_key(shared_secret, ephemeral_public_key,
+                                                                         recipient_public_key))
+
+    cipher = AES.new(key=wrapping_key, mode=AES.MODE_GCM, nonce=wrapped_key[nonce_start:tag_start])
+
+    return cipher.decrypt_and_verify(wrapped_key[ciphertext_start:], wrapped_key[tag_start:ciphertext_start])
+
+
+# Chunked encryption (see encrypt_chunk), for data too large to encrypt as one value: each chunk of a stream is
+# encrypted on its own with AES-256-GCM under the stream's key, with its index as the nonce and whether it is the last
+# chunk as associated data, so that chunks cannot be reordered, swapped between positions, or dropped from the end
+# without failing to decrypt. The nonce is only unique within a stream, so every stream needs a new random key.
+CHUNK_NONCE_SIZE = 12
+CHUNK_TAG_SIZE = 16
+
+
+def _chunk_cipher(key: bytes, index: int, last: bool):
+    cipher = AES.new(key=key, mode=AES.MODE_GCM, nonce=index.to_bytes(CHUNK_NONCE_SIZE, 'big'))
+    cipher.update(b'\x01' if last else b'\x00')
+
+    return cipher
+
+
+@instrumented(bytes_argument='plaintext')
+def encrypt_chunk(key: bytes, index: int, last: bool, plaintext: Union[bytes, bytearray, memoryview])\
+        -> Tuple[bytes, bytes]:
+    """
+    Encrypts the chunk at the given index of a stream (see the comment above), without padding.
+    :param key: the key of the stream, which must not be used for another stream
+    :param index: the position of the chunk in the stream, from 0
+    :param last: whether it is the last chunk of the stream
+    :param plaintext: the chunk
+    :return: the ciphertext, as long as the chunk, and the tag
+    :raise ValueError: if key length is incorrect
+    """
+    return _chunk_cipher(key, index, last).encrypt_and_digest(plaintext)
+
+
+@instrumented(bytes_argument='ciphertext')
+def decrypt_chunk(key: bytes, index: int, last: bool, ciphertext: Union[bytes, bytearray, memoryview],
+                  tag: bytes) -> bytes:
+    """
+    Decrypts and verifies the chunk at the given index of a stream encrypted with encrypt_chunk.
+    :param key: the key of the stream
+    :param index: the position of the chunk in the stream, from 0
+    :param last: whether it is the last chunk of the stream
+    :param ciphertext: the encrypted chunk
+    :param tag: the tag of the chunk
+    :return: the chunk
+    :raise ValueError: if the key is wrong, or the chunk was modified or is not the one at this position
+    """
+    return _chunk_cipher(key, index, last).decrypt_and_verify(ciphertext, tag)
@@ -1,20 +1,295 @@
+import hmac
+import io
+import json
+import os
 import sqlite3
 from sqlite3 import Connection, Cursor, connect
-from typing import Tuple, List, Dict, Optional
+from typing import Tuple, List, Dict, Optional, Any, BinaryIO, Iterator
 
 from argon2 import PasswordHasher
 from argon2.exceptions import HashingError, VerifyMismatchError, VerificationError, InvalidHashError
 
-from Utils.cryptography import derive_256_bit_salt_and_key, decrypt_aes_256_gcm, encrypt_aes_256_gcm
-from re import match as regex_match
+from Utils.cryptography import derive_256_bit_salt_and_key, decrypt_aes_256_gcm, encrypt_aes_256_gcm, derive_subkey, \
+    keyed_fingerprint, generate_x25519_key_pair, wrap_key, unwrap_key, encrypt_chunk, decrypt_chunk
+from Utils.instrumentation import instrumented, timer
+from Utils.urls import normalize_url
+from re import match as regex_match, findall as regex_findall
 
 from config import VALID_EMAIL_PATTERN
 
+# The url index: the normalized host and registrable domain of each Account url (see Utils.urls), so that the Accounts
+# matching a page url are found with an index lookup instead of a scan of every url. create_account and edit_account
+# maintain it; the triggers drop the entry of an Account whose url is changed or that is deleted by any other means,
+# and index_account_urls adds the missing entries (setup_database runs it at startup).
+ACCOUNT_URLS_SCHEMA = (
+    """CREATE TABLE IF NOT EXISTS account_urls (
+    account_id INTEGER PRIMARY KEY,
+    user_id INTEGER NOT NULL,
+    host TEXT NOT NULL,
+    domain TEXT NOT NULL,
+    FOREIGN KEY(account_id) REFERENCES accounts(id) ON DELETE CASCADE
+    ) STRICT ;""",
+    "CREATE INDEX IF NOT EXISTS account_urls_user_id_domain ON account_urls(user_id, domain);",
+    """CREATE TRIGGER IF NOT EXISTS account_urls_account_deleted AFTER DELETE ON accounts BEGIN
+    DELETE FROM account_urls WHERE account_id = OLD.id;
+    END;""",
+    """CREATE TRIGGER IF NOT EXISTS account_urls_account_url_updated AFTER UPDATE OF url ON accounts BEGIN
+    DELETE FROM account_urls WHERE account_id = NEW.id;
+    END;""",
+)
+
+# Password fingerprints: an HMAC of each Account's plaintext password, keyed by a per-User secret, so that reused
+# passwords are found with a GROUP BY over an index instead of decrypting the vault (one Argon2 run per Account). The
+# secret is an HKDF subkey of a key derived with Argon2 from the master password and a per-User salt (user_keys). It is
+# derived once per process and master password, on the first fingerprint after unlocking, and then kept in memory
+# like the master password itself. create_account, edit_account, and rehash_and_reencrypt_passwords maintain the
+# fingerprints; the triggers drop the fingerprint of an Account whose password is changed by any other means, and
+# fingerprint_account_passwords adds the missing ones.
+FINGERPRINT_KEY_PURPOSE = 'account password fingerprint'
+
+ACCOUNT_FINGERPRINTS_SCHEMA = (
+    """CREATE TABLE IF NOT EXISTS user_keys (
+    user_id INTEGER PRIMARY KEY,
+    salt BLOB NOT NULL,
+    FOREIGN KEY(user_id) REFERENCES users(id) ON DELETE CASCADE
+    ) STRICT ;""",
+    """CREATE TABLE IF NOT EXISTS account_fingerprints (
+    account_id INTEGER PRIMARY KEY,
+    user_id INTEGER NOT NULL,
+    fingerprint BLOB NOT NULL,
+    FOREIGN KEY(account_id) REFERENCES accounts(id) ON DELETE CASCADE
+    ) STRICT ;""",
+    """CREATE INDEX IF NOT EXISTS account_fingerprints_user_id_fingerprint
+    ON account_fingerprints(user_id, fingerprint);""",
+    """CREATE TRIGGER IF NOT EXISTS account_fingerprints_account_deleted AFTER DELETE ON accounts BEGIN
+    DELETE FROM account_fingerprints WHERE account_id = OLD.id;
+    END;""",
+    """CREATE TRIGGER IF NOT EXISTS account_fingerprints_account_password_updated AFTER UPDATE OF password ON accounts
+    BEGIN
+    DELETE FROM account_fingerprints WHERE account_id = NEW.id;
+    END;""",
+)
+
+
+# The change journal: an append-only log of the Account changes, written by triggers so that every change is logged,
+# whatever makes it. Each entry gets the next revision of the vault (AUTOINCREMENT never reuses one, even after
+# compaction), so a consumer that has seen the vault at some revision asks changes_since for the Accounts changed after
+# it instead of rescanning every Account. Only the latest entry of each Account is needed, so compaction drops the
+# entries that a newer one supersedes, and can also drop old deletions, after which changes_since refuses the revisions
+# that may have missed them (compacted_revision) and the consumer has to rescan.
+#
+# The revision of an Account's latest entry is also its version (get_account_version), which edit_account and
+# delete_account can be made conditional on, so that concurrent writers (the GUI, the CLI, a sync) refuse to overwrite
+# a change they have not seen instead of locking the vault. The journal stands in for a version column, which would
+# have to be kept up to date by every statement that writes an Account.
+ACCOUNT_CHANGES_SCHEMA = (
+    """CREATE TABLE IF NOT EXISTS account_changes (
+    revision INTEGER PRIMARY KEY AUTOINCREMENT,
+    account_id INTEGER NOT NULL,
+    user_id INTEGER NOT NULL,
+    operation TEXT NOT NULL CHECK (operation IN ('insert', 'update', 'delete'))
+    ) STRICT ;""",
+    "CREATE INDEX IF NOT EXISTS account_changes_user_id_revision ON account_changes(user_id, revision);",
+    "CREATE INDEX IF NOT EXISTS account_changes_account_id_revision ON account_changes(account_id, revision);",
+    """CREATE TABLE IF NOT EXISTS account_changes_compaction (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    compacted_revision INTEGER NOT NULL
+    ) STRICT ;""",
+    """CREATE TRIGGER IF NOT EXISTS account_changes_account_inserted AFTER INSERT ON accounts BEGIN
+    INSERT INTO account_changes (account_id, user_id, operation) VALUES (NEW.id, NEW.user_id, 'insert');
+    END;""",
+    """CREATE TRIGGER IF NOT EXISTS account_changes_account_updated AFTER UPDATE ON accounts BEGIN
+    INSERT INTO account_changes (account_id, user_id, operation) VALUES (NEW.id, NEW.user_id, 'update');
+    END;""",
+    """CREATE TRIGGER IF NOT EXISTS account_changes_account_deleted AFTER DELETE ON accounts BEGIN
+    INSERT INTO account_changes (account_id, user_id, operation) VALUES (OLD.id, OLD.user_id, 'delete');
+    END;""",
+    # Accounts created before the journal existed are logged once, as inserted
+    """INSERT INTO account_changes (account_id, user_id, operation)
+    SELECT accounts.id, accounts.user_id, 'insert' FROM accounts
+    WHERE NOT EXISTS (SELECT 1 FROM account_changes WHERE account_changes.account_id = accounts.id)
+    ORDER BY accounts.id;""",
+)
+
+
+# Sealed Account metadata: an opt-in per User (seal_account_metadata) that encrypts the name, url, and username of their
+# Accounts, which are otherwise stored in plaintext. Each Account's metadata is encrypted as one value with AES-GCM,
+# under an HKDF subkey of the user key (see the password fingerprints), and the accounts row only keeps placeholders:
+# the name is a blind index (a keyed HMAC) of the lowercased name, so UNIQUE(name, user_id) still refuses a duplicate
+# name whatever its case and get_account_id_by_account_name_and_user_id is still an index lookup, while the url is NULL
+# and the username is empty. The url index of a sealed Account holds blind indexes of the host and domain instead of
+# the plaintext, so find_accounts_for_url is still an index lookup, and the words of the name, username, and host are
+# kept as blind tokens, so that search_accounts only decrypts the matching Accounts. The keys are derived once the
+# master password is verified (e.g. by is_valid_login) and kept in memory like the fingerprint key, so the read
+# functions reveal the metadata transparently; without them they raise SealedMetadataLockedError. The triggers drop
+# the metadata of an Account whose placeholders are changed by any other means, so stale metadata is never revealed.
+METADATA_KEY_PURPOSE = 'account metadata encryption'
+BLIND_INDEX_KEY_PURPOSE = 'account metadata blind index'
+
+ACCOUNT_METADATA_SCHEMA = (
+    """CREATE TABLE IF NOT EXISTS sealed_users (
+    user_id INTEGER PRIMARY KEY,
+    FOREIGN KEY(user_id) REFERENCES users(id) ON DELETE CASCADE
+    ) STRICT ;""",
+    """CREATE TABLE IF NOT EXISTS account_metadata (
+    account_id INTEGER PRIMARY KEY,
+    user_id INTEGER NOT NULL,
+    metadata BLOB NOT NULL,
+    nonce BLOB NOT NULL,
+    tag BLOB NOT NULL,
+    FOREIGN KEY(account_id) REFERENCES accounts(id) ON DELETE CASCADE
+    ) STRICT ;""",
+    """CREATE TABLE IF NOT EXISTS account_metadata_tokens (
+    account_id INTEGER NOT NULL,
+    user_id INTEGER NOT NULL,
+    token BLOB NOT NULL,
+    PRIMARY KEY(account_id, token),
+    FOREIGN KEY(account_id) REFERENCES accounts(id) ON DELETE CASCADE
+    ) STRICT ;""",
+    """CREATE INDEX IF NOT EXISTS account_metadata_tokens_user_id_token
+    ON account_metadata_tokens(user_id, token);""",
+    """CREATE TRIGGER IF NOT EXISTS account_metadata_account_deleted AFTER DELETE ON accounts BEGIN
+    DELETE FROM account_metadata WHERE account_id = OLD.id;
+    DELETE FROM account_metadata_tokens WHERE account_id = OLD.id;
+    END;""",
+    """CREATE TRIGGER IF NOT EXISTS account_metadata_account_updated AFTER UPDATE OF name, url, username ON accounts
+    BEGIN
+    DELETE FROM account_metadata WHERE account_id = NEW.id;
+    DELETE FROM account_metadata_tokens WHERE account_id = NEW.id;
+    END;""",
+)
+
+# The metadata encryption and blind index keys of the sealed Users unlocked in this process, by their user_keys salt
+_metadata_keys: Dict[bytes, Tuple[bytes, bytes]] = {}
+
+# The user keys of the Users whose master password was verified in this process, by user id and user_keys salt, each
+# with a keyed hash (under the user key) of that master password, so that a call with another password derives its own
+# key instead of being given this one. The master passwords themselves are not kept.
+_user_keys: Dict[Tuple[int, bytes], Tuple[bytes, bytes]] = {}
+
+# Shared items: entries shared between Users without a copy per User. The password of a shared item is encrypted once,
+# under a random item key, and the item key is wrapped (see Utils.cryptography.wrap_key) for the X25519 public key of
+# each member, so adding a member costs one unwrap and one wrap and removing one deletes their membership row, without
+# re-encrypting the item. Each User's key pair is created the first time their master password is verified
+# (is_valid_login), since the public key must be known before anyone can share with them; the private key is encrypted
+# under an HKDF subkey of the user key (see the password fingerprints). The owner of an item is also a member, and is
+# the only one who can add or remove members, or delete it. The membership table is indexed by User, so listing a
+# User's shared items does not scan the items of the others. A removed member may have kept the item key (or the
+# password), so revoking their access for good means deleting the item and sharing a new password. The name, url, and
+# username of a shared item are stored in plaintext, so a User whose Account metadata is sealed cannot share items.
+# Shared items are listed and looked up by name alongside the Accounts of each member, so an item is never shared with a
+# User who already has an Account or another shared item with its name, nor with a User whose Account names are sealed
+# (whose names the owner cannot compare).
+KEY_PAIR_KEY_PURPOSE = 'x25519 private key encryption'
+
+SHARED_ITEMS_SCHEMA = (
+    """CREATE TABLE IF NOT EXISTS user_key_pairs (
+    user_id INTEGER PRIMARY KEY,
+    public_key BLOB NOT NULL,
+    private_key BLOB NOT NULL,
+    nonce BLOB NOT NULL,
+    tag BLOB NOT NULL,
+    FOREIGN KEY(user_id) REFERENCES users(id) ON DELETE CASCADE
+    ) STRICT ;""",
+    """CREATE TABLE IF NOT EXISTS shared_items (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    owner_id INTEGER NOT NULL,
+    name TEXT NOT NULL COLLATE NOCASE,
+    url TEXT COLLATE NOCASE,
+    username TEXT NOT NULL,
+    password BLOB NOT NULL,
+    nonce BLOB NOT NULL,
+    tag BLOB NOT NULL,
+    FOREIGN KEY(owner_id) REFERENCES users(id),
+    UNIQUE(name, owner_id)
+    ) STRICT ;""",
+    """CREATE TABLE IF NOT EXISTS shared_item_members (
+    item_id INTEGER NOT NULL,
+    user_id INTEGER NOT NULL,
+    wrapped_key BLOB NOT NULL,
+    PRIMARY KEY(item_id, user_id),
+    FOREIGN KEY(item_id) REFERENCES shared_items(id) ON DELETE CASCADE,
+    FOREIGN KEY(user_id) REFERENCES users(id) ON DELETE CASCADE
+    ) STRICT ;""",
+    "CREATE INDEX IF NOT EXISTS shared_item_members_user_id ON shared_item_members(user_id, item_id);",
+    """CREATE TRIGGER IF NOT EXISTS shared_item_members_item_deleted AFTER DELETE ON shared_items BEGIN
+    DELETE FROM shared_item_members WHERE item_id = OLD.id;
+    END;""",
+)
+
+# Attachments: files (recovery codes, SSH keys, PDFs) and long notes kept alongside an Account. They can be far larger
+# than anything else in the vault, so they are never held in memory whole: add_attachment reads the content in chunks
+# of ATTACHMENT_CHUNK_SIZE bytes, encrypts each one on its own (see Utils.cryptography.encrypt_chunk), and stores it as
+# a row of attachment_chunks, and read_attachment decrypts them one row at a time. Each attachment has its own random
+# key, encrypted under an HKDF subkey of the user key (see the password fingerprints), so a User's attachments cost a
+# single Argon2 run, and rehash_and_reencrypt_passwords leaves them as they are. The attachments row holds the name,
+# kind, and size, so listing an Account's attachments does not read a chunk, and the Account queries never touch
+# either table. The names are stored in plaintext, even for a User whose Account metadata is sealed. The triggers drop
+# the attachments of a deleted Account, and the chunks of a deleted attachment.
+ATTACHMENT_KEY_PURPOSE = 'attachment key encryption'
+ATTACHMENT_CHUNK_SIZE = 64 * 1024
+ATTACHMENT_KINDS = ('file', 'note')
+
+ATTACHMENTS_SCHEMA = (
+    """CREATE TABLE IF NOT EXISTS attachments (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    account_id INTEGER NOT NULL,
+    user_id INTEGER NOT NULL,
+    name TEXT NOT NULL COLLATE NOCASE,
+    kind TEXT NOT NULL CHECK (kind IN ('file', 'note')),
+    size INTEGER NOT NULL,
+    chunk_count INTEGER NOT NULL,
+    key BLOB NOT NULL,
+    nonce BLOB NOT NULL,
+    tag BLOB NOT NULL,
+    FOREIGN KEY(account_id) REFERENCES accounts(id) ON DELETE CASCADE,
+    UNIQUE(account_id, name)
+    ) STRICT ;""",
+    """CREATE TABLE IF NOT EXISTS attachment_chunks (
+    attachment_id INTEGER NOT NULL,
+    chunk_index INTEGER NOT NULL,
+    ciphertext BLOB NOT NULL,
+    tag BLOB NOT NULL,
+    PRIMARY KEY(attachment_id, chunk_index),
+    FOREIGN KEY(attachment_id) REFERENCES attachments(id) ON DELETE CASCADE
+    ) STRICT ;""",
+    """CREATE TRIGGER IF NOT EXISTS attachments_account_deleted AFTER DELETE ON accounts BEGIN
+    DELETE FROM attachments WHERE account_id = OLD.id;
+    END;""",
+    """CREATE TRIGGER IF NOT EXISTS attachment_chunks_attachment_deleted AFTER DELETE ON attachments BEGIN
+    DELETE FROM attachment_chunks WHERE attachment_id = OLD.id;
+    END;""",
+)
+
+
+class AccountVersionConflictError(ValueError):
+    """
+    Raised when an Account is edited or deleted on the condition that it was not written after a version, but it was
+    (e.g. by another process since the caller read it).
+    """
+
+
+class ChangeJournalCompactedError(ValueError):
+    """
+    Raised when the changes after a revision are asked for, but some of them were compacted away, so the consumer has
+    to rescan the Accounts instead.
+    """
+
+
+class SealedMetadataLockedError(ValueError):
+    """
+    Raised when the Accounts of a User whose metadata is sealed are read or edited before their master password was
+    verified in this process, so the metadata cannot be decrypted.
+    """
 
-def create_user(email: str, password: str, connection: Connection) -> int:
+
+@instrumented()
+def create_user(email: str, password: str, connection: Connection, user_id: Optional[int] = None) -> int:
     """
     Creates a new User in the database with the given email and a hash of the given password, returns the
     corresponding User id.
+    :param user_id: the id to give the User (defaults to the next free one), e.g. the one a sharded vault's directory
+    assigned (see Utils.sharded_vault)
     :return: the id of the created User
     :raise ValueError: if the given email is invalid or an empty string, or if the given password is an empty string
     :raise argon2.exceptions.HashingError: if hashing fails
@@ -33,9 +308,10 @@ def create_user(email: str, password: str, connection: Connection) -> int:
     cursor = connection.cursor()
 
     ph = PasswordHasher()
-    hashed_password = ph.hash(password)
+    with timer('argon2.hash'):
+        hashed_password = ph.hash(password)
 
-    cursor.execute("INSERT INTO users VALUES (:id, :email, :password) RETURNING id", {'id': None,
+    cursor.execute("INSERT INTO users VALUES (:id, :email, :password) RETURNING id", {'id': user_id,
                                                                                       'email': email,
                                                                                       'password': hashed_password})
 
@@ -47,6 +323,7 @@ def create_user(email: str, password: str, connection: Connection) -> int:
     return user_id
 
 
+@instrumented()
 def create_account(user_id: int, master_password: str, name: str, url: Optional[str], username: str, password: str,
                    connection: Connection) -> int:
     """
@@ -89,7 +366,10 @@ def create_account(user_id: int, master_password: str, name: str, url: Optional[
 
     hashed_password = get_login_password_by_user_id(user_id, connection)
 
-    ph.verify(hash=hashed_password, password=master_password)
+    with timer('argon2.verify'):
+        ph.verify(hash=hashed_password, password=master_password)
+
+    metadata_keys = _unlock_metadata_keys(cursor, user_id, master_password)
 
     salt, key = derive_256_bit_salt_and_key(master_password)
     encrypted_password, nonce, tag = encrypt_aes_256_gcm(key, password)
@@ -98,9 +378,7 @@ def create_account(user_id: int, master_password: str, name: str, url: Optional[
         cursor.execute("""INSERT INTO accounts VALUES (:id, :name, :url, :username, :password, :salt, :nonce, :tag,
         :user_id) RETURNING id""",
                        {'id': None,
-                        'name': name,
-                        'url': url,
-                        'username': username,
+                        **_stored_account_metadata(name, url, username, metadata_keys),
                         'password': encrypted_password,
                         'salt': salt,
                         'nonce': nonce,
@@ -112,22 +390,453 @@ def create_account(user_id: int, master_password: str, name: str, url: Optional[
 
     account_id = cursor.fetchone()[0]
 
+    if metadata_keys:
+        _seal_account(cursor, account_id, user_id, name, url, username, metadata_keys)
+    else:
+        _index_account_url(cursor, account_id, user_id, url)
+
+    _fingerprint_account_password(cursor, account_id, user_id, password,
+                                  _get_fingerprint_key(cursor, user_id, master_password))
+
     connection.commit()
     cursor.close()
 
     return account_id
 
 
+@instrumented()
+def create_accounts(user_id: int, master_password: str, accounts: List[Dict[str, Optional[str]]],
+                    connection: Connection) -> List[Optional[int]]:
+    """
+    Creates a batch of Accounts for the User with the given user_id and master_password in a single transaction, like
+    create_account does for one Account but verifying the master password (and deriving the fingerprint key) only once
+    per batch. An Account that cannot be created, because its name, username, or password is an empty string or its
+    name is already in use, is skipped instead of raising.
+    :param accounts: the Accounts to create, as dictionaries with name, url (optional), username, and password keys
+    :return: the id of each created Account, or None for each skipped one, in the order of the given Accounts
+    :raise ValueError: if the given user_id is invalid or the master_password is an empty string (or if raised by a
+    called cryptographic function)
+    :raise argon2.exceptions.HashingError: if hashing fails
+    :raise argon2.exceptions.VerifyMismatchError: if the User's hashed_password is not valid for the given
+    master password
+    :raise argon2.exceptions.InvalidHashError: if hash is invalid
+    :raise argon2.exceptions.VerificationError: if there was a miscellaneous verification error (if the argon
+    verification raised VerificationError as opposed to VerifyMismatchError or InvalidHashError)
+    """
+    cursor = connection.cursor()
+
+    cursor.execute("SELECT EXISTS (SELECT 1 FROM users WHERE id=?)", (user_id,))
+
+    user_exists = cursor.fetchone()[0]
+
+    if not user_exists:
+        raise ValueError(f'There is no User with the given user_id ({user_id})')
+
+    if not master_password:
+        raise ValueError('The given master_password was an empty string')
+
+    ph = PasswordHasher()
+
+    hashed_password = get_login_password_by_user_id(user_id, connection)
+
+    with timer('argon2.verify'):
+        ph.verify(hash=hashed_password, password=master_password)
+
+    fingerprint_key = _get_fingerprint_key(cursor, user_id, master_password)
+    metadata_keys = _unlock_metadata_keys(cursor, user_id, master_password)
+    account_ids = []
+
+    for account in accounts:
+        name, url, username, password = account.get('name'), account.get('url'), account.get('username'), \
+            account.get('password')
+
+        if not name or not username or not password:
+            account_ids.append(None)
+            continue
+
+        salt, key = derive_256_bit_salt_and_key(master_password)
+        encrypted_password, nonce, tag = encrypt_aes_256_gcm(key, password)
+
+        # A failed INSERT changes nothing, so the rest of the batch is unaffected
+        try:
+            cursor.execute("""INSERT INTO accounts VALUES (:id, :name, :url, :username, :password, :salt, :nonce,
+            :tag, :user_id) RETURNING id""", {'id': None,
+                                               **_stored_account_metadata(name, url, username, metadata_keys),
+                                               'password': encrypted_password, 'salt': salt, 'nonce': nonce,
+                                               'tag': tag, 'user_id': user_id})
+        except sqlite3.IntegrityError:
+            account_ids.append(None)
+            continue
+
+        account_id = cursor.fetchone()[0]
+
+        if metadata_keys:
+            _seal_account(cursor, account_id, user_id, name, url, username, metadata_keys)
+        else:
+            _index_account_url(cursor, account_id, user_id, url)
+        _fingerprint_account_password(cursor, account_id, user_id, password, fingerprint_key)
+
+        account_ids.append(account_id)
+
+    connection.commit()
+    cursor.close()
+
+    return account_ids
+
+
+def _index_account_url(cursor: Cursor, account_id: int, user_id: int, url: Optional[str]) -> None:
+    """
+    Adds the normalized host and registrable domain of the given Account url to the url index, unless the url has no
+    valid host.
+    """
+    normalized_url = normalize_url(url)
+
+    if normalized_url is not None:
+        host, domain = normalized_url
+        cursor.execute("INSERT OR REPLACE INTO account_urls VALUES (?, ?, ?, ?)", (account_id, user_id, host, domain))
+
+
+def _derive_user_key(user_id: int, master_password: str, salt: bytes, verified: bool = True) -> bytes:
+    """
+    Returns the user key of the User with the given id, derived from the given master password and user_keys salt, or
+    the kept one if it was derived from the same master password. A derived key is only kept if the master password is
+    verified; otherwise the caller keeps it (see _keep_user_key) once it decrypted something.
+    """
+    kept = _user_keys.get((user_id, salt))
+
+    if kept is not None and hmac.compare_digest(kept[1], keyed_fingerprint(kept[0], master_password)):
+        return kept[0]
+
+    user_key = derive_256_bit_salt_and_key(password=master_password, salt=salt)[1]
+
+    if verified:
+        _keep_user_key(user_id, master_password, salt, user_key)
+
+    return user_key
+
+
+def _keep_user_key(user_id: int, master_password: str, salt: bytes, user_key: bytes) -> None:
+    _user_keys[(user_id, salt)] = user_key, keyed_fingerprint(user_key, master_password)
+
+
+def _get_user_key_salt(cursor: Cursor, user_id: int) -> bytes:
+    """
+    Returns the user_keys salt of the User with the given id, creating it if they do not have one yet.
+    """
+    cursor.execute("INSERT OR IGNORE INTO user_keys VALUES (?, ?)", (user_id, os.urandom(16)))
+    cursor.execute("SELECT salt FROM user_keys WHERE user_id=?", (user_id,))
+
+    return cursor.fetchone()[0]
+
+
+def _get_fingerprint_key(cursor: Cursor, user_id: int, master_password: str) -> bytes:
+    """
+    Returns the password fingerprint key of the User with the given id, creating their user_keys salt if they do not
+    have one yet. The master password must already be verified.
+    """
+    salt = _get_user_key_salt(cursor, user_id)
+
+    return derive_subkey(_derive_user_key(user_id, master_password, salt), FINGERPRINT_KEY_PURPOSE)
+
+
+def _fingerprint_account_password(cursor: Cursor, account_id: int, user_id: int, password: str,
+                                  fingerprint_key: bytes) -> None:
+    """
+    Stores the fingerprint of the given Account password, replacing the previous one.
+    """
+    cursor.execute("INSERT OR REPLACE INTO account_fingerprints VALUES (?, ?, ?)",
+                   (account_id, user_id, keyed_fingerprint(fingerprint_key, password)))
+
+
+def _unlock_metadata_keys(cursor: Cursor, user_id: int, master_password: str) -> Optional[Tuple[bytes, bytes]]:
+    """
+    Derives and keeps the metadata keys of the User with the given id if their Account metadata is sealed. The master
+    password must already be verified.
+    :return: the metadata encryption and blind index keys, or None if the User's metadata is not sealed
+    """
+    cursor.execute("SELECT EXISTS (SELECT 1 FROM sealed_users WHERE user_id=?)", (user_id,))
+
+    if not cursor.fetchone()[0]:
+        return None
+
+    salt = _get_user_key_salt(cursor, user_id)
+    user_key = _derive_user_key(user_id, master_password, salt)
+
+    metadata_keys = derive_subkey(user_key, METADATA_KEY_PURPOSE), derive_subkey(user_key, BLIND_INDEX_KEY_PURPOSE)
+    _metadata_keys[salt] = metadata_keys
+
+    return metadata_keys
+
+
+def _get_metadata_keys(cursor: Cursor, user_id: int) -> Optional[Tuple[bytes, bytes]]:
+    """
+    Returns the metadata keys of the User with the given id, unlocked by _unlock_metadata_keys.
+    :return: the metadata encryption and blind index keys, or None if the User's metadata is not sealed
+    :raise SealedMetadataLockedError: if the User's metadata is sealed but was not unlocked in this process
+    """
+    cursor.execute("""SELECT user_keys.salt FROM sealed_users
+    LEFT JOIN user_keys ON user_keys.user_id = sealed_users.user_id
+    WHERE sealed_users.user_id=?""", (user_id,))
+
+    result = cursor.fetchone()
+
+    if result is None:
+        return None
+
+    metadata_keys = _metadata_keys.get(result[0])
+
+    if metadata_keys is None:
+        raise SealedMetadataLockedError(f'The Account metadata of the User with the given id ({user_id}) is sealed and '
+                                        f'their master password was not verified')
+
+    return metadata_keys
+
+
+def _blind_index(blind_index_key: bytes, kind: str, value: str) -> bytes:
+    return keyed_fingerprint(blind_index_key, f'{kind}:{value}')
+
+
+def _blind_account_name(blind_index_key: bytes, name: str) -> str:
+    """
+    Returns the placeholder stored as the name of a sealed Account, which is the same for names that only differ in
+    case, like the NOCASE collation of the plaintext names.
+    """
+    return _blind_index(blind_index_key, 'name', name.lower()).hex()
+
+
+def _stored_account_metadata(name: str, url: Optional[str], username: str,
+                             metadata_keys: Optional[Tuple[bytes, bytes]]) -> Dict[str, Optional[str]]:
+    """
+    Returns the name, url, and username to store in the accounts row of an Account: the given ones, or the placeholders
+    if the Account is sealed with the given metadata keys.
+    """
+    if metadata_keys is None:
+        return {'name': name, 'url': url, 'username': username}
+
+    return {'name': _blind_account_name(metadata_keys[1], name), 'url': None, 'username': ''}
+
+
+def _metadata_words(text: str) -> List[str]:
+    return regex_findall(r'[^\W_]+', text.lower())
+
+
+def _seal_account(cursor: Cursor, account_id: int, user_id: int, name: str, url: Optional[str], username: str,
+                  metadata_keys: Tuple[bytes, bytes]) -> None:
+    """
+    Stores the encrypted metadata of the given sealed Account, with its search tokens and its url index entry, replacing
+    the previous ones. The Account id is encrypted with the metadata, so that metadata moved to another row is refused.
+    """
+    metadata_key, blind_index_key = metadata_keys
+    normalized_url = normalize_url(url)
+
+    metadata, nonce, tag = encrypt_aes_256_gcm(metadata_key, json.dumps([account_id, name, url, username]))
+    cursor.execute("INSERT OR REPLACE INTO account_metadata VALUES (?, ?, ?, ?, ?)",
+                   (account_id, user_id, metadata, nonce, tag))
+
+    words = set(_metadata_words(f'{name} {username} {normalized_url[0] if normalized_url else ""}'))
+
+    cursor.execute("DELETE FROM account_metadata_tokens WHERE account_id=?", (account_id,))
+    cursor.executemany("INSERT INTO account_metadata_tokens VALUES (?, ?, ?)",
+                       [(account_id, user_id, _blind_index(blind_index_key, 'word', word)) for word in words])
+
+    if normalized_url is not None:
+        host, domain = normalized_url
+        cursor.execute("INSERT OR REPLACE INTO account_urls VALUES (?, ?, ?, ?)",
+                       (account_id, user_id, _blind_index(blind_index_key, 'host', host).hex(),
+                        _blind_index(blind_index_key, 'domain', domain).hex()))
+
+
+def _reveal_account_metadata(cursor: Cursor, user_id: int, account_ids: List[int])\
+        -> Dict[int, Tuple[str, Optional[str], str]]:
+    """
+    Returns the decrypted name, url, and username of the given Accounts of the User with the given id that are sealed.
+    :raise SealedMetadataLockedError: if the User's metadata is sealed but was not unlocked in this process
+    :raise ValueError: if the metadata of an Account does not decrypt
+    """
+    metadata_keys = _get_metadata_keys(cursor, user_id)
+
+    if metadata_keys is None:
+        return {}
+
+    revealed = {}
+
+    # Batched to stay under SQLite's limit on the number of parameters
+    for start in range(0, len(account_ids), 500):
+        batch = account_ids[start:start + 500]
+
+        cursor.execute(f"""SELECT account_id, metadata, nonce, tag FROM account_metadata
+        WHERE account_id IN ({', '.join('?' * len(batch))})""", batch)
+
+        for account_id, metadata, nonce, tag in cursor.fetchall():
+            try:
+                sealed_account_id, name, url, username = json.loads(
+                    decrypt_aes_256_gcm(key=metadata_keys[0], ciphertext=metadata, nonce=nonce, tag=tag))
+            except ValueError as e:
+                raise ValueError(f'An error occurred while decrypting the metadata of the Account with the given id '
+                                 f'({account_id}): {e}')
+
+            if sealed_account_id != account_id:
+                raise ValueError(f'The metadata of the Account with the given id ({account_id}) belongs to another '
+                                 f'Account')
+
+            revealed[account_id] = name, url, username
+
+    return revealed
+
+
+def _reveal_accounts(cursor: Cursor, user_id: int, accounts: List[Tuple[int, str, Optional[str], str]])\
+        -> List[Tuple[int, str, Optional[str], str]]:
+    """
+    Replaces the placeholders of the given (id, name, url, username) of the sealed Accounts with their metadata.
+    """
+    revealed = _reveal_account_metadata(cursor, user_id, [account[0] for account in accounts])
+
+    if not revealed:
+        return accounts
+
+    return [(account_id, *revealed.get(account_id, (name, url, username)))
+            for account_id, name, url, username in accounts]
+
+
+def _publish_key_pair(cursor: Cursor, user_id: int, master_password: str) -> bool:
+    """
+    Creates the key pair of the User with the given id if they do not have one yet, with their private key encrypted
+    under a subkey of their user key. The master password must already be verified.
+    :return: whether a key pair was created
+    """
+    cursor.execute("SELECT EXISTS (SELECT 1 FROM user_key_pairs WHERE user_id=?)", (user_id,))
+
+    if cursor.fetchone()[0]:
+        return False
+
+    private_key, public_key = generate_x25519_key_pair()
+    key = derive_subkey(_derive_user_key(user_id, master_password, _get_user_key_salt(cursor, user_id)),
+                        KEY_PAIR_KEY_PURPOSE)
+    encrypted_private_key, nonce, tag = encrypt_aes_256_gcm(key, private_key.hex())
+
+    cursor.execute("INSERT INTO user_key_pairs VALUES (?, ?, ?, ?, ?)",
+                   (user_id, public_key, encrypted_private_key, nonce, tag))
+
+    return True
+
+
+def _get_private_key(cursor: Cursor, user_id: int, master_password: str) -> bytes:
+    """
+    Returns the decrypted private key of the User with the given id.
+    :raise ValueError: if the User has no key pair or if a cryptography error occurs (e.g. if the master password is not
+    valid)
+    """
+    cursor.execute("""SELECT user_key_pairs.private_key, user_key_pairs.nonce, user_key_pairs.tag, user_keys.salt
+    FROM user_key_pairs JOIN user_keys ON user_keys.user_id = user_key_pairs.user_id
+    WHERE user_key_pairs.user_id=?""", (user_id,))
+
+    result = cursor.fetchone()
+
+    if result is None:
+        raise ValueError(f'The User with the given id ({user_id}) has no key pair')
+
+    encrypted_private_key, nonce, tag, salt = result
+    user_key = _derive_user_key(user_id, master_password, salt, verified=False)
+    key = derive_subkey(user_key, KEY_PAIR_KEY_PURPOSE)
+
+    try:
+        private_key = bytes.fromhex(decrypt_aes_256_gcm(key=key, ciphertext=encrypted_private_key, nonce=nonce,
+                                                        tag=tag))
+    except ValueError as e:
+        raise ValueError(f'An error occurred while decrypting the private key: {e}')
+
+    # The private key only decrypts with the right master password
+    _keep_user_key(user_id, master_password, salt, user_key)
+
+    return private_key
+
+
+def _get_public_keys(cursor: Cursor, user_ids: List[int]) -> Dict[int, bytes]:
+    """
+    Returns the public keys of the given Users.
+    :raise ValueError: if one of them has no key pair yet
+    """
+    public_keys = {}
+
+    for user_id in user_ids:
+        cursor.execute("SELECT public_key FROM user_key_pairs WHERE user_id=?", (user_id,))
+
+        result = cursor.fetchone()
+
+        if result is None:
+            raise ValueError(f'The User with the given id ({user_id}) has no key pair yet (it is created the next '
+                             f'time they log in)')
+
+        public_keys[user_id] = result[0]
+
+    return public_keys
+
+
+def _get_owned_item_key(cursor: Cursor, item_id: int, owner_id: int, master_password: str) -> bytes:
+    """
+    Returns the unwrapped key of the shared item with the given id, which the User with the given id must own.
+    :raise ValueError: if there is no such item owned by the User, or if a cryptography error occurs
+    """
+    cursor.execute("""SELECT shared_item_members.wrapped_key FROM shared_items
+    JOIN shared_item_members ON shared_item_members.item_id = shared_items.id
+    AND shared_item_members.user_id = shared_items.owner_id
+    WHERE shared_items.id=? AND shared_items.owner_id=?""", (item_id, owner_id))
+
+    result = cursor.fetchone()
+
+    if result is None:
+        raise ValueError(f'The User with the given id ({owner_id}) owns no shared item with the given id ({item_id})')
+
+    return unwrap_key(result[0], _get_private_key(cursor, owner_id, master_password))
+
+
+def _verify_master_password(user_id: int, master_password: str, connection: Connection) -> None:
+    """
+    :raise ValueError: if the given user_id is invalid or the master_password is an empty string
+    :raise argon2.exceptions.VerifyMismatchError: if the User's hashed_password is not valid for the given
+    master password
+    """
+    hashed_password = get_login_password_by_user_id(user_id, connection)
+
+    if not hashed_password:
+        raise ValueError(f'There is no User with the given user_id ({user_id})')
+
+    if not master_password:
+        raise ValueError('The given master_password was an empty string')
+
+    with timer('argon2.verify'):
+        PasswordHasher().verify(hash=hashed_password, password=master_password)
+
+
+def _refused_write_error(account_id: int, expected_version: Optional[int]) -> ValueError:
+    """
+    Returns the error of a conditional write of the Account with the given id that wrote nothing: without an expected
+    version, the Account was deleted in the meantime, else it was written (or deleted) after that version.
+    """
+    if expected_version is None:
+        return ValueError(f'There is no Account with the given id ({account_id})')
+
+    return AccountVersionConflictError(f'The Account with the given id ({account_id}) was changed after version '
+                                       f'{expected_version}')
+
+
+@instrumented()
 def edit_account(account_id: int, connection: Connection, master_password: Optional[str] = None,
                  name: Optional[str] = None, url: Optional[str] = None, username: Optional[str] = None,
-                 password: Optional[str] = None) -> None:
+                 password: Optional[str] = None, expected_version: Optional[int] = None) -> int:
     """
     Edits the Account in the database with the given id using the given Account name, url, username, and password.
     Each field is optional to allow only changing one aspect of the Account. However, if the password is passed, the
     master_password must also be passed for re-encryption purposes. The changes are only committed if there is not
-    an error.
+    an error. If an expected_version is passed, the Account is only edited if it was not written after that version
+    (see get_account_version), so that a concurrent change made by another process is not overwritten.
+    :param expected_version: the version of the Account the caller last read (or any later revision of the vault,
+    e.g. the one changes_since last returned), or None to edit the Account whatever its version
+    :return: the new version of the Account
     :raise ValueError: if the given account_id is invalid or if the password is passed without the master_password
     (or if raised by a called cryptographic function)
+    :raise AccountVersionConflictError: if the Account was written after the expected_version
+    :raise SealedMetadataLockedError: if the User's metadata is sealed but was not unlocked in this process
     :raise Sqlite3.IntegrityError: if the passed name is already in use for another Account
     :raise argon2.exceptions.HashingError: if hashing fails
     :raise argon2.exceptions.VerifyMismatchError: if the User's hashed_password is not valid for the given
@@ -138,59 +847,111 @@ def edit_account(account_id: int, connection: Connection, master_password: Optio
     """
     cursor = connection.cursor()
 
-    cursor.execute("SELECT EXISTS (SELECT 1 FROM accounts WHERE id=?)", (account_id,))
+    cursor.execute("SELECT user_id, name, url, username FROM accounts WHERE id=?", (account_id,))
 
-    account_exits = cursor.fetchone()[0]
+    account = cursor.fetchone()
 
-    if not account_exits:
+    if account is None:
         raise ValueError(f'There is no Account with the given id ({account_id})')
 
+    user_id = account[0]
+
     if password and not master_password:
         raise ValueError('The given master_password was an empty string or was not provided')
 
+    # Only the given fields are set, since the url index and fingerprint triggers fire on any update of their column
+    assignments = {}
+
     if name:
-        try:
-            cursor.execute("UPDATE accounts SET name=:name WHERE id=:account_id", {'name': name,
-                                                                                   'account_id': account_id})
-        except sqlite3.IntegrityError as e:
-            raise sqlite3.IntegrityError(f'The name could not be updated because this Account name is already '
-                                         f'being used for this user: {e}')
+        assignments['name'] = name
 
     if url:
-        cursor.execute("UPDATE accounts SET url=:url WHERE id=:account_id", {'url': url,
-                                                                             'account_id': account_id})
+        assignments['url'] = url
 
     if username:
-        cursor.execute("UPDATE accounts SET username=:username WHERE id=:account_id",
-                       {'username': username, 'account_id': account_id})
+        assignments['username'] = username
+
+    metadata_keys = _get_metadata_keys(cursor, user_id) if assignments else None
+    sealed_metadata = None
+
+    # The metadata of a sealed Account is encrypted as one value, so it is rewritten whole
+    if metadata_keys:
+        current_name, current_url, current_username = _reveal_account_metadata(cursor, user_id, [account_id])\
+            .get(account_id, account[1:])
+        sealed_metadata = name or current_name, url or current_url, username or current_username
+        assignments.update(_stored_account_metadata(*sealed_metadata, metadata_keys))
 
     if password and master_password:
         ph = PasswordHasher()
 
-        cursor.execute("SELECT user_id FROM accounts WHERE id=?", (account_id,))
-        user_id = cursor.fetchone()[0]
-
         hashed_password = get_login_password_by_user_id(user_id, connection)
 
-        ph.verify(hash=hashed_password, password=master_password)
+        with timer('argon2.verify'):
+            ph.verify(hash=hashed_password, password=master_password)
 
         salt, key = derive_256_bit_salt_and_key(master_password)
         encrypted_password, nonce, tag = encrypt_aes_256_gcm(key, password)
 
-        cursor.execute("""UPDATE accounts SET password=:password, salt=:salt, nonce=:nonce, tag=:tag WHERE
-        id=:account_id""", {'password': encrypted_password, 'salt': salt, 'nonce': nonce, 'tag': tag,
-                            'account_id': account_id})
+        assignments.update({'password': encrypted_password, 'salt': salt, 'nonce': nonce, 'tag': tag})
+
+    if not assignments:
+        cursor.close()
+        version = get_account_version(account_id, connection)
+
+        if version is None:
+            raise _refused_write_error(account_id, None)
+
+        # Nothing is written, but a caller expecting an older version still has to learn of the newer one
+        if expected_version is not None and version > expected_version:
+            raise _refused_write_error(account_id, expected_version)
+
+        return version
+
+    # One conditional statement, so that the version check and the write cannot be interleaved with another writer
+    try:
+        cursor.execute(f"""UPDATE accounts SET {', '.join(f'{column}=:{column}' for column in assignments)}
+        WHERE id=:account_id AND (:expected_version IS NULL OR
+        (SELECT MAX(revision) FROM account_changes WHERE account_id=:account_id) <= :expected_version)""",
+                       {**assignments, 'account_id': account_id, 'expected_version': expected_version})
+    except sqlite3.IntegrityError as e:
+        connection.rollback()
+        cursor.close()
+        raise sqlite3.IntegrityError(f'The name could not be updated because this Account name is already '
+                                     f'being used for this user: {e}')
+
+    if cursor.rowcount == 0:
+        connection.rollback()
+        cursor.close()
+        raise _refused_write_error(account_id, expected_version)
+
+    if sealed_metadata:
+        _seal_account(cursor, account_id, user_id, *sealed_metadata, metadata_keys)
+    elif url:
+        _index_account_url(cursor, account_id, user_id, url)
+
+    if password and master_password:
+        _fingerprint_account_password(cursor, account_id, user_id, password,
+                                      _get_fingerprint_key(cursor, user_id, master_password))
+
+    version = get_account_version(account_id, connection)
 
     connection.commit()
     cursor.close()
 
+    return version
 
-def delete_account(account_id: int, connection: Connection) -> None:
+
+@instrumented()
+def delete_account(account_id: int, connection: Connection, expected_version: Optional[int] = None) -> None:
     """
-    Removes the Account with the given id from the database.
+    Removes the Account with the given id from the database. If an expected_version is passed, the Account is only
+    removed if it was not written after that version (see edit_account).
     :param account_id: the id for the Account to be removed
     :param connection: the database connection to use
+    :param expected_version: the version of the Account the caller last read (or any later revision of the vault), or
+    None to remove the Account whatever its version
     :raise ValueError: if the given account_id is invalid
+    :raise AccountVersionConflictError: if the Account was written after the expected_version
     """
     cursor = connection.cursor()
 
@@ -201,13 +962,42 @@ def delete_account(account_id: int, connection: Connection) -> None:
     if not account_exits:
         raise ValueError(f'There is no Account with the given id ({account_id})')
 
-    cursor.execute("DELETE FROM accounts WHERE id=?", (account_id,))
+    cursor.execute("""DELETE FROM accounts WHERE id=:account_id AND (:expected_version IS NULL OR
+    (SELECT MAX(revision) FROM account_changes WHERE account_id=:account_id) <= :expected_version)""",
+                   {'account_id': account_id, 'expected_version': expected_version})
+
+    if cursor.rowcount == 0:
+        connection.rollback()
+        cursor.close()
+        raise _refused_write_error(account_id, expected_version)
 
     connection.commit()
 
     cursor.close()
 
 
+@instrumented()
+def get_account_version(account_id: int, connection: Connection) -> Optional[int]:
+    """
+    Returns the version of the Account with the given id: the revision of its latest write in the change journal,
+    which increases every time the Account is written, by any process.
+    :param account_id: the id of the Account
+    :param connection: the database connection to use
+    :return: the version of the Account, or None if there is no Account with the given id
+    """
+    cursor = connection.cursor()
+
+    cursor.execute("""SELECT MAX(account_changes.revision) FROM accounts
+    JOIN account_changes ON account_changes.account_id = accounts.id WHERE accounts.id=?""", (account_id,))
+
+    version = cursor.fetchone()[0]
+
+    cursor.close()
+
+    return version
+
+
+@instrumented()
 def get_user_id_by_email(email: str, connection: Connection) -> Optional[int]:
     """
     Returns the corresponding user_id if a User with the given email exists, else None.
@@ -226,6 +1016,7 @@ def get_user_id_by_email(email: str, connection: Connection) -> Optional[int]:
     return user_id
 
 
+@instrumented()
 def get_login_password_by_user_id(user_id: int, connection: Connection) -> Optional[str]:
     """
     Returns the hashed login password for a User if the User with the given id exists, else None.
@@ -246,6 +1037,7 @@ def get_login_password_by_user_id(user_id: int, connection: Connection) -> Optio
     return password
 
 
+@instrumented()
 def get_account_id_by_account_name_and_user_id(account_name: str, user_id: int, connection: Connection)\
         -> Optional[int]:
     """
@@ -254,6 +1046,7 @@ def get_account_id_by_account_name_and_user_id(account_name: str, user_id: int,
     :param user_id: the id of the associated User
     :param connection: the database connection to use
     :return: the id of the corresponding Account if it exists, else None
+    :raise SealedMetadataLockedError: if the User's metadata is sealed but was not unlocked in this process
     """
     cursor = connection.cursor()
 
@@ -262,11 +1055,21 @@ def get_account_id_by_account_name_and_user_id(account_name: str, user_id: int,
 
     result = cursor.fetchone()
 
+    # The name of a sealed Account is looked up by its blind index, only once the plaintext name is not found
+    metadata_keys = _get_metadata_keys(cursor, user_id) if result is None and account_name else None
+
+    if metadata_keys:
+        cursor.execute("SELECT id FROM accounts WHERE name=:name AND user_id=:user_id",
+                       {'name': _blind_account_name(metadata_keys[1], account_name), 'user_id': user_id})
+
+        result = cursor.fetchone()
+
     account_id = result[0] if result else None
 
     return account_id
 
 
+@instrumented()
 def get_account_name_url_and_username_by_account_id(account_id: int, connection: Connection)\
         -> Optional[Tuple[str, Optional[str], str]]:
     """
@@ -274,34 +1077,53 @@ def get_account_name_url_and_username_by_account_id(account_id: int, connection:
     :param account_id: the id of the Account to be queried
     :param connection: the database connection to use
     :return: the name and username of the Account with the given id if the Account exists, else None
+    :raise SealedMetadataLockedError: if the User's metadata is sealed but was not unlocked in this process
     """
     cursor = connection.cursor()
 
-    cursor.execute("SELECT name, url, username FROM accounts WHERE id=?", (account_id, ))
+    cursor.execute("SELECT user_id, name, url, username FROM accounts WHERE id=?", (account_id, ))
 
     result = cursor.fetchone()
 
-    user_account_name_url_and_username = result if result else None
+    user_account_name_url_and_username = _reveal_account_metadata(cursor, result[0], [account_id])\
+        .get(account_id, result[1:]) if result else None
 
     cursor.close()
 
     return user_account_name_url_and_username
 
 
+@instrumented()
 def get_all_account_names_urls_and_usernames_by_user_id(user_id: int, connection: Connection)\
         -> Optional[List[Tuple[str, Optional[str], str]]]:
     """
-    Returns the name, url, and username of all Accounts for the User with the given id if they have Accounts, else None.
+    Returns the name, url, and username of all Accounts for the User with the given id, followed by the items shared
+    with them (see get_shared_items_by_user_id), if they have any, else None. Unlike
+    get_all_account_ids_names_urls_and_usernames_by_user_id, this is what the User sees of their vault (e.g. the list
+    command and the agent), and each name can be looked up in turn: a shared item never has the name of one of the
+    member's Accounts or of another shared item when it is shared (see create_shared_item), and an Account created later
+    with its name takes precedence over it.
     :param user_id: the id of the associated user
     :param connection: the database connection to use
-    :return: all name and username of all Accounts for the User with the given id if they have Accounts, else None
+    :return: the name, url, and username of the Accounts and shared items of the User with the given id if they have
+    any, else None
+    :raise SealedMetadataLockedError: if the User's metadata is sealed but was not unlocked in this process
     """
     cursor = connection.cursor()
 
-    cursor.execute("SELECT name, url, username FROM accounts WHERE user_id=?", (user_id,))
+    cursor.execute("SELECT id, name, url, username FROM accounts WHERE user_id=?", (user_id,))
 
     result = cursor.fetchall()
 
+    accounts = [account[1:] for account in _reveal_accounts(cursor, user_id, result)]
+
+    cursor.execute("""SELECT shared_items.name, shared_items.url, shared_items.username FROM shared_item_members
+    JOIN shared_items ON shared_items.id = shared_item_members.item_id
+    WHERE shared_item_members.user_id=?
+    ORDER BY shared_items.name""", (user_id,))
+
+    result = accounts + cursor.fetchall()
+
     user_account_names_urls_and_usernames = result if result else None
 
     cursor.close()
@@ -309,22 +1131,50 @@ def get_all_account_names_urls_and_usernames_by_user_id(user_id: int, connection
     return user_account_names_urls_and_usernames
 
 
-def get_decrypted_account_password(account_id: int, master_password: str, connection: Connection) -> str:
+@instrumented()
+def get_all_account_ids_names_urls_and_usernames_by_user_id(user_id: int, connection: Connection)\
+        -> Optional[List[Tuple[int, str, Optional[str], str]]]:
     """
-    Returns the decrypted account password for an Account given the Account id and the User's master password.
-    :param account_id: the id of the Account to decrypt the password for
-    :param master_password: the User's master password
+    Returns the id, name, url, and username of all Accounts for the User with the given id if they have Accounts, else
+    None. Lets callers that go on to act on each Account avoid looking up every id by name. Only the User's own
+    Accounts are returned, without the items shared with them (which have no Account id and cannot be edited by
+    members), unlike get_all_account_names_urls_and_usernames_by_user_id; this is what the exports and the GUI list.
+    :param user_id: the id of the associated user
     :param connection: the database connection to use
-    :return: the decrypted Account password
-    :raise ValueError: if there is no Account with the given id or if a cryptography error occurs
+    :return: the id, name, url, and username of all Accounts for the User with the given id if they have Accounts, else
+    None
+    :raise SealedMetadataLockedError: if the User's metadata is sealed but was not unlocked in this process
     """
     cursor = connection.cursor()
 
-    cursor.execute("SELECT password, salt, nonce, tag FROM accounts WHERE id=?", (account_id,))
+    cursor.execute("SELECT id, name, url, username FROM accounts WHERE user_id=? ORDER BY id", (user_id,))
 
-    result = cursor.fetchone()
+    result = cursor.fetchall()
 
-    if not result:
+    user_account_ids_names_urls_and_usernames = _reveal_accounts(cursor, user_id, result) if result else None
+
+    cursor.close()
+
+    return user_account_ids_names_urls_and_usernames
+
+
+@instrumented()
+def get_decrypted_account_password(account_id: int, master_password: str, connection: Connection) -> str:
+    """
+    Returns the decrypted account password for an Account given the Account id and the User's master password.
+    :param account_id: the id of the Account to decrypt the password for
+    :param master_password: the User's master password
+    :param connection: the database connection to use
+    :return: the decrypted Account password
+    :raise ValueError: if there is no Account with the given id or if a cryptography error occurs
+    """
+    cursor = connection.cursor()
+
+    cursor.execute("SELECT password, salt, nonce, tag FROM accounts WHERE id=?", (account_id,))
+
+    result = cursor.fetchone()
+
+    if not result:
         raise ValueError(f'There is no account with the given id ({account_id})')
 
     password, salt, nonce, tag = result
@@ -344,6 +1194,48 @@ def get_decrypted_account_password(account_id: int, master_password: str, connec
     return plaintext
 
 
+@instrumented()
+def get_encrypted_account_password(account_id: int, connection: Connection)\
+        -> Optional[Tuple[bytes, bytes, bytes, bytes]]:
+    """
+    Returns the encrypted password of the Account with the given id, along with the salt of the key it was encrypted
+    with and its nonce and tag, if the Account exists, else None. Lets callers that cache the derived keys by salt
+    decrypt without running Argon2 again.
+    :param account_id: the id of the Account
+    :param connection: the database connection to use
+    :return: the ciphertext, salt, nonce, and tag of the Account password if the Account exists, else None
+    """
+    cursor = connection.cursor()
+
+    cursor.execute("SELECT password, salt, nonce, tag FROM accounts WHERE id=?", (account_id,))
+
+    result = cursor.fetchone()
+
+    cursor.close()
+
+    return result
+
+
+@instrumented()
+def get_all_account_salts_by_user_id(user_id: int, connection: Connection) -> List[bytes]:
+    """
+    Returns the distinct salts of the keys the Account passwords of the User with the given id are encrypted with.
+    :param user_id: the id of the User
+    :param connection: the database connection to use
+    :return: the distinct salts (an empty list if the User has no Accounts)
+    """
+    cursor = connection.cursor()
+
+    cursor.execute("SELECT DISTINCT salt FROM accounts WHERE user_id=?", (user_id,))
+
+    salts = [row[0] for row in cursor.fetchall()]
+
+    cursor.close()
+
+    return salts
+
+
+@instrumented()
 def get_all_decrypted_account_passwords_by_user_id(user_id: int, master_password: str, connection: Connection)\
         -> Optional[Dict[int, str]]:
     """
@@ -395,11 +1287,948 @@ def get_all_decrypted_account_passwords_by_user_id(user_id: int, master_password
     return decrypted_account_passwords
 
 
+@instrumented()
+def index_account_urls(connection: Connection, user_id: Optional[int] = None) -> int:
+    """
+    Adds the Accounts with a url that are missing from the url index (e.g. created before it existed or inserted
+    without create_account) to it.
+    :param connection: the database connection to use
+    :param user_id: the id of the User whose Accounts are indexed (all Users if not provided)
+    :return: the number of Accounts added to the index
+    """
+    cursor = connection.cursor()
+
+    cursor.execute("""SELECT accounts.id, accounts.user_id, accounts.url FROM accounts
+    LEFT JOIN account_urls ON account_urls.account_id = accounts.id
+    WHERE accounts.url IS NOT NULL AND account_urls.account_id IS NULL
+    AND (:user_id IS NULL OR accounts.user_id=:user_id)""", {'user_id': user_id})
+
+    entries = []
+
+    for account_id, account_user_id, url in cursor.fetchall():
+        normalized_url = normalize_url(url)
+
+        if normalized_url is not None:
+            entries.append((account_id, account_user_id, *normalized_url))
+
+    cursor.executemany("INSERT INTO account_urls VALUES (?, ?, ?, ?)", entries)
+
+    connection.commit()
+    cursor.close()
+
+    return len(entries)
+
+
+@instrumented()
+def find_accounts_for_url(user_id: int, url: str, connection: Connection)\
+        -> List[Tuple[int, str, Optional[str], str]]:
+    """
+    Returns the id, name, url, and username of the Accounts of the User with the given id whose url has the same
+    registrable domain as the given url (e.g. https://login.example.com/path matches example.com and
+    www.example.com). The Accounts on the exact same host come first, then the others by name. Uses the url index, so
+    it does not scan the User's Accounts.
+    :param user_id: the id of the User
+    :param url: the url to find the Accounts for, with or without a scheme
+    :param connection: the database connection to use
+    :return: the matching Accounts (an empty list if there are none or if the url has no valid host)
+    :raise SealedMetadataLockedError: if the User's metadata is sealed but was not unlocked in this process
+    """
+    normalized_url = normalize_url(url)
+
+    if normalized_url is None:
+        return []
+
+    host, domain = normalized_url
+
+    cursor = connection.cursor()
+
+    metadata_keys = _get_metadata_keys(cursor, user_id)
+
+    # The url index of a sealed User holds the blind indexes of the hosts and domains
+    if metadata_keys:
+        host = _blind_index(metadata_keys[1], 'host', host).hex()
+        domain = _blind_index(metadata_keys[1], 'domain', domain).hex()
+
+    cursor.execute("""SELECT accounts.id, accounts.name, accounts.url, accounts.username,
+    account_urls.host != :host AS other_host FROM account_urls
+    JOIN accounts ON accounts.id = account_urls.account_id
+    WHERE account_urls.user_id=:user_id AND account_urls.domain=:domain
+    ORDER BY other_host, accounts.name""", {'user_id': user_id, 'domain': domain, 'host': host})
+
+    other_hosts = {}
+    accounts = []
+
+    for account_id, name, account_url, username, other_host in cursor.fetchall():
+        other_hosts[account_id] = other_host
+        accounts.append((account_id, name, account_url, username))
+
+    # The placeholder names of sealed Accounts are meaningless, so they are sorted by their revealed names
+    if metadata_keys:
+        accounts = sorted(_reveal_accounts(cursor, user_id, accounts),
+                          key=lambda account: (other_hosts[account[0]], account[1].lower()))
+
+    cursor.close()
+
+    return accounts
+
+
+@instrumented()
+def fingerprint_account_passwords(user_id: int, master_password: str, connection: Connection) -> int:
+    """
+    Adds the missing password fingerprints of the Accounts of the User with the given id (e.g. Accounts created before
+    fingerprints existed or inserted without create_account). Only those Accounts are decrypted, and Accounts sharing a
+    salt share one Argon2 run.
+    :param user_id: the id of the User
+    :param master_password: the User's master password
+    :param connection: the database connection to use
+    :return: the number of fingerprints added
+    :raise ValueError: if a cryptography error occurs (e.g. if the master password is not valid)
+    :raise argon2.exceptions.HashingError: if an error occurs during hashing
+    """
+    cursor = connection.cursor()
+
+    cursor.execute("""SELECT accounts.id, accounts.password, accounts.salt, accounts.nonce, accounts.tag FROM accounts
+    LEFT JOIN account_fingerprints ON account_fingerprints.account_id = accounts.id
+    WHERE accounts.user_id=? AND account_fingerprints.account_id IS NULL""", (user_id,))
+
+    missing_accounts = cursor.fetchall()
+
+    if not missing_accounts:
+        cursor.close()
+        return 0
+
+    keys = {}
+    plaintext_account_passwords = {}
+
+    for account_id, password, salt, nonce, tag in missing_accounts:
+        if salt not in keys:
+            keys[salt] = derive_256_bit_salt_and_key(password=master_password, salt=salt)[1]
+
+        try:
+            plaintext_account_passwords[account_id] = decrypt_aes_256_gcm(key=keys[salt], ciphertext=password,
+                                                                          nonce=nonce, tag=tag)
+        except ValueError as e:
+            raise ValueError(f'An error occurred while decrypting the password: {e}')
+
+    fingerprint_key = _get_fingerprint_key(cursor, user_id, master_password)
+
+    for account_id, account_password in plaintext_account_passwords.items():
+        _fingerprint_account_password(cursor, account_id, user_id, account_password, fingerprint_key)
+
+    connection.commit()
+    cursor.close()
+
+    return len(plaintext_account_passwords)
+
+
+@instrumented()
+def get_reused_account_passwords_by_user_id(user_id: int, connection: Connection) -> List[List[Tuple[int, str]]]:
+    """
+    Returns the groups of Accounts of the User with the given id that share the same password, as found by their
+    password fingerprints, without decrypting anything. Accounts without a fingerprint are not included (see
+    fingerprint_account_passwords).
+    :param user_id: the id of the User
+    :param connection: the database connection to use
+    :return: the (id, name) of the Accounts of each group, ordered by name, with the largest groups first (then by the
+    first name)
+    :raise SealedMetadataLockedError: if the User's metadata is sealed but was not unlocked in this process
+    """
+    cursor = connection.cursor()
+
+    cursor.execute("""SELECT reused.fingerprint, accounts.id, accounts.name FROM (
+    SELECT fingerprint FROM account_fingerprints WHERE user_id=:user_id
+    GROUP BY fingerprint HAVING COUNT(*) > 1) AS reused
+    JOIN account_fingerprints ON account_fingerprints.user_id=:user_id
+    AND account_fingerprints.fingerprint = reused.fingerprint
+    JOIN accounts ON accounts.id = account_fingerprints.account_id
+    ORDER BY accounts.name""", {'user_id': user_id})
+
+    rows = cursor.fetchall()
+    revealed = _reveal_account_metadata(cursor, user_id, [account_id for _, account_id, _ in rows])
+    groups = {}
+
+    for fingerprint, account_id, name in rows:
+        groups.setdefault(fingerprint, []).append((account_id, revealed[account_id][0] if account_id in revealed
+                                                   else name))
+
+    cursor.close()
+
+    if revealed:
+        for group in groups.values():
+            group.sort(key=lambda account: account[1].lower())
+
+    return sorted(groups.values(), key=lambda group: (-len(group), group[0][1].lower()))
+
+
+@instrumented()
+def seal_account_metadata(user_id: int, master_password: str, connection: Connection) -> int:
+    """
+    Seals the Account metadata of the User with the given id: encrypts the name, url, and username of each of their
+    Accounts and stores blind indexes in their place, after which their Accounts are created and edited sealed. Sealing
+    a sealed User seals the Accounts that are not (e.g. inserted without create_account).
+    :param user_id: the id of the User
+    :param master_password: the User's master password
+    :param connection: the database connection to use
+    :return: the number of Accounts sealed
+    :raise ValueError: if the given user_id is invalid or the master_password is an empty string (or if raised by a
+    called cryptographic function)
+    :raise Sqlite3.IntegrityError: if two Account names only differ in the case of non-ASCII letters, which the blind
+    indexes cannot tell apart
+    :raise argon2.exceptions.VerifyMismatchError: if the User's hashed_password is not valid for the given
+    master password
+    :raise argon2.exceptions.InvalidHashError: if hash is invalid
+    :raise argon2.exceptions.VerificationError: if there was a miscellaneous verification error (if the argon
+    verification raised VerificationError as opposed to VerifyMismatchError or InvalidHashError)
+    """
+    hashed_password = get_login_password_by_user_id(user_id, connection)
+
+    if not hashed_password:
+        raise ValueError(f'There is no User with the given user_id ({user_id})')
+
+    if not master_password:
+        raise ValueError('The given master_password was an empty string')
+
+    with timer('argon2.verify'):
+        PasswordHasher().verify(hash=hashed_password, password=master_password)
+
+    cursor = connection.cursor()
+
+    cursor.execute("INSERT OR IGNORE INTO sealed_users VALUES (?)", (user_id,))
+    metadata_keys = _unlock_metadata_keys(cursor, user_id, master_password)
+
+    cursor.execute("""SELECT accounts.id, accounts.name, accounts.url, accounts.username FROM accounts
+    LEFT JOIN account_metadata ON account_metadata.account_id = accounts.id
+    WHERE accounts.user_id=? AND account_metadata.account_id IS NULL""", (user_id,))
+
+    unsealed_accounts = cursor.fetchall()
+
+    try:
+        for account_id, name, url, username in unsealed_accounts:
+            cursor.execute("UPDATE accounts SET name=:name, url=:url, username=:username WHERE id=:account_id",
+                           {**_stored_account_metadata(name, url, username, metadata_keys), 'account_id': account_id})
+            _seal_account(cursor, account_id, user_id, name, url, username, metadata_keys)
+    except sqlite3.IntegrityError as e:
+        connection.rollback()
+        cursor.close()
+        raise sqlite3.IntegrityError(f'The Account metadata could not be sealed because two Account names only differ '
+                                     f'in case: {e}')
+
+    connection.commit()
+    cursor.close()
+
+    return len(unsealed_accounts)
+
+
+@instrumented()
+def is_account_metadata_sealed(user_id: int, connection: Connection) -> bool:
+    """
+    Returns whether the Account metadata of the User with the given id is sealed (see seal_account_metadata).
+    """
+    cursor = connection.cursor()
+
+    cursor.execute("SELECT EXISTS (SELECT 1 FROM sealed_users WHERE user_id=?)", (user_id,))
+
+    is_sealed = bool(cursor.fetchone()[0])
+
+    cursor.close()
+
+    return is_sealed
+
+
+@instrumented()
+def reveal_sealed_account_metadata(user_id: int, account_ids: List[int], connection: Connection)\
+        -> Dict[int, Tuple[str, Optional[str], str]]:
+    """
+    Returns the name, url, and username of the given Accounts of the User with the given id that are sealed, for the
+    callers that read the accounts table themselves (the others are revealed by the read functions).
+    :param user_id: the id of the User
+    :param account_ids: the ids of the Accounts
+    :param connection: the database connection to use
+    :return: the name, url, and username by Account id (empty if the User's metadata is not sealed)
+    :raise SealedMetadataLockedError: if the User's metadata is sealed but was not unlocked in this process
+    :raise ValueError: if the metadata of an Account does not decrypt
+    """
+    cursor = connection.cursor()
+
+    try:
+        return _reveal_account_metadata(cursor, user_id, account_ids)
+    finally:
+        cursor.close()
+
+
+@instrumented()
+def search_accounts(user_id: int, query: str, connection: Connection) -> List[Tuple[int, str, Optional[str], str]]:
+    """
+    Returns the id, name, url, and username of the Accounts of the User with the given id that match the given query,
+    in id order. An Account matches if its name, url, or username contains the query (ignoring case), or, if the User's
+    metadata is sealed, if every word of the query is a word of its name, username, or url host, which is looked up in
+    the blind index so that only the matching Accounts are decrypted (a query without words matches every Account).
+    :param user_id: the id of the User
+    :param query: the text to search for
+    :param connection: the database connection to use
+    :return: the matching Accounts
+    :raise SealedMetadataLockedError: if the User's metadata is sealed but was not unlocked in this process
+    """
+    cursor = connection.cursor()
+
+    metadata_keys = _get_metadata_keys(cursor, user_id)
+
+    if metadata_keys is None:
+        cursor.execute("SELECT id, name, url, username FROM accounts WHERE user_id=? ORDER BY id", (user_id,))
+
+        query = query.lower()
+        accounts = [account for account in cursor.fetchall()
+                    if any(query in field.lower() for field in account[1:] if field is not None)]
+
+        cursor.close()
+
+        return accounts
+
+    tokens = [_blind_index(metadata_keys[1], 'word', word) for word in set(_metadata_words(query))]
+
+    if tokens:
+        cursor.execute(f"""SELECT id, name, url, username FROM accounts WHERE id IN (
+        SELECT account_id FROM account_metadata_tokens WHERE user_id=? AND token IN ({', '.join('?' * len(tokens))})
+        GROUP BY account_id HAVING COUNT(*) = ?) ORDER BY id""", (user_id, *tokens, len(tokens)))
+    else:
+        cursor.execute("SELECT id, name, url, username FROM accounts WHERE user_id=? ORDER BY id", (user_id,))
+
+    accounts = _reveal_accounts(cursor, user_id, cursor.fetchall())
+
+    cursor.close()
+
+    return accounts
+
+
+def _check_shared_item_name_is_free(name: str, owner_id: int, user_ids: List[int], connection: Connection) -> None:
+    """
+    Checks that none of the Users with the given ids (the members of an item of the given owner) has an Account or an
+    item shared by another owner with the given name, and that none of them has sealed Account names.
+    :raise ValueError: if the name is taken for one of the Users, or one of them has sealed Account names
+    """
+    for user_id in user_ids:
+        if is_account_metadata_sealed(user_id, connection):
+            raise ValueError(f'The Account metadata of the User with the given id ({user_id}) is sealed, so a shared '
+                             f'item could have the name of one of their Accounts')
+
+    cursor = connection.cursor()
+    placeholders = ', '.join('?' * len(user_ids))
+
+    # The items of the owner are left to UNIQUE(name, owner_id)
+    cursor.execute(f"""SELECT user_id FROM accounts WHERE name=? AND user_id IN ({placeholders})
+    UNION SELECT shared_item_members.user_id FROM shared_item_members
+    JOIN shared_items ON shared_items.id = shared_item_members.item_id
+    WHERE shared_items.name=? AND shared_items.owner_id != ? AND shared_item_members.user_id IN ({placeholders})
+    LIMIT 1""", [name, *user_ids, name, owner_id, *user_ids])
+
+    result = cursor.fetchone()
+
+    cursor.close()
+
+    if result:
+        raise ValueError(f'The User with the given id ({result[0]}) already has an Account or a shared item with the '
+                         f'given name ({name})')
+
+
+@instrumented()
+def create_shared_item(owner_id: int, master_password: str, name: str, url: Optional[str], username: str,
+                       password: str, member_ids: List[int], connection: Connection) -> int:
+    """
+    Creates an item shared by the User with the given owner_id with the Users with the given member_ids: its password
+    is encrypted once, under a new item key, which is wrapped for the owner and each member.
+    :param owner_id: the id of the User who shares the item (who becomes its first member)
+    :param member_ids: the ids of the Users to share the item with, who must have a key pair (see is_valid_login)
+    :return: the id of the created shared item
+    :raise ValueError: if the given owner_id is invalid, the name, username, master_password, or password are empty
+    strings, the owner's Account metadata is sealed, a member has no key pair, sealed Account metadata, or an Account
+    or another owner's shared item with the given name (or if raised by a called cryptographic function)
+    :raise Sqlite3.IntegrityError: if the owner already shares an item with the given name
+    :raise argon2.exceptions.VerifyMismatchError: if the owner's hashed_password is not valid for the given
+    master password
+    """
+    if not name:
+        raise ValueError('The given name was an empty string')
+
+    if not username:
+        raise ValueError('The given username was an empty string')
+
+    if not password:
+        raise ValueError('The given password was an empty string')
+
+    # The metadata of a shared item is not sealed, so sharing would reveal what the owner sealed
+    if is_account_metadata_sealed(owner_id, connection):
+        raise ValueError(f'The Account metadata of the User with the given id ({owner_id}) is sealed, and shared items '
+                         f'would store it in plaintext')
+
+    _verify_master_password(owner_id, master_password, connection)
+
+    user_ids = list(dict.fromkeys([owner_id, *member_ids]))
+
+    _check_shared_item_name_is_free(name, owner_id, user_ids, connection)
+
+    cursor = connection.cursor()
+
+    _publish_key_pair(cursor, owner_id, master_password)
+    public_keys = _get_public_keys(cursor, user_ids)
+
+    item_key = os.urandom(32)
+    encrypted_password, nonce, tag = encrypt_aes_256_gcm(item_key, password)
+
+    try:
+        cursor.execute("""INSERT INTO shared_items VALUES (:id, :owner_id, :name, :url, :username, :password, :nonce,
+        :tag) RETURNING id""", {'id': None, 'owner_id': owner_id, 'name': name, 'url': url, 'username': username,
+                                'password': encrypted_password, 'nonce': nonce, 'tag': tag})
+    except sqlite3.IntegrityError as e:
+        connection.rollback()
+        cursor.close()
+        raise sqlite3.IntegrityError(f'The shared item could not be created because this name is already being used '
+                                     f'for an item shared by this user: {e}')
+
+    item_id = cursor.fetchone()[0]
+
+    cursor.executemany("INSERT INTO shared_item_members VALUES (?, ?, ?)",
+                       [(item_id, user_id, wrap_key(item_key, public_key)) for user_id, public_key in public_keys.items()])
+
+    connection.commit()
+    cursor.close()
+
+    return item_id
+
+
+@instrumented()
+def add_shared_item_member(item_id: int, owner_id: int, master_password: str, member_id: int,
+                           connection: Connection) -> None:
+    """
+    Shares the shared item with the given id with one more User, by unwrapping its key with the owner's private key and
+    wrapping it for the new member, without re-encrypting the item. Adding a member again does nothing.
+    :param item_id: the id of the shared item
+    :param owner_id: the id of the User who owns the item
+    :param master_password: the owner's master password
+    :param member_id: the id of the User to share the item with, who must have a key pair
+    :raise ValueError: if the owner does not own the item, or the member has no key pair, sealed Account metadata, or
+    an Account or another owner's shared item with the item's name (or if raised by a called cryptographic function)
+    :raise argon2.exceptions.VerifyMismatchError: if the owner's hashed_password is not valid for the given
+    master password
+    """
+    _verify_master_password(owner_id, master_password, connection)
+
+    cursor = connection.cursor()
+
+    cursor.execute("SELECT name FROM shared_items WHERE id=? AND owner_id=?", (item_id, owner_id))
+
+    result = cursor.fetchone()
+
+    if result is not None:
+        _check_shared_item_name_is_free(result[0], owner_id, [member_id], connection)
+
+    public_key = _get_public_keys(cursor, [member_id])[member_id]
+
+    cursor.execute("INSERT OR IGNORE INTO shared_item_members VALUES (?, ?, ?)",
+                   (item_id, member_id, wrap_key(_get_owned_item_key(cursor, item_id, owner_id, master_password),
+                                                 public_key)))
+
+    connection.commit()
+    cursor.close()
+
+
+@instrumented()
+def remove_shared_item_member(item_id: int, owner_id: int, member_id: int, connection: Connection) -> None:
+    """
+    Stops sharing the shared item with the given id with a member, by deleting their wrapped item key. The item is not
+    re-encrypted, so a member who kept the key or the password keeps them.
+    :param item_id: the id of the shared item
+    :param owner_id: the id of the User who owns the item
+    :param member_id: the id of the member to remove (not the owner, who deletes the item instead)
+    :raise ValueError: if the owner does not own the item, the member is the owner, or the User is not a member
+    """
+    if member_id == owner_id:
+        raise ValueError('The owner of a shared item cannot be removed from it')
+
+    cursor = connection.cursor()
+
+    cursor.execute("""DELETE FROM shared_item_members WHERE item_id=:item_id AND user_id=:member_id
+    AND EXISTS (SELECT 1 FROM shared_items WHERE id=:item_id AND owner_id=:owner_id)""",
+                   {'item_id': item_id, 'member_id': member_id, 'owner_id': owner_id})
+
+    removed = cursor.rowcount
+
+    connection.commit()
+    cursor.close()
+
+    if not removed:
+        raise ValueError(f'The User with the given id ({member_id}) is not a member of a shared item with the given id '
+                         f'({item_id}) owned by the User with the given id ({owner_id})')
+
+
+@instrumented()
+def delete_shared_item(item_id: int, owner_id: int, connection: Connection) -> None:
+    """
+    Removes the shared item with the given id, for all its members.
+    :param item_id: the id of the shared item
+    :param owner_id: the id of the User who owns the item
+    :raise ValueError: if the User does not own the item
+    """
+    cursor = connection.cursor()
+
+    cursor.execute("DELETE FROM shared_items WHERE id=? AND owner_id=?", (item_id, owner_id))
+
+    deleted = cursor.rowcount
+
+    connection.commit()
+    cursor.close()
+
+    if not deleted:
+        raise ValueError(f'The User with the given id ({owner_id}) owns no shared item with the given id ({item_id})')
+
+
+@instrumented()
+def get_shared_items_by_user_id(user_id: int, connection: Connection)\
+        -> List[Tuple[int, str, Optional[str], str, int]]:
+    """
+    Returns the items shared with the User with the given id (including the ones they own), found through the
+    membership index.
+    :param user_id: the id of the User
+    :param connection: the database connection to use
+    :return: the id, name, url, username, and owner id of each shared item, ordered by name
+    """
+    cursor = connection.cursor()
+
+    cursor.execute("""SELECT shared_items.id, shared_items.name, shared_items.url, shared_items.username,
+    shared_items.owner_id FROM shared_item_members
+    JOIN shared_items ON shared_items.id = shared_item_members.item_id
+    WHERE shared_item_members.user_id=?
+    ORDER BY shared_items.name""", (user_id,))
+
+    shared_items = cursor.fetchall()
+
+    cursor.close()
+
+    return shared_items
+
+
+@instrumented()
+def get_shared_item_by_name_and_user_id(name: str, user_id: int, connection: Connection)\
+        -> Optional[Tuple[int, str, Optional[str], str, int]]:
+    """
+    Returns the item with the given name shared with the User with the given id, preferring the one they own if
+    several Users share an item with that name with them.
+    :param name: the name of the shared item
+    :param user_id: the id of the member
+    :param connection: the database connection to use
+    :return: the id, name, url, username, and owner id of the shared item if there is one, else None
+    """
+    cursor = connection.cursor()
+
+    cursor.execute("""SELECT shared_items.id, shared_items.name, shared_items.url, shared_items.username,
+    shared_items.owner_id FROM shared_item_members
+    JOIN shared_items ON shared_items.id = shared_item_members.item_id
+    WHERE shared_item_members.user_id=:user_id AND shared_items.name=:name
+    ORDER BY shared_items.owner_id != :user_id, shared_items.id LIMIT 1""", {'user_id': user_id, 'name': name})
+
+    shared_item = cursor.fetchone()
+
+    cursor.close()
+
+    return shared_item
+
+
+@instrumented()
+def get_decrypted_shared_item_password(item_id: int, user_id: int, master_password: str, connection: Connection)\
+        -> str:
+    """
+    Returns the decrypted password of the shared item with the given id, for one of its members: their private key
+    unwraps the item key, which decrypts the password.
+    :param item_id: the id of the shared item
+    :param user_id: the id of the member
+    :param master_password: the member's master password
+    :param connection: the database connection to use
+    :return: the decrypted password
+    :raise ValueError: if the User is not a member of the item or if a cryptography error occurs (e.g. if the master
+    password is not valid)
+    """
+    cursor = connection.cursor()
+
+    cursor.execute("""SELECT shared_item_members.wrapped_key, shared_items.password, shared_items.nonce,
+    shared_items.tag FROM shared_item_members
+    JOIN shared_items ON shared_items.id = shared_item_members.item_id
+    WHERE shared_item_members.item_id=? AND shared_item_members.user_id=?""", (item_id, user_id))
+
+    result = cursor.fetchone()
+
+    if result is None:
+        cursor.close()
+        raise ValueError(f'The User with the given id ({user_id}) is not a member of a shared item with the given id '
+                         f'({item_id})')
+
+    wrapped_key, ciphertext, nonce, tag = result
+
+    try:
+        item_key = unwrap_key(wrapped_key, _get_private_key(cursor, user_id, master_password))
+
+        return decrypt_aes_256_gcm(key=item_key, ciphertext=ciphertext, nonce=nonce, tag=tag)
+    except ValueError as e:
+        raise ValueError(f'An error occurred while decrypting the shared item password: {e}')
+    finally:
+        cursor.close()
+
+
+@instrumented()
+def add_attachment(account_id: int, master_password: str, name: str, content: BinaryIO, connection: Connection,
+                   kind: str = 'file') -> int:
+    """
+    Adds an attachment with the given name to the Account with the given id, streaming the given content into
+    encrypted chunks so that only one chunk is in memory at a time.
+    :param account_id: the id of the Account
+    :param master_password: the master password of the User who owns the Account
+    :param name: the name of the attachment (e.g. its file name)
+    :param content: a binary file object to read the content from, until its end
+    :param connection: the database connection to use
+    :param kind: one of ATTACHMENT_KINDS
+    :return: the id of the created attachment
+    :raise ValueError: if the given account_id is invalid, the name or master_password are empty strings, or the kind
+    is not one of ATTACHMENT_KINDS
+    :raise Sqlite3.IntegrityError: if the Account already has an attachment with the given name
+    :raise argon2.exceptions.VerifyMismatchError: if the User's hashed_password is not valid for the given
+    master password
+    """
+    if not name:
+        raise ValueError('The given name was an empty string')
+
+    if kind not in ATTACHMENT_KINDS:
+        raise ValueError(f'The given kind ({kind}) is not one of {", ".join(ATTACHMENT_KINDS)}')
+
+    cursor = connection.cursor()
+
+    cursor.execute("SELECT user_id FROM accounts WHERE id=?", (account_id,))
+
+    result = cursor.fetchone()
+
+    if result is None:
+        cursor.close()
+        raise ValueError(f'There is no Account with the given id ({account_id})')
+
+    user_id = result[0]
+
+    _verify_master_password(user_id, master_password, connection)
+
+    attachment_key = os.urandom(32)
+    key = derive_subkey(_derive_user_key(user_id, master_password, _get_user_key_salt(cursor, user_id)),
+                        ATTACHMENT_KEY_PURPOSE)
+    encrypted_key, nonce, tag = encrypt_aes_256_gcm(key, attachment_key.hex())
+
+    try:
+        cursor.execute("""INSERT INTO attachments VALUES (NULL, :account_id, :user_id, :name, :kind, 0, 0, :key, :nonce,
+        :tag) RETURNING id""", {'account_id': account_id, 'user_id': user_id, 'name': name, 'kind': kind,
+                                 'key': encrypted_key, 'nonce': nonce, 'tag': tag})
+        attachment_id = cursor.fetchone()[0]
+
+        size = 0
+        chunk_count = 0
+        chunk = content.read(ATTACHMENT_CHUNK_SIZE)
+
+        # Every attachment has a last chunk, even an empty one, so that one cut short does not decrypt
+        while True:
+            next_chunk = content.read(ATTACHMENT_CHUNK_SIZE)
+            ciphertext, chunk_tag = encrypt_chunk(attachment_key, chunk_count, not next_chunk, chunk)
+
+            cursor.execute("INSERT INTO attachment_chunks VALUES (?, ?, ?, ?)",
+                           (attachment_id, chunk_count, ciphertext, chunk_tag))
+
+            size += len(chunk)
+            chunk_count += 1
+
+            if not next_chunk:
+                break
+
+            chunk = next_chunk
+
+        cursor.execute("UPDATE attachments SET size=?, chunk_count=? WHERE id=?", (size, chunk_count, attachment_id))
+    except sqlite3.IntegrityError as e:
+        connection.rollback()
+        cursor.close()
+        raise sqlite3.IntegrityError(f'The attachment could not be added because this name is already being used for '
+                                     f'an attachment of this Account: {e}')
+    except BaseException:
+        connection.rollback()
+        cursor.close()
+        raise
+
+    connection.commit()
+    cursor.close()
+
+    return attachment_id
+
+
+@instrumented()
+def add_note(account_id: int, master_password: str, name: str, text: str, connection: Connection) -> int:
+    """
+    Adds a note with the given name and text to the Account with the given id, as an attachment of the note kind (see
+    add_attachment).
+    :return: the id of the created attachment
+    :raise ValueError: if the given account_id is invalid or the name or master_password are empty strings
+    :raise Sqlite3.IntegrityError: if the Account already has an attachment with the given name
+    :raise argon2.exceptions.VerifyMismatchError: if the User's hashed_password is not valid for the given
+    master password
+    """
+    return add_attachment(account_id, master_password, name, io.BytesIO(text.encode('utf-8')), connection,
+                          kind='note')
+
+
+@instrumented()
+def get_attachments_by_account_id(account_id: int, connection: Connection) -> List[Tuple[int, str, str, int]]:
+    """
+    Returns the attachments of the Account with the given id, without reading their content.
+    :param account_id: the id of the Account
+    :param connection: the database connection to use
+    :return: the id, name, kind, and size in bytes of each attachment, ordered by name
+    """
+    cursor = connection.cursor()
+
+    cursor.execute("SELECT id, name, kind, size FROM attachments WHERE account_id=? ORDER BY name", (account_id,))
+
+    attachments = cursor.fetchall()
+
+    cursor.close()
+
+    return attachments
+
+
+@instrumented()
+def get_attachment_id_by_name_and_account_id(name: str, account_id: int, connection: Connection) -> Optional[int]:
+    """
+    Returns the id of the attachment with the given name (ignoring case) of the Account with the given id if there is
+    one, else None.
+    """
+    cursor = connection.cursor()
+
+    cursor.execute("SELECT id FROM attachments WHERE name=? AND account_id=?", (name, account_id))
+
+    result = cursor.fetchone()
+
+    cursor.close()
+
+    return result[0] if result is not None else None
+
+
+def _read_attachment_chunks(cursor: Cursor, attachment_id: int, attachment_key: bytes, chunk_count: int)\
+        -> Iterator[bytes]:
+    try:
+        cursor.execute("""SELECT chunk_index, ciphertext, tag FROM attachment_chunks WHERE attachment_id=?
+        ORDER BY chunk_index""", (attachment_id,))
+
+        index = 0
+
+        # The cursor steps through the rows, so one chunk is read at a time
+        for chunk_index, ciphertext, tag in cursor:
+            if chunk_index != index or index >= chunk_count:
+                raise ValueError(f'The chunks of the attachment with the given id ({attachment_id}) are out of order')
+
+            yield decrypt_chunk(attachment_key, index, index == chunk_count - 1, ciphertext, tag)
+
+            index += 1
+
+        if index != chunk_count:
+            raise ValueError(f'The attachment with the given id ({attachment_id}) is truncated')
+    finally:
+        cursor.close()
+
+
+@instrumented()
+def read_attachment(attachment_id: int, master_password: str, connection: Connection) -> Iterator[bytes]:
+    """
+    Returns an iterator over the decrypted content of the attachment with the given id, one chunk at a time, so that it
+    can be written out (e.g. to a file) without holding the whole attachment in memory. The attachment key is decrypted
+    before this returns; each chunk is verified as it is read, so a consumer must discard what it wrote if the iteration
+    raises.
+    :param attachment_id: the id of the attachment
+    :param master_password: the master password of the User who owns the attachment
+    :param connection: the database connection to use
+    :return: an iterator over the chunks of the content
+    :raise ValueError: if there is no attachment with the given id, or if a cryptography error occurs (e.g. if the
+    master password is not valid, or a chunk was modified, reordered, or removed)
+    """
+    cursor = connection.cursor()
+
+    cursor.execute("""SELECT attachments.key, attachments.nonce, attachments.tag, attachments.chunk_count,
+    attachments.user_id, user_keys.salt FROM attachments JOIN user_keys ON user_keys.user_id = attachments.user_id
+    WHERE attachments.id=?""", (attachment_id,))
+
+    result = cursor.fetchone()
+
+    if result is None:
+        cursor.close()
+        raise ValueError(f'There is no attachment with the given id ({attachment_id})')
+
+    encrypted_key, nonce, tag, chunk_count, user_id, salt = result
+    user_key = _derive_user_key(user_id, master_password, salt, verified=False)
+    key = derive_subkey(user_key, ATTACHMENT_KEY_PURPOSE)
+
+    try:
+        attachment_key = bytes.fromhex(decrypt_aes_256_gcm(key=key, ciphertext=encrypted_key, nonce=nonce, tag=tag))
+    except ValueError as e:
+        cursor.close()
+        raise ValueError(f'An error occurred while decrypting the attachment key: {e}')
+
+    # The attachment key only decrypts with the right master password
+    _keep_user_key(user_id, master_password, salt, user_key)
+
+    return _read_attachment_chunks(cursor, attachment_id, attachment_key, chunk_count)
+
+
+@instrumented()
+def get_decrypted_note(attachment_id: int, master_password: str, connection: Connection) -> str:
+    """
+    Returns the decrypted text of the note (or text attachment) with the given id.
+    :raise ValueError: if there is no attachment with the given id, if its content is not utf-8 text, or if a
+    cryptography error occurs (e.g. if the master password is not valid)
+    """
+    content = b''.join(read_attachment(attachment_id, master_password, connection))
+
+    try:
+        return content.decode('utf-8')
+    except UnicodeDecodeError as e:
+        raise ValueError(f'The attachment with the given id ({attachment_id}) is not text: {e}')
+
+
+@instrumented()
+def delete_attachment(attachment_id: int, connection: Connection) -> None:
+    """
+    Removes the attachment with the given id and its chunks.
+    :raise ValueError: if there is no attachment with the given id
+    """
+    cursor = connection.cursor()
+
+    cursor.execute("DELETE FROM attachments WHERE id=?", (attachment_id,))
+
+    deleted = cursor.rowcount
+
+    connection.commit()
+    cursor.close()
+
+    if not deleted:
+        raise ValueError(f'There is no attachment with the given id ({attachment_id})')
+
+
+@instrumented()
+def get_current_revision(connection: Connection) -> int:
+    """
+    Returns the current revision of the vault: the revision of the latest Account change (of any User), which only
+    ever increases, or 0 if no Account was ever changed.
+    :param connection: the database connection to use
+    :return: the current revision
+    """
+    cursor = connection.cursor()
+
+    cursor.execute("SELECT seq FROM sqlite_sequence WHERE name='account_changes'")
+
+    result = cursor.fetchone()
+
+    cursor.close()
+
+    return result[0] if result else 0
+
+
+@instrumented()
+def changes_since(user_id: int, revision: int, connection: Connection) -> Dict[str, Any]:
+    """
+    Returns the Accounts of the User with the given id that were changed after the given revision, using the change
+    journal, so that only the changed Accounts are read. An Account changed several times is only returned once, in
+    its current state, and an Account created and deleted after the revision may be returned as deleted.
+    :param user_id: the id of the User
+    :param revision: the revision the caller last saw (e.g. the revision returned by the previous call), 0 for all
+    the changes
+    :param connection: the database connection to use
+    :return: a dict with the current 'revision' (to pass to the next call), the id, name, url, and username of the
+    'changed' (created or edited) Accounts, ordered by name, and the ids of the 'deleted' Accounts
+    :raise ChangeJournalCompactedError: if changes after the given revision were compacted away
+    :raise SealedMetadataLockedError: if the User's metadata is sealed but was not unlocked in this process
+    """
+    cursor = connection.cursor()
+
+    # Changes committed after this point have a later revision, so they are left for the next call
+    current_revision = get_current_revision(connection)
+
+    cursor.execute("SELECT compacted_revision FROM account_changes_compaction")
+
+    compaction = cursor.fetchone()
+
+    if compaction and revision < compaction[0]:
+        cursor.close()
+        raise ChangeJournalCompactedError(f'The changes after revision {revision} were compacted (up to revision '
+                                          f'{compaction[0]})')
+
+    cursor.execute("""SELECT account_id, operation FROM account_changes
+    WHERE user_id=:user_id AND revision > :revision AND revision <= :current_revision
+    ORDER BY revision""", {'user_id': user_id, 'revision': revision, 'current_revision': current_revision})
+
+    latest_operations = dict(cursor.fetchall())
+
+    deleted = [account_id for account_id, operation in latest_operations.items() if operation == 'delete']
+    changed_ids = [account_id for account_id, operation in latest_operations.items() if operation != 'delete']
+
+    changed = []
+
+    # Batched to stay under SQLite's limit on the number of parameters
+    for start in range(0, len(changed_ids), 500):
+        batch = changed_ids[start:start + 500]
+
+        cursor.execute(f"""SELECT id, name, url, username FROM accounts
+        WHERE id IN ({', '.join('?' * len(batch))})""", batch)
+
+        changed.extend(cursor.fetchall())
+
+    changed = _reveal_accounts(cursor, user_id, changed)
+
+    cursor.close()
+
+    return {'revision': current_revision, 'changed': sorted(changed, key=lambda account: account[1].lower()),
+            'deleted': deleted}
+
+
+@instrumented()
+def compact_account_changes(connection: Connection, deleted_before_revision: Optional[int] = None) -> int:
+    """
+    Compacts the change journal: drops the entries superseded by a later entry of the same Account, which no consumer
+    needs, and, if a revision is given, the deletions up to it, after which changes_since refuses the revisions before
+    it. The latest entry of every existing Account is always kept.
+    :param connection: the database connection to use
+    :param deleted_before_revision: the revision up to which deletions are dropped (none are if not provided)
+    :return: the number of entries dropped
+    :raise ValueError: if deleted_before_revision is after the current revision
+    """
+    if deleted_before_revision is not None and deleted_before_revision > get_current_revision(connection):
+        raise ValueError(f'The given revision ({deleted_before_revision}) is after the current revision')
+
+    cursor = connection.cursor()
+
+    cursor.execute("""DELETE FROM account_changes WHERE revision <
+    (SELECT MAX(newer.revision) FROM account_changes AS newer WHERE newer.account_id = account_changes.account_id)""")
+
+    dropped = cursor.rowcount
+
+    if deleted_before_revision is not None:
+        cursor.execute("DELETE FROM account_changes WHERE operation = 'delete' AND revision <= ?",
+                       (deleted_before_revision,))
+
+        dropped += cursor.rowcount
+
+        cursor.execute("""INSERT INTO account_changes_compaction (id, compacted_revision) VALUES (1, :revision)
+        ON CONFLICT (id) DO UPDATE SET compacted_revision = MAX(compacted_revision, :revision)""",
+                       {'revision': deleted_before_revision})
+
+    connection.commit()
+    cursor.close()
+
+    return dropped
+
+
+@instrumented()
 def is_valid_login(email: str, entered_password: str, connection: Connection) -> bool:
     """
     When a user attempts to sign in, verifies their account info. Returns True if there is a User with a matching
     email and password (using verification of the hash for the password). Additionally, rehashes their password
-    if the argon2 default configuration changes and re-encrypts their Account passwords.
+    if the argon2 default configuration changes and re-encrypts their Account passwords, creates their key pair for
+    shared items if they do not have one, and unlocks their Account metadata if it is sealed.
     Returns False otherwise or raises a ValueError if there was a miscellaneous verification error.
     :param email: the given email when a user signs in
     :param entered_password: the given password when a user signs in (plaintext)
@@ -416,7 +2245,8 @@ def is_valid_login(email: str, entered_password: str, connection: Connection) ->
         return False
 
     try:
-        is_valid = ph.verify(hash=hashed_password, password=entered_password)
+        with timer('argon2.verify'):
+            is_valid = ph.verify(hash=hashed_password, password=entered_password)
 
     except (VerifyMismatchError, InvalidHashError):
         return False
@@ -424,12 +2254,23 @@ def is_valid_login(email: str, entered_password: str, connection: Connection) ->
     except VerificationError as e:
         raise VerificationError(f'The login could not be verified for miscellaneous reasons: {e}')
 
+    cursor = connection.cursor()
+
+    # Both write on first use (the key pair, and the user_keys salt), so they are committed together
+    key_pair_created = _publish_key_pair(cursor, user_id, entered_password)
+
+    if _unlock_metadata_keys(cursor, user_id, entered_password) or key_pair_created:
+        connection.commit()
+
+    cursor.close()
+
     if ph.check_needs_rehash(hashed_password):
         rehash_and_reencrypt_passwords(user_id=user_id, entered_password=entered_password, connection=connection)
 
     return is_valid
 
 
+@instrumented()
 def rehash_and_reencrypt_passwords(user_id: int, entered_password: str, connection: Connection) -> None:
     """
     For the User with the given id:
@@ -448,7 +2289,8 @@ def rehash_and_reencrypt_passwords(user_id: int, entered_password: str, connecti
     # Hashing steps
     ph = PasswordHasher()
 
-    hashed_password = ph.hash(entered_password)
+    with timer('argon2.hash'):
+        hashed_password = ph.hash(entered_password)
 
     cursor.execute("UPDATE users SET password=:password WHERE id=:user_id", ({'password': hashed_password,
                                                                               'user_id': user_id}))
@@ -476,11 +2318,28 @@ def rehash_and_reencrypt_passwords(user_id: int, entered_password: str, connecti
     update_query = "UPDATE accounts SET password=:password, salt=:salt, nonce=:nonce, tag=:tag WHERE id=:account_id"
     cursor.executemany(update_query, ciphertext_account_passwords)
 
+    fingerprint_key = _get_fingerprint_key(cursor, user_id, entered_password)
+
+    for account_id, account_password in plaintext_account_passwords.items():
+        _fingerprint_account_password(cursor, account_id, user_id, account_password, fingerprint_key)
+
     connection.commit()
     cursor.close()
 
 
+@instrumented()
+def forget_unlocked_keys() -> None:
+    """
+    Forgets the keys this process derived from master passwords (the user keys, and the metadata keys of the sealed
+    Users), e.g. when a vault is locked. The sealed Users' Account metadata then cannot be read until their master
+    password is verified again.
+    """
+    _user_keys.clear()
+    _metadata_keys.clear()
+
+
 # Utils for testing:
+@instrumented()
 def db_setup() -> Tuple[Connection, Cursor]:
     """
     Creates an in-memory database with the necessary tables, used for testing, and returns the corresponding
@@ -511,6 +2370,10 @@ def db_setup() -> Tuple[Connection, Cursor]:
                     UNIQUE(name, user_id)
                     ) STRICT ;""")
 
+    for statement in ACCOUNT_URLS_SCHEMA + ACCOUNT_FINGERPRINTS_SCHEMA + ACCOUNT_CHANGES_SCHEMA + \
+            ACCOUNT_METADATA_SCHEMA + SHARED_ITEMS_SCHEMA + ATTACHMENTS_SCHEMA:
+        cursor.execute(statement)
+
     connection.commit()
 
     return connection, cursor
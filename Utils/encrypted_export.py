@@ -0,0 +1,422 @@
+import json
+import os
+import sqlite3
+import struct
+import tempfile
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, Future
+from sqlite3 import Connection
+from typing import BinaryIO, Deque, Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+
+from argon2 import PasswordHasher
+from argon2.exceptions import HashingError
+from argon2.low_level import hash_secret_raw, Type
+from Crypto.Cipher import AES
+
+from Utils.database import create_account
+from Utils.import_export import iter_decrypted_accounts
+
+# An encrypted export format that is written and read as a stream, so that exporting and importing a vault of any size
+# takes constant memory. The file is a header followed by chunks:
+#
+#   header: magic (8 bytes), Argon2id time cost, memory cost (KiB), and parallelism (3 x uint32), salt length (uint8)
+#           and salt, nonce prefix (8 bytes)
+#   chunk:  flags (uint8: 1 = final chunk, 2 = compressed), ciphertext length (uint32), ciphertext, GCM tag (16 bytes)
+#
+# The key is derived with Argon2id from the export password (the master password by default) and the salt. Each chunk
+# is a whole number of records (JSON arrays of name, url, username, and password, one per line), optionally compressed
+# with zlib, and encrypted on its own with AES-256-GCM. The nonce of a chunk is the nonce prefix followed by the chunk
+# index, and its associated data is the header, the chunk index, and the flags, so that editing the header, reordering
+# or dropping chunks, or truncating the file (which loses the chunk flagged as final) all fail authentication. Chunks are
+# compressed and encrypted (or decrypted and decompressed) on a thread pool, which PyCryptodome and zlib allow since
+# they release the GIL, with a bounded number of chunks in flight.
+#
+# The KDF parameters are necessarily read before anything is authenticated, so readers refuse a salt shorter than
+# MIN_SALT_SIZE and parameters above the MAX_* bounds, which a crafted header could otherwise use to hang or exhaust the
+# memory of whoever opens the file (writers refuse them too, so that every file they write can be read).
+#
+# The container itself (write_encrypted_chunks and read_encrypted_chunks) holds any chunks of bytes, and is also used
+# under a different magic for the vault backups of Utils.backup.
+
+MAGIC = b'PPMEXP\x00\x01'
+KDF_PARAMETERS = struct.Struct('>III')
+CHUNK_HEADER = struct.Struct('>BI')
+CHUNK_AAD = struct.Struct('>IB')
+NONCE_PREFIX_SIZE = 8
+TAG_SIZE = 16
+
+FINAL_CHUNK = 1
+COMPRESSED_CHUNK = 2
+
+DEFAULT_CHUNK_SIZE = 64 * 1024
+MAX_CHUNK_SIZE = 64 * 1024 * 1024
+DEFAULT_WORKERS = 4
+
+SALT_SIZE = 16
+MIN_SALT_SIZE = 16
+MAX_TIME_COST = 64
+MAX_MEMORY_COST = 1024 * 1024
+MAX_PARALLELISM = 64
+
+ExportedAccount = Tuple[str, Optional[str], str, str]
+
+
+class EncryptedExportError(ValueError):
+    """
+    Raised when an encrypted export cannot be read: it is not an encrypted export, the password is wrong, or the file
+    was modified or truncated.
+    """
+
+
+class KDFParameters(NamedTuple):
+    time_cost: int
+    memory_cost: int
+    parallelism: int
+
+    @classmethod
+    def default(cls) -> 'KDFParameters':
+        """
+        Returns the parameters argon2-cffi currently uses for hashing the master password.
+        """
+        ph = PasswordHasher()
+
+        return cls(ph.time_cost, ph.memory_cost, ph.parallelism)
+
+
+def _kdf_parameters_error(kdf_parameters: KDFParameters, salt: bytes) -> Optional[str]:
+    """
+    Returns why the given Argon2id parameters and salt are refused, or None if they are within the bounds.
+    """
+    if len(salt) < MIN_SALT_SIZE:
+        return f'The salt is shorter than {MIN_SALT_SIZE} bytes'
+
+    for name, value, maximum in (('time cost', kdf_parameters.time_cost, MAX_TIME_COST),
+                                 ('memory cost', kdf_parameters.memory_cost, MAX_MEMORY_COST),
+                                 ('parallelism', kdf_parameters.parallelism, MAX_PARALLELISM)):
+        if not 1 <= value <= maximum:
+            return f'The Argon2id {name} ({value}) is not between 1 and {maximum}'
+
+    return None
+
+
+def _derive_export_key(export_password: str, salt: bytes, kdf_parameters: KDFParameters) -> bytes:
+    return hash_secret_raw(secret=export_password.encode('utf-8'), salt=salt, time_cost=kdf_parameters.time_cost,
+                           memory_cost=kdf_parameters.memory_cost, parallelism=kdf_parameters.parallelism,
+                           hash_len=32, type=Type.ID)
+
+
+def _encrypt_chunk(key: bytes, header: bytes, nonce_prefix: bytes, index: int, flags: int, data: bytes) -> bytes:
+    if flags & COMPRESSED_CHUNK:
+        data = zlib.compress(data)
+
+    cipher = AES.new(key=key, mode=AES.MODE_GCM, nonce=nonce_prefix + struct.pack('>I', index))
+    cipher.update(header + CHUNK_AAD.pack(index, flags))
+    ciphertext, tag = cipher.encrypt_and_digest(data)
+
+    return CHUNK_HEADER.pack(flags, len(ciphertext)) + ciphertext + tag
+
+
+def _decrypt_chunk(key: bytes, header: bytes, nonce_prefix: bytes, index: int, flags: int, ciphertext: bytes,
+                   tag: bytes) -> bytes:
+    cipher = AES.new(key=key, mode=AES.MODE_GCM, nonce=nonce_prefix + struct.pack('>I', index))
+    cipher.update(header + CHUNK_AAD.pack(index, flags))
+
+    try:
+        data = cipher.decrypt_and_verify(ciphertext, tag)
+    except ValueError:
+        raise EncryptedExportError(f'Chunk {index} could not be authenticated (wrong password, or the file was '
+                                   f'modified or reordered)')
+
+    return zlib.decompress(data) if flags & COMPRESSED_CHUNK else data
+
+
+def _chunk_records(accounts: Iterable[ExportedAccount], chunk_size: int) -> Iterator[bytes]:
+    """
+    Serializes the Accounts into chunks of whole records of at least chunk_size bytes (except the last one).
+    """
+    records = []
+    size = 0
+
+    for account in accounts:
+        record = json.dumps(list(account), ensure_ascii=False).encode('utf-8') + b'\n'
+        records.append(record)
+        size += len(record)
+
+        if size >= chunk_size:
+            yield b''.join(records)
+            records = []
+            size = 0
+
+    if records:
+        yield b''.join(records)
+
+
+def _fsync_directory(directory: str) -> None:
+    """
+    Makes a rename in the given directory durable. Directories cannot be opened (or synced) on Windows, where the
+    rename is durable once it returns.
+    """
+    if os.name != 'posix':
+        return
+
+    directory_descriptor = os.open(directory, os.O_RDONLY)
+
+    try:
+        os.fsync(directory_descriptor)
+    finally:
+        os.close(directory_descriptor)
+
+
+def write_encrypted_chunks(path: str, chunks: Iterable[bytes], password: str, compress: bool = True,
+                           workers: int = DEFAULT_WORKERS, kdf_parameters: Optional[KDFParameters] = None,
+                           magic: bytes = MAGIC) -> None:
+    """
+    Writes the given chunks of plaintext to an encrypted file in the format of the encrypted exports at the given
+    path. The chunks are consumed as a stream. The file is written to a temporary file, synced, and renamed into place,
+    so that a failed write (or a crash) does not leave a partial file.
+    :param path: the path of the file to write
+    :param chunks: the chunks of plaintext, each at most MAX_CHUNK_SIZE bytes once compressed
+    :param password: the password the file is encrypted with
+    :param compress: whether to compress the chunks
+    :param workers: the number of threads compressing and encrypting chunks
+    :param kdf_parameters: the Argon2id parameters (defaults to those of the master password hashes)
+    :param magic: the 8 bytes that start the file and identify what it holds (encrypted exports by default)
+    :raise ValueError: if the password is an empty string or the KDF parameters are out of bounds
+    """
+    if not password:
+        raise ValueError('The given password was an empty string')
+
+    kdf_parameters = kdf_parameters or KDFParameters.default()
+    salt = os.urandom(SALT_SIZE)
+    error = _kdf_parameters_error(kdf_parameters, salt)
+
+    if error:
+        raise ValueError(error)
+
+    nonce_prefix = os.urandom(NONCE_PREFIX_SIZE)
+    header = magic + KDF_PARAMETERS.pack(*kdf_parameters) + bytes([len(salt)]) + salt + nonce_prefix
+    key = _derive_export_key(password, salt, kdf_parameters)
+    flags = COMPRESSED_CHUNK if compress else 0
+
+    file_descriptor, temporary_path = tempfile.mkstemp(suffix='.tmp', dir=os.path.dirname(os.path.abspath(path)))
+
+    try:
+        with os.fdopen(file_descriptor, 'wb') as encrypted_file, ThreadPoolExecutor(max_workers=workers) as executor:
+            encrypted_file.write(header)
+            in_flight: Deque[Future] = deque()
+            chunks = iter(chunks)
+            chunk = next(chunks, b'')
+            index = 0
+
+            # Each chunk is only submitted once the next one is known, so that the last one can be flagged as final
+            while True:
+                next_chunk = next(chunks, None)
+                chunk_flags = flags | (FINAL_CHUNK if next_chunk is None else 0)
+                in_flight.append(executor.submit(_encrypt_chunk, key, header, nonce_prefix, index, chunk_flags, chunk))
+
+                if len(in_flight) >= workers * 2:
+                    encrypted_file.write(in_flight.popleft().result())
+
+                if next_chunk is None:
+                    break
+
+                chunk = next_chunk
+                index += 1
+
+            while in_flight:
+                encrypted_file.write(in_flight.popleft().result())
+
+            # The file is on disk before it replaces the previous one, so that a crash leaves one or the other whole
+            encrypted_file.flush()
+            os.fsync(encrypted_file.fileno())
+
+        os.replace(temporary_path, path)
+        _fsync_directory(os.path.dirname(os.path.abspath(path)))
+    except BaseException:
+        os.remove(temporary_path)
+        raise
+
+
+def write_encrypted_export(path: str, accounts: Iterable[ExportedAccount], export_password: str,
+                           chunk_size: int = DEFAULT_CHUNK_SIZE, compress: bool = True, workers: int = DEFAULT_WORKERS,
+                           kdf_parameters: Optional[KDFParameters] = None) -> int:
+    """
+    Writes the given Accounts to an encrypted export at the given path. The Accounts are consumed as a stream. The file
+    is written to a temporary file and renamed into place, so that a failed export does not leave a partial file.
+    :param path: the path of the export to write
+    :param accounts: the (name, url, username, password) of each Account
+    :param export_password: the password the export is encrypted with
+    :param chunk_size: the approximate plaintext size of a chunk, in bytes
+    :param compress: whether to compress the chunks
+    :param workers: the number of threads compressing and encrypting chunks
+    :param kdf_parameters: the Argon2id parameters (defaults to those of the master password hashes)
+    :return: the number of Accounts written
+    :raise ValueError: if the export password is an empty string
+    """
+    if not export_password:
+        raise ValueError('The given export_password was an empty string')
+
+    record_count = 0
+
+    def counted(accounts_to_count: Iterable[ExportedAccount]) -> Iterator[ExportedAccount]:
+        nonlocal record_count
+
+        for account in accounts_to_count:
+            record_count += 1
+            yield account
+
+    write_encrypted_chunks(path, _chunk_records(counted(accounts), chunk_size), export_password, compress=compress,
+                           workers=workers, kdf_parameters=kdf_parameters)
+
+    return record_count
+
+
+def is_encrypted_export(path: str) -> bool:
+    """
+    Returns whether the file at the given path starts like an encrypted export.
+    """
+    with open(path, 'rb') as export_file:
+        return export_file.read(len(MAGIC)) == MAGIC
+
+
+def _read_exactly(export_file: BinaryIO, size: int) -> bytes:
+    data = export_file.read(size)
+
+    if len(data) != size:
+        raise EncryptedExportError('The encrypted file is truncated')
+
+    return data
+
+
+def read_encrypted_chunks(path: str, password: str, workers: int = DEFAULT_WORKERS, magic: bytes = MAGIC)\
+        -> Iterator[bytes]:
+    """
+    Reads the chunks of plaintext of the encrypted file at the given path, written by write_encrypted_chunks, as a
+    stream. A chunk is only yielded once it is authenticated, but a truncated or reordered file is only detected when
+    its end is reached.
+    :param path: the path of the file
+    :param password: the password the file was encrypted with
+    :param workers: the number of threads decrypting and decompressing chunks
+    :param magic: the 8 bytes the file must start with (those of encrypted exports by default)
+    :return: an iterator of the chunks
+    :raise EncryptedExportError: if the file does not start with the magic, its KDF parameters are out of bounds, the
+    password is wrong, or the file was modified, reordered, or truncated
+    """
+    with open(path, 'rb') as encrypted_file, ThreadPoolExecutor(max_workers=workers) as executor:
+        if encrypted_file.read(len(magic)) != magic:
+            raise EncryptedExportError(f'{path} is not an encrypted file of the expected kind')
+
+        kdf_bytes = _read_exactly(encrypted_file, KDF_PARAMETERS.size + 1)
+        salt = _read_exactly(encrypted_file, kdf_bytes[-1])
+        nonce_prefix = _read_exactly(encrypted_file, NONCE_PREFIX_SIZE)
+        header = magic + kdf_bytes + salt + nonce_prefix
+        kdf_parameters = KDFParameters(*KDF_PARAMETERS.unpack(kdf_bytes[:-1]))
+        error = _kdf_parameters_error(kdf_parameters, salt)
+
+        if error:
+            raise EncryptedExportError(f'{path} cannot be read: {error}')
+
+        try:
+            key = _derive_export_key(password, salt, kdf_parameters)
+        except HashingError as e:
+            raise EncryptedExportError(f'The key of {path} could not be derived: {e}')
+
+        in_flight: Deque[Future] = deque()
+        index = 0
+        final = False
+
+        while not final:
+            flags, length = CHUNK_HEADER.unpack(_read_exactly(encrypted_file, CHUNK_HEADER.size))
+
+            if length > MAX_CHUNK_SIZE:
+                raise EncryptedExportError(f'Chunk {index} is larger than the maximum chunk size')
+
+            ciphertext = _read_exactly(encrypted_file, length)
+            tag = _read_exactly(encrypted_file, TAG_SIZE)
+            final = bool(flags & FINAL_CHUNK)
+            in_flight.append(executor.submit(_decrypt_chunk, key, header, nonce_prefix, index, flags, ciphertext, tag))
+            index += 1
+
+            while in_flight and (final or len(in_flight) >= workers * 2):
+                yield in_flight.popleft().result()
+
+        if encrypted_file.read(1):
+            raise EncryptedExportError('The encrypted file has data after its final chunk')
+
+
+def read_encrypted_export(path: str, export_password: str, workers: int = DEFAULT_WORKERS)\
+        -> Iterator[ExportedAccount]:
+    """
+    Reads the Accounts of the encrypted export at the given path as a stream. A chunk's Accounts are only yielded once
+    it is authenticated, but a truncated or reordered file is only detected when its end is reached, so callers that
+    must not act on a partial export should read it through once first (see import_accounts_from_encrypted_export).
+    :param path: the path of the export
+    :param export_password: the password the export was encrypted with
+    :param workers: the number of threads decrypting and decompressing chunks
+    :return: an iterator of the (name, url, username, password) of each Account
+    :raise EncryptedExportError: if the file is not an encrypted export, the password is wrong, or the file was
+    modified, reordered, or truncated
+    """
+    for chunk in read_encrypted_chunks(path, export_password, workers=workers):
+        for line in chunk.splitlines():
+            name, url, username, password = json.loads(line)
+            yield name, url, username, password
+
+
+def export_accounts_encrypted(path: str, user_id: int, master_password: str, connection: Connection,
+                              export_password: Optional[str] = None, compress: bool = True,
+                              workers: int = DEFAULT_WORKERS) -> int:
+    """
+    Exports all Accounts of the User with the given id to an encrypted export at the given path.
+    :param path: the path of the export to write
+    :param user_id: the id of the User whose Accounts are exported
+    :param master_password: the User's master password
+    :param connection: the database connection to use
+    :param export_password: the password to encrypt the export with (defaults to the master password)
+    :param compress: whether to compress the chunks
+    :param workers: the number of threads compressing and encrypting chunks
+    :return: the number of exported Accounts
+    :raise ValueError: if a cryptography error occurs
+    """
+    accounts = (account[1:] for account in iter_decrypted_accounts(user_id, master_password, connection))
+
+    return write_encrypted_export(path, accounts, export_password or master_password, compress=compress,
+                                  workers=workers)
+
+
+def import_accounts_from_encrypted_export(path: str, user_id: int, master_password: str, connection: Connection,
+                                          export_password: Optional[str] = None, workers: int = DEFAULT_WORKERS)\
+        -> Tuple[List[int], List[Dict[str, Optional[str]]]]:
+    """
+    Imports the Accounts of the encrypted export at the given path for the User with the given id. The export is read
+    through once to authenticate all of it before any Account is created, so that a modified or truncated export
+    imports nothing. Accounts that cannot be added, due to missing info or a duplicate Account name, are returned
+    instead of raising, like import_accounts_from_csv does.
+    :param path: the path of the export
+    :param user_id: the id of the User to import the Accounts for
+    :param master_password: the User's master password
+    :param connection: the database connection to use
+    :param export_password: the password the export was encrypted with (defaults to the master password)
+    :param workers: the number of threads decrypting and decompressing chunks
+    :return: the ids of the created Accounts and the Accounts that could not be added
+    :raise EncryptedExportError: if the export cannot be read
+    :raise argon2.exceptions.VerifyMismatchError: if the master password is not valid for the User
+    """
+    export_password = export_password or master_password
+
+    for _ in read_encrypted_export(path, export_password, workers=workers):
+        pass
+
+    created_account_ids = []
+    unimportable_accounts = []
+
+    for name, url, username, password in read_encrypted_export(path, export_password, workers=workers):
+        try:
+            created_account_ids.append(create_account(user_id=user_id, master_password=master_password, name=name,
+                                                      url=url or None, username=username, password=password,
+                                                      connection=connection))
+        except (ValueError, sqlite3.IntegrityError):
+            unimportable_accounts.append({'name': name, 'url': url, 'username': username, 'password': password})
+
+    return created_account_ids, unimportable_accounts
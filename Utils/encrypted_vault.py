@@ -0,0 +1,238 @@
+import os
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor, Future
+from time import monotonic
+from typing import Iterator, Optional, Tuple
+
+from Database.database_setup import setup_tables
+from Utils.encrypted_export import write_encrypted_chunks, read_encrypted_chunks, KDFParameters
+from Utils.sql_trace import connect
+
+# An optional mode where the whole vault is kept on disk as one encrypted file instead of an SQLite database, so that
+# the names, urls, usernames, and emails (which the database stores in plaintext) are encrypted too. The file is the
+# serialized database (sqlite3.Connection.serialize) in the encrypted export container (see Utils.encrypted_export),
+# under its own magic, so it is compressed, encrypted, and authenticated with a key derived with Argon2id from the vault
+# password. Opening the vault decrypts it straight into an in-memory database (deserialize), so nothing is decrypted
+# to disk and every query then runs from memory.
+#
+# Changes are saved by serializing the database again and rewriting the file, which is written to a temporary file,
+# synced, and renamed over the previous one, so that a crash leaves either the old or the new vault. Since rewriting the
+# file costs an Argon2 run and a pass over the whole database, saves are debounced: save_if_due only saves once no
+# change was made for save_delay seconds (or max_save_delay seconds after the first unsaved change, for a vault that
+# keeps changing), and the encryption and write run on a background thread. Another process writing the vault file
+# would be overwritten by the next save, so a save refuses to replace a file that changed since it was read or saved.
+
+VAULT_MAGIC = b'PPMVLT\x00\x01'
+VAULT_EXTENSION = '.ppmvault'
+
+# Plaintext size of the chunks the serialized database is encrypted in
+VAULT_CHUNK_SIZE = 1024 * 1024
+
+DEFAULT_SAVE_DELAY = 2.0
+DEFAULT_MAX_SAVE_DELAY = 30.0
+
+# The identity of a version of the vault file: its inode, size, and modification time
+FileIdentity = Tuple[int, int, int]
+
+
+class EncryptedVaultConflictError(ValueError):
+    """
+    Raised when the encrypted vault file was replaced by another process since it was read or last saved, so saving
+    would overwrite its changes.
+    """
+
+
+def is_encrypted_vault(path: str) -> bool:
+    """
+    Returns whether the file at the given path starts like an encrypted vault.
+    """
+    with open(path, 'rb') as vault_file:
+        return vault_file.read(len(VAULT_MAGIC)) == VAULT_MAGIC
+
+
+def _file_identity(path: str) -> Optional[FileIdentity]:
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+
+    return stat.st_ino, stat.st_size, stat.st_mtime_ns
+
+
+def _serialized_chunks(serialized: bytes) -> Iterator[bytes]:
+    view = memoryview(serialized)
+
+    for start in range(0, len(view), VAULT_CHUNK_SIZE):
+        yield bytes(view[start:start + VAULT_CHUNK_SIZE])
+
+
+class EncryptedVault:
+    """
+    An encrypted vault file, opened as an in-memory database (connection) that is saved back to the file.
+    """
+    def __init__(self, path: str, vault_password: str, save_delay: float = DEFAULT_SAVE_DELAY,
+                 max_save_delay: float = DEFAULT_MAX_SAVE_DELAY, kdf_parameters: Optional[KDFParameters] = None):
+        """
+        Opens the encrypted vault at the given path, or creates an empty one if there is no file there.
+        :param path: the path of the encrypted vault
+        :param vault_password: the password the vault is encrypted with
+        :param save_delay: the number of seconds without a change after which save_if_due saves
+        :param max_save_delay: the number of seconds after the first unsaved change after which save_if_due saves,
+        even if changes are still being made
+        :param kdf_parameters: the Argon2id parameters of the saves (defaults to those of the master password hashes)
+        :raise ValueError: if the vault password is an empty string
+        :raise EncryptedExportError: if the file is not an encrypted vault, the password is wrong, or the file was
+        modified or truncated
+        """
+        if not vault_password:
+            raise ValueError('The given vault_password was an empty string')
+
+        self.path = path
+        self.save_delay = save_delay
+        self.max_save_delay = max_save_delay
+        self._vault_password = vault_password
+        self._kdf_parameters = kdf_parameters
+        self._file_identity = _file_identity(path)
+
+        self.connection = connect(':memory:')
+
+        if self._file_identity is not None:
+            self.connection.deserialize(b''.join(read_encrypted_chunks(path, vault_password, magic=VAULT_MAGIC)))
+
+        setup_tables(self.connection)
+
+        # Changes are detected with the connection's count of changed rows, so that every write is noticed
+        self._saved_changes = self._changes_seen = self.connection.total_changes
+        self._first_unsaved_change_time = self._last_change_time = None
+        self._pending_save: Optional[Future] = None
+        self._executor = ThreadPoolExecutor(max_workers=1)
+
+    @property
+    def has_unsaved_changes(self) -> bool:
+        return self.connection.total_changes != self._saved_changes
+
+    def _write(self, serialized: bytes, expected_identity: Optional[FileIdentity]) -> FileIdentity:
+        if _file_identity(self.path) != expected_identity:
+            raise EncryptedVaultConflictError(f'{self.path} was changed by another process since it was read')
+
+        write_encrypted_chunks(self.path, _serialized_chunks(serialized), self._vault_password,
+                               kdf_parameters=self._kdf_parameters, magic=VAULT_MAGIC)
+
+        return _file_identity(self.path)
+
+    def _wait_for_pending_save(self) -> None:
+        """
+        Waits for the save running in the background, if any, and raises its error if it failed.
+        """
+        if self._pending_save is not None:
+            pending_save, self._pending_save = self._pending_save, None
+
+            try:
+                self._file_identity = pending_save.result()
+            except BaseException:
+                # The changes it held are still unsaved, so that the next save writes them
+                self._saved_changes = None
+                raise
+
+    def _start_save(self) -> None:
+        self._wait_for_pending_save()
+
+        # Serialized on the caller's thread, since the connection cannot be used from another one
+        changes = self.connection.total_changes
+        serialized = self.connection.serialize()
+
+        self._pending_save = self._executor.submit(self._write, serialized, self._file_identity)
+        self._saved_changes = self._changes_seen = changes
+        self._first_unsaved_change_time = self._last_change_time = None
+
+    def save_if_due(self, now: Optional[float] = None) -> bool:
+        """
+        Starts saving the vault in the background if it has unsaved changes and no change was made for save_delay
+        seconds, or the first unsaved change was made max_save_delay seconds ago. Meant to be called periodically (e.g.
+        from an event loop), since changes are noticed when it is called.
+        :param now: the current time.monotonic() (defaults to now)
+        :return: whether a save was started
+        :raise EncryptedVaultConflictError: if the previous save found the file changed by another process
+        :raise OSError: if the previous save could not be written
+        """
+        now = monotonic() if now is None else now
+
+        if self._pending_save is not None and self._pending_save.done():
+            self._wait_for_pending_save()
+
+        if self.connection.total_changes != self._changes_seen:
+            self._changes_seen = self.connection.total_changes
+            self._last_change_time = now
+
+            if self._first_unsaved_change_time is None:
+                self._first_unsaved_change_time = now
+
+        # An uncommitted transaction is never saved
+        if not self.has_unsaved_changes or self.connection.in_transaction:
+            return False
+
+        if (now - self._last_change_time < self.save_delay
+                and now - self._first_unsaved_change_time < self.max_save_delay):
+            return False
+
+        self._start_save()
+
+        return True
+
+    def save(self) -> None:
+        """
+        Saves the vault now, if it has unsaved changes, and waits until the file is written.
+        :raise EncryptedVaultConflictError: if the file was changed by another process since it was read or last saved
+        :raise ValueError: if the connection has an uncommitted transaction
+        :raise OSError: if the file could not be written
+        """
+        if self.connection.in_transaction:
+            raise ValueError('The vault cannot be saved with an uncommitted transaction')
+
+        if self.has_unsaved_changes:
+            self._start_save()
+
+        self._wait_for_pending_save()
+
+    def close(self) -> None:
+        """
+        Saves the unsaved (committed) changes and closes the vault's connection. The connection is closed even if the
+        save fails.
+        """
+        try:
+            if self.connection.in_transaction:
+                self.connection.rollback()
+
+            self.save()
+        finally:
+            self._executor.shutdown()
+            self.connection.close()
+
+    def __enter__(self) -> 'EncryptedVault':
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
+
+
+def encrypt_database_file(db_name: str, vault_path: str, vault_password: str,
+                          kdf_parameters: Optional[KDFParameters] = None) -> None:
+    """
+    Writes the database file at the given path to an encrypted vault. The database file is left as it is, so that it
+    can be checked and removed once the vault opens.
+    :param db_name: the path of the database file
+    :param vault_path: the path of the encrypted vault to write
+    :param vault_password: the password the vault is encrypted with
+    :param kdf_parameters: the Argon2id parameters (defaults to those of the master password hashes)
+    :raise ValueError: if the vault password is an empty string or if there already is a file at the vault path
+    """
+    if os.path.exists(vault_path):
+        raise ValueError(f'{vault_path} already exists')
+
+    connection = sqlite3.connect(db_name)
+
+    try:
+        write_encrypted_chunks(vault_path, _serialized_chunks(connection.serialize()), vault_password,
+                               kdf_parameters=kdf_parameters, magic=VAULT_MAGIC)
+    finally:
+        connection.close()
@@ -0,0 +1,375 @@
+import json
+import os
+from csv import DictReader, DictWriter
+from sqlite3 import Connection
+from typing import List, Dict, Optional, Tuple, Iterable, Iterator
+
+from Utils.cryptography import derive_256_bit_salt_and_key, decrypt_aes_256_gcm
+from Utils.database import create_accounts, get_all_account_ids_names_urls_and_usernames_by_user_id, \
+    get_all_decrypted_account_passwords_by_user_id, reveal_sealed_account_metadata
+
+CSV_FIELDNAMES = ['name', 'url', 'username', 'password']
+
+DEFAULT_IMPORT_BATCH_SIZE = 100
+
+# The NDJSON format: a header line with the format name and schema version, then one JSON object per Account with the
+# name, url (a string or null, so that an empty url and no url stay distinct), username, and password. It is read and
+# written a line at a time, so files of any size take constant memory, and the line numbers let an interrupted import
+# or export resume where it stopped. Exports also write the id of each Account, which an interrupted export resumes
+# after (so Accounts added or deleted in between do not shift it); readers ignore it, like any other unknown key.
+# Readers reject files of a newer schema version than they know.
+NDJSON_FORMAT = 'personal-password-manager/accounts'
+NDJSON_VERSION = 1
+NDJSON_EXTENSIONS = ('.ndjson', '.jsonl')
+
+# The line of the first Account (the header is line 1)
+NDJSON_FIRST_ACCOUNT_LINE = 2
+
+
+def import_accounts_from_csv(csv_path: str, user_id: int, master_password: str, connection: Connection)\
+        -> Tuple[List[int], List[Dict[str, Optional[str]]]]:
+    """
+    Imports the Accounts in the CSV file at the given path for the User with the given id. The file must have at least
+    the name, username, and password columns (the url column is optional). Rows that cannot be added, due to missing
+    info or a duplicate Account name, are returned instead of raising; fully empty rows are skipped.
+    :param csv_path: the path of the CSV file to import
+    :param user_id: the id of the User to import the Accounts for
+    :param master_password: the User's master password
+    :param connection: the database connection to use
+    :return: the ids of the created Accounts and the rows that could not be added
+    :raise ValueError: if the CSV file does not have the necessary columns
+    :raise argon2.exceptions.VerifyMismatchError: if the master password is not valid for the User
+    """
+    with open(file=csv_path, mode='r', encoding='utf-8-sig') as csv_file:
+        reader = DictReader(csv_file)
+
+        if not reader.fieldnames or not {'name', 'username', 'password'}.issubset(reader.fieldnames):
+            raise ValueError('The CSV file must have at least these exact column names (the url column is optional): '
+                             'name, url, username, password')
+
+        has_url = 'url' in reader.fieldnames
+
+        return import_accounts(({'name': row['name'], 'url': row['url'] if has_url else None,
+                                 'username': row['username'], 'password': row['password']} for row in reader),
+                               user_id=user_id, master_password=master_password, connection=connection)
+
+
+def import_accounts(accounts: Iterable[Dict[str, Optional[str]]], user_id: int, master_password: str,
+                    connection: Connection, batch_size: int = DEFAULT_IMPORT_BATCH_SIZE)\
+        -> Tuple[List[int], List[Dict[str, Optional[str]]]]:
+    """
+    Imports the given Accounts for the User with the given id, consuming them as a stream and creating them in batches
+    with create_accounts (which verifies the master password once per batch instead of once per Account). Empty urls
+    are stored as no url. Accounts that cannot be added, due to missing info or a duplicate Account name, are returned
+    instead of raising; Accounts without any field value are skipped.
+    :param accounts: the Accounts, as dictionaries with name, url, username, and password keys
+    :param user_id: the id of the User to import the Accounts for
+    :param master_password: the User's master password
+    :param connection: the database connection to use
+    :param batch_size: the number of Accounts created per transaction
+    :return: the ids of the created Accounts and the Accounts that could not be added
+    :raise ValueError: if there is no User with the given id
+    :raise argon2.exceptions.VerifyMismatchError: if the master password is not valid for the User
+    """
+    created_account_ids = []
+    unimportable_accounts = []
+    batch = []
+
+    def create_batch():
+        for account, account_id in zip(batch, create_accounts(user_id=user_id, master_password=master_password,
+                                                              accounts=[{**account, 'url': account['url'] or None}
+                                                                        for account in batch],
+                                                              connection=connection)):
+            if account_id is None:
+                unimportable_accounts.append(account)
+            else:
+                created_account_ids.append(account_id)
+
+        batch.clear()
+
+    for account in accounts:
+        if not any(account.values()):
+            continue
+
+        batch.append(account)
+
+        if len(batch) >= batch_size:
+            create_batch()
+
+    if batch:
+        create_batch()
+
+    return created_account_ids, unimportable_accounts
+
+
+def write_accounts_to_csv(csv_path: str, accounts: Iterable[Dict[str, Optional[str]]]) -> None:
+    """
+    Writes the given Accounts (dictionaries with name, url, username, and password keys) to a CSV file at the given
+    path, in the format import_accounts_from_csv reads.
+    """
+    with open(csv_path, 'w', encoding='utf-8-sig', newline='') as destination_file:
+        writer = DictWriter(destination_file, fieldnames=CSV_FIELDNAMES, lineterminator='\n')
+        writer.writeheader()
+        writer.writerows(accounts)
+
+
+def export_accounts_to_csv(csv_path: str, user_id: int, master_password: str, connection: Connection) -> int:
+    """
+    Exports all Accounts of the User with the given id, with their decrypted passwords, to a CSV file at the given path.
+    :param csv_path: the path of the CSV file to write
+    :param user_id: the id of the User whose Accounts are exported
+    :param master_password: the User's master password
+    :param connection: the database connection to use
+    :return: the number of exported Accounts
+    :raise ValueError: if there is no User with the given id or if a cryptography error occurs
+    """
+    accounts = get_all_account_ids_names_urls_and_usernames_by_user_id(user_id=user_id, connection=connection) or []
+    passwords = get_all_decrypted_account_passwords_by_user_id(user_id=user_id, master_password=master_password,
+                                                               connection=connection) or {}
+
+    write_accounts_to_csv(csv_path, ({'name': name, 'url': url, 'username': username, 'password': passwords[account_id]}
+                                     for account_id, name, url, username in accounts))
+
+    return len(accounts)
+
+
+def iter_decrypted_accounts(user_id: int, master_password: str, connection: Connection, after_account_id: int = 0,
+                            batch_size: int = 256) -> Iterator[Tuple[int, str, Optional[str], str, str]]:
+    """
+    Yields the id, name, url, username, and decrypted password of each Account of the User with the given id, in id
+    order, fetching the rows in batches instead of loading the whole vault. The key of the last salt is reused, so
+    Accounts sharing a salt (like synthetic ones) only run Argon2 once.
+    :param after_account_id: the id after which to start (the Accounts up to it are not read)
+    :raise ValueError: if a cryptography error occurs
+    """
+    cursor = connection.cursor()
+    cursor.execute("""SELECT id, name, url, username, password, salt, nonce, tag FROM accounts WHERE user_id=?
+    AND id>? ORDER BY id""", (user_id, after_account_id))
+    keys: Dict[bytes, bytes] = {}
+
+    try:
+        while True:
+            rows = cursor.fetchmany(batch_size)
+
+            if not rows:
+                return
+
+            revealed = reveal_sealed_account_metadata(user_id, [row[0] for row in rows], connection)
+
+            for account_id, name, url, username, ciphertext, salt, nonce, tag in rows:
+                name, url, username = revealed.get(account_id, (name, url, username))
+
+                if salt not in keys:
+                    keys.clear()
+                    keys[salt] = derive_256_bit_salt_and_key(password=master_password, salt=salt)[1]
+
+                try:
+                    password = decrypt_aes_256_gcm(key=keys[salt], ciphertext=ciphertext, nonce=nonce, tag=tag)
+                except ValueError as e:
+                    raise ValueError(f'An error occurred while decrypting the password: {e}')
+
+                yield account_id, name, url, username, password
+    finally:
+        cursor.close()
+
+
+def _truncate_to_lines(path: str, line_count: int) -> bytes:
+    """
+    Truncates the file at the given path after its first line_count complete lines, dropping a partially written one.
+    :return: the last kept line
+    """
+    line = b''
+
+    with open(path, 'r+b') as ndjson_file:
+        for _ in range(line_count):
+            line = ndjson_file.readline()
+
+            if not line.endswith(b'\n'):
+                raise ValueError(f'{path} has fewer than {line_count} complete lines')
+
+        ndjson_file.truncate()
+
+    return line
+
+
+def _write_ndjson_lines(ndjson_path: str, accounts: Iterable[Dict], start_line: int) -> int:
+    """
+    Writes the given Accounts (JSON objects) to the NDJSON file at the given path, after its header if start_line is
+    the first Account line, or else appended to the (already truncated) file.
+    :return: the line after the last written Account
+    """
+    mode = 'a' if start_line > NDJSON_FIRST_ACCOUNT_LINE else 'w'
+    line = start_line
+
+    with open(ndjson_path, mode, encoding='utf-8', newline='\n') as ndjson_file:
+        if mode == 'w':
+            ndjson_file.write(json.dumps({'format': NDJSON_FORMAT, 'version': NDJSON_VERSION}) + '\n')
+
+        for account in accounts:
+            ndjson_file.write(json.dumps(account, ensure_ascii=False) + '\n')
+            line += 1
+
+    return line
+
+
+def write_accounts_to_ndjson(ndjson_path: str, accounts: Iterable[Tuple[str, Optional[str], str, str]],
+                             start_line: int = NDJSON_FIRST_ACCOUNT_LINE) -> int:
+    """
+    Writes the given Accounts to an NDJSON file at the given path, consuming them as a stream. With a start_line past
+    the first Account line, the existing file is resumed instead: it is cut after the line before start_line (dropping
+    a partially written line) and the given Accounts are appended from there.
+    :param ndjson_path: the path of the NDJSON file to write
+    :param accounts: the (name, url, username, password) of each Account to write, starting at start_line
+    :param start_line: the line of the first given Account
+    :return: the line after the last written Account, i.e. the start_line to resume from
+    :raise ValueError: if resuming a file that has fewer lines than start_line - 1
+    """
+    if start_line > NDJSON_FIRST_ACCOUNT_LINE:
+        _truncate_to_lines(ndjson_path, start_line - 1)
+
+    return _write_ndjson_lines(ndjson_path, ({'name': name, 'url': url, 'username': username, 'password': password}
+                                             for name, url, username, password in accounts), start_line)
+
+
+def _parse_ndjson_account(line: str, line_number: int) -> Dict[str, Optional[str]]:
+    try:
+        account = json.loads(line)
+    except ValueError as e:
+        raise ValueError(f'Line {line_number} is not valid JSON: {e}')
+
+    if not isinstance(account, dict):
+        raise ValueError(f'Line {line_number} is not a JSON object')
+
+    for field in CSV_FIELDNAMES:
+        value = account.get(field)
+
+        if field == 'url' and value is None:
+            continue
+
+        if not isinstance(value, str):
+            raise ValueError(f'Line {line_number}: the {field} must be a string')
+
+    return {field: account[field] for field in CSV_FIELDNAMES}
+
+
+def read_accounts_from_ndjson(ndjson_path: str, start_line: int = NDJSON_FIRST_ACCOUNT_LINE)\
+        -> Iterator[Tuple[int, Dict[str, Optional[str]]]]:
+    """
+    Reads the Accounts of the NDJSON file at the given path as a stream, starting at the given line (the lines before
+    it, except the header, are skipped without being parsed). Blank lines are skipped.
+    :param ndjson_path: the path of the NDJSON file
+    :param start_line: the line to start reading Accounts at
+    :return: an iterator of the line number and the Account (a dictionary with name, url, username, and password keys)
+    :raise ValueError: if the header is missing or of a newer version, or if a line is not a valid Account (raised when
+    that line is reached)
+    """
+    with open(ndjson_path, 'r', encoding='utf-8-sig') as ndjson_file:
+        try:
+            header = json.loads(ndjson_file.readline())
+        except ValueError:
+            header = None
+
+        if not isinstance(header, dict) or header.get('format') != NDJSON_FORMAT:
+            raise ValueError(f'{ndjson_path} is not an accounts NDJSON file')
+
+        if not isinstance(header.get('version'), int) or header['version'] > NDJSON_VERSION:
+            raise ValueError(f'{ndjson_path} has schema version {header.get("version")}, but only versions up to '
+                             f'{NDJSON_VERSION} are supported')
+
+        for line_number, line in enumerate(ndjson_file, start=NDJSON_FIRST_ACCOUNT_LINE):
+            if line_number < start_line or not line.strip():
+                continue
+
+            yield line_number, _parse_ndjson_account(line, line_number)
+
+
+def export_accounts_to_ndjson(ndjson_path: str, user_id: int, master_password: str, connection: Connection,
+                              start_line: int = NDJSON_FIRST_ACCOUNT_LINE) -> int:
+    """
+    Exports all Accounts of the User with the given id, with their decrypted passwords and ids, to an NDJSON file at the
+    given path, decrypting them a batch at a time. An interrupted export is resumed by passing the line it returned or,
+    after a crash, the number of complete lines in the file plus one: it continues after the id of the Account on the
+    line before (the Accounts up to it are not decrypted again, and Accounts added or deleted since do not shift it).
+    :param ndjson_path: the path of the NDJSON file to write
+    :param user_id: the id of the User whose Accounts are exported
+    :param master_password: the User's master password
+    :param connection: the database connection to use
+    :param start_line: the line to resume the export at
+    :return: the line after the last exported Account
+    :raise ValueError: if a cryptography error occurs, or if resuming a file that has fewer lines than start_line - 1
+    or whose line before start_line has no Account id
+    """
+    after_account_id = 0
+
+    if start_line > NDJSON_FIRST_ACCOUNT_LINE:
+        last_line = _truncate_to_lines(ndjson_path, start_line - 1)
+
+        try:
+            after_account_id = json.loads(last_line)['id']
+        except (ValueError, TypeError, KeyError):
+            after_account_id = None
+
+        if not isinstance(after_account_id, int):
+            raise ValueError(f'Line {start_line - 1} of {ndjson_path} has no Account id to resume the export after')
+
+    accounts = iter_decrypted_accounts(user_id, master_password, connection, after_account_id=after_account_id)
+
+    return _write_ndjson_lines(ndjson_path, ({'id': account_id, 'name': name, 'url': url, 'username': username,
+                                              'password': password}
+                                             for account_id, name, url, username, password in accounts), start_line)
+
+
+def import_accounts_from_ndjson(ndjson_path: str, user_id: int, master_password: str, connection: Connection,
+                                start_line: int = NDJSON_FIRST_ACCOUNT_LINE,
+                                batch_size: int = DEFAULT_IMPORT_BATCH_SIZE)\
+        -> Iterator[Tuple[int, List[Tuple[int, Optional[int], Dict[str, Optional[str]]]]]]:
+    """
+    Imports the Accounts of the NDJSON file at the given path for the User with the given id as a stream, creating them
+    in batches with create_accounts and yielding the result of each batch once it is committed. An interrupted import
+    is resumed by passing the line after the last line of the last yielded batch. If a line is invalid, the batch of
+    the lines before it is still committed and yielded before raising. Urls are kept as they are (null stays NULL and
+    an empty string stays empty).
+    :param ndjson_path: the path of the NDJSON file
+    :param user_id: the id of the User to import the Accounts for
+    :param master_password: the User's master password
+    :param connection: the database connection to use
+    :param start_line: the line to start (or resume) the import at
+    :param batch_size: the number of Accounts created per transaction
+    :return: an iterator of the last line number of each committed batch and, for each line of the batch, the line
+    number, the id of the created Account (None if it could not be added, due to missing info or a duplicate Account
+    name), and the Account
+    :raise ValueError: if the file is not a valid accounts NDJSON file
+    :raise argon2.exceptions.VerifyMismatchError: if the master password is not valid for the User
+    """
+    accounts = read_accounts_from_ndjson(ndjson_path, start_line=start_line)
+    batch = []
+
+    def create_batch() -> Tuple[int, List[Tuple[int, Optional[int], Dict[str, Optional[str]]]]]:
+        account_ids = create_accounts(user_id=user_id, master_password=master_password,
+                                      accounts=[account for _, account in batch], connection=connection)
+        results = [(line_number, account_id, account)
+                   for (line_number, account), account_id in zip(batch, account_ids)]
+        batch.clear()
+
+        return results[-1][0], results
+
+    while True:
+        try:
+            batch.append(next(accounts))
+        except StopIteration:
+            break
+        except ValueError:
+            if batch:
+                yield create_batch()
+
+            raise
+
+        if len(batch) >= batch_size:
+            yield create_batch()
+
+    if batch:
+        yield create_batch()
+
+
+def is_ndjson_path(path: str) -> bool:
+    return os.path.splitext(path)[1].lower() in NDJSON_EXTENSIONS
@@ -0,0 +1,416 @@
+import csv
+import io
+import json
+import xml.etree.ElementTree as ElementTree
+from sqlite3 import Connection
+from typing import Callable, Dict, Iterator, List, Optional, Tuple, Set, TextIO
+
+from Utils.import_export import import_accounts, DEFAULT_IMPORT_BATCH_SIZE
+from Utils.urls import normalize_url
+
+# Importers for the export files of other password managers, so that Users can migrate without renaming CSV columns by
+# hand. Each importer is registered under a name with a detect function, which is given the start of a file, and a read
+# function, which streams the file as Account dictionaries (name, url, username, password) that are then created in
+# batches. Nothing reads a whole file into memory: CSV files are read a row at a time, KeePass XML is read with
+# iterparse (dropping each entry once it is read), and Bitwarden JSON is read with an incremental reader that decodes
+# one item of the items array at a time.
+
+Account = Dict[str, Optional[str]]
+
+# The number of characters read from the start of a file to detect its format
+DETECT_HEAD_SIZE = 64 * 1024
+
+# The number of characters the incremental JSON reader reads at a time
+JSON_CHUNK_SIZE = 64 * 1024
+
+BITWARDEN_LOGIN_ITEM_TYPE = 1
+
+
+class Importer:
+    """
+    A registered importer: the format it reads, how to detect it from the start of a file, and how to read it.
+    """
+    def __init__(self, name: str, description: str, extensions: Tuple[str, ...], detect: Callable[[str], bool],
+                 read: Callable[[str], Iterator[Account]]):
+        self.name = name
+        self.description = description
+        self.extensions = extensions
+        self.detect = detect
+        self.read = read
+
+
+# The registered importers, in the order they are tried when detecting the format of a file
+IMPORTERS: Dict[str, Importer] = {}
+
+
+def importer(name: str, description: str, extensions: Tuple[str, ...], detect: Callable[[str], bool]):
+    """
+    Registers the decorated function, which streams the Accounts of a file, as the importer with the given name.
+    :param name: the unique name of the importer
+    :param description: the name of the format shown to the user
+    :param extensions: the file extensions of the format, for file dialogs
+    :param detect: returns whether the given start of a file is in the format
+    """
+    def decorator(read: Callable[[str], Iterator[Account]]):
+        if name in IMPORTERS:
+            raise ValueError(f'An importer with the name {name} is already registered')
+
+        IMPORTERS[name] = Importer(name, description, extensions, detect, read)
+        return read
+
+    return decorator
+
+
+def _account(name: Optional[str], url: Optional[str], username: Optional[str], password: Optional[str]) -> Account:
+    """
+    Returns the Account dictionary for the given fields. An Account without a name is named after the host of its url.
+    """
+    if not name:
+        normalized_url = normalize_url(url)
+        name = normalized_url[0] if normalized_url else name
+
+    return {'name': name, 'url': url or None, 'username': username, 'password': password}
+
+
+# CSV importers:
+
+def _csv_header(head: str) -> Set[str]:
+    """
+    Returns the lowercased column names of the CSV file that starts with the given text.
+    """
+    try:
+        return {column.strip().lower() for column in next(csv.reader(io.StringIO(head)), [])}
+    except csv.Error:
+        return set()
+
+
+def _first_value(row: Dict[str, Optional[str]], columns: Tuple[str, ...]) -> Optional[str]:
+    """
+    Returns the first non-empty value of the given columns in the row, or None.
+    """
+    for column in columns:
+        if row.get(column):
+            return row[column]
+
+    return None
+
+
+def register_csv_importer(name: str, description: str, columns: Dict[str, Tuple[str, ...]], marker_columns: Set[str],
+                          include_row: Optional[Callable[[Dict[str, Optional[str]]], bool]] = None,
+                          map_url: Optional[Callable[[Optional[str]], Optional[str]]] = None) -> None:
+    """
+    Registers an importer for CSV files, detected by their column names, that maps columns onto the Account fields.
+    Column names are matched case-insensitively.
+    :param name: the unique name of the importer
+    :param description: the name of the format shown to the user
+    :param columns: the lowercase column names for each Account field (name, url, username, and password), in order of
+    preference
+    :param marker_columns: the lowercase column names a file must have to be in the format
+    :param include_row: returns whether a row (keyed by lowercase column names) holds an Account, e.g. not a note
+    :param map_url: converts the url column into the Account url
+    """
+    def detect(head: str) -> bool:
+        return marker_columns.issubset(_csv_header(head))
+
+    def read(path: str) -> Iterator[Account]:
+        with open(file=path, mode='r', encoding='utf-8-sig', newline='') as csv_file:
+            reader = csv.reader(csv_file)
+            header = [column.strip().lower() for column in next(reader, [])]
+
+            for values in reader:
+                row = dict(zip(header, values))
+
+                if not any(values) or (include_row and not include_row(row)):
+                    continue
+
+                url = _first_value(row, columns.get('url', ()))
+
+                yield _account(name=_first_value(row, columns.get('name', ())),
+                               url=map_url(url) if map_url else url,
+                               username=_first_value(row, columns.get('username', ())),
+                               password=_first_value(row, columns.get('password', ())))
+
+    importer(name, description, ('.csv',), detect)(read)
+
+
+# Bitwarden separates the uris of an item with commas in CSV exports; only the first one is kept
+register_csv_importer('bitwarden-csv', 'Bitwarden CSV',
+                      columns={'name': ('name',), 'url': ('login_uri',), 'username': ('login_username',),
+                               'password': ('login_password',)},
+                      marker_columns={'login_uri', 'login_username', 'login_password'},
+                      include_row=lambda row: row.get('type', 'login') == 'login',
+                      map_url=lambda url: url.split(',')[0].strip() if url else url)
+
+# Also reads Safari exports, which have the same columns
+register_csv_importer('1password-csv', '1Password CSV',
+                      columns={'name': ('title',), 'url': ('url', 'website', 'login url'),
+                               'username': ('username',), 'password': ('password',)},
+                      marker_columns={'title', 'username', 'password'})
+
+# Chrome, Edge, and Firefox exports (Firefox has no name column, so its Accounts are named after their host)
+register_csv_importer('browser-csv', 'Browser CSV (Chrome, Edge, Firefox)',
+                      columns={'name': ('name',), 'url': ('url', 'origin'), 'username': ('username',),
+                               'password': ('password',)},
+                      marker_columns={'url', 'username', 'password'})
+
+
+# Bitwarden JSON importer:
+
+class _JSONReader:
+    """
+    Reads the values of a JSON document from a text file one at a time, holding only a window of the file in memory.
+    Containers are either stepped into with expect (to stream their items) or decoded whole with value.
+    """
+    def __init__(self, file: TextIO, chunk_size: int = JSON_CHUNK_SIZE):
+        self._file = file
+        self._chunk_size = chunk_size
+        self._decoder = json.JSONDecoder()
+        self._buffer = ''
+        self._position = 0
+        self._eof = False
+
+    def _fill(self) -> bool:
+        """
+        Drops the consumed part of the buffer and reads the next chunk into it. Returns False at the end of the file.
+        """
+        chunk = self._file.read(self._chunk_size) if not self._eof else ''
+
+        if not chunk:
+            self._eof = True
+            return False
+
+        self._buffer = self._buffer[self._position:] + chunk
+        self._position = 0
+
+        return True
+
+    def peek(self) -> str:
+        """
+        Skips whitespace and returns the next character, or an empty string at the end of the file.
+        """
+        while True:
+            while self._position < len(self._buffer) and self._buffer[self._position] in ' \t\r\n':
+                self._position += 1
+
+            if self._position < len(self._buffer):
+                return self._buffer[self._position]
+
+            if not self._fill():
+                return ''
+
+    def expect(self, character: str) -> None:
+        """
+        Consumes the given structural character (e.g. the { or [ of a container).
+        :raise ValueError: if the next character is a different one
+        """
+        if self.peek() != character:
+            raise ValueError(f'Invalid JSON: expected {character!r} but found {self.peek() or "the end of the file"!r}')
+
+        self._position += 1
+
+    def value(self):
+        """
+        Decodes and consumes the next whole value.
+        :raise ValueError: if it is not valid JSON
+        """
+        self.peek()
+
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self._buffer, self._position)
+
+                # A number at the end of the buffer may continue in the next chunk
+                if end < len(self._buffer) or self._eof:
+                    self._position = end
+                    return value
+            except json.JSONDecodeError as e:
+                if self._eof:
+                    raise ValueError(f'Invalid JSON: {e}') from e
+
+            self._fill()
+
+    def items(self, end: str) -> Iterator[None]:
+        """
+        Iterates over the members of the container that was just stepped into, whose closing character is given. The
+        caller consumes each member, and the separating commas and closing character are consumed here.
+        """
+        if self.peek() == end:
+            self._position += 1
+            return
+
+        while True:
+            yield
+
+            separator = self.peek()
+
+            if separator not in (',', end):
+                raise ValueError(f"Invalid JSON: expected ',' or {end!r} but found "
+                                 f"{separator or 'the end of the file'!r}")
+
+            self._position += 1
+
+            if separator == end:
+                return
+
+
+def _detect_bitwarden_json(head: str) -> bool:
+    head = head.lstrip()
+
+    return head.startswith('{') and ('"items"' in head or '"encrypted"' in head)
+
+
+@importer('bitwarden-json', 'Bitwarden JSON', ('.json',), _detect_bitwarden_json)
+def read_bitwarden_json(path: str) -> Iterator[Account]:
+    """
+    Streams the login items of an unencrypted Bitwarden JSON export. Folders, notes, cards, and identities are skipped.
+    :raise ValueError: if the export is encrypted or is not valid JSON
+    """
+    with open(file=path, mode='r', encoding='utf-8-sig') as json_file:
+        reader = _JSONReader(json_file)
+        reader.expect('{')
+
+        for _ in reader.items('}'):
+            key = reader.value()
+            reader.expect(':')
+
+            if key == 'encrypted':
+                if reader.value():
+                    raise ValueError('Encrypted Bitwarden exports cannot be imported, please export the vault in the '
+                                     'unencrypted JSON format')
+            elif key == 'items':
+                reader.expect('[')
+
+                for _ in reader.items(']'):
+                    item = reader.value()
+
+                    if not isinstance(item, dict) or item.get('type') != BITWARDEN_LOGIN_ITEM_TYPE:
+                        continue
+
+                    login = item.get('login') or {}
+                    uris = [uri.get('uri') for uri in login.get('uris') or () if isinstance(uri, dict)]
+
+                    yield _account(name=item.get('name'), url=next((uri for uri in uris if uri), None),
+                                   username=login.get('username'), password=login.get('password'))
+            else:
+                reader.value()
+
+
+# KeePass XML importer:
+
+def _keepass_fields(entry: ElementTree.Element) -> Dict[str, Optional[str]]:
+    """
+    Returns the values of the String fields of the given KeePass entry by their key.
+    """
+    return {field.findtext('Key'): field.findtext('Value') for field in entry.iterfind('String')}
+
+
+@importer('keepass-xml', 'KeePass 2 XML', ('.xml',), lambda head: '<KeePassFile' in head)
+def read_keepass_xml(path: str) -> Iterator[Account]:
+    """
+    Streams the entries of a KeePass 2 XML export, skipping the entry histories and the recycle bin.
+    :raise ValueError: if the file is not valid XML
+    """
+    recycle_bin_uuid = None
+    elements = []
+
+    # Whether each open group is (in) the recycle bin
+    groups_in_recycle_bin = []
+
+    try:
+        for event, element in ElementTree.iterparse(path, events=('start', 'end')):
+            if event == 'start':
+                elements.append(element)
+
+                if element.tag == 'Group':
+                    groups_in_recycle_bin.append(bool(groups_in_recycle_bin) and groups_in_recycle_bin[-1])
+
+                continue
+
+            elements.pop()
+            parent = elements[-1] if elements else None
+
+            if element.tag == 'RecycleBinUUID':
+                recycle_bin_uuid = element.text
+            elif element.tag == 'Meta':
+                # The Meta element can hold large binaries, such as custom icons
+                element.clear()
+            elif element.tag == 'UUID' and parent is not None and parent.tag == 'Group':
+                if recycle_bin_uuid and element.text == recycle_bin_uuid:
+                    groups_in_recycle_bin[-1] = True
+            elif element.tag == 'Group':
+                groups_in_recycle_bin.pop()
+            elif element.tag == 'Entry' and parent is not None and parent.tag == 'Group':
+                if not groups_in_recycle_bin[-1]:
+                    fields = _keepass_fields(element)
+
+                    yield _account(name=fields.get('Title'), url=fields.get('URL'), username=fields.get('UserName'),
+                                   password=fields.get('Password'))
+
+                # Entries (and their histories) are dropped once read, so that memory stays constant
+                parent.remove(element)
+    except ElementTree.ParseError as e:
+        raise ValueError(f'Invalid KeePass XML: {e}') from e
+
+
+# Detection and import:
+
+def detect_importer(path: str) -> Importer:
+    """
+    Returns the importer for the format of the given file, detected from its start.
+    :raise ValueError: if the format is not one of the supported ones
+    """
+    with open(file=path, mode='r', encoding='utf-8-sig', errors='replace') as file:
+        head = file.read(DETECT_HEAD_SIZE)
+
+    for registered_importer in IMPORTERS.values():
+        if registered_importer.detect(head):
+            return registered_importer
+
+    raise ValueError('The file is not in a supported export format: '
+                     + ', '.join(registered_importer.description for registered_importer in IMPORTERS.values()))
+
+
+def read_accounts(path: str, importer_name: Optional[str] = None) -> Iterator[Account]:
+    """
+    Streams the Accounts of the given export file of another password manager.
+    :param path: the path of the export file
+    :param importer_name: the name of the importer to use (detected from the file by default)
+    :return: an iterator over the Accounts, as dictionaries with name, url, username, and password keys
+    :raise ValueError: if there is no importer with the given name or the format is not detected
+    """
+    if importer_name is None:
+        return detect_importer(path).read(path)
+
+    if importer_name not in IMPORTERS:
+        raise ValueError(f'There is no importer with the given name ({importer_name})')
+
+    return IMPORTERS[importer_name].read(path)
+
+
+def import_accounts_from_file(path: str, user_id: int, master_password: str, connection: Connection,
+                              importer_name: Optional[str] = None, batch_size: int = DEFAULT_IMPORT_BATCH_SIZE)\
+        -> Tuple[List[int], List[Account]]:
+    """
+    Imports the Accounts of the given export file of another password manager for the User with the given id,
+    streaming the file and creating the Accounts in batches. Accounts without a name, username, or password, or with a
+    name that is already in use, are returned instead of raising.
+    :param path: the path of the export file
+    :param user_id: the id of the User to import the Accounts for
+    :param master_password: the User's master password
+    :param connection: the database connection to use
+    :param importer_name: the name of the importer to use (detected from the file by default)
+    :param batch_size: the number of Accounts created per transaction
+    :return: the ids of the created Accounts and the Accounts that could not be added
+    :raise ValueError: if the format is not supported or the file is invalid (the Accounts of the batches before the
+    invalid part stay imported)
+    """
+    return import_accounts(read_accounts(path, importer_name), user_id=user_id, master_password=master_password,
+                           connection=connection, batch_size=batch_size)
+
+
+def supported_extensions() -> List[str]:
+    """
+    Returns the file extensions of the registered importers, without duplicates.
+    """
+    return sorted({extension for registered_importer in IMPORTERS.values()
+                   for extension in registered_importer.extensions})
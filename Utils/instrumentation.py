@@ -0,0 +1,265 @@
+import atexit
+import json
+import os
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+from functools import wraps
+from inspect import signature
+from time import perf_counter
+from typing import Callable, Dict, Optional, Any, Iterator, List
+
+# Opt-in instrumentation of the hot paths (key derivation, AES, and the database utils). Disabled by default: the
+# instrumented wrappers then only check a module-level flag before calling straight through. Enable it either by
+# calling enable() or by setting the PPM_INSTRUMENTATION environment variable, in which case the metrics are also
+# dumped at exit to PPM_INSTRUMENTATION_JSON and PPM_INSTRUMENTATION_PROMETHEUS (defaulting to ppm_metrics.json and
+# ppm_metrics.prom in the working directory).
+
+ENABLED_ENV_VAR = 'PPM_INSTRUMENTATION'
+JSON_PATH_ENV_VAR = 'PPM_INSTRUMENTATION_JSON'
+PROMETHEUS_PATH_ENV_VAR = 'PPM_INSTRUMENTATION_PROMETHEUS'
+
+# Upper bounds (in seconds) of the latency histogram buckets, spanning a cached SQL lookup to a slow Argon2 run
+LATENCY_BUCKETS = (0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_enabled = os.environ.get(ENABLED_ENV_VAR, '') not in ('', '0')
+_lock = threading.Lock()
+
+
+class _Metric:
+    """
+    The call count, error count, latency histogram, and bytes processed of one instrumented function or block.
+    """
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.total_seconds = 0.0
+        self.bytes_processed = 0
+        # One count per bucket in LATENCY_BUCKETS plus one for the +Inf bucket (not cumulative)
+        self.bucket_counts = [0] * (len(LATENCY_BUCKETS) + 1)
+
+
+_metrics: Dict[str, _Metric] = {}
+
+
+def enable() -> None:
+    """
+    Starts recording metrics for every instrumented function and block.
+    """
+    global _enabled
+    _enabled = True
+
+
+def disable() -> None:
+    """
+    Stops recording metrics. Already recorded metrics are kept until reset() is called.
+    """
+    global _enabled
+    _enabled = False
+
+
+def is_enabled() -> bool:
+    return _enabled
+
+
+def reset() -> None:
+    """
+    Discards all recorded metrics.
+    """
+    with _lock:
+        _metrics.clear()
+
+
+def record(name: str, seconds: float, bytes_processed: int = 0, error: bool = False) -> None:
+    """
+    Records one call of the instrumented function or block with the given name.
+    :param name: the name of the metric
+    :param seconds: how long the call took
+    :param bytes_processed: how many bytes of input the call processed
+    :param error: whether the call raised an exception
+    """
+    bucket_index = bisect_left(LATENCY_BUCKETS, seconds)
+
+    with _lock:
+        metric = _metrics.get(name)
+
+        if metric is None:
+            metric = _metrics[name] = _Metric()
+
+        metric.calls += 1
+        metric.errors += error
+        metric.total_seconds += seconds
+        metric.bytes_processed += bytes_processed
+        metric.bucket_counts[bucket_index] += 1
+
+
+def _byte_length(value: Any) -> int:
+    if isinstance(value, str):
+        return len(value.encode('utf-8'))
+
+    try:
+        return len(value)
+    except TypeError:
+        return 0
+
+
+def instrumented(name: Optional[str] = None, bytes_argument: Optional[str] = None) -> Callable:
+    """
+    Decorator that records the call count, latency, errors, and (optionally) the bytes processed of the decorated
+    function while instrumentation is enabled.
+    :param name: the name of the metric (defaults to the module and qualified name of the function)
+    :param bytes_argument: the name of the argument whose length counts as the bytes processed by a call
+    """
+    def decorator(function: Callable) -> Callable:
+        metric_name = name or f'{function.__module__}.{function.__qualname__}'
+
+        if bytes_argument:
+            argument_position = list(signature(function).parameters).index(bytes_argument)
+        else:
+            argument_position = None
+
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return function(*args, **kwargs)
+
+            if argument_position is None:
+                bytes_processed = 0
+            elif bytes_argument in kwargs:
+                bytes_processed = _byte_length(kwargs[bytes_argument])
+            elif argument_position < len(args):
+                bytes_processed = _byte_length(args[argument_position])
+            else:
+                bytes_processed = 0
+
+            start = perf_counter()
+
+            try:
+                result = function(*args, **kwargs)
+            except BaseException:
+                record(metric_name, perf_counter() - start, bytes_processed, error=True)
+                raise
+
+            record(metric_name, perf_counter() - start, bytes_processed)
+
+            return result
+
+        return wrapper
+
+    return decorator
+
+
+@contextmanager
+def timer(name: str, bytes_processed: int = 0) -> Iterator[None]:
+    """
+    Context manager that records the duration of the enclosed block under the given name while instrumentation is
+    enabled.
+    :param name: the name of the metric
+    :param bytes_processed: how many bytes of input the block processes
+    """
+    if not _enabled:
+        yield
+        return
+
+    start = perf_counter()
+
+    try:
+        yield
+    except BaseException:
+        record(name, perf_counter() - start, bytes_processed, error=True)
+        raise
+
+    record(name, perf_counter() - start, bytes_processed)
+
+
+def snapshot() -> Dict[str, Dict[str, Any]]:
+    """
+    Returns a copy of the recorded metrics keyed by name, with cumulative histogram buckets keyed by their upper bound.
+    """
+    with _lock:
+        metrics = {name: (metric.calls, metric.errors, metric.total_seconds, metric.bytes_processed,
+                          list(metric.bucket_counts))
+                   for name, metric in _metrics.items()}
+
+    result = {}
+
+    for name, (calls, errors, total_seconds, bytes_processed, bucket_counts) in sorted(metrics.items()):
+        cumulative_buckets = {}
+        running_count = 0
+
+        for upper_bound, bucket_count in zip([*map(str, LATENCY_BUCKETS), '+Inf'], bucket_counts):
+            running_count += bucket_count
+            cumulative_buckets[upper_bound] = running_count
+
+        result[name] = {'calls': calls,
+                        'errors': errors,
+                        'total_seconds': total_seconds,
+                        'mean_seconds': total_seconds / calls if calls else 0.0,
+                        'bytes_processed': bytes_processed,
+                        'latency_buckets': cumulative_buckets}
+
+    return result
+
+
+def to_prometheus_text() -> str:
+    """
+    Returns the recorded metrics in the Prometheus text exposition format.
+    """
+    metrics = snapshot()
+    lines: List[str] = []
+
+    def label(metric_name: str) -> str:
+        escaped_name = metric_name.replace('\\', '\\\\').replace('"', '\\"')
+        return f'function="{escaped_name}"'
+
+    lines.append('# HELP ppm_calls_total Number of calls of an instrumented function.')
+    lines.append('# TYPE ppm_calls_total counter')
+    lines.extend(f'ppm_calls_total{{{label(name)}}} {metric["calls"]}' for name, metric in metrics.items())
+
+    lines.append('# HELP ppm_call_errors_total Number of calls of an instrumented function that raised.')
+    lines.append('# TYPE ppm_call_errors_total counter')
+    lines.extend(f'ppm_call_errors_total{{{label(name)}}} {metric["errors"]}' for name, metric in metrics.items())
+
+    lines.append('# HELP ppm_bytes_processed_total Number of input bytes processed by an instrumented function.')
+    lines.append('# TYPE ppm_bytes_processed_total counter')
+    lines.extend(f'ppm_bytes_processed_total{{{label(name)}}} {metric["bytes_processed"]}'
+                 for name, metric in metrics.items())
+
+    lines.append('# HELP ppm_call_duration_seconds Latency of an instrumented function.')
+    lines.append('# TYPE ppm_call_duration_seconds histogram')
+
+    for name, metric in metrics.items():
+        for upper_bound, bucket_count in metric['latency_buckets'].items():
+            lines.append(f'ppm_call_duration_seconds_bucket{{{label(name)},le="{upper_bound}"}} {bucket_count}')
+
+        lines.append(f'ppm_call_duration_seconds_sum{{{label(name)}}} {metric["total_seconds"]}')
+        lines.append(f'ppm_call_duration_seconds_count{{{label(name)}}} {metric["calls"]}')
+
+    return '\n'.join(lines) + '\n'
+
+
+def dump(json_path: Optional[str] = None, prometheus_path: Optional[str] = None) -> None:
+    """
+    Writes the recorded metrics to the given JSON and/or Prometheus text-format files.
+    :param json_path: the file to write the JSON metrics to, if any
+    :param prometheus_path: the file to write the Prometheus text-format metrics to, if any
+    """
+    if json_path:
+        with open(json_path, 'w', encoding='utf-8') as json_file:
+            json.dump(snapshot(), json_file, indent=2)
+
+    if prometheus_path:
+        with open(prometheus_path, 'w', encoding='utf-8') as prometheus_file:
+            prometheus_file.write(to_prometheus_text())
+
+
+def dump_at_exit(json_path: Optional[str] = None, prometheus_path: Optional[str] = None) -> None:
+    """
+    Registers a dump of the recorded metrics to the given files when the interpreter exits.
+    """
+    atexit.register(dump, json_path=json_path, prometheus_path=prometheus_path)
+
+
+if _enabled:
+    dump_at_exit(json_path=os.environ.get(JSON_PATH_ENV_VAR, 'ppm_metrics.json'),
+                 prometheus_path=os.environ.get(PROMETHEUS_PATH_ENV_VAR, 'ppm_metrics.prom'))
@@ -0,0 +1,255 @@
+import os
+import sqlite3
+from sqlite3 import Connection
+from typing import Dict, Optional, List
+
+from Database.database_setup import setup_tables
+from Utils.database import create_user
+from Utils.sql_trace import connect
+
+# An optional storage layout for multi-user deployments, where every User has their own database file (a shard) next
+# to a small directory database that maps emails to User ids. In the single-file layout, every write takes the lock of
+# the whole database, so one User's import or rehash blocks every other User's writes; with a shard per User, writes
+# of different Users never contend, and only creating a User writes to the directory.
+#
+# A shard is a complete database (the same tables, indexes, and triggers as the single file) that only holds the rows
+# of its User, including their users row under the id the directory assigned. So every Utils.database function works
+# on it unchanged: routing is picking the connection, which ShardedVault.connect_by_email does, and the functions are
+# then called with it as before. Since a User's rows all live in their shard, nothing can span two Users: an item can
+# only be shared (see create_shared_item) in the single-file layout, and shard_database_file only keeps each shared
+# item in the shard of its owner, without its other members.
+#
+# shard_database_file migrates a single-file database to the layout, copying every table row by row (keeping the ids,
+# so that the change journal and the Account versions carry over) instead of copying the whole file once per User.
+
+DIRECTORY_NAME = 'directory.sqlite3'
+
+DIRECTORY_SCHEMA = (
+    """CREATE TABLE IF NOT EXISTS users (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    email TEXT UNIQUE NOT NULL
+    ) STRICT ;""",
+)
+
+# The statements that copy the rows of one User from the attached single-file database (source) to their shard, in an
+# order that satisfies the foreign keys. The accounts are copied after their journal entries, and the entries that
+# their insert triggers add are then dropped, so that the journal of the shard is the one of the single file.
+SHARD_COPY_STATEMENTS = (
+    "INSERT INTO users SELECT * FROM source.users WHERE id=:user_id",
+    "INSERT INTO user_keys SELECT * FROM source.user_keys WHERE user_id=:user_id",
+    "INSERT INTO sealed_users SELECT * FROM source.sealed_users WHERE user_id=:user_id",
+    "INSERT INTO user_key_pairs SELECT * FROM source.user_key_pairs WHERE user_id=:user_id",
+    "INSERT INTO account_changes SELECT * FROM source.account_changes WHERE user_id=:user_id",
+    "INSERT OR REPLACE INTO account_changes_compaction SELECT * FROM source.account_changes_compaction",
+    "INSERT INTO accounts SELECT * FROM source.accounts WHERE user_id=:user_id",
+    """DELETE FROM account_changes WHERE revision > (SELECT IFNULL(MAX(revision), 0) FROM source.account_changes
+    WHERE user_id=:user_id)""",
+    "INSERT INTO account_urls SELECT * FROM source.account_urls WHERE user_id=:user_id",
+    "INSERT INTO account_fingerprints SELECT * FROM source.account_fingerprints WHERE user_id=:user_id",
+    "INSERT INTO account_metadata SELECT * FROM source.account_metadata WHERE user_id=:user_id",
+    "INSERT INTO account_metadata_tokens SELECT * FROM source.account_metadata_tokens WHERE user_id=:user_id",
+    "INSERT INTO shared_items SELECT * FROM source.shared_items WHERE owner_id=:user_id",
+    """INSERT INTO shared_item_members SELECT members.* FROM source.shared_item_members AS members
+    JOIN source.shared_items AS items ON items.id = members.item_id
+    WHERE items.owner_id=:user_id AND members.user_id=:user_id""",
+    "INSERT INTO attachments SELECT * FROM source.attachments WHERE user_id=:user_id",
+    """INSERT INTO attachment_chunks SELECT chunks.* FROM source.attachment_chunks AS chunks
+    JOIN source.attachments AS attachments ON attachments.id = chunks.attachment_id
+    WHERE attachments.user_id=:user_id""",
+)
+
+
+def shard_name(user_id: int) -> str:
+    """
+    Returns the file name of the shard of the User with the given id.
+    """
+    return f'user_{user_id}.sqlite3'
+
+
+def _setup_directory(connection: Connection) -> None:
+    for statement in DIRECTORY_SCHEMA:
+        connection.execute(statement)
+
+    connection.commit()
+
+
+class ShardedVault:
+    """
+    A sharded vault directory: the directory database, and a connection to each shard opened so far.
+    """
+    def __init__(self, path: str):
+        """
+        Opens the sharded vault in the directory at the given path, or creates an empty one if there is none.
+        :param path: the path of the directory
+        """
+        os.makedirs(path, exist_ok=True)
+
+        self.path = path
+        self.directory = connect(os.path.join(path, DIRECTORY_NAME))
+        self._shards: Dict[int, Connection] = {}
+
+        _setup_directory(self.directory)
+
+    def get_user_id_by_email(self, email: str) -> Optional[int]:
+        """
+        Returns the id of the User with the given email if there is one, else None.
+        """
+        result = self.directory.execute("SELECT id FROM users WHERE email=?", (email,)).fetchone()
+
+        return result[0] if result is not None else None
+
+    def create_user(self, email: str, password: str) -> int:
+        """
+        Creates a new User with the given email and a hash of the given password, in a new shard.
+        :return: the id of the created User
+        :raise ValueError: if the given email is invalid or an empty string, or if the given password is an empty string
+        :raise Sqlite3.IntegrityError: if there already is a User with the given email
+        :raise argon2.exceptions.HashingError: if hashing fails
+        """
+        cursor = self.directory.cursor()
+
+        # The directory row stays uncommitted (holding the directory's lock) until the shard is created
+        cursor.execute("INSERT INTO users VALUES (NULL, ?) RETURNING id", (email,))
+        user_id = cursor.fetchone()[0]
+        cursor.close()
+
+        shard_path = os.path.join(self.path, shard_name(user_id))
+
+        try:
+            if os.path.exists(shard_path):
+                raise ValueError(f'The shard of a new User already exists ({shard_path})')
+
+            connection = connect(shard_path)
+
+            try:
+                setup_tables(connection)
+                create_user(email, password, connection, user_id=user_id)
+            except BaseException:
+                connection.close()
+                os.remove(shard_path)
+                raise
+
+            self.directory.commit()
+        except BaseException:
+            self.directory.rollback()
+            raise
+
+        self._shards[user_id] = connection
+
+        return user_id
+
+    def connect(self, user_id: int) -> Connection:
+        """
+        Returns the connection to the shard of the User with the given id, which is opened on first use and closed with
+        the vault.
+        :raise ValueError: if there is no User with the given id or their shard is missing
+        """
+        connection = self._shards.get(user_id)
+
+        if connection is not None:
+            return connection
+
+        if self.directory.execute("SELECT 1 FROM users WHERE id=?", (user_id,)).fetchone() is None:
+            raise ValueError(f'There is no User with the given user_id ({user_id})')
+
+        shard_path = os.path.join(self.path, shard_name(user_id))
+
+        # sqlite3 would create an empty database instead
+        if not os.path.exists(shard_path):
+            raise ValueError(f'The shard of the User with the given user_id ({user_id}) is missing ({shard_path})')
+
+        connection = connect(shard_path)
+        setup_tables(connection)
+        self._shards[user_id] = connection
+
+        return connection
+
+    def connect_by_email(self, email: str) -> Connection:
+        """
+        Returns the connection to the shard of the User with the given email (see connect).
+        :raise ValueError: if there is no User with the given email or their shard is missing
+        """
+        user_id = self.get_user_id_by_email(email)
+
+        if user_id is None:
+            raise ValueError(f'There is no User with the email {email}')
+
+        return self.connect(user_id)
+
+    def close(self) -> None:
+        """
+        Closes the directory and every shard connection.
+        """
+        for connection in self._shards.values():
+            connection.close()
+
+        self._shards.clear()
+        self.directory.close()
+
+    def __enter__(self) -> 'ShardedVault':
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
+
+
+def shard_database_file(db_name: str, path: str) -> int:
+    """
+    Writes the database file at the given path to a new sharded vault: a shard per User with a copy of their rows, and
+    the directory. The database file is left as it is, so that it can be checked and removed once the vault opens.
+    Shared items are only kept by their owner (see the module comment).
+    :param db_name: the path of the database file
+    :param path: the path of the directory to write the sharded vault to, which must not exist or be empty
+    :return: the number of Users
+    :raise ValueError: if there already is a file, or a directory that is not empty, at the given path
+    """
+    if os.path.isfile(path) or (os.path.isdir(path) and os.listdir(path)):
+        raise ValueError(f'{path} already exists')
+
+    source = sqlite3.connect(db_name)
+
+    try:
+        setup_tables(source)
+        users = source.execute("SELECT id, email FROM users ORDER BY id").fetchall()
+    finally:
+        source.close()
+
+    os.makedirs(path, exist_ok=True)
+    written: List[str] = []
+
+    try:
+        for user_id, _ in users:
+            shard_path = os.path.join(path, shard_name(user_id))
+            written.append(shard_path)
+            shard = sqlite3.connect(shard_path)
+
+            try:
+                setup_tables(shard)
+                shard.execute("ATTACH DATABASE ? AS source", (db_name,))
+
+                for statement in SHARD_COPY_STATEMENTS:
+                    shard.execute(statement, {'user_id': user_id})
+
+                shard.commit()
+                shard.execute("DETACH DATABASE source")
+            finally:
+                shard.close()
+
+        # Written last, so that the vault does not open before every shard is written
+        written.append(os.path.join(path, DIRECTORY_NAME))
+        directory = sqlite3.connect(written[-1])
+
+        try:
+            _setup_directory(directory)
+            directory.executemany("INSERT INTO users VALUES (?, ?)", users)
+            directory.commit()
+        finally:
+            directory.close()
+    except BaseException:
+        for file_name in written:
+            if os.path.exists(file_name):
+                os.remove(file_name)
+
+        raise
+
+    return len(users)
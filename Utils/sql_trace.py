@@ -0,0 +1,374 @@
+import atexit
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+from sqlite3 import Connection, Cursor
+from time import perf_counter
+from typing import Dict, List, Optional, Any, Iterable
+
+# Optional SQL tracing for the connections used by Utils.database and the GUI. A trace callback counts every statement
+# SQLite runs (including statements run by triggers and implicit transaction statements), while the traced cursor
+# times each statement from execution until its last row is fetched and counts the rows it affected or returned.
+# Statements are aggregated by their normalized text, where every literal and parameter is replaced with '?', so that
+# no account data (or password hash) ever ends up in the trace or the logs. Statements slower than the threshold are
+# logged with their EXPLAIN QUERY PLAN.
+#
+# Set PPM_SQL_TRACE=1 to trace the connections opened through connect() below. PPM_SQL_TRACE_SLOW_MS sets the slow
+# query threshold in milliseconds (default 50) and PPM_SQL_TRACE_REPORT the file the report is written to at exit
+# (default ppm_sql_trace.json).
+
+ENABLED_ENV_VAR = 'PPM_SQL_TRACE'
+SLOW_QUERY_THRESHOLD_ENV_VAR = 'PPM_SQL_TRACE_SLOW_MS'
+REPORT_PATH_ENV_VAR = 'PPM_SQL_TRACE_REPORT'
+
+DEFAULT_SLOW_QUERY_THRESHOLD_MS = 50.0
+
+# Statements executed at least this many times are reported as repeated, e.g. a lookup run once per row (N+1)
+DEFAULT_REPEATED_STATEMENT_COUNT = 10
+
+logger = logging.getLogger(__name__)
+
+_LITERAL_PATTERN = re.compile(r"""
+    [xX]'[0-9a-fA-F]*'                      # blob literal
+    | '(?:[^']|'')*'                        # string literal
+    | (?<![\w$])-?\d+(?:\.\d+)?(?:[eE][-+]?\d+)?(?![\w$])   # numeric literal
+    | \?\d*                                 # positional parameter
+    | [:@$][A-Za-z_]\w*                     # named parameter
+    | \bNULL\b                              # NULL (as bound for None parameters)
+""", re.VERBOSE | re.IGNORECASE)
+
+
+def normalize_sql(sql: str) -> str:
+    """
+    Returns the given statement with every literal and parameter replaced by '?' and whitespace collapsed, so that all
+    executions of the same statement share one normalized text regardless of the bound values.
+    """
+    return ' '.join(_LITERAL_PATTERN.sub('?', sql).split())
+
+
+class StatementStats:
+    """
+    The aggregated executions of one normalized statement.
+    """
+    def __init__(self, statement: str):
+        self.statement = statement
+        self.count = 0
+        self.timed_count = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+        self.rows = 0
+        self.slow_count = 0
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {'statement': self.statement,
+                'count': self.count,
+                'timed_count': self.timed_count,
+                'total_ms': self.total_seconds * 1000,
+                'mean_ms': self.total_seconds * 1000 / self.timed_count if self.timed_count else 0.0,
+                'max_ms': self.max_seconds * 1000,
+                'rows': self.rows,
+                'slow_count': self.slow_count}
+
+
+class SQLTrace:
+    """
+    Collects the statements executed on the connections it is attached to.
+    """
+    def __init__(self, slow_query_threshold_ms: float = DEFAULT_SLOW_QUERY_THRESHOLD_MS,
+                 slow_query_logger: logging.Logger = logger):
+        self.slow_query_threshold_seconds = slow_query_threshold_ms / 1000
+        self.slow_query_logger = slow_query_logger
+        self.statements: Dict[str, StatementStats] = {}
+        self.slow_queries: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+
+    def _stats(self, statement: str) -> StatementStats:
+        stats = self.statements.get(statement)
+
+        if stats is None:
+            stats = self.statements[statement] = StatementStats(statement)
+
+        return stats
+
+    def attach(self, connection: Connection) -> None:
+        """
+        Starts counting every statement SQLite executes on the given connection.
+        """
+        connection.set_trace_callback(self._trace_callback)
+
+    @staticmethod
+    def detach(connection: Connection) -> None:
+        connection.set_trace_callback(None)
+
+    def _trace_callback(self, sql: str) -> None:
+        # The query plans requested for slow statements are not statements of the application
+        if sql.startswith('EXPLAIN QUERY PLAN'):
+            return
+
+        statement = normalize_sql(sql)
+
+        with self._lock:
+            self._stats(statement).count += 1
+
+    def record_execution(self, sql: str, parameters: Any, seconds: float, rows: int, connection: Connection) -> None:
+        """
+        Records the duration and rows of one execution of the given statement, and logs it with its query plan if it
+        was slower than the threshold.
+        :param sql: the statement as passed to execute (with placeholders)
+        :param parameters: the parameters the statement was executed with
+        :param seconds: how long the statement took, from execution until its last row was fetched
+        :param rows: the number of rows the statement affected or returned
+        :param connection: the connection the statement was executed on
+        """
+        statement = normalize_sql(sql)
+        is_slow = seconds >= self.slow_query_threshold_seconds
+
+        with self._lock:
+            stats = self._stats(statement)
+            stats.timed_count += 1
+            stats.total_seconds += seconds
+            stats.max_seconds = max(stats.max_seconds, seconds)
+            stats.rows += rows
+            stats.slow_count += is_slow
+
+        if not is_slow:
+            return
+
+        query_plan = explain_query_plan(sql, parameters, connection)
+
+        with self._lock:
+            self.slow_queries.append({'statement': statement, 'ms': seconds * 1000, 'rows': rows,
+                                      'query_plan': query_plan})
+
+        self.slow_query_logger.warning('Slow SQL statement (%.1f ms, %d rows): %s\n%s', seconds * 1000, rows,
+                                       statement, '\n'.join(query_plan))
+
+    def report(self) -> List[Dict[str, Any]]:
+        """
+        Returns the aggregated statements, slowest in total first.
+        """
+        with self._lock:
+            statements = [stats.to_dict() for stats in self.statements.values()]
+
+        return sorted(statements, key=lambda stats: (stats['total_ms'], stats['count']), reverse=True)
+
+    def repeated_statements(self, min_count: int = DEFAULT_REPEATED_STATEMENT_COUNT) -> List[Dict[str, Any]]:
+        """
+        Returns the statements executed at least min_count times, most executed first. Single-row lookups showing up
+        here usually mean a loop runs one query per row (N+1) where one set-based query would do.
+        """
+        repeated = [stats for stats in self.report() if stats['count'] >= min_count]
+
+        return sorted(repeated, key=lambda stats: stats['count'], reverse=True)
+
+    def reset(self) -> None:
+        with self._lock:
+            self.statements.clear()
+            self.slow_queries.clear()
+
+    def dump(self, path: str, repeated_statement_count: int = DEFAULT_REPEATED_STATEMENT_COUNT) -> None:
+        """
+        Writes the statements, the repeated statements, and the slow queries as JSON to the given file.
+        """
+        with self._lock:
+            slow_queries = list(self.slow_queries)
+
+        with open(path, 'w', encoding='utf-8') as report_file:
+            json.dump({'statements': self.report(),
+                       'repeated_statements': self.repeated_statements(repeated_statement_count),
+                       'slow_queries': slow_queries}, report_file, indent=2)
+
+
+def explain_query_plan(sql: str, parameters: Any, connection: Connection) -> List[str]:
+    """
+    Returns the lines of the EXPLAIN QUERY PLAN output for the given statement, or an empty list if SQLite cannot
+    explain it (e.g. for transaction control statements).
+    """
+    # A plain cursor, so that the plan query itself is not traced
+    cursor = Cursor(connection)
+
+    try:
+        cursor.execute(f'EXPLAIN QUERY PLAN {sql}', parameters if parameters is not None else ())
+        rows = cursor.fetchall()
+    except (sqlite3.Error, ValueError):
+        return []
+    finally:
+        cursor.close()
+
+    # EXPLAIN QUERY PLAN rows are (id, parent, notused, detail), where nested steps point to their parent's id
+    depths = {0: -1}
+    lines = []
+
+    for plan_id, parent_id, _, detail in rows:
+        depths[plan_id] = depths.get(parent_id, -1) + 1
+        lines.append(f'{"  " * depths[plan_id]}{detail}')
+
+    return lines
+
+
+class TracedCursor(Cursor):
+    """
+    A cursor that times each statement from execution until its last row is fetched (or the next statement starts)
+    and reports it to the SQLTrace of its connection.
+    """
+    def __init__(self, connection: 'TracedConnection'):
+        super().__init__(connection)
+        self._trace = connection.sql_trace
+        self._pending = None
+
+    def _finish_pending(self):
+        if self._pending is None:
+            return
+
+        sql, parameters, seconds, rows = self._pending
+        self._pending = None
+
+        self._trace.record_execution(sql, parameters, seconds, rows, self.connection)
+
+    def _timed(self, method, *args):
+        start = perf_counter()
+
+        try:
+            return method(*args)
+        finally:
+            if self._pending is not None:
+                sql, parameters, seconds, rows = self._pending
+                self._pending = (sql, parameters, seconds + perf_counter() - start, rows)
+
+    def execute(self, sql: str, parameters: Any = ()):
+        self._finish_pending()
+
+        start = perf_counter()
+        super().execute(sql, parameters)
+        seconds = perf_counter() - start
+
+        self._pending = (sql, parameters, seconds, max(self.rowcount, 0))
+
+        # Statements that do not return rows are complete once executed
+        if self.description is None:
+            self._finish_pending()
+
+        return self
+
+    def executemany(self, sql: str, seq_of_parameters: Iterable[Any]):
+        self._finish_pending()
+
+        start = perf_counter()
+        super().executemany(sql, seq_of_parameters)
+        seconds = perf_counter() - start
+
+        # The query plan is explained without parameters, since the statement ran with many
+        self._pending = (sql, None, seconds, max(self.rowcount, 0))
+        self._finish_pending()
+
+        return self
+
+    def _add_fetched_rows(self, count: int):
+        if self._pending is not None:
+            sql, parameters, seconds, rows = self._pending
+            self._pending = (sql, parameters, seconds, rows + count)
+
+    def fetchone(self):
+        row = self._timed(super().fetchone)
+
+        if row is None:
+            self._finish_pending()
+        else:
+            self._add_fetched_rows(1)
+
+        return row
+
+    def fetchmany(self, size: Optional[int] = None):
+        rows = self._timed(super().fetchmany, self.arraysize if size is None else size)
+        self._add_fetched_rows(len(rows))
+
+        if not rows:
+            self._finish_pending()
+
+        return rows
+
+    def fetchall(self):
+        rows = self._timed(super().fetchall)
+        self._add_fetched_rows(len(rows))
+        self._finish_pending()
+
+        return rows
+
+    def close(self):
+        self._finish_pending()
+        super().close()
+
+    def __del__(self):
+        # Utils.database functions often fetch a single row and drop the cursor without closing it
+        try:
+            self._finish_pending()
+        except Exception:
+            pass
+
+
+class TracedConnection(Connection):
+    """
+    A connection whose cursors report to the given SQLTrace, which is also attached as its trace callback.
+    """
+    def __init__(self, *args, sql_trace: Optional[SQLTrace] = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.sql_trace = sql_trace or default_trace()
+        self.sql_trace.attach(self)
+
+    def cursor(self, factory=TracedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql: str, parameters: Any = ()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql: str, seq_of_parameters: Iterable[Any]):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+
+_default_trace: Optional[SQLTrace] = None
+
+
+def is_enabled_by_environment() -> bool:
+    return os.environ.get(ENABLED_ENV_VAR, '') not in ('', '0')
+
+
+def default_trace() -> SQLTrace:
+    """
+    Returns the process-wide SQLTrace shared by the connections opened through connect() (created on first use, with
+    the threshold from PPM_SQL_TRACE_SLOW_MS and a report written at exit to PPM_SQL_TRACE_REPORT).
+    """
+    global _default_trace
+
+    if _default_trace is None:
+        threshold = float(os.environ.get(SLOW_QUERY_THRESHOLD_ENV_VAR, DEFAULT_SLOW_QUERY_THRESHOLD_MS))
+        _default_trace = SQLTrace(slow_query_threshold_ms=threshold)
+        atexit.register(_default_trace.dump, os.environ.get(REPORT_PATH_ENV_VAR, 'ppm_sql_trace.json'))
+
+    return _default_trace
+
+
+def traced_connect(database: str, sql_trace: Optional[SQLTrace] = None, **kwargs) -> TracedConnection:
+    """
+    Connects to the given database with every statement reported to the given SQLTrace (or the process-wide one).
+    :param database: the path of the database to connect to
+    :param sql_trace: the SQLTrace to report to (the process-wide one if not provided)
+    :param kwargs: any other sqlite3.connect arguments
+    :return: the traced connection
+    """
+    return sqlite3.connect(database, factory=TracedConnection, sql_trace=sql_trace, **kwargs)
+
+
+def connect(database: str, **kwargs) -> Connection:
+    """
+    Connects to the given database, with SQL tracing attached if the PPM_SQL_TRACE environment variable is set.
+    :param database: the path of the database to connect to
+    :param kwargs: any other sqlite3.connect arguments
+    :return: the connection
+    """
+    if is_enabled_by_environment():
+        return traced_connect(database, **kwargs)
+
+    return sqlite3.connect(database, **kwargs)
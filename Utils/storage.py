@@ -0,0 +1,569 @@
+import base64
+import json
+import os
+import sqlite3
+from contextlib import contextmanager
+from sqlite3 import Connection
+from typing import ContextManager, Dict, Iterator, List, NamedTuple, Optional, Protocol, Tuple, Any
+
+from Utils.cryptography import derive_256_bit_salt_and_key, encrypt_aes_256_gcm, decrypt_aes_256_gcm
+from Utils.database import get_user_id_by_email, get_login_password_by_user_id, \
+    get_account_id_by_account_name_and_user_id, is_account_metadata_sealed, reveal_sealed_account_metadata
+from Utils.database import search_accounts as search_database_accounts
+
+# Storage backends: the records of Users and Accounts (with the Account passwords already encrypted) behind one
+# protocol, StorageBackend, so that the code that only needs to store, find, and list them does not depend on SQLite.
+# SQLiteBackend stores them in the application database (the users and accounts tables), and is the default; reads go
+# through Utils.database, so sealed metadata is revealed as usual. The rest of Utils.database (the url index, the
+# password fingerprints, the change journal, sealing, and sharing) is built on SQL and triggers and stays SQLite only:
+# the triggers keep it consistent with the writes of SQLiteBackend, but an Account it adds is only indexed by the next
+# index_account_urls and fingerprinted by the next fingerprint_account_passwords, and it refuses to write the metadata of
+# a sealed User.
+#
+# LogStructuredBackend is the alternative: an append-only log file with the whole vault indexed in memory. Every
+# transaction is appended as one JSON line (the records it wrote) and synced, and opening the file replays the log into
+# the index, so lookups and lists never touch the disk and a write costs one append. A crash in the middle of an append
+# leaves a torn last line, which is dropped when the log is replayed, so a transaction is either in the log or not.
+# Updated and deleted records stay in the log until compact() rewrites it with the live records only. The file is not
+# locked, so it must only be opened by one process at a time.
+#
+# Writes are grouped with transaction(): nested transactions join the outermost one, whose writes are committed when it
+# exits, or all rolled back if it exits with an exception. A write outside a transaction is a transaction on its own.
+
+LOG_EXTENSION = '.ppmlog'
+
+
+class StoredAccount(NamedTuple):
+    id: int
+    user_id: int
+    name: str
+    url: Optional[str]
+    username: str
+    password: bytes
+    salt: bytes
+    nonce: bytes
+    tag: bytes
+
+
+# The ciphertext, salt, nonce, and tag of an encrypted Account password
+EncryptedPassword = Tuple[bytes, bytes, bytes, bytes]
+
+
+class LogCorruptedError(ValueError):
+    """
+    Raised when a line of a log file other than the last one cannot be read, which a torn append cannot cause.
+    """
+
+
+class StorageBackend(Protocol):
+    def add_user(self, email: str, hashed_password: str) -> int:
+        """
+        Stores a new User and returns their id.
+        :raise Sqlite3.IntegrityError: if there already is a User with the given email
+        """
+
+    def get_user_id_by_email(self, email: str) -> Optional[int]:
+        """
+        Returns the id of the User with the given email if there is one, else None.
+        """
+
+    def get_user_password(self, user_id: int) -> Optional[str]:
+        """
+        Returns the hashed password of the User with the given id if there is one, else None.
+        """
+
+    def set_user_password(self, user_id: int, hashed_password: str) -> None:
+        """
+        Replaces the hashed password of the User with the given id.
+        :raise ValueError: if there is no User with the given id
+        """
+
+    def add_account(self, user_id: int, name: str, url: Optional[str], username: str,
+                    encrypted_password: EncryptedPassword) -> int:
+        """
+        Stores a new Account of the User with the given id and returns its id.
+        :raise ValueError: if there is no User with the given id
+        :raise Sqlite3.IntegrityError: if the User already has an Account with the given name (ignoring ASCII case)
+        """
+
+    def update_account(self, account_id: int, name: Optional[str] = None, url: Optional[str] = None,
+                       username: Optional[str] = None, encrypted_password: Optional[EncryptedPassword] = None) -> None:
+        """
+        Replaces the given fields of the Account with the given id (the ones that are None are left as they are).
+        :raise ValueError: if there is no Account with the given id
+        :raise Sqlite3.IntegrityError: if the User already has another Account with the given name
+        """
+
+    def delete_account(self, account_id: int) -> None:
+        """
+        Removes the Account with the given id.
+        :raise ValueError: if there is no Account with the given id
+        """
+
+    def get_account(self, account_id: int) -> Optional[StoredAccount]:
+        """
+        Returns the Account with the given id if there is one, else None.
+        """
+
+    def get_account_id_by_name(self, user_id: int, name: str) -> Optional[int]:
+        """
+        Returns the id of the User's Account with the given name (ignoring ASCII case) if there is one, else None.
+        """
+
+    def list_accounts(self, user_id: int) -> List[StoredAccount]:
+        """
+        Returns the Accounts of the User with the given id, in id order.
+        """
+
+    def search_accounts(self, user_id: int, query: str) -> List[StoredAccount]:
+        """
+        Returns the Accounts of the User with the given id whose name, url, or username contains the query (ignoring
+        case), in id order.
+        """
+
+    def transaction(self) -> ContextManager[None]:
+        """
+        Returns a context manager that groups the writes made inside it into one transaction.
+        """
+
+    def close(self) -> None:
+        """
+        Commits nothing more and releases the backend's connection or file.
+        """
+
+
+_NOCASE_TABLE = str.maketrans('ABCDEFGHIJKLMNOPQRSTUVWXYZ', 'abcdefghijklmnopqrstuvwxyz')
+
+
+def _nocase(text: str) -> str:
+    """
+    Returns the given text with only its ASCII letters lowercased, like SQLite's NOCASE collation.
+    """
+    return text.translate(_NOCASE_TABLE)
+
+
+def _matches(account: StoredAccount, query: str) -> bool:
+    return any(query in field.lower() for field in (account.name, account.url, account.username) if field is not None)
+
+
+class SQLiteBackend:
+    """
+    The storage backend of the application database, over the given connection.
+    """
+    def __init__(self, connection: Connection):
+        self.connection = connection
+        self._depth = 0
+
+    @contextmanager
+    def transaction(self) -> Iterator[None]:
+        self._depth += 1
+
+        try:
+            yield
+        except BaseException:
+            self._depth -= 1
+
+            if not self._depth:
+                self.connection.rollback()
+
+            raise
+
+        self._depth -= 1
+
+        if not self._depth:
+            self.connection.commit()
+
+    def add_user(self, email: str, hashed_password: str) -> int:
+        with self.transaction():
+            return self.connection.execute("INSERT INTO users VALUES (NULL, ?, ?) RETURNING id",
+                                           (email, hashed_password)).fetchone()[0]
+
+    def get_user_id_by_email(self, email: str) -> Optional[int]:
+        return get_user_id_by_email(email, self.connection)
+
+    def get_user_password(self, user_id: int) -> Optional[str]:
+        return get_login_password_by_user_id(user_id, self.connection)
+
+    def set_user_password(self, user_id: int, hashed_password: str) -> None:
+        with self.transaction():
+            if not self.connection.execute("UPDATE users SET password=? WHERE id=?",
+                                           (hashed_password, user_id)).rowcount:
+                raise ValueError(f'There is no User with the given user_id ({user_id})')
+
+    def _refuse_sealed_metadata(self, user_id: int) -> None:
+        if is_account_metadata_sealed(user_id, self.connection):
+            raise ValueError(f'The Account metadata of the User with the given user_id ({user_id}) is sealed, so it '
+                             f'can only be written through Utils.database')
+
+    def add_account(self, user_id: int, name: str, url: Optional[str], username: str,
+                    encrypted_password: EncryptedPassword) -> int:
+        if self.connection.execute("SELECT 1 FROM users WHERE id=?", (user_id,)).fetchone() is None:
+            raise ValueError(f'There is no User with the given user_id ({user_id})')
+
+        self._refuse_sealed_metadata(user_id)
+
+        with self.transaction():
+            return self.connection.execute("""INSERT INTO accounts (name, url, username, password, salt, nonce, tag,
+            user_id) VALUES (?, ?, ?, ?, ?, ?, ?, ?) RETURNING id""",
+                                           (name, url, username, *encrypted_password, user_id)).fetchone()[0]
+
+    def update_account(self, account_id: int, name: Optional[str] = None, url: Optional[str] = None,
+                       username: Optional[str] = None, encrypted_password: Optional[EncryptedPassword] = None) -> None:
+        account = self.connection.execute("SELECT user_id FROM accounts WHERE id=?", (account_id,)).fetchone()
+
+        if account is None:
+            raise ValueError(f'There is no Account with the given account_id ({account_id})')
+
+        fields: Dict[str, Any] = {'name': name, 'url': url, 'username': username}
+        fields = {column: value for column, value in fields.items() if value is not None}
+
+        if fields:
+            self._refuse_sealed_metadata(account[0])
+
+        if encrypted_password is not None:
+            fields.update(zip(('password', 'salt', 'nonce', 'tag'), encrypted_password))
+
+        if not fields:
+            return
+
+        with self.transaction():
+            self.connection.execute(f"UPDATE accounts SET {', '.join(f'{column}=:{column}' for column in fields)} "
+                                    f"WHERE id=:account_id", {**fields, 'account_id': account_id})
+
+    def delete_account(self, account_id: int) -> None:
+        with self.transaction():
+            if not self.connection.execute("DELETE FROM accounts WHERE id=?", (account_id,)).rowcount:
+                raise ValueError(f'There is no Account with the given account_id ({account_id})')
+
+    def _stored_accounts(self, where: str, parameters: tuple) -> List[StoredAccount]:
+        """
+        Returns the Accounts matching the given condition (all of one User), with the metadata of sealed ones revealed.
+        """
+        rows = self.connection.execute(f"""SELECT id, user_id, name, url, username, password, salt, nonce, tag
+        FROM accounts WHERE {where} ORDER BY id""", parameters).fetchall()
+
+        if not rows:
+            return []
+
+        revealed = reveal_sealed_account_metadata(rows[0][1], [row[0] for row in rows], self.connection)
+
+        return [StoredAccount(row[0], row[1], *revealed.get(row[0], row[2:5]), *row[5:]) for row in rows]
+
+    def get_account(self, account_id: int) -> Optional[StoredAccount]:
+        accounts = self._stored_accounts("id=?", (account_id,))
+
+        return accounts[0] if accounts else None
+
+    def get_account_id_by_name(self, user_id: int, name: str) -> Optional[int]:
+        return get_account_id_by_account_name_and_user_id(name, user_id, self.connection)
+
+    def list_accounts(self, user_id: int) -> List[StoredAccount]:
+        return self._stored_accounts("user_id=?", (user_id,))
+
+    def search_accounts(self, user_id: int, query: str) -> List[StoredAccount]:
+        # Searched by Utils.database, which also searches sealed metadata (through the blind index)
+        account_ids = [account[0] for account in search_database_accounts(user_id, query, self.connection)]
+
+        if not account_ids:
+            return []
+
+        return self._stored_accounts(f"id IN ({', '.join('?' * len(account_ids))})", tuple(account_ids))
+
+    def close(self) -> None:
+        self.connection.close()
+
+
+def _encode_bytes(value: bytes) -> str:
+    return base64.b64encode(value).decode('ascii')
+
+
+def _decode_bytes(value: str) -> bytes:
+    return base64.b64decode(value)
+
+
+class LogStructuredBackend:
+    """
+    The storage backend of an append-only log file, indexed in memory.
+    """
+    def __init__(self, path: str, sync: bool = True):
+        """
+        Opens the log at the given path, or creates an empty one if there is no file there, and replays it.
+        :param path: the path of the log file
+        :param sync: whether every transaction is synced to the disk (fsync) before it is considered committed
+        :raise LogCorruptedError: if a line other than the last one cannot be read
+        """
+        self.path = path
+        self.sync = sync
+        self._depth = 0
+        self._pending: List[list] = []
+        self._file = None
+
+        self._load()
+
+    def _reset(self) -> None:
+        self._users: Dict[int, Tuple[str, str]] = {}
+        self._user_ids_by_email: Dict[str, int] = {}
+        self._accounts: Dict[int, StoredAccount] = {}
+        self._account_ids_by_name: Dict[Tuple[int, str], int] = {}
+        # Dicts instead of sets, so that each User's Accounts stay in id (insertion) order
+        self._account_ids_by_user: Dict[int, Dict[int, None]] = {}
+        self._next_user_id = self._next_account_id = 1
+        self.record_count = 0
+
+    def _load(self) -> None:
+        self._reset()
+
+        if self._file is not None:
+            self._file.close()
+
+        valid_length = 0
+
+        if os.path.exists(self.path):
+            with open(self.path, 'rb') as log_file:
+                lines = log_file.read().split(b'\n')
+
+            # The part after the last newline is empty unless the last append was torn
+            for index, line in enumerate(lines[:-1]):
+                try:
+                    records = json.loads(line)['records']
+                except (ValueError, KeyError, TypeError) as e:
+                    if index == len(lines) - 2:
+                        break
+
+                    raise LogCorruptedError(f'Line {index + 1} of {self.path} cannot be read: {e}')
+
+                for record in records:
+                    self._apply(record)
+
+                valid_length += len(line) + 1
+
+        self._file = open(self.path, 'ab')
+
+        # Drops a torn last append, so that the next one starts on its own line
+        if self._file.tell() != valid_length:
+            self._file.truncate(valid_length)
+
+    def _apply(self, record: list) -> None:
+        kind = record[0]
+        self.record_count += 1
+
+        if kind == 'user':
+            _, user_id, email, hashed_password = record
+            previous = self._users.get(user_id)
+
+            if previous is not None:
+                self._user_ids_by_email.pop(previous[0], None)
+
+            self._users[user_id] = (email, hashed_password)
+            self._user_ids_by_email[email] = user_id
+            self._next_user_id = max(self._next_user_id, user_id + 1)
+        elif kind == 'account':
+            account = StoredAccount(record[1], record[2], record[3], record[4], record[5],
+                                    *(_decode_bytes(value) for value in record[6:10]))
+            self._remove_account(account.id)
+            self._accounts[account.id] = account
+            self._account_ids_by_name[(account.user_id, _nocase(account.name))] = account.id
+            self._account_ids_by_user.setdefault(account.user_id, {})[account.id] = None
+            self._next_account_id = max(self._next_account_id, account.id + 1)
+        elif kind == 'delete':
+            self._remove_account(record[1])
+        elif kind == 'sequence':
+            # Written by compact(), so that the ids of the deleted records are still never reused
+            self._next_user_id = max(self._next_user_id, record[1])
+            self._next_account_id = max(self._next_account_id, record[2])
+        else:
+            raise LogCorruptedError(f'Unknown record in {self.path}: {kind}')
+
+    def _remove_account(self, account_id: int) -> None:
+        account = self._accounts.pop(account_id, None)
+
+        if account is not None:
+            del self._account_ids_by_name[(account.user_id, _nocase(account.name))]
+            del self._account_ids_by_user[account.user_id][account_id]
+
+    def _write(self, record: list) -> None:
+        self._apply(record)
+        self._pending.append(record)
+
+    def _append(self, records: List[list]) -> None:
+        self._file.write(json.dumps({'records': records}, separators=(',', ':')).encode('utf-8') + b'\n')
+        self._file.flush()
+
+        if self.sync:
+            os.fsync(self._file.fileno())
+
+    @contextmanager
+    def transaction(self) -> Iterator[None]:
+        self._depth += 1
+
+        try:
+            yield
+        except BaseException:
+            self._depth -= 1
+
+            # The index already holds the writes, so it is rebuilt from the log
+            if not self._depth and self._pending:
+                self._pending = []
+                self._load()
+
+            raise
+
+        self._depth -= 1
+
+        if not self._depth and self._pending:
+            records, self._pending = self._pending, []
+
+            try:
+                self._append(records)
+            except BaseException:
+                self._load()
+                raise
+
+    def add_user(self, email: str, hashed_password: str) -> int:
+        if email in self._user_ids_by_email:
+            raise sqlite3.IntegrityError('UNIQUE constraint failed: users.email')
+
+        with self.transaction():
+            user_id = self._next_user_id
+            self._write(['user', user_id, email, hashed_password])
+
+        return user_id
+
+    def get_user_id_by_email(self, email: str) -> Optional[int]:
+        return self._user_ids_by_email.get(email)
+
+    def get_user_password(self, user_id: int) -> Optional[str]:
+        user = self._users.get(user_id)
+
+        return user[1] if user is not None else None
+
+    def set_user_password(self, user_id: int, hashed_password: str) -> None:
+        if user_id not in self._users:
+            raise ValueError(f'There is no User with the given user_id ({user_id})')
+
+        with self.transaction():
+            self._write(['user', user_id, self._users[user_id][0], hashed_password])
+
+    def _write_account(self, account: StoredAccount) -> None:
+        existing_id = self._account_ids_by_name.get((account.user_id, _nocase(account.name)))
+
+        if existing_id is not None and existing_id != account.id:
+            raise sqlite3.IntegrityError('UNIQUE constraint failed: accounts.name, accounts.user_id')
+
+        self._write(['account', account.id, account.user_id, account.name, account.url, account.username,
+                     *(_encode_bytes(value) for value in account[5:])])
+
+    def add_account(self, user_id: int, name: str, url: Optional[str], username: str,
+                    encrypted_password: EncryptedPassword) -> int:
+        if user_id not in self._users:
+            raise ValueError(f'There is no User with the given user_id ({user_id})')
+
+        with self.transaction():
+            account_id = self._next_account_id
+            self._write_account(StoredAccount(account_id, user_id, name, url, username, *encrypted_password))
+
+        return account_id
+
+    def update_account(self, account_id: int, name: Optional[str] = None, url: Optional[str] = None,
+                       username: Optional[str] = None, encrypted_password: Optional[EncryptedPassword] = None) -> None:
+        account = self._accounts.get(account_id)
+
+        if account is None:
+            raise ValueError(f'There is no Account with the given account_id ({account_id})')
+
+        fields = {'name': name, 'url': url, 'username': username}
+        account = account._replace(**{field: value for field, value in fields.items() if value is not None})
+
+        if encrypted_password is not None:
+            account = account._replace(**dict(zip(('password', 'salt', 'nonce', 'tag'), encrypted_password)))
+
+        with self.transaction():
+            self._write_account(account)
+
+    def delete_account(self, account_id: int) -> None:
+        if account_id not in self._accounts:
+            raise ValueError(f'There is no Account with the given account_id ({account_id})')
+
+        with self.transaction():
+            self._write(['delete', account_id])
+
+    def get_account(self, account_id: int) -> Optional[StoredAccount]:
+        return self._accounts.get(account_id)
+
+    def get_account_id_by_name(self, user_id: int, name: str) -> Optional[int]:
+        return self._account_ids_by_name.get((user_id, _nocase(name)))
+
+    def list_accounts(self, user_id: int) -> List[StoredAccount]:
+        return [self._accounts[account_id] for account_id in self._account_ids_by_user.get(user_id, ())]
+
+    def search_accounts(self, user_id: int, query: str) -> List[StoredAccount]:
+        query = query.lower()
+
+        return [account for account in self.list_accounts(user_id) if _matches(account, query)]
+
+    def compact(self) -> None:
+        """
+        Rewrites the log with the live records only, to a temporary file that is synced and renamed over the log, so
+        that a crash leaves either the old or the new log.
+        :raise ValueError: if called inside a transaction
+        """
+        if self._depth:
+            raise ValueError('The log cannot be compacted inside a transaction')
+
+        records = [['sequence', self._next_user_id, self._next_account_id]]
+        records += [['user', user_id, email, hashed_password] for user_id, (email, hashed_password) in
+                    self._users.items()]
+        records += [['account', account.id, account.user_id, account.name, account.url, account.username,
+                     *(_encode_bytes(value) for value in account[5:])] for account in
+                    sorted(self._accounts.values())]
+
+        temporary_path = f'{self.path}.tmp'
+
+        with open(temporary_path, 'wb') as log_file:
+            log_file.write(json.dumps({'records': records}, separators=(',', ':')).encode('utf-8') + b'\n')
+            log_file.flush()
+            os.fsync(log_file.fileno())
+
+        self._file.close()
+        os.replace(temporary_path, self.path)
+        self._load()
+
+    def close(self) -> None:
+        self._file.close()
+
+
+def store_account(backend: StorageBackend, user_id: int, master_password: str, name: str, url: Optional[str],
+                  username: str, password: str) -> int:
+    """
+    Encrypts the given Account password like Utils.database.create_account (with a key derived from the master password
+    and a new salt) and stores the Account in the given backend.
+    :return: the id of the stored Account
+    :raise ValueError: if the name, username, master_password, or password are empty strings, or there is no User with
+    the given id
+    :raise Sqlite3.IntegrityError: if the User already has an Account with the given name
+    """
+    for field, value in (('name', name), ('username', username), ('master_password', master_password),
+                         ('password', password)):
+        if not value:
+            raise ValueError(f'The given {field} was an empty string')
+
+    salt, key = derive_256_bit_salt_and_key(master_password)
+    ciphertext, nonce, tag = encrypt_aes_256_gcm(key=key, plaintext=password)
+
+    return backend.add_account(user_id, name, url, username, (ciphertext, salt, nonce, tag))
+
+
+def reveal_account_password(backend: StorageBackend, account_id: int, master_password: str) -> str:
+    """
+    Returns the decrypted password of the Account with the given id in the given backend.
+    :raise ValueError: if there is no Account with the given id or if a cryptography error occurs (e.g. if the master
+    password is not valid)
+    """
+    account = backend.get_account(account_id)
+
+    if account is None:
+        raise ValueError(f'There is no Account with the given account_id ({account_id})')
+
+    _, key = derive_256_bit_salt_and_key(master_password, account.salt)
+
+    return decrypt_aes_256_gcm(key=key, ciphertext=account.password, nonce=account.nonce, tag=account.tag)
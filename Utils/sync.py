@@ -0,0 +1,458 @@
+import hashlib
+import os
+import sqlite3
+import string
+from sqlite3 import Connection, Cursor
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from Database.database_setup import setup_database
+from Utils.cryptography import derive_256_bit_salt_and_key, decrypt_aes_256_gcm
+from Utils.database import is_valid_login, get_user_id_by_email, get_login_password_by_user_id, index_account_urls, \
+    fingerprint_account_passwords, is_account_metadata_sealed
+
+# Two-way sync of a User's Accounts between two vault files, e.g. the vaults of two machines. Accounts are matched by
+# name (case-insensitively, like the UNIQUE(name, user_id) constraint), and each one is summarized by a hash of its
+# stored row. Rows are copied between the vaults as they are stored (the ciphertext, salt, nonce, and tag), which is
+# valid because the key of an Account is derived from the master password and the Account's own salt, so both vaults
+# must have the same master password.
+#
+# The merge is three-way. Each vault keeps, per peer vault, the hashes both sides had after their last sync (the
+# base), so an Account that changed on one side only is copied to the other, and one that changed on both sides is a
+# conflict (unless both changes decrypt to the same Account). The hashes are grouped into buckets by name, and each
+# bucket is summarized by the XOR of its hashes, which is also kept for the base, so only the buckets whose summary
+# changed on either side are compared and written, like the subtrees of a Merkle tree. Each vault also stores the hash
+# of each of its rows and the current summary of each bucket, which a sync brings up to date by rehashing only the
+# Accounts its change journal logged after the revision hashed by the previous sync (every Account on the first sync,
+# or if the journal was compacted past that revision), so the hashing, the key derivations (to compare conflicts and
+# to refresh the password fingerprints), and the writes are all proportional to the changed Accounts.
+#
+# Both vault files are written in a single transaction (the peer vault is attached to the connection), so a failed sync
+# changes neither of them. With the default rollback journal SQLite commits the two files atomically; in WAL mode each
+# file is committed atomically on its own.
+
+BUCKET_COUNT = 256
+DIGEST_SIZE = 16
+EMPTY_DIGEST = bytes(DIGEST_SIZE)
+
+PEER_SCHEMA = 'peer'
+
+SYNC_SCHEMA = (
+    """CREATE TABLE IF NOT EXISTS {schema}.sync_vault (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    vault_id TEXT NOT NULL
+    ) STRICT ;""",
+    """CREATE TABLE IF NOT EXISTS {schema}.sync_state (
+    peer_vault_id TEXT NOT NULL,
+    user_id INTEGER NOT NULL,
+    bucket INTEGER NOT NULL,
+    name TEXT NOT NULL COLLATE NOCASE,
+    own_hash BLOB,
+    peer_hash BLOB,
+    PRIMARY KEY(peer_vault_id, user_id, name),
+    FOREIGN KEY(user_id) REFERENCES users(id) ON DELETE CASCADE
+    ) STRICT ;""",
+    """CREATE INDEX IF NOT EXISTS {schema}.sync_state_bucket ON sync_state(peer_vault_id, user_id, bucket);""",
+    """CREATE TABLE IF NOT EXISTS {schema}.sync_buckets (
+    peer_vault_id TEXT NOT NULL,
+    user_id INTEGER NOT NULL,
+    bucket INTEGER NOT NULL,
+    own_digest BLOB NOT NULL,
+    peer_digest BLOB NOT NULL,
+    PRIMARY KEY(peer_vault_id, user_id, bucket),
+    FOREIGN KEY(user_id) REFERENCES users(id) ON DELETE CASCADE
+    ) STRICT ;""",
+    """CREATE TABLE IF NOT EXISTS {schema}.sync_hashes (
+    account_id INTEGER PRIMARY KEY,
+    user_id INTEGER NOT NULL,
+    bucket INTEGER NOT NULL,
+    name TEXT NOT NULL COLLATE NOCASE,
+    row_hash BLOB NOT NULL,
+    FOREIGN KEY(user_id) REFERENCES users(id) ON DELETE CASCADE
+    ) STRICT ;""",
+    """CREATE INDEX IF NOT EXISTS {schema}.sync_hashes_bucket ON sync_hashes(user_id, bucket);""",
+    """CREATE TABLE IF NOT EXISTS {schema}.sync_hash_buckets (
+    user_id INTEGER NOT NULL,
+    bucket INTEGER NOT NULL,
+    digest BLOB NOT NULL,
+    PRIMARY KEY(user_id, bucket),
+    FOREIGN KEY(user_id) REFERENCES users(id) ON DELETE CASCADE
+    ) STRICT ;""",
+    """CREATE TABLE IF NOT EXISTS {schema}.sync_hashed_revisions (
+    user_id INTEGER PRIMARY KEY,
+    revision INTEGER NOT NULL,
+    FOREIGN KEY(user_id) REFERENCES users(id) ON DELETE CASCADE
+    ) STRICT ;""",
+)
+
+# SQLite's NOCASE collation only folds ASCII letters
+_NOCASE = str.maketrans(string.ascii_uppercase, string.ascii_lowercase)
+
+AccountRow = Tuple[str, Optional[str], str, bytes, bytes, bytes, bytes]
+
+
+def _name_key(name: str) -> str:
+    return name.translate(_NOCASE)
+
+
+def _bucket(key: str) -> int:
+    return hashlib.blake2b(key.encode('utf-8'), digest_size=1).digest()[0] % BUCKET_COUNT
+
+
+def _row_hash(row: AccountRow) -> bytes:
+    """
+    Returns the hash of the stored row of an Account (name, url, username, password, salt, nonce, and tag).
+    """
+    row_hash = hashlib.blake2b(digest_size=DIGEST_SIZE)
+
+    for field in row:
+        data = b'' if field is None else field if isinstance(field, bytes) else field.encode('utf-8')
+
+        # Length-prefixed, with a separate marker for a missing url, so that different rows cannot hash the same
+        row_hash.update(b'\x00' if field is None else b'\x01' + len(data).to_bytes(8, 'big') + data)
+
+    return row_hash.digest()
+
+
+def _xor(first: bytes, second: bytes) -> bytes:
+    return (int.from_bytes(first, 'big') ^ int.from_bytes(second, 'big')).to_bytes(DIGEST_SIZE, 'big')
+
+
+def _leaf_digest(key: str, row_hash: bytes) -> bytes:
+    return hashlib.blake2b(key.encode('utf-8') + b'\x00' + row_hash, digest_size=DIGEST_SIZE).digest()
+
+
+def _bucket_digests(hashes: Iterable[Tuple[str, Optional[bytes]]]) -> Dict[int, bytes]:
+    """
+    Returns the summary of each bucket of the given (name key, row hash) pairs, skipping missing rows.
+    """
+    digests: Dict[int, bytes] = {}
+
+    for key, row_hash in hashes:
+        if row_hash is not None:
+            bucket = _bucket(key)
+            digests[bucket] = _xor(digests.get(bucket, EMPTY_DIGEST), _leaf_digest(key, row_hash))
+
+    return digests
+
+
+def _setup_sync_tables(cursor: Cursor, schema: str) -> str:
+    """
+    Creates the sync tables of the given schema if needed, and returns the id of its vault.
+    """
+    for statement in SYNC_SCHEMA:
+        cursor.execute(statement.format(schema=schema))
+
+    cursor.execute(f"INSERT OR IGNORE INTO {schema}.sync_vault VALUES (1, ?)", (os.urandom(16).hex(),))
+    cursor.execute(f"SELECT vault_id FROM {schema}.sync_vault")
+
+    return cursor.fetchone()[0]
+
+
+def _update_account_hashes(cursor: Cursor, schema: str, user_id: int) -> Dict[int, bytes]:
+    """
+    Brings the stored row hashes and bucket summaries of the User's Accounts in the given schema up to date, rehashing
+    only the Accounts the change journal logged after the last hashed revision (or every Account if there is none or
+    the journal was compacted past it), and returns the summary of each bucket.
+    """
+    cursor.execute(f"SELECT seq FROM {schema}.sqlite_sequence WHERE name='account_changes'")
+    current_revision = (cursor.fetchone() or (0,))[0]
+    cursor.execute(f"SELECT revision FROM {schema}.sync_hashed_revisions WHERE user_id=?", (user_id,))
+    hashed_revision = cursor.fetchone()
+    cursor.execute(f"SELECT compacted_revision FROM {schema}.account_changes_compaction")
+    compaction = cursor.fetchone()
+
+    cursor.execute(f"SELECT bucket, digest FROM {schema}.sync_hash_buckets WHERE user_id=?", (user_id,))
+    digests: Dict[int, bytes] = dict(cursor.fetchall())
+
+    if hashed_revision is None or (compaction and hashed_revision[0] < compaction[0]):
+        cursor.execute(f"DELETE FROM {schema}.sync_hashes WHERE user_id=?", (user_id,))
+        cursor.execute(f"DELETE FROM {schema}.sync_hash_buckets WHERE user_id=?", (user_id,))
+        digests = {}
+        changed_accounts, parameters = '', ()
+    else:
+        changed_accounts = f"""AND id IN (SELECT account_id FROM {schema}.account_changes WHERE user_id=? AND revision>?
+        AND revision<=?)"""
+        parameters = (user_id, hashed_revision[0], current_revision)
+
+        cursor.execute(f"""DELETE FROM {schema}.sync_hashes WHERE user_id=? AND account_id IN (SELECT account_id
+        FROM {schema}.account_changes WHERE user_id=? AND revision>? AND revision<=?) RETURNING bucket, name,
+        row_hash""", (user_id,) + parameters)
+
+        for bucket, name, row_hash in cursor.fetchall():
+            digests[bucket] = _xor(digests.get(bucket, EMPTY_DIGEST), _leaf_digest(_name_key(name), row_hash))
+
+    cursor.execute(f"""SELECT id, name, url, username, password, salt, nonce, tag FROM {schema}.accounts WHERE user_id=?
+    {changed_accounts}""", (user_id,) + parameters)
+    hashes = []
+
+    for row in cursor.fetchall():
+        key, row_hash = _name_key(row[1]), _row_hash(row[1:])
+        bucket = _bucket(key)
+        digests[bucket] = _xor(digests.get(bucket, EMPTY_DIGEST), _leaf_digest(key, row_hash))
+        hashes.append((row[0], user_id, bucket, row[1], row_hash))
+
+    cursor.executemany(f"INSERT INTO {schema}.sync_hashes VALUES (?, ?, ?, ?, ?)", hashes)
+    cursor.executemany(f"INSERT OR REPLACE INTO {schema}.sync_hash_buckets VALUES (?, ?, ?)",
+                       [(user_id, bucket, digest) for bucket, digest in digests.items()])
+    cursor.execute(f"INSERT OR REPLACE INTO {schema}.sync_hashed_revisions VALUES (?, ?)", (user_id, current_revision))
+
+    return {bucket: digest for bucket, digest in digests.items() if digest != EMPTY_DIGEST}
+
+
+def _account_hashes(cursor: Cursor, schema: str, user_id: int, buckets: List[int]) -> Dict[str, bytes]:
+    """
+    Returns the stored row hash of each Account of the User in the given buckets, by name key.
+    """
+    if not buckets:
+        return {}
+
+    cursor.execute(f"""SELECT name, row_hash FROM {schema}.sync_hashes WHERE user_id=?
+    AND bucket IN ({', '.join('?' * len(buckets))})""", [user_id] + buckets)
+
+    return {_name_key(name): row_hash for name, row_hash in cursor.fetchall()}
+
+
+def _base_buckets(cursor: Cursor, schema: str, peer_vault_id: str, user_id: int)\
+        -> Dict[int, Tuple[bytes, bytes]]:
+    cursor.execute(f"SELECT bucket, own_digest, peer_digest FROM {schema}.sync_buckets WHERE peer_vault_id=? AND "
+                   f"user_id=?", (peer_vault_id, user_id))
+
+    return {bucket: (own_digest, peer_digest) for bucket, own_digest, peer_digest in cursor.fetchall()}
+
+
+def _select_account(cursor: Cursor, schema: str, user_id: int, key: str) -> Optional[AccountRow]:
+    cursor.execute(f"SELECT name, url, username, password, salt, nonce, tag FROM {schema}.accounts WHERE user_id=? AND "
+                   f"name=?", (user_id, key))
+
+    return cursor.fetchone()
+
+
+def _copy_account(cursor: Cursor, key: str, source: str, source_user_id: int, target: str,
+                  target_user_id: int) -> str:
+    """
+    Makes the Account with the given name key in the target schema a copy of the one in the source schema, deleting it
+    if the source has none, and returns the name of the copied (or deleted) Account.
+    """
+    row = _select_account(cursor, source, source_user_id, key)
+
+    if row is None:
+        cursor.execute(f"DELETE FROM {target}.accounts WHERE user_id=? AND name=? RETURNING name",
+                       (target_user_id, key))
+        deleted_row = cursor.fetchone()
+
+        return deleted_row[0] if deleted_row else key
+
+    cursor.execute(f"""UPDATE {target}.accounts SET name=?, url=?, username=?, password=?, salt=?, nonce=?, tag=?
+    WHERE user_id=? AND name=?""", row + (target_user_id, key))
+
+    if cursor.rowcount == 0:
+        cursor.execute(f"INSERT INTO {target}.accounts VALUES (NULL, ?, ?, ?, ?, ?, ?, ?, ?)", row + (target_user_id,))
+
+    return row[0]
+
+
+def _decrypted_account(row: AccountRow, master_password: str) -> Tuple[str, Optional[str], str, str]:
+    name, url, username, ciphertext, salt, nonce, tag = row
+    key = derive_256_bit_salt_and_key(password=master_password, salt=salt)[1]
+
+    return name, url, username, decrypt_aes_256_gcm(key=key, ciphertext=ciphertext, nonce=nonce, tag=tag)
+
+
+def _verify_login(connection: Connection, email: str, master_password: str, description: str) -> int:
+    if not is_valid_login(email=email, entered_password=master_password, connection=connection):
+        raise ValueError(f'The email or master password is not valid for the {description} vault')
+
+    user_id = get_user_id_by_email(email, connection)
+
+    # Accounts are matched by name, which a sealed vault only stores as a blind index
+    if is_account_metadata_sealed(user_id, connection):
+        raise ValueError(f'The Account metadata of the User is sealed in the {description} vault, which cannot be '
+                         f'synced')
+
+    return user_id
+
+
+def sync_vaults(connection: Connection, peer_path: str, email: str, master_password: str,
+                prefer: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Syncs the Accounts of the User with the given email between the vault of the given connection and the vault file at
+    peer_path, in both directions, and returns a JSON-serializable report: the names of the Accounts copied from the
+    peer (pulled) and to it (pushed), the names of the conflicting Accounts, and the number of buckets compared. An
+    Account changed differently on both sides since the last sync is a conflict, which is left as it is on both sides
+    (and reported again by the next sync) unless prefer says which side wins.
+    :param connection: the connection to the local vault
+    :param peer_path: the path of the peer vault file, which is set up (with a copy of the User) if needed
+    :param email: the email of the User, who must have the same master password in both vaults
+    :param master_password: the User's master password
+    :param prefer: 'local' or 'remote' to resolve conflicts in favor of that side, or None to report them
+    :return: the report
+    :raise ValueError: if the login is not valid for either vault, the User's Account metadata is sealed in either
+    vault, prefer is invalid, or peer_path is the local vault
+    """
+    if prefer not in (None, 'local', 'remote'):
+        raise ValueError(f"prefer must be 'local', 'remote', or None, not {prefer!r}")
+
+    local_user_id = _verify_login(connection, email, master_password, 'local')
+
+    setup_database(peer_path)
+    peer_connection = sqlite3.connect(peer_path)
+
+    try:
+        # A vault without the User, e.g. a new file, gets a copy of the User (with the same master password hash)
+        if get_user_id_by_email(email, peer_connection) is None:
+            peer_connection.execute("INSERT INTO users VALUES (NULL, ?, ?)",
+                                    (email, get_login_password_by_user_id(local_user_id, connection)))
+            peer_connection.commit()
+
+        peer_user_id = _verify_login(peer_connection, email, master_password, 'peer')
+    finally:
+        peer_connection.close()
+
+    if connection.in_transaction:
+        connection.commit()
+
+    connection.execute(f"ATTACH DATABASE ? AS {PEER_SCHEMA}", (peer_path,))
+
+    try:
+        cursor = connection.cursor()
+
+        try:
+            report = _merge(cursor, local_user_id, peer_user_id, master_password, prefer)
+            connection.commit()
+        except BaseException:
+            connection.rollback()
+            raise
+        finally:
+            cursor.close()
+    finally:
+        connection.execute(f"DETACH DATABASE {PEER_SCHEMA}")
+
+    # The url index and the password fingerprints of the copied Accounts were dropped by the triggers, and are rebuilt
+    # (only for those Accounts) after the commit
+    peer_connection = sqlite3.connect(peer_path)
+
+    try:
+        for vault_connection, user_id in ((connection, local_user_id), (peer_connection, peer_user_id)):
+            index_account_urls(vault_connection, user_id)
+            fingerprint_account_passwords(user_id, master_password, vault_connection)
+    finally:
+        peer_connection.close()
+
+    return report
+
+
+def _merge(cursor: Cursor, local_user_id: int, peer_user_id: int, master_password: str,
+           prefer: Optional[str]) -> Dict[str, Any]:
+    local_vault_id = _setup_sync_tables(cursor, 'main')
+    peer_vault_id = _setup_sync_tables(cursor, PEER_SCHEMA)
+
+    if local_vault_id == peer_vault_id:
+        raise ValueError('The peer vault is the local vault (or a copy of it that was never synced)')
+
+    local_digests = _update_account_hashes(cursor, 'main', local_user_id)
+    peer_digests = _update_account_hashes(cursor, PEER_SCHEMA, peer_user_id)
+
+    # The base is only trusted if both vaults agree on it, e.g. not if one of them was restored from an older backup
+    base = _base_buckets(cursor, 'main', peer_vault_id, local_user_id)
+    peer_base = _base_buckets(cursor, PEER_SCHEMA, local_vault_id, peer_user_id)
+    base_is_trusted = base == {bucket: (own, peer) for bucket, (peer, own) in peer_base.items()}
+
+    if not base_is_trusted:
+        base = {}
+
+    changed_buckets = sorted(bucket for bucket in range(BUCKET_COUNT)
+                             if (local_digests.get(bucket, EMPTY_DIGEST), peer_digests.get(bucket, EMPTY_DIGEST))
+                             != base.get(bucket, (EMPTY_DIGEST, EMPTY_DIGEST)))
+
+    base_hashes: Dict[str, Tuple[Optional[bytes], Optional[bytes]]] = {}
+
+    if base_is_trusted and changed_buckets:
+        cursor.execute(f"""SELECT name, own_hash, peer_hash FROM sync_state WHERE peer_vault_id=? AND user_id=?
+        AND bucket IN ({', '.join('?' * len(changed_buckets))})""", [peer_vault_id, local_user_id] + changed_buckets)
+        base_hashes = {_name_key(name): (own_hash, peer_hash) for name, own_hash, peer_hash in cursor.fetchall()}
+
+    local_hashes = _account_hashes(cursor, 'main', local_user_id, changed_buckets)
+    peer_hashes = _account_hashes(cursor, PEER_SCHEMA, peer_user_id, changed_buckets)
+    keys: Set[str] = set(local_hashes) | set(peer_hashes) | set(base_hashes)
+
+    pulled, pushed, conflicts = [], [], []
+    new_base: Dict[str, Tuple[Optional[bytes], Optional[bytes]]] = {}
+
+    for key in sorted(keys):
+        local_hash, peer_hash = local_hashes.get(key), peer_hashes.get(key)
+        base_local_hash, base_peer_hash = base_hashes.get(key, (None, None))
+        local_changed, peer_changed = local_hash != base_local_hash, peer_hash != base_peer_hash
+
+        if local_changed and peer_changed and local_hash != peer_hash:
+            local_row = _select_account(cursor, 'main', local_user_id, key)
+            peer_row = _select_account(cursor, PEER_SCHEMA, peer_user_id, key)
+
+            if local_row and peer_row and (_decrypted_account(local_row, master_password)
+                                           == _decrypted_account(peer_row, master_password)):
+                new_base[key] = (local_hash, peer_hash)
+                continue
+
+            conflicts.append((local_row or peer_row)[0])
+
+            if prefer is None:
+                continue
+
+            local_changed, peer_changed = prefer == 'local', prefer == 'remote'
+
+        if local_changed and not peer_changed:
+            pushed.append(_copy_account(cursor, key, 'main', local_user_id, PEER_SCHEMA, peer_user_id))
+            peer_hash = local_hash
+        elif peer_changed and not local_changed:
+            pulled.append(_copy_account(cursor, key, PEER_SCHEMA, peer_user_id, 'main', local_user_id))
+            local_hash = peer_hash
+
+        new_base[key] = (local_hash, peer_hash)
+
+    _write_base(cursor, local_vault_id, peer_vault_id, local_user_id, peer_user_id, new_base, base_is_trusted,
+                changed_buckets)
+
+    return {'pulled': pulled,
+            'pushed': pushed,
+            'conflicts': conflicts,
+            'buckets_compared': len(changed_buckets)}
+
+
+def _write_base(cursor: Cursor, local_vault_id: str, peer_vault_id: str, local_user_id: int, peer_user_id: int,
+                new_base: Dict[str, Tuple[Optional[bytes], Optional[bytes]]], base_is_trusted: bool,
+                changed_buckets: List[int]) -> None:
+    """
+    Stores the new base of the given keys in both vaults (each from its own side), and the summaries of the changed
+    buckets. An untrusted base is replaced entirely.
+    """
+    sides = (('main', peer_vault_id, local_user_id, False), (PEER_SCHEMA, local_vault_id, peer_user_id, True))
+
+    for schema, other_vault_id, user_id, swapped in sides:
+        if not base_is_trusted:
+            cursor.execute(f"DELETE FROM {schema}.sync_state WHERE peer_vault_id=? AND user_id=?",
+                           (other_vault_id, user_id))
+            cursor.execute(f"DELETE FROM {schema}.sync_buckets WHERE peer_vault_id=? AND user_id=?",
+                           (other_vault_id, user_id))
+
+        for key, (local_hash, peer_hash) in new_base.items():
+            own_hash, other_hash = (peer_hash, local_hash) if swapped else (local_hash, peer_hash)
+
+            if own_hash is None and other_hash is None:
+                cursor.execute(f"DELETE FROM {schema}.sync_state WHERE peer_vault_id=? AND user_id=? AND name=?",
+                               (other_vault_id, user_id, key))
+            else:
+                cursor.execute(f"INSERT OR REPLACE INTO {schema}.sync_state VALUES (?, ?, ?, ?, ?, ?)",
+                               (other_vault_id, user_id, _bucket(key), key, own_hash, other_hash))
+
+        if not changed_buckets:
+            continue
+
+        cursor.execute(f"""SELECT name, own_hash, peer_hash FROM {schema}.sync_state WHERE peer_vault_id=?
+        AND user_id=? AND bucket IN ({', '.join('?' * len(changed_buckets))})""",
+                       [other_vault_id, user_id] + changed_buckets)
+        rows = cursor.fetchall()
+        own_digests = _bucket_digests((_name_key(name), own_hash) for name, own_hash, _ in rows)
+        other_digests = _bucket_digests((_name_key(name), other_hash) for name, _, other_hash in rows)
+
+        cursor.executemany(f"INSERT OR REPLACE INTO {schema}.sync_buckets VALUES (?, ?, ?, ?, ?)",
+                           [(other_vault_id, user_id, bucket, own_digests.get(bucket, EMPTY_DIGEST),
+                             other_digests.get(bucket, EMPTY_DIGEST)) for bucket in changed_buckets])
@@ -0,0 +1,155 @@
+import os
+import sqlite3
+import tempfile
+import unittest
+from unittest import mock
+
+import Utils.backup
+from Utils.backup import create_backup, restore_backup, verify_backup, rotate_backups, list_backups, \
+    read_backup_manifest, BackupError, FULL_BACKUP_SUFFIX, INCREMENTAL_BACKUP_SUFFIX
+from Utils.database import db_setup, create_user, get_all_account_names_urls_and_usernames_by_user_id, \
+    get_decrypted_account_password, get_account_id_by_account_name_and_user_id
+from Utils.encrypted_export import EncryptedExportError, KDFParameters
+from Utils.import_export import import_accounts
+
+# Cheap Argon2id parameters, so that the tests do not spend their time in the KDF
+TEST_KDF_PARAMETERS = KDFParameters(1, 8, 1)
+
+
+class BackupUtilsTests(unittest.TestCase):
+    def setUp(self) -> None:
+        self.directory = tempfile.TemporaryDirectory()
+        self.backup_directory = os.path.join(self.directory.name, 'backups')
+        self.connection, self.cursor = db_setup()
+        self.master_password = 'MasterPassword'
+        self.user_id = create_user(email='testemail@gmail.com', password=self.master_password,
+                                   connection=self.connection)
+
+        import_accounts(({'name': f'Company {i}', 'url': f'https://company{i}.com', 'username': 'user',
+                          'password': f'Password{i}'} for i in range(8)),
+                        self.user_id, self.master_password, self.connection)
+
+    def tearDown(self) -> None:
+        self.cursor.close()
+        self.connection.close()
+        self.directory.cleanup()
+
+    def backup(self, **kwargs) -> str:
+        return create_backup(self.connection, self.backup_directory, 'BackupPassword',
+                             kdf_parameters=TEST_KDF_PARAMETERS, **kwargs)
+
+    def test_full_and_incremental_backups_restore(self):
+        """
+        An incremental backup only stores the changed pages, and restoring it replays its chain into the database.
+        """
+        progress = []
+        full_path = self.backup(progress=lambda copied, total: progress.append((copied, total)))
+
+        import_accounts([{'name': 'Added later', 'url': None, 'username': 'user', 'password': 'LaterPassword'}],
+                        self.user_id, self.master_password, self.connection)
+        incremental_path = self.backup()
+
+        full_manifest = read_backup_manifest(full_path, 'BackupPassword')
+        incremental_manifest = read_backup_manifest(incremental_path, 'BackupPassword')
+
+        self.assertTrue(full_path.endswith(FULL_BACKUP_SUFFIX))
+        self.assertTrue(incremental_path.endswith(INCREMENTAL_BACKUP_SUFFIX))
+        self.assertEqual(full_manifest['page_count'], full_manifest['pages_stored'])
+        self.assertLess(incremental_manifest['pages_stored'], incremental_manifest['page_count'])
+        self.assertEqual([full_manifest['name'], incremental_manifest['name']], incremental_manifest['chain'])
+        self.assertEqual((full_manifest['page_count'], full_manifest['page_count']), progress[-1])
+
+        restored = sqlite3.connect(':memory:')
+        restore_backup(full_path, 'BackupPassword', restored)
+        self.assertEqual(8, len(get_all_account_names_urls_and_usernames_by_user_id(self.user_id, restored)))
+
+        restore_backup(incremental_path, 'BackupPassword', restored)
+        self.assertEqual(9, len(get_all_account_names_urls_and_usernames_by_user_id(self.user_id, restored)))
+        self.assertEqual('LaterPassword', get_decrypted_account_password(
+            get_account_id_by_account_name_and_user_id('Added later', self.user_id, restored), self.master_password,
+            restored))
+
+        restored.close()
+
+    def test_no_plaintext_reaches_the_backup_directory(self):
+        """
+        The snapshot of a backup and the database of a restore are only held in memory, including for a database in
+        WAL mode, so the backup directory only ever holds encrypted backups.
+        """
+        database_path = os.path.join(self.directory.name, 'vault.sqlite3')
+        vault = sqlite3.connect(database_path)
+        self.addCleanup(vault.close)
+        vault.execute("PRAGMA journal_mode=WAL")
+        self.connection.backup(vault)
+
+        listings = []
+
+        def copy_database(*args):
+            copy(*args)
+            listings.append(sorted(os.listdir(self.backup_directory)))
+
+        copy = Utils.backup._copy_database
+
+        with mock.patch.object(Utils.backup, '_copy_database', copy_database):
+            backup_path = create_backup(vault, self.backup_directory, 'BackupPassword',
+                                        kdf_parameters=TEST_KDF_PARAMETERS)
+            verify_backup(backup_path, 'BackupPassword')
+            restore_backup(backup_path, 'BackupPassword', vault)
+
+        self.assertEqual([[], [os.path.basename(backup_path)]], listings)
+        self.assertEqual('wal', vault.execute("PRAGMA journal_mode").fetchone()[0])
+        self.assertEqual('Password3', get_decrypted_account_password(
+            get_account_id_by_account_name_and_user_id('Company 3', self.user_id, vault), self.master_password, vault))
+
+    def test_new_chains_and_rotation(self):
+        """
+        A chain is started after max_incrementals incremental backups or with incremental=False, and only the newest
+        chains are kept.
+        """
+        paths = [self.backup(max_incrementals=1, keep_chains=2) for _ in range(5)]
+        paths.append(self.backup(incremental=False, keep_chains=2))
+
+        self.assertEqual([True, False, True, False, True, True],
+                         [path.endswith(FULL_BACKUP_SUFFIX) for path in paths])
+        self.assertEqual(paths[4:], list_backups(self.backup_directory))
+        self.assertEqual(paths[4:5], rotate_backups(self.backup_directory, keep_chains=1))
+
+    def test_restore_does_not_touch_the_database_if_the_backup_does_not_verify(self):
+        """
+        A backup with a wrong password, a missing or tampered file in its chain, or another password's chain fails to
+        restore, and the database is left unchanged.
+        """
+        full_path = self.backup()
+        incremental_path = self.backup()
+        target = sqlite3.connect(':memory:')
+        target.execute("CREATE TABLE untouched (id INTEGER)")
+
+        with self.assertRaises(EncryptedExportError):
+            restore_backup(incremental_path, 'WrongPassword', target)
+
+        with open(full_path, 'r+b') as backup_file:
+            backup_file.seek(-20, os.SEEK_END)
+            backup_file.write(b'\x00')
+
+        with self.assertRaises(EncryptedExportError):
+            restore_backup(incremental_path, 'BackupPassword', target)
+
+        os.remove(full_path)
+
+        with self.assertRaises(BackupError):
+            verify_backup(incremental_path, 'BackupPassword')
+
+        self.assertEqual([('untouched',)], target.execute("SELECT name FROM sqlite_master").fetchall())
+        target.close()
+
+    def test_backup_with_another_password_starts_a_new_chain(self):
+        self.backup()
+        other_path = create_backup(self.connection, self.backup_directory, 'OtherPassword',
+                                   kdf_parameters=TEST_KDF_PARAMETERS)
+
+        self.assertTrue(other_path.endswith(FULL_BACKUP_SUFFIX))
+        self.assertEqual(os.path.basename(other_path), verify_backup(other_path, 'OtherPassword')['name'])
+
+
+if __name__ == '__main__':
+    unittest.main()
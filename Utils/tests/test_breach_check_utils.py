@@ -0,0 +1,127 @@
+import hashlib
+import os
+import random
+import tempfile
+import unittest
+
+from Utils.breach_check import convert_hash_dump, BreachedPasswordFile, BloomFilter, check_passwords, \
+    open_breached_password_file, find_breached_account_passwords, sha1_digest, HEADER, RECORD
+from Utils.database import db_setup, create_user, create_account
+
+
+def sha1_hex(password: str) -> str:
+    return hashlib.sha1(password.encode('utf-8')).hexdigest().upper()
+
+
+class BreachCheckUtilsTests(unittest.TestCase):
+    def setUp(self) -> None:
+        self.directory = tempfile.TemporaryDirectory()
+        self.dump_path = os.path.join(self.directory.name, 'dump.txt')
+        self.corpus_path = os.path.join(self.directory.name, 'corpus.bin')
+
+    def tearDown(self) -> None:
+        self.directory.cleanup()
+
+    def write_dump(self, lines):
+        with open(self.dump_path, 'w', encoding='utf-8') as dump_file:
+            dump_file.write('\n'.join(lines) + '\n')
+
+    def test_convert_and_check(self):
+        """
+        Passwords in the dump are found with their counts, with or without the Bloom filter, and others are not.
+        """
+        self.write_dump([f'{sha1_hex("password")}:3861493', f'{sha1_hex("123456").lower()}:37359195', '',
+                         sha1_hex('letmein')])
+
+        self.assertEqual(3, convert_hash_dump(self.dump_path, self.corpus_path))
+
+        for use_bloom_filter in (False, True):
+            with BreachedPasswordFile(self.corpus_path, use_bloom_filter=use_bloom_filter) as corpus:
+                self.assertEqual(3, len(corpus))
+                self.assertEqual(3861493, corpus.count('password'))
+                self.assertEqual(37359195, corpus.count('123456'))
+                self.assertEqual(1, corpus.count('letmein'))
+                self.assertIn('password', corpus)
+                self.assertNotIn('Xk9vQ2pL7mN4rT1', corpus)
+
+    def test_external_sort_merges_runs_and_duplicates(self):
+        """
+        A dump larger than a chunk is sorted externally into the same file, with duplicate hashes merged.
+        """
+        rng = random.Random(1)
+        passwords = [f'password{i}' for i in range(500)]
+        lines = [f'{sha1_hex(password)}:{i + 1}' for i, password in enumerate(passwords)]
+        lines.append(f'{sha1_hex("password7")}:100')
+        rng.shuffle(lines)
+        self.write_dump(lines)
+
+        in_memory_path = os.path.join(self.directory.name, 'in_memory.bin')
+
+        self.assertEqual(500, convert_hash_dump(self.dump_path, self.corpus_path, chunk_records=37))
+        self.assertEqual(500, convert_hash_dump(self.dump_path, in_memory_path))
+
+        with open(self.corpus_path, 'rb') as corpus_file, open(in_memory_path, 'rb') as in_memory_file:
+            data = corpus_file.read()
+            self.assertEqual(in_memory_file.read(), data)
+
+        digests = [record[0] for record in RECORD.iter_unpack(data[HEADER.size:])]
+        self.assertEqual(sorted(digests), digests)
+
+        with BreachedPasswordFile(self.corpus_path) as corpus:
+            self.assertEqual(108, corpus.count('password7'))
+            self.assertTrue(all(corpus.count(password) for password in passwords))
+
+        self.assertEqual([], [name for name in os.listdir(self.directory.name) if name.endswith(('.run', '.tmp'))])
+
+    def test_invalid_dump_line(self):
+        self.write_dump([sha1_hex('password'), 'not a hash:1'])
+
+        with self.assertRaises(ValueError):
+            convert_hash_dump(self.dump_path, self.corpus_path)
+
+        self.assertFalse(os.path.exists(self.corpus_path))
+
+    def test_invalid_corpus_file(self):
+        with open(self.corpus_path, 'wb') as corpus_file:
+            corpus_file.write(b'not a corpus file at all')
+
+        with self.assertRaises(ValueError):
+            BreachedPasswordFile(self.corpus_path)
+
+        self.assertIsNone(open_breached_password_file(os.path.join(self.directory.name, 'missing.bin')))
+
+    def test_bloom_filter_has_no_false_negatives(self):
+        bloom_filter = BloomFilter(1000)
+        digests = [sha1_digest(str(i)) for i in range(2000)]
+
+        for digest in digests[:1000]:
+            bloom_filter.add(digest)
+
+        self.assertTrue(all(bloom_filter.might_contain(digest) for digest in digests[:1000]))
+        self.assertLess(sum(bloom_filter.might_contain(digest) for digest in digests[1000:]), 50)
+
+    def test_batch_check_of_account_passwords(self):
+        """
+        Reports the breach counts of the User's Accounts whose password is breached.
+        """
+        self.write_dump([f'{sha1_hex("password")}:5', f'{sha1_hex("qwerty")}:2'])
+        convert_hash_dump(self.dump_path, self.corpus_path)
+
+        self.assertEqual({2: 2}, check_passwords({1: 'Xk9vQ2pL7mN4rT1', 2: 'qwerty'},
+                                                 BreachedPasswordFile(self.corpus_path)))
+
+        connection, cursor = db_setup()
+        user_id = create_user(email='testemail@gmail.com', password='MasterPassword', connection=connection)
+        safe_account_id = create_account(user_id=user_id, master_password='MasterPassword', name='Safe', url=None,
+                                         username='user', password='Xk9vQ2pL7mN4rT1', connection=connection)
+        breached_account_id = create_account(user_id=user_id, master_password='MasterPassword', name='Breached',
+                                             url=None, username='user', password='password', connection=connection)
+
+        with BreachedPasswordFile(self.corpus_path) as corpus:
+            breached = find_breached_account_passwords(user_id, 'MasterPassword', connection, corpus)
+
+        self.assertEqual({breached_account_id: 5}, breached)
+        self.assertNotIn(safe_account_id, breached)
+
+        cursor.close()
+        connection.close()
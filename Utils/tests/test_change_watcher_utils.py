@@ -0,0 +1,73 @@
+import os
+import sqlite3
+import tempfile
+import unittest
+
+from Database.database_setup import setup_database
+from Utils.change_watcher import VaultChangeWatcher
+from Utils.database import ChangeJournalCompactedError, compact_account_changes, get_current_revision
+
+
+class ChangeWatcherUtilsTests(unittest.TestCase):
+    def setUp(self) -> None:
+        self.directory = tempfile.TemporaryDirectory()
+        db_name = os.path.join(self.directory.name, 'vault.sqlite3')
+        setup_database(db_name)
+
+        self.connection = sqlite3.connect(db_name)
+        self.other_connection = sqlite3.connect(db_name)
+        self.other_connection.execute("INSERT INTO users VALUES (1, 'testemail@gmail.com', 'hash')")
+        self.other_connection.commit()
+
+    def tearDown(self) -> None:
+        self.connection.close()
+        self.other_connection.close()
+        self.directory.cleanup()
+
+    def insert_account(self, connection: sqlite3.Connection, name: str) -> int:
+        account_id = connection.execute("INSERT INTO accounts VALUES (NULL, ?, NULL, 'user', x'00', x'00', x'00', "
+                                        "x'00', 1) RETURNING id", (name,)).fetchone()[0]
+        connection.commit()
+
+        return account_id
+
+    def test_poll_reports_the_changes_committed_by_other_connections(self):
+        watcher = VaultChangeWatcher(1, self.connection)
+
+        self.assertIsNone(watcher.poll())
+
+        account_id = self.insert_account(self.other_connection, 'A')
+        self.other_connection.execute("UPDATE accounts SET username='edited' WHERE id=?", (account_id,))
+        self.other_connection.commit()
+
+        self.assertEqual({'revision': 2, 'changed': [(account_id, 'A', None, 'edited')], 'deleted': []},
+                         watcher.poll())
+        self.assertIsNone(watcher.poll())
+
+        # The watcher's own connection does not trigger a poll, but its changes are reported with the next external one
+        own_account_id = self.insert_account(self.connection, 'B')
+        self.assertIsNone(watcher.poll())
+
+        self.other_connection.execute("DELETE FROM accounts WHERE id=?", (account_id,))
+        self.other_connection.commit()
+
+        self.assertEqual({'revision': 4, 'changed': [(own_account_id, 'B', None, 'user')], 'deleted': [account_id]},
+                         watcher.poll())
+
+    def test_poll_after_compaction(self):
+        watcher = VaultChangeWatcher(1, self.connection)
+        account_id = self.insert_account(self.other_connection, 'A')
+        self.other_connection.execute("DELETE FROM accounts WHERE id=?", (account_id,))
+        self.other_connection.commit()
+        compact_account_changes(self.other_connection, get_current_revision(self.other_connection))
+
+        with self.assertRaises(ChangeJournalCompactedError):
+            watcher.poll()
+
+        watcher.reset()
+
+        self.assertIsNone(watcher.poll())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,10 +1,13 @@
 import base64
+import hashlib
+import hmac
 import unittest
 
 import argon2.low_level
 from argon2 import PasswordHasher
 
-from Utils.cryptography import derive_256_bit_salt_and_key, encrypt_aes_256_gcm, decrypt_aes_256_gcm
+from Utils.cryptography import derive_256_bit_salt_and_key, encrypt_aes_256_gcm, decrypt_aes_256_gcm, derive_subkey, \
+    keyed_fingerprint, generate_x25519_key_pair, wrap_key, unwrap_key, encrypt_chunk, decrypt_chunk
 
 
 class CryptographyUtilsTests(unittest.TestCase):
@@ -186,3 +189,72 @@ class CryptographyUtilsTests(unittest.TestCase):
             self.assertEquals('MAC check failed', str(e))
         else:
             self.fail('ValueError should have occurred for failed MAC check.')
+
+    def test_derive_subkey(self):
+        """
+        Derives the same 256-bit subkey for the same key and purpose, and independent subkeys for other purposes.
+        """
+        key = bytes(range(32))
+
+        subkey = derive_subkey(key, 'fingerprint')
+
+        self.assertEqual(32, len(subkey))
+        self.assertEqual(subkey, derive_subkey(key, 'fingerprint'))
+        self.assertNotEqual(subkey, derive_subkey(key, 'other purpose'))
+        self.assertNotEqual(subkey, derive_subkey(bytes(32), 'fingerprint'))
+        self.assertNotEqual(key, subkey)
+
+    def test_keyed_fingerprint(self):
+        """
+        The fingerprint is the HMAC-SHA256 of the utf-8 encoded plaintext, so it depends on both the key and plaintext.
+        """
+        key = bytes(range(32))
+
+        self.assertEqual(hmac.new(key, 'pässword'.encode('utf-8'), hashlib.sha256).digest(),
+                         keyed_fingerprint(key, 'pässword'))
+        self.assertEqual(keyed_fingerprint(key, b'password'), keyed_fingerprint(key, 'password'))
+        self.assertNotEqual(keyed_fingerprint(key, 'password'), keyed_fingerprint(bytes(32), 'password'))
+
+    def test_wrap_and_unwrap_key(self):
+        """
+        A key wrapped for a public key is only unwrapped with the matching private key, and differs on every wrap.
+        """
+        private_key, public_key = generate_x25519_key_pair()
+        other_private_key, _ = generate_x25519_key_pair()
+        key = bytes(range(32))
+
+        wrapped_key = wrap_key(key, public_key)
+
+        self.assertEqual((32, 32), (len(private_key), len(public_key)))
+        self.assertEqual(key, unwrap_key(wrapped_key, private_key))
+        self.assertNotEqual(wrapped_key, wrap_key(key, public_key))
+
+        with self.assertRaises(ValueError):
+            unwrap_key(wrapped_key, other_private_key)
+
+        with self.assertRaises(ValueError):
+            unwrap_key(wrapped_key[:40], private_key)
+
+        with self.assertRaises(ValueError):
+            unwrap_key(wrapped_key[:-1] + bytes([wrapped_key[-1] ^ 1]), private_key)
+
+    def test_encrypt_and_decrypt_chunk(self):
+        """
+        A chunk only decrypts at the position it was encrypted for, so chunks cannot be reordered or a stream cut
+        short.
+        """
+        key = bytes(range(32))
+
+        ciphertext, tag = encrypt_chunk(key, 3, False, b'chunk')
+
+        self.assertEqual(len(b'chunk'), len(ciphertext))
+        self.assertEqual(b'chunk', decrypt_chunk(key, 3, False, ciphertext, tag))
+
+        with self.assertRaises(ValueError):
+            decrypt_chunk(key, 2, False, ciphertext, tag)
+
+        with self.assertRaises(ValueError):
+            decrypt_chunk(key, 3, True, ciphertext, tag)
+
+        with self.assertRaises(ValueError):
+            decrypt_chunk(bytes(32), 3, False, ciphertext, tag)
@@ -1,16 +1,28 @@
+import io
 import sqlite3
 import unittest
 from typing import Tuple
+from unittest import mock
 
 import argon2.exceptions
 from argon2 import PasswordHasher
 
-from Utils.cryptography import derive_256_bit_salt_and_key, encrypt_aes_256_gcm
+import Utils.database
+from Utils.cryptography import derive_256_bit_salt_and_key, encrypt_aes_256_gcm, decrypt_aes_256_gcm
 from Utils.database import get_login_password_by_user_id, get_account_id_by_account_name_and_user_id, db_setup, \
     get_decrypted_account_password, get_all_account_names_urls_and_usernames_by_user_id, get_user_id_by_email, \
     is_valid_login, \
     get_all_decrypted_account_passwords_by_user_id, rehash_and_reencrypt_passwords, create_user, create_account, \
-    get_account_name_url_and_username_by_account_id, edit_account, delete_account
+    get_account_name_url_and_username_by_account_id, edit_account, delete_account, \
+    get_all_account_ids_names_urls_and_usernames_by_user_id, get_encrypted_account_password, \
+    get_all_account_salts_by_user_id, index_account_urls, find_accounts_for_url, fingerprint_account_passwords, \
+    get_reused_account_passwords_by_user_id, create_accounts, changes_since, compact_account_changes, \
+    get_current_revision, ChangeJournalCompactedError, get_account_version, AccountVersionConflictError, \
+    seal_account_metadata, search_accounts, is_account_metadata_sealed, SealedMetadataLockedError, create_shared_item, \
+    add_shared_item_member, remove_shared_item_member, delete_shared_item, get_shared_items_by_user_id, \
+    get_shared_item_by_name_and_user_id, get_decrypted_shared_item_password, add_attachment, add_note, \
+    get_attachments_by_account_id, get_attachment_id_by_name_and_account_id, read_attachment, get_decrypted_note, \
+    delete_attachment, ATTACHMENT_CHUNK_SIZE
 
 
 class DatabaseUtilsTests(unittest.TestCase):
@@ -115,6 +127,34 @@ class DatabaseUtilsTests(unittest.TestCase):
         self.assertEquals(password, get_decrypted_account_password(account_id, master_password, self.connection))
         self.assertEquals(user_id, queried_user_id)
 
+    def test_create_accounts_successful(self):
+        """
+        Creates a batch of Accounts, returning None for each one that cannot be created instead of raising, and the
+        created Accounts can then be queried for, with their url indexes and password fingerprints.
+        """
+        master_password = 'MasterPassword'
+        user_id = create_user(email='new-email@gmail.com', password=master_password, connection=self.connection)
+
+        account_ids = create_accounts(user_id=user_id, master_password=master_password, accounts=[
+            {'name': 'Google', 'url': 'https://www.google.com', 'username': 'user', 'password': 'Password1'},
+            {'name': 'google', 'url': None, 'username': 'duplicate', 'password': 'Password2'},
+            {'name': 'No password', 'url': None, 'username': 'user', 'password': ''},
+            {'name': 'Example', 'username': 'user', 'password': 'Password1'}], connection=self.connection)
+
+        self.assertIsNotNone(account_ids[0])
+        self.assertEqual([None, None], account_ids[1:3])
+        self.assertEqual([('Google', 'https://www.google.com', 'user'), ('Example', None, 'user')],
+                         get_all_account_names_urls_and_usernames_by_user_id(user_id, self.connection))
+        self.assertEqual('Password1', get_decrypted_account_password(account_ids[3], master_password,
+                                                                     self.connection))
+        self.assertEqual([[(account_ids[3], 'Example'), (account_ids[0], 'Google')]],
+                         get_reused_account_passwords_by_user_id(user_id, self.connection))
+        self.assertEqual([account_ids[0]], [account[0] for account in
+                                            find_accounts_for_url(user_id, 'https://google.com', self.connection)])
+
+        with self.assertRaises(argon2.exceptions.VerifyMismatchError):
+            create_accounts(user_id=user_id, master_password='WrongPassword', accounts=[], connection=self.connection)
+
     def test_create_account_non_existent_user_id(self):
         """
         Fails to create an Account due to receiving a non-existent user id.
@@ -695,6 +735,32 @@ class DatabaseUtilsTests(unittest.TestCase):
 
         self.assertIsNone(user_1_account_names_urls_and_usernames)
 
+    def test_get_all_account_ids_names_urls_and_usernames_by_user_successful(self):
+        """
+        When a User has associated Accounts, the id, name, url, and username of each are returned in id order.
+        """
+        self.cursor.executemany("INSERT INTO accounts VALUES (:id, :name, :url, :username, :password, :salt, :nonce, "
+                                ":tag, :user_id)",
+                                [{'id': 7, 'name': 'Company 2', 'url': None, 'username': 'testemail@gmail.com',
+                                  'password': b'password', 'salt': b'salt', 'nonce': b'nonce', 'tag': b'tag',
+                                  'user_id': 1},
+                                 {'id': 3, 'name': 'Company 1', 'url': 'https://www.example.com',
+                                  'username': 'testemail@gmail.com', 'password': b'password', 'salt': b'salt',
+                                  'nonce': b'nonce', 'tag': b'tag', 'user_id': 1},
+                                 {'id': 5, 'name': 'Company 1', 'url': None, 'username': 'otheremail@gmail.com',
+                                  'password': b'password', 'salt': b'salt', 'nonce': b'nonce', 'tag': b'tag',
+                                  'user_id': 2}])
+
+        self.assertEqual([(3, 'Company 1', 'https://www.example.com', 'testemail@gmail.com'),
+                          (7, 'Company 2', None, 'testemail@gmail.com')],
+                         get_all_account_ids_names_urls_and_usernames_by_user_id(user_id=1, connection=self.connection))
+
+    def test_get_all_account_ids_names_urls_and_usernames_by_user_non_existent(self):
+        """
+        When a User has no associated Accounts, None is returned.
+        """
+        self.assertIsNone(get_all_account_ids_names_urls_and_usernames_by_user_id(user_id=1, connection=self.connection))
+
     def get_decrypted_account_password_set_up(self) -> Tuple[str, str, str, int, int, int]:
         """
         Abstracts the setup for the get_decrypted_account_password tests.
@@ -781,6 +847,36 @@ class DatabaseUtilsTests(unittest.TestCase):
         else:
             self.fail('Value error was not raised when the wrong master password was given')
 
+    def test_get_encrypted_account_password_successful(self):
+        """
+        Returns the ciphertext, salt, nonce, and tag that decrypt to the Account password with the key derived from
+        the salt.
+        """
+        master_password, account_password, _, _, account_id, _ = self.get_decrypted_account_password_set_up()
+
+        ciphertext, salt, nonce, tag = get_encrypted_account_password(account_id, self.connection)
+        key = derive_256_bit_salt_and_key(master_password, salt)[1]
+
+        self.assertEqual(account_password, decrypt_aes_256_gcm(key, ciphertext, nonce, tag))
+
+    def test_get_encrypted_account_password_non_existent_account(self):
+        """
+        When there is no Account with the given id, None is returned.
+        """
+        self.assertIsNone(get_encrypted_account_password(1, self.connection))
+
+    def test_get_all_account_salts_by_user_id(self):
+        """
+        Returns each distinct salt of the User's Accounts once, and an empty list for a User without Accounts.
+        """
+        self.cursor.executemany("INSERT INTO accounts VALUES (NULL, ?, NULL, 'user', x'00', ?, x'00', x'00', ?)",
+                                [('Company 1', b'salt 1', 1), ('Company 2', b'salt 1', 1), ('Company 3', b'salt 2', 1),
+                                 ('Company 1', b'salt 3', 2)])
+
+        self.assertEqual({b'salt 1', b'salt 2'}, set(get_all_account_salts_by_user_id(1, self.connection)))
+        self.assertEqual(2, len(get_all_account_salts_by_user_id(1, self.connection)))
+        self.assertEqual([], get_all_account_salts_by_user_id(3, self.connection))
+
     def test_get_all_decrypted_account_passwords_by_user_id_successful(self):
         """
         When given fully valid inputs, the plaintext Account passwords are returned.
@@ -843,6 +939,536 @@ class DatabaseUtilsTests(unittest.TestCase):
                                                                              'email': 'superemail@gmail.com',
                                                                              'password': hashed_password})
 
+    def insert_accounts_with_urls(self, urls_by_name: dict, user_id: int = 1):
+        self.cursor.executemany("INSERT INTO accounts VALUES (NULL, ?, ?, 'user', x'00', x'00', x'00', x'00', ?)",
+                                [(name, url, user_id) for name, url in urls_by_name.items()])
+
+    def test_index_account_urls(self):
+        """
+        Indexes the Accounts with a valid url host that are not indexed yet, and only those of the given User if one
+        is given.
+        """
+        self.insert_accounts_with_urls({'Company 1': 'https://www.example.com', 'Company 2': None,
+                                        'Company 3': 'not a url'})
+        self.insert_accounts_with_urls({'Company 1': 'https://other.example.org'}, user_id=2)
+
+        self.assertEqual(1, index_account_urls(self.connection, user_id=1))
+        self.assertEqual(1, index_account_urls(self.connection))
+        self.assertEqual(0, index_account_urls(self.connection))
+
+        self.cursor.execute("SELECT user_id, host, domain FROM account_urls ORDER BY user_id")
+        self.assertEqual([(1, 'www.example.com', 'example.com'), (2, 'other.example.org', 'example.org')],
+                         self.cursor.fetchall())
+
+    def test_find_accounts_for_url(self):
+        """
+        Returns the User's Accounts on the same registrable domain, those on the exact same host first.
+        """
+        self.insert_accounts_with_urls({'B': 'https://www.example.com/home', 'A': 'example.com',
+                                        'C': 'https://login.example.com', 'D': 'https://example.org',
+                                        'E': 'https://notexample.com'})
+        self.insert_accounts_with_urls({'F': 'https://login.example.com'}, user_id=2)
+        index_account_urls(self.connection)
+
+        accounts = find_accounts_for_url(1, 'https://LOGIN.example.com:443/path?next=/', self.connection)
+
+        self.assertEqual(['C', 'A', 'B'], [account[1] for account in accounts])
+        self.assertEqual('https://login.example.com', accounts[0][2])
+        self.assertEqual([], find_accounts_for_url(1, 'https://example.net', self.connection))
+        self.assertEqual([], find_accounts_for_url(1, 'not a url', self.connection))
+
+    def test_find_accounts_for_url_uses_the_index(self):
+        self.cursor.execute("EXPLAIN QUERY PLAN SELECT account_id FROM account_urls WHERE user_id=1 AND domain='a.com'")
+
+        self.assertIn('INDEX account_urls_user_id_domain (user_id=? AND domain=?)',
+                      ' '.join(row[3] for row in self.cursor.fetchall()))
+
+    def test_url_index_is_maintained(self):
+        """
+        create_account and edit_account index the url, and changing the url or deleting the Account in any other way
+        removes the stale entry.
+        """
+        master_password = 'TestPassword'
+        self.cursor.execute("INSERT INTO users VALUES (3, 'coolemail@gmail.com', ?)",
+                            (PasswordHasher().hash(master_password),))
+
+        account_id = create_account(user_id=3, master_password=master_password, name='Company', url='https://a.com',
+                                    username='user', password='password', connection=self.connection)
+        self.assertEqual([account_id], [account[0] for account in find_accounts_for_url(3, 'a.com', self.connection)])
+
+        edit_account(account_id=account_id, connection=self.connection, url='https://www.b.com')
+        self.assertEqual([], find_accounts_for_url(3, 'a.com', self.connection))
+        self.assertEqual([account_id], [account[0] for account in find_accounts_for_url(3, 'b.com', self.connection)])
+
+        self.cursor.execute("UPDATE accounts SET url='https://c.com' WHERE id=?", (account_id,))
+        self.assertEqual([], find_accounts_for_url(3, 'b.com', self.connection))
+
+        index_account_urls(self.connection)
+        self.assertEqual(1, len(find_accounts_for_url(3, 'c.com', self.connection)))
+
+        delete_account(account_id, self.connection)
+        self.cursor.execute("SELECT COUNT(*) FROM account_urls")
+        self.assertEqual(0, self.cursor.fetchone()[0])
+
+    def test_reused_account_passwords(self):
+        """
+        create_account and edit_account fingerprint the passwords, so that reused passwords are grouped without
+        decrypting anything, and only within the same User.
+        """
+        master_password = 'TestPassword'
+        self.cursor.execute("INSERT INTO users VALUES (3, 'coolemail@gmail.com', ?)",
+                            (PasswordHasher().hash(master_password),))
+        self.cursor.execute("INSERT INTO users VALUES (4, 'otheremail@gmail.com', ?)",
+                            (PasswordHasher().hash(master_password),))
+
+        account_ids = {name: create_account(user_id=3, master_password=master_password, name=name, url=None,
+                                            username='user', password=password, connection=self.connection)
+                       for name, password in (('B', 'Reused'), ('A', 'Reused'), ('C', 'Unique'), ('D', 'Twice'),
+                                              ('E', 'Twice'), ('F', 'Reused'))}
+        create_account(user_id=4, master_password=master_password, name='G', url=None, username='user',
+                       password='Unique', connection=self.connection)
+
+        self.assertEqual([[(account_ids['A'], 'A'), (account_ids['B'], 'B'), (account_ids['F'], 'F')],
+                          [(account_ids['D'], 'D'), (account_ids['E'], 'E')]],
+                         get_reused_account_passwords_by_user_id(3, self.connection))
+
+        edit_account(account_id=account_ids['E'], connection=self.connection, master_password=master_password,
+                     password='Unique')
+        delete_account(account_ids['F'], self.connection)
+
+        self.assertEqual([['A', 'B'], ['C', 'E']],
+                         [[name for _, name in group]
+                          for group in get_reused_account_passwords_by_user_id(3, self.connection)])
+        self.assertEqual([], get_reused_account_passwords_by_user_id(4, self.connection))
+
+        # Fingerprints are keyed per User, so the same password does not have the same fingerprint for another User
+        self.cursor.execute("SELECT COUNT(DISTINCT fingerprint) FROM account_fingerprints WHERE account_id IN (?, ?)",
+                            (account_ids['C'], get_account_id_by_account_name_and_user_id('G', 4, self.connection)))
+        self.assertEqual(2, self.cursor.fetchone()[0])
+
+    def test_fingerprint_account_passwords(self):
+        """
+        Adds the fingerprints missing after a password is changed without edit_account or after a rehash, and does
+        not decrypt the Accounts that already have one.
+        """
+        master_password, account_password, account_password_2, user_id, account_id, account_id_2 = \
+            self.get_decrypted_account_password_set_up()
+
+        self.assertEqual(2, fingerprint_account_passwords(user_id, master_password, self.connection))
+        self.assertEqual(0, fingerprint_account_passwords(user_id, master_password, self.connection))
+
+        salt, key = derive_256_bit_salt_and_key(master_password)
+        ciphertext, nonce, tag = encrypt_aes_256_gcm(key, account_password)
+        self.cursor.execute("UPDATE accounts SET password=?, salt=?, nonce=?, tag=? WHERE id=?",
+                            (ciphertext, salt, nonce, tag, account_id_2))
+        self.assertEqual([], get_reused_account_passwords_by_user_id(user_id, self.connection))
+
+        self.assertEqual(1, fingerprint_account_passwords(user_id, master_password, self.connection))
+        self.assertEqual([[account_id, account_id_2]],
+                         [sorted(account_id for account_id, _ in group)
+                          for group in get_reused_account_passwords_by_user_id(user_id, self.connection)])
+
+        rehash_and_reencrypt_passwords(user_id=user_id, entered_password=master_password, connection=self.connection)
+        self.assertEqual(0, fingerprint_account_passwords(user_id, master_password, self.connection))
+        self.assertEqual(1, len(get_reused_account_passwords_by_user_id(user_id, self.connection)))
+
+    def test_fingerprint_account_passwords_wrong_master_password(self):
+        master_password, account_password, account_password_2, user_id, account_id, account_id_2 = \
+            self.get_decrypted_account_password_set_up()
+
+        with self.assertRaises(ValueError):
+            fingerprint_account_passwords(user_id, 'WrongPassword', self.connection)
+
+        self.cursor.execute("SELECT COUNT(*) FROM user_keys")
+        self.assertEqual(0, self.cursor.fetchone()[0])
+
+    def test_reused_account_passwords_uses_the_index(self):
+        self.cursor.execute("EXPLAIN QUERY PLAN SELECT fingerprint, COUNT(*) FROM account_fingerprints WHERE user_id=1 "
+                            "GROUP BY fingerprint HAVING COUNT(*) > 1")
+
+        self.assertIn('INDEX account_fingerprints_user_id_fingerprint (user_id=?)',
+                      ' '.join(row[3] for row in self.cursor.fetchall()))
+
+    def insert_account(self, name: str, user_id: int = 1) -> int:
+        self.cursor.execute("INSERT INTO accounts VALUES (NULL, ?, NULL, 'user', x'00', x'00', x'00', x'00', ?) "
+                            "RETURNING id", (name, user_id))
+
+        return self.cursor.fetchone()[0]
+
+    def test_changes_since(self):
+        """
+        Every insert, update, and delete of an Account gets the next revision, and changes_since returns each Account
+        changed after a revision once, in its current state, and only for the given User.
+        """
+        self.assertEqual(0, get_current_revision(self.connection))
+
+        account_id = self.insert_account('A')
+        account_id_2 = self.insert_account('B')
+        self.insert_account('Other', user_id=2)
+        revision = get_current_revision(self.connection)
+
+        self.assertEqual(3, revision)
+        self.assertEqual({'revision': 3, 'changed': [(account_id, 'A', None, 'user'), (account_id_2, 'B', None, 'user')],
+                          'deleted': []}, changes_since(1, 0, self.connection))
+
+        edit_account(account_id=account_id, connection=self.connection, username='edited')
+        edit_account(account_id=account_id, connection=self.connection, url='https://example.com')
+        delete_account(account_id_2, self.connection)
+        account_id_3 = self.insert_account('C')
+
+        self.assertEqual({'revision': 7, 'changed': [(account_id, 'A', 'https://example.com', 'edited'),
+                                                     (account_id_3, 'C', None, 'user')],
+                          'deleted': [account_id_2]}, changes_since(1, revision, self.connection))
+        self.assertEqual({'revision': 7, 'changed': [], 'deleted': []}, changes_since(1, 7, self.connection))
+        self.assertEqual({'revision': 7, 'changed': [], 'deleted': []}, changes_since(2, revision, self.connection))
+
+    def test_compact_account_changes(self):
+        """
+        Compaction keeps the latest change of every Account, so changes_since returns the same changes, and the
+        revisions that may have missed a compacted deletion are refused.
+        """
+        account_id = self.insert_account('A')
+        account_id_2 = self.insert_account('B')
+        edit_account(account_id=account_id, connection=self.connection, username='edited')
+        delete_account(account_id_2, self.connection)
+        edit_account(account_id=account_id, connection=self.connection, username='edited again')
+
+        before = [changes_since(1, revision, self.connection) for revision in range(6)]
+
+        self.assertEqual(3, compact_account_changes(self.connection))
+        self.assertEqual(before, [changes_since(1, revision, self.connection) for revision in range(6)])
+
+        self.assertEqual(1, compact_account_changes(self.connection, deleted_before_revision=4))
+        self.assertEqual(5, get_current_revision(self.connection))
+        self.assertEqual(before[4:], [changes_since(1, revision, self.connection) for revision in range(4, 6)])
+
+        with self.assertRaises(ChangeJournalCompactedError):
+            changes_since(1, 3, self.connection)
+
+        with self.assertRaises(ValueError):
+            compact_account_changes(self.connection, deleted_before_revision=6)
+
+        # Revisions are not reused after compaction
+        self.insert_account('C')
+        self.assertEqual(6, get_current_revision(self.connection))
+
+    def test_edits_conditional_on_the_account_version(self):
+        """
+        Every write gives the Account a new version, and an edit or deletion expecting an older version is refused and
+        changes nothing, while one expecting the current version or a later revision goes through.
+        """
+        account_id = self.insert_account('A')
+        account_id_2 = self.insert_account('B')
+        version = get_account_version(account_id, self.connection)
+
+        self.assertEqual(1, version)
+        self.assertIsNone(get_account_version(3400, self.connection))
+
+        new_version = edit_account(account_id=account_id, connection=self.connection, username='first',
+                                   url='https://example.com', expected_version=version)
+
+        self.assertEqual(3, new_version)
+        self.assertEqual(new_version, get_account_version(account_id, self.connection))
+
+        with self.assertRaises(AccountVersionConflictError):
+            edit_account(account_id=account_id, connection=self.connection, username='second', name='Renamed',
+                         expected_version=version)
+
+        with self.assertRaises(AccountVersionConflictError):
+            delete_account(account_id, self.connection, expected_version=version)
+
+        # An edit that changes nothing still reports the newer version
+        with self.assertRaises(AccountVersionConflictError):
+            edit_account(account_id=account_id, connection=self.connection, expected_version=version)
+
+        self.assertEqual(new_version, edit_account(account_id=account_id, connection=self.connection,
+                                                   expected_version=new_version))
+
+        self.assertEqual(('A', 'https://example.com', 'first'),
+                         get_account_name_url_and_username_by_account_id(account_id, self.connection))
+        self.assertEqual(new_version, get_account_version(account_id, self.connection))
+
+        # Any revision after the Account's latest write will do, e.g. the revision of the whole vault
+        edit_account(account_id=account_id_2, connection=self.connection, username='edited',
+                     expected_version=get_current_revision(self.connection))
+        delete_account(account_id, self.connection, expected_version=get_current_revision(self.connection))
+
+        self.assertIsNone(get_account_version(account_id, self.connection))
+
+    def create_sealed_user(self) -> int:
+        user_id = create_user(email='sealed@gmail.com', password='MasterPassword', connection=self.connection)
+
+        create_accounts(user_id, 'MasterPassword', [
+            {'name': 'Gmail', 'url': 'https://mail.google.com', 'username': 'bob@gmail.com', 'password': 'Password1'},
+            {'name': 'Google', 'url': 'https://www.google.com', 'username': 'bob', 'password': 'Password1'}],
+                        self.connection)
+
+        self.assertEqual(2, seal_account_metadata(user_id, 'MasterPassword', self.connection))
+
+        return user_id
+
+    def test_seal_account_metadata(self):
+        """
+        The name, url, and username of a sealed User's Accounts are not stored in plaintext, but every read function
+        reveals them, names are still unique whatever their case, and new and edited Accounts are sealed too.
+        """
+        user_id = self.create_sealed_user()
+        gmail_id = get_account_id_by_account_name_and_user_id('gmail', user_id, self.connection)
+
+        self.assertTrue(is_account_metadata_sealed(user_id, self.connection))
+        self.assertFalse(is_account_metadata_sealed(1, self.connection))
+        self.assertEqual(0, seal_account_metadata(user_id, 'MasterPassword', self.connection))
+
+        self.cursor.execute("SELECT name, url, username FROM accounts WHERE user_id=?", (user_id,))
+
+        for name, url, username in self.cursor.fetchall():
+            self.assertNotIn(name, ('Gmail', 'Google'))
+            self.assertEqual((None, ''), (url, username))
+
+        self.assertEqual(('Gmail', 'https://mail.google.com', 'bob@gmail.com'),
+                         get_account_name_url_and_username_by_account_id(gmail_id, self.connection))
+        self.assertEqual([('Gmail', 'https://mail.google.com', 'bob@gmail.com'),
+                          ('Google', 'https://www.google.com', 'bob')],
+                         get_all_account_names_urls_and_usernames_by_user_id(user_id, self.connection))
+        self.assertEqual([['Gmail', 'Google']], [[name for _, name in group] for group in
+                                                 get_reused_account_passwords_by_user_id(user_id, self.connection)])
+        self.assertEqual(['Google', 'Gmail'], [account[1] for account in
+                                               find_accounts_for_url(user_id, 'www.google.com', self.connection)])
+
+        with self.assertRaises(sqlite3.IntegrityError):
+            create_account(user_id, 'MasterPassword', 'GOOGLE', None, 'other', 'Password', self.connection)
+
+        revision = get_current_revision(self.connection)
+        account_id = create_account(user_id, 'MasterPassword', 'Yahoo', None, 'bob', 'Password', self.connection)
+        edit_account(account_id=account_id, connection=self.connection, url='https://login.yahoo.com')
+        edit_account(account_id=gmail_id, connection=self.connection, name='Mail', username='robert')
+
+        self.assertEqual(['Yahoo'], [account[1] for account in
+                                     find_accounts_for_url(user_id, 'yahoo.com', self.connection)])
+        self.assertEqual({'revision': revision + 3,
+                          'changed': [(gmail_id, 'Mail', 'https://mail.google.com', 'robert'),
+                                      (account_id, 'Yahoo', 'https://login.yahoo.com', 'bob')], 'deleted': []},
+                         changes_since(user_id, revision, self.connection))
+        self.assertIsNone(get_account_id_by_account_name_and_user_id('Gmail', user_id, self.connection))
+        self.assertEqual(gmail_id, get_account_id_by_account_name_and_user_id('MAIL', user_id, self.connection))
+
+    def test_search_accounts(self):
+        """
+        Searches the Accounts by substring, or, once sealed, by whole words through the blind index.
+        """
+        self.insert_accounts_with_urls({'Company 1': 'https://www.example.com', 'Other': None})
+
+        self.assertEqual(['Company 1'], [account[1] for account in search_accounts(1, 'EXAMPLE', self.connection)])
+        self.assertEqual(['Company 1', 'Other'], [account[1] for account in search_accounts(1, '', self.connection)])
+
+        user_id = self.create_sealed_user()
+
+        self.assertEqual(['Gmail', 'Google'], [account[1] for account in
+                                               search_accounts(user_id, 'bob', self.connection)])
+        self.assertEqual(['Gmail'], [account[1] for account in search_accounts(user_id, 'Gmail.com', self.connection)])
+        self.assertEqual(['Google'], [account[1] for account in
+                                      search_accounts(user_id, 'www google', self.connection)])
+        self.assertEqual([], search_accounts(user_id, 'goo', self.connection))
+        self.assertEqual(2, len(search_accounts(user_id, '', self.connection)))
+
+    def test_sealed_account_metadata_is_locked_until_the_login(self):
+        user_id = self.create_sealed_user()
+
+        with mock.patch.dict(Utils.database._metadata_keys, clear=True):
+            with self.assertRaises(SealedMetadataLockedError):
+                get_all_account_names_urls_and_usernames_by_user_id(user_id, self.connection)
+
+            with self.assertRaises(SealedMetadataLockedError):
+                get_account_id_by_account_name_and_user_id('Gmail', user_id, self.connection)
+
+            self.assertTrue(is_valid_login('sealed@gmail.com', 'MasterPassword', self.connection))
+            self.assertEqual(['Gmail', 'Google'], [account[0] for account in
+                                                   get_all_account_names_urls_and_usernames_by_user_id(
+                                                       user_id, self.connection)])
+
+    def create_users_with_key_pairs(self, *emails: str) -> Tuple[int, ...]:
+        user_ids = []
+
+        for email in emails:
+            user_ids.append(create_user(email=email, password=f'{email} password', connection=self.connection))
+            self.assertTrue(is_valid_login(email, f'{email} password', self.connection))
+
+        return tuple(user_ids)
+
+    def test_shared_items(self):
+        """
+        A shared item is listed for, and can be decrypted by, its owner and members only, and members can be added and
+        removed by the owner.
+        """
+        owner_id, member_id, other_id = self.create_users_with_key_pairs('owner@gmail.com', 'member@gmail.com',
+                                                                         'other@gmail.com')
+        create_account(member_id, 'member@gmail.com password', 'Bank', None, 'member', 'BankPassword', self.connection)
+
+        item_id = create_shared_item(owner_id, 'owner@gmail.com password', 'Streaming', 'https://streaming.com',
+                                     'family', 'SharedPassword', [member_id], self.connection)
+
+        self.assertEqual([(item_id, 'Streaming', 'https://streaming.com', 'family', owner_id)],
+                         get_shared_items_by_user_id(member_id, self.connection))
+        self.assertEqual([('Bank', None, 'member'), ('Streaming', 'https://streaming.com', 'family')],
+                         get_all_account_names_urls_and_usernames_by_user_id(member_id, self.connection))
+        self.assertEqual(item_id, get_shared_item_by_name_and_user_id('streaming', member_id, self.connection)[0])
+        self.assertIsNone(get_shared_item_by_name_and_user_id('Streaming', other_id, self.connection))
+
+        self.assertEqual('SharedPassword', get_decrypted_shared_item_password(
+            item_id, owner_id, 'owner@gmail.com password', self.connection))
+        self.assertEqual('SharedPassword', get_decrypted_shared_item_password(
+            item_id, member_id, 'member@gmail.com password', self.connection))
+
+        with self.assertRaises(ValueError):
+            get_decrypted_shared_item_password(item_id, other_id, 'other@gmail.com password', self.connection)
+
+        add_shared_item_member(item_id, owner_id, 'owner@gmail.com password', other_id, self.connection)
+
+        self.assertEqual('SharedPassword', get_decrypted_shared_item_password(
+            item_id, other_id, 'other@gmail.com password', self.connection))
+
+        remove_shared_item_member(item_id, owner_id, member_id, self.connection)
+
+        self.assertEqual([], get_shared_items_by_user_id(member_id, self.connection))
+
+        with self.assertRaises(ValueError):
+            remove_shared_item_member(item_id, owner_id, owner_id, self.connection)
+
+        delete_shared_item(item_id, owner_id, self.connection)
+
+        self.assertEqual([], get_shared_items_by_user_id(other_id, self.connection))
+        self.cursor.execute("SELECT COUNT(*) FROM shared_item_members")
+        self.assertEqual(0, self.cursor.fetchone()[0])
+
+    def test_user_keys_are_kept_by_user_not_by_master_password(self):
+        """
+        A user key is kept by user id and salt once the master password is verified, not by the master password, and a
+        wrong master password derives its own key instead of getting the kept one.
+        """
+        user_id = create_user(email='keys@gmail.com', password='MasterPassword', connection=self.connection)
+        account_id = create_account(user_id, 'MasterPassword', 'Server', None, 'root', 'Password', self.connection)
+
+        with mock.patch.dict(Utils.database._user_keys, clear=True):
+            note_id = add_note(account_id, 'MasterPassword', 'Recovery codes', 'code 1', self.connection)
+
+            self.assertEqual([user_id], [kept_user_id for kept_user_id, _ in Utils.database._user_keys])
+            self.assertNotIn('MasterPassword', repr(Utils.database._user_keys))
+
+            with self.assertRaises(ValueError):
+                get_decrypted_note(note_id, 'WrongPassword', self.connection)
+
+            self.assertEqual('code 1', get_decrypted_note(note_id, 'MasterPassword', self.connection))
+
+    def test_attachments(self):
+        """
+        Attachments are streamed in and out in chunks, listed without their content, and deleted with their Account.
+        """
+        user_id = create_user(email='attachments@gmail.com', password='MasterPassword', connection=self.connection)
+        account_id = create_account(user_id, 'MasterPassword', 'Server', None, 'root', 'Password', self.connection)
+        content = bytes(range(256)) * (ATTACHMENT_CHUNK_SIZE // 128) + b'tail'
+
+        key_id = add_attachment(account_id, 'MasterPassword', 'id_ed25519', io.BytesIO(content), self.connection)
+        empty_id = add_attachment(account_id, 'MasterPassword', 'empty.txt', io.BytesIO(), self.connection)
+        note_id = add_note(account_id, 'MasterPassword', 'Recovery codes', 'code 1\ncode 2', self.connection)
+
+        self.assertEqual([(empty_id, 'empty.txt', 'file', 0), (key_id, 'id_ed25519', 'file', len(content)),
+                          (note_id, 'Recovery codes', 'note', 13)],
+                         get_attachments_by_account_id(account_id, self.connection))
+        self.assertEqual(note_id, get_attachment_id_by_name_and_account_id('recovery CODES', account_id,
+                                                                            self.connection))
+        self.assertIsNone(get_attachment_id_by_name_and_account_id('Other', account_id, self.connection))
+
+        chunks = list(read_attachment(key_id, 'MasterPassword', self.connection))
+
+        self.assertEqual(3, len(chunks))
+        self.assertEqual(content, b''.join(chunks))
+        self.assertEqual(b'', b''.join(read_attachment(empty_id, 'MasterPassword', self.connection)))
+        self.assertEqual('code 1\ncode 2', get_decrypted_note(note_id, 'MasterPassword', self.connection))
+
+        with self.assertRaises(ValueError):
+            read_attachment(key_id, 'WrongPassword', self.connection)
+
+        with self.assertRaises(argon2.exceptions.VerifyMismatchError):
+            add_attachment(account_id, 'WrongPassword', 'Other', io.BytesIO(b'content'), self.connection)
+
+        with self.assertRaises(sqlite3.IntegrityError):
+            add_note(account_id, 'MasterPassword', 'ID_ED25519', 'note', self.connection)
+
+        # A stream cut short does not decrypt, even though every remaining chunk does
+        self.cursor.execute("DELETE FROM attachment_chunks WHERE attachment_id=? AND chunk_index=2", (key_id,))
+
+        with self.assertRaises(ValueError):
+            list(read_attachment(key_id, 'MasterPassword', self.connection))
+
+        delete_attachment(empty_id, self.connection)
+
+        with self.assertRaises(ValueError):
+            delete_attachment(empty_id, self.connection)
+
+        delete_account(account_id, self.connection)
+
+        self.cursor.execute("SELECT (SELECT COUNT(*) FROM attachments) + (SELECT COUNT(*) FROM attachment_chunks)")
+        self.assertEqual(0, self.cursor.fetchone()[0])
+
+    def test_shared_item_requires_the_key_pairs_of_the_members(self):
+        """
+        An item cannot be shared with a User who has not logged in since sharing was added, so has no key pair, nor by a
+        User whose Account metadata is sealed, and only the owner can add members.
+        """
+        owner_id, member_id = self.create_users_with_key_pairs('owner@gmail.com', 'member@gmail.com')
+        new_user_id = create_user(email='new@gmail.com', password='NewPassword', connection=self.connection)
+
+        with self.assertRaises(ValueError):
+            create_shared_item(owner_id, 'owner@gmail.com password', 'Streaming', None, 'family', 'SharedPassword',
+                               [new_user_id], self.connection)
+
+        self.assertEqual([], get_shared_items_by_user_id(owner_id, self.connection))
+
+        # The plaintext metadata of a shared item would undo the sealing
+        seal_account_metadata(new_user_id, 'NewPassword', self.connection)
+
+        with self.assertRaises(ValueError):
+            create_shared_item(new_user_id, 'NewPassword', 'Streaming', None, 'family', 'SharedPassword', [member_id],
+                               self.connection)
+
+        item_id = create_shared_item(owner_id, 'owner@gmail.com password', 'Streaming', None, 'family',
+                                     'SharedPassword', [member_id], self.connection)
+
+        with self.assertRaises(ValueError):
+            add_shared_item_member(item_id, member_id, 'member@gmail.com password', owner_id, self.connection)
+
+    def test_shared_item_names_do_not_collide_for_members(self):
+        """
+        An item is not shared with a User who already has an Account or another owner's shared item with its name, nor
+        with a User whose Account names are sealed, so that every listed name can be looked up.
+        """
+        owner_id, member_id, other_owner_id, sealed_id = self.create_users_with_key_pairs(
+            'owner@gmail.com', 'member@gmail.com', 'other@gmail.com', 'sealed@gmail.com')
+        create_account(member_id, 'member@gmail.com password', 'Bank', None, 'member', 'BankPassword', self.connection)
+        seal_account_metadata(sealed_id, 'sealed@gmail.com password', self.connection)
+
+        for name, member_ids in (('BANK', [member_id]), ('Streaming', [sealed_id])):
+            with self.assertRaises(ValueError):
+                create_shared_item(owner_id, 'owner@gmail.com password', name, None, 'family', 'SharedPassword',
+                                   member_ids, self.connection)
+
+        create_shared_item(other_owner_id, 'other@gmail.com password', 'Streaming', None, 'other', 'OtherPassword',
+                           [member_id], self.connection)
+
+        with self.assertRaises(ValueError):
+            create_shared_item(owner_id, 'owner@gmail.com password', 'streaming', None, 'family', 'SharedPassword',
+                               [member_id], self.connection)
+
+        item_id = create_shared_item(owner_id, 'owner@gmail.com password', 'Streaming', None, 'family',
+                                     'SharedPassword', [], self.connection)
+
+        for new_member_id in (member_id, sealed_id):
+            with self.assertRaises(ValueError):
+                add_shared_item_member(item_id, owner_id, 'owner@gmail.com password', new_member_id, self.connection)
+
+        self.assertEqual([('Bank', None, 'member'), ('Streaming', None, 'other')],
+                         get_all_account_names_urls_and_usernames_by_user_id(member_id, self.connection))
+
     def test_is_valid_login_successful(self):
         """
         is_valid_login returns True when the given login is already associated with a User in the database.
@@ -0,0 +1,207 @@
+import os
+import tempfile
+import unittest
+
+from Utils.database import db_setup, create_user, create_account, get_all_account_names_urls_and_usernames_by_user_id, \
+    get_all_decrypted_account_passwords_by_user_id
+from Utils.encrypted_export import write_encrypted_export, read_encrypted_export, EncryptedExportError, KDFParameters, \
+    export_accounts_encrypted, import_accounts_from_encrypted_export, is_encrypted_export, MAGIC, CHUNK_HEADER, \
+    TAG_SIZE, KDF_PARAMETERS, NONCE_PREFIX_SIZE, MAX_MEMORY_COST, MAX_PARALLELISM
+
+# Cheap Argon2 parameters, so that the tests do not spend their time deriving keys
+TEST_KDF_PARAMETERS = KDFParameters(time_cost=1, memory_cost=8, parallelism=1)
+
+
+class EncryptedExportUtilsTests(unittest.TestCase):
+    def setUp(self) -> None:
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'export.ppm')
+        self.accounts = [(f'Company {i}', f'https://company{i}.com' if i % 3 else None, f'user{i}', f'Pässword {i}')
+                         for i in range(500)]
+
+    def tearDown(self) -> None:
+        self.directory.cleanup()
+
+    def write(self, accounts=None, **kwargs) -> int:
+        return write_encrypted_export(self.path, self.accounts if accounts is None else accounts, 'ExportPassword',
+                                      chunk_size=kwargs.pop('chunk_size', 1024), kdf_parameters=TEST_KDF_PARAMETERS,
+                                      **kwargs)
+
+    def read(self, password: str = 'ExportPassword', workers: int = 4):
+        return list(read_encrypted_export(self.path, password, workers=workers))
+
+    def chunk_offsets(self):
+        """
+        Returns the start and end offsets of each chunk of the export.
+        """
+        with open(self.path, 'rb') as export_file:
+            data = export_file.read()
+
+        offset = len(MAGIC) + KDF_PARAMETERS.size + 1 + data[len(MAGIC) + KDF_PARAMETERS.size] + NONCE_PREFIX_SIZE
+        offsets = []
+
+        while offset < len(data):
+            length = CHUNK_HEADER.unpack_from(data, offset)[1]
+            end = offset + CHUNK_HEADER.size + length + TAG_SIZE
+            offsets.append((offset, end))
+            offset = end
+
+        return data, offsets
+
+    def test_round_trip(self):
+        """
+        The Accounts read back are the ones written, with or without compression and with any number of workers.
+        """
+        for compress in (True, False):
+            self.assertEqual(500, self.write(compress=compress, workers=3))
+            self.assertTrue(is_encrypted_export(self.path))
+            self.assertEqual(self.accounts, self.read(workers=1))
+            self.assertEqual(self.accounts, self.read(workers=4))
+
+        self.assertEqual(0, self.write(accounts=[]))
+        self.assertEqual([], self.read())
+
+    def test_chunks_are_streamed(self):
+        """
+        The Accounts are split into many independently encrypted chunks, and compression shrinks them.
+        """
+        self.write(compress=False)
+        uncompressed_size = os.path.getsize(self.path)
+        self.assertGreater(len(self.chunk_offsets()[1]), 20)
+
+        self.write()
+        self.assertLess(os.path.getsize(self.path), uncompressed_size)
+
+    def test_wrong_password(self):
+        self.write()
+
+        with self.assertRaises(EncryptedExportError):
+            self.read(password='WrongPassword')
+
+    def test_truncation_is_detected(self):
+        """
+        Dropping the final chunk, or cutting the file anywhere, fails to read.
+        """
+        self.write()
+        data, offsets = self.chunk_offsets()
+
+        for length in (offsets[-1][0], offsets[-1][0] + 3, len(data) - 1):
+            with open(self.path, 'wb') as export_file:
+                export_file.write(data[:length])
+
+            with self.assertRaises(EncryptedExportError):
+                self.read()
+
+    def test_reordering_and_tampering_are_detected(self):
+        self.write()
+        data, offsets = self.chunk_offsets()
+        (first_start, first_end), (second_start, second_end) = offsets[0], offsets[1]
+
+        modified_files = [
+            data[:first_start] + data[second_start:second_end] + data[first_start:first_end] + data[second_end:],
+            data[:first_start] + data[second_start:],
+            data[:first_start + CHUNK_HEADER.size] + bytes([data[first_start + CHUNK_HEADER.size] ^ 1])
+            + data[first_start + CHUNK_HEADER.size + 1:],
+            data[:len(MAGIC)] + KDF_PARAMETERS.pack(2, 8, 1) + data[len(MAGIC) + KDF_PARAMETERS.size:],
+            data + data[first_start:first_end],
+        ]
+
+        for modified_file in modified_files:
+            with open(self.path, 'wb') as export_file:
+                export_file.write(modified_file)
+
+            with self.assertRaises(EncryptedExportError):
+                self.read()
+
+    def test_unsafe_kdf_parameters_are_refused_before_deriving_the_key(self):
+        """
+        A short salt or out-of-bounds Argon2id parameters in the (not yet authenticated) header raise
+        EncryptedExportError instead of an argon2 error, a hang, or running out of memory.
+        """
+        self.write()
+
+        with open(self.path, 'rb') as export_file:
+            data = export_file.read()
+
+        salt_size_offset = len(MAGIC) + KDF_PARAMETERS.size
+        rest = data[salt_size_offset + 1 + data[salt_size_offset]:]
+        modified_files = [
+            data[:salt_size_offset] + bytes([0]) + rest,
+            data[:len(MAGIC)] + KDF_PARAMETERS.pack(2 ** 32 - 1, 8, 1) + data[salt_size_offset:],
+            data[:len(MAGIC)] + KDF_PARAMETERS.pack(1, 2 ** 32 - 1, 1) + data[salt_size_offset:],
+            data[:len(MAGIC)] + KDF_PARAMETERS.pack(1, 8, 0) + data[salt_size_offset:],
+            data[:len(MAGIC)] + KDF_PARAMETERS.pack(1, 8, MAX_PARALLELISM) + data[salt_size_offset:],
+        ]
+
+        for modified_file in modified_files:
+            with open(self.path, 'wb') as export_file:
+                export_file.write(modified_file)
+
+            with self.assertRaises(EncryptedExportError):
+                self.read()
+
+        with self.assertRaises(ValueError):
+            write_encrypted_export(self.path, self.accounts, 'ExportPassword',
+                                   kdf_parameters=KDFParameters(1, MAX_MEMORY_COST + 1, 1))
+
+    def test_not_an_encrypted_export(self):
+        with open(self.path, 'w', encoding='utf-8') as csv_file:
+            csv_file.write('name,url,username,password\n')
+
+        self.assertFalse(is_encrypted_export(self.path))
+
+        with self.assertRaises(EncryptedExportError):
+            self.read()
+
+    def test_export_and_import_accounts(self):
+        """
+        Exports a User's Accounts and imports them for another User, reporting the ones that could not be added.
+        """
+        connection, cursor = db_setup()
+        user_id = create_user(email='testemail@gmail.com', password='MasterPassword', connection=connection)
+        other_user_id = create_user(email='otheremail@gmail.com', password='OtherPassword', connection=connection)
+
+        for name, url, username, password in self.accounts[:3]:
+            create_account(user_id=user_id, master_password='MasterPassword', name=name, url=url, username=username,
+                           password=password, connection=connection)
+
+        create_account(user_id=other_user_id, master_password='OtherPassword', name='Company 1', url=None,
+                       username='user', password='Existing', connection=connection)
+
+        self.assertEqual(3, export_accounts_encrypted(self.path, user_id, 'MasterPassword', connection,
+                                                      export_password='ExportPassword'))
+
+        account_ids, unimportable_accounts = import_accounts_from_encrypted_export(
+            self.path, other_user_id, 'OtherPassword', connection, export_password='ExportPassword')
+
+        self.assertEqual(2, len(account_ids))
+        self.assertEqual([{'name': 'Company 1', 'url': 'https://company1.com', 'username': 'user1',
+                           'password': 'Pässword 1'}], unimportable_accounts)
+        self.assertEqual(['Company 0', 'Company 1', 'Company 2'],
+                         sorted(account[0] for account in
+                                get_all_account_names_urls_and_usernames_by_user_id(other_user_id, connection)))
+        self.assertEqual({'Pässword 0', 'Existing', 'Pässword 2'},
+                         set(get_all_decrypted_account_passwords_by_user_id(other_user_id, 'OtherPassword',
+                                                                            connection).values()))
+
+        cursor.close()
+        connection.close()
+
+    def test_modified_export_imports_nothing(self):
+        connection, cursor = db_setup()
+        user_id = create_user(email='testemail@gmail.com', password='MasterPassword', connection=connection)
+
+        self.write(accounts=self.accounts[:100], chunk_size=256)
+        data, offsets = self.chunk_offsets()
+
+        with open(self.path, 'wb') as export_file:
+            export_file.write(data[:offsets[-1][0]])
+
+        with self.assertRaises(EncryptedExportError):
+            import_accounts_from_encrypted_export(self.path, user_id, 'MasterPassword', connection,
+                                                  export_password='ExportPassword')
+
+        self.assertIsNone(get_all_account_names_urls_and_usernames_by_user_id(user_id, connection))
+
+        cursor.close()
+        connection.close()
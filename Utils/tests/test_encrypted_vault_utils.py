@@ -0,0 +1,109 @@
+import os
+import tempfile
+import unittest
+
+from Utils.database import create_user, create_account, get_all_account_names_urls_and_usernames_by_user_id, \
+    get_decrypted_account_password, get_account_id_by_account_name_and_user_id
+from Utils.encrypted_export import EncryptedExportError, KDFParameters
+from Utils.encrypted_vault import EncryptedVault, EncryptedVaultConflictError, is_encrypted_vault
+
+# Cheap Argon2id parameters, so that the tests do not spend their time in the KDF
+TEST_KDF_PARAMETERS = KDFParameters(1, 8, 1)
+
+
+class EncryptedVaultUtilsTests(unittest.TestCase):
+    def setUp(self) -> None:
+        self.directory = tempfile.TemporaryDirectory()
+        self.vault_path = os.path.join(self.directory.name, 'vault.ppmvault')
+
+    def tearDown(self) -> None:
+        self.directory.cleanup()
+
+    def open_vault(self, password: str = 'VaultPassword') -> EncryptedVault:
+        return EncryptedVault(self.vault_path, password, save_delay=2, max_save_delay=10,
+                              kdf_parameters=TEST_KDF_PARAMETERS)
+
+    def test_vault_round_trip(self):
+        """
+        A new vault is only written once it changes, nothing in it is stored in plaintext, and it opens again with the
+        same password only.
+        """
+        with self.open_vault() as vault:
+            user_id = create_user(email='testemail@gmail.com', password='MasterPassword', connection=vault.connection)
+            create_account(user_id, 'MasterPassword', 'Company', 'https://company.com', 'user', 'AccountPassword',
+                           vault.connection)
+
+            self.assertFalse(os.path.exists(self.vault_path))
+
+        self.assertTrue(is_encrypted_vault(self.vault_path))
+
+        with open(self.vault_path, 'rb') as vault_file:
+            contents = vault_file.read()
+
+        for plaintext in (b'testemail@gmail.com', b'Company', b'company.com', b'CREATE TABLE'):
+            self.assertNotIn(plaintext, contents)
+
+        with self.open_vault() as vault:
+            self.assertEqual([('Company', 'https://company.com', 'user')],
+                             get_all_account_names_urls_and_usernames_by_user_id(user_id, vault.connection))
+            self.assertEqual('AccountPassword', get_decrypted_account_password(
+                get_account_id_by_account_name_and_user_id('Company', user_id, vault.connection), 'MasterPassword',
+                vault.connection))
+            self.assertFalse(vault.has_unsaved_changes)
+
+        with self.assertRaises(EncryptedExportError):
+            self.open_vault('WrongPassword')
+
+    def test_saves_are_debounced(self):
+        """
+        save_if_due saves once no change was made for save_delay seconds, or max_save_delay seconds after the first
+        unsaved change, and never in the middle of a transaction.
+        """
+        vault = self.open_vault()
+        self.addCleanup(vault.close)
+
+        self.assertFalse(vault.save_if_due(now=0))
+
+        for now in range(0, 12, 1):
+            vault.connection.execute("INSERT INTO users VALUES (NULL, ?, 'hash')", (f'user{now}@gmail.com',))
+            vault.connection.commit()
+
+            # Changes keep coming every second, so only the maximum delay triggers a save
+            self.assertEqual(now == 10, vault.save_if_due(now=now), now)
+
+        self.assertFalse(vault.save_if_due(now=12))
+        self.assertTrue(vault.save_if_due(now=13))
+        self.assertFalse(vault.save_if_due(now=20))
+
+        vault.connection.execute("INSERT INTO users VALUES (NULL, 'uncommitted@gmail.com', 'hash')")
+        self.assertFalse(vault.save_if_due(now=30))
+        self.assertFalse(vault.save_if_due(now=40))
+
+        vault.connection.commit()
+        self.assertTrue(vault.save_if_due(now=50))
+        vault.save()
+
+        self.assertFalse(vault.has_unsaved_changes)
+
+    def test_save_does_not_overwrite_another_process_changes(self):
+        with self.open_vault() as vault:
+            create_user(email='testemail@gmail.com', password='MasterPassword', connection=vault.connection)
+
+        vault = self.open_vault()
+        other_vault = self.open_vault()
+
+        create_user(email='other@gmail.com', password='MasterPassword', connection=other_vault.connection)
+        other_vault.close()
+
+        create_user(email='stale@gmail.com', password='MasterPassword', connection=vault.connection)
+
+        with self.assertRaises(EncryptedVaultConflictError):
+            vault.close()
+
+        with self.open_vault() as vault:
+            self.assertEqual(['other@gmail.com', 'testemail@gmail.com'],
+                             [email for email, in vault.connection.execute("SELECT email FROM users ORDER BY email")])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,213 @@
+import json
+import os
+import tempfile
+import tracemalloc
+import unittest
+
+from Utils.database import db_setup, create_user, delete_account, get_all_account_names_urls_and_usernames_by_user_id, \
+    get_account_id_by_account_name_and_user_id
+from Utils.import_export import import_accounts_from_csv, export_accounts_to_csv, write_accounts_to_csv, \
+    write_accounts_to_ndjson, read_accounts_from_ndjson, export_accounts_to_ndjson, import_accounts_from_ndjson, \
+    NDJSON_FORMAT
+
+
+class ImportExportUtilsTests(unittest.TestCase):
+    def setUp(self) -> None:
+        self.connection, self.cursor = db_setup()
+        self.master_password = 'MasterPassword'
+        self.user_id = create_user(email='testemail@gmail.com', password=self.master_password,
+                                   connection=self.connection)
+
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self) -> None:
+        self.cursor.close()
+        self.connection.close()
+        self.directory.cleanup()
+
+    def write_csv(self, contents: str) -> str:
+        path = os.path.join(self.directory.name, 'accounts.csv')
+
+        with open(path, 'w', encoding='utf-8-sig') as csv_file:
+            csv_file.write(contents)
+
+        return path
+
+    def test_import_accounts_from_csv_successful(self):
+        """
+        Creates an Account for each row, skipping fully empty rows and returning the rows that could not be added.
+        """
+        path = self.write_csv('name,url,username,password\n'
+                              'Company 1,https://www.example.com,user,Password1\n'
+                              ',,,\n'
+                              'Company 2,,user,Password2\n'
+                              'company 1,,duplicate,Password3\n'
+                              'Company 3,,,Password4\n')
+
+        account_ids, unimportable_accounts = import_accounts_from_csv(path, self.user_id, self.master_password,
+                                                                      self.connection)
+
+        self.assertEqual(2, len(account_ids))
+        self.assertEqual([('Company 1', 'https://www.example.com', 'user'), ('Company 2', None, 'user')],
+                         get_all_account_names_urls_and_usernames_by_user_id(self.user_id, self.connection))
+        self.assertEqual([{'name': 'company 1', 'url': '', 'username': 'duplicate', 'password': 'Password3'},
+                          {'name': 'Company 3', 'url': '', 'username': '', 'password': 'Password4'}],
+                         unimportable_accounts)
+
+    def test_import_accounts_from_csv_missing_columns(self):
+        """
+        A CSV file without the name, username, and password columns raises a ValueError; the url column is optional.
+        """
+        with self.assertRaises(ValueError):
+            import_accounts_from_csv(self.write_csv('name,password\nCompany,Password\n'), self.user_id,
+                                     self.master_password, self.connection)
+
+        account_ids, _ = import_accounts_from_csv(self.write_csv('name,username,password\nCompany,user,Password\n'),
+                                                  self.user_id, self.master_password, self.connection)
+
+        self.assertEqual(1, len(account_ids))
+
+    def test_export_and_reimport_round_trip(self):
+        """
+        Exported Accounts, with their decrypted passwords, can be imported again unchanged.
+        """
+        import_accounts_from_csv(self.write_csv('name,url,username,password\n'
+                                                'Company 1,https://www.example.com/a/very/long/url,user,Password1\n'
+                                                'Company 2,,user,"Pass,word""2"\n'),
+                                 self.user_id, self.master_password, self.connection)
+
+        export_path = os.path.join(self.directory.name, 'export.csv')
+
+        self.assertEqual(2, export_accounts_to_csv(export_path, self.user_id, self.master_password, self.connection))
+
+        other_user_id = create_user(email='otheremail@gmail.com', password=self.master_password,
+                                    connection=self.connection)
+        account_ids, unimportable_accounts = import_accounts_from_csv(export_path, other_user_id, self.master_password,
+                                                                      self.connection)
+
+        self.assertEqual((2, []), (len(account_ids), unimportable_accounts))
+
+        export_path_2 = os.path.join(self.directory.name, 'export_2.csv')
+        export_accounts_to_csv(export_path_2, other_user_id, self.master_password, self.connection)
+
+        with open(export_path, 'r', encoding='utf-8-sig') as export_file, \
+                open(export_path_2, 'r', encoding='utf-8-sig') as export_file_2:
+            self.assertEqual(export_file.read(), export_file_2.read())
+
+    def test_write_accounts_to_csv(self):
+        path = os.path.join(self.directory.name, 'unimportable.csv')
+        write_accounts_to_csv(path, [{'name': 'Company', 'url': None, 'username': 'user', 'password': ''}])
+
+        with open(path, 'r', encoding='utf-8-sig') as csv_file:
+            self.assertEqual('name,url,username,password\nCompany,,user,\n', csv_file.read())
+
+    def ndjson_path(self) -> str:
+        return os.path.join(self.directory.name, 'accounts.ndjson')
+
+    def test_ndjson_round_trip(self):
+        """
+        Accounts are read back with their line numbers, and a null url stays distinct from an empty one.
+        """
+        path = self.ndjson_path()
+        accounts = [('Company 1', None, 'user', 'Pässword "1"'), ('Company 2', '', 'user', 'Password2\n'),
+                    ('Company 3', 'https://example.com', 'user', 'Password3')]
+
+        self.assertEqual(5, write_accounts_to_ndjson(path, accounts))
+
+        with open(path, 'r', encoding='utf-8') as ndjson_file:
+            self.assertEqual({'format': NDJSON_FORMAT, 'version': 1}, json.loads(ndjson_file.readline()))
+
+        self.assertEqual([(line, dict(zip(['name', 'url', 'username', 'password'], account)))
+                          for line, account in zip(range(2, 5), accounts)],
+                         list(read_accounts_from_ndjson(path)))
+        self.assertEqual([4], [line for line, _ in read_accounts_from_ndjson(path, start_line=4)])
+
+    def test_ndjson_reader_is_a_stream(self):
+        """
+        Reading a large file takes constant memory, and an invalid line is only reported once it is reached.
+        """
+        path = self.ndjson_path()
+        write_accounts_to_ndjson(path, ((f'Company {i}', None, 'user', 'x' * 100) for i in range(50_000)))
+
+        with open(path, 'a', encoding='utf-8') as ndjson_file:
+            ndjson_file.write('{"name": "Bad", "url": null, "username": 1, "password": "Password"}\n')
+
+        reader = read_accounts_from_ndjson(path)
+        tracemalloc.start()
+
+        try:
+            for _ in range(50_000):
+                next(reader)
+
+            peak_memory = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+        self.assertLess(peak_memory, 1024 * 1024)
+
+        with self.assertRaises(ValueError) as context:
+            next(reader)
+
+        self.assertEqual('Line 50002: the username must be a string', str(context.exception))
+
+    def test_ndjson_invalid_header(self):
+        path = self.ndjson_path()
+
+        for header in ('name,url,username,password', json.dumps({'format': NDJSON_FORMAT, 'version': 2})):
+            with open(path, 'w', encoding='utf-8') as ndjson_file:
+                ndjson_file.write(header + '\n')
+
+            with self.assertRaises(ValueError):
+                list(read_accounts_from_ndjson(path))
+
+    def test_ndjson_export_and_import_resume(self):
+        """
+        An export cut off in the middle of a line (even after an already exported Account is deleted) and an
+        interrupted import both resume from a line without duplicating or losing Accounts.
+        """
+        path = self.write_csv('name,url,username,password\n' + ''.join(f'Company {i},,user,Password{i}\n'
+                                                                       for i in range(4)))
+        import_accounts_from_csv(csv_path=path, user_id=self.user_id, master_password=self.master_password,
+                                 connection=self.connection)
+
+        ndjson_path = self.ndjson_path()
+        self.assertEqual(6, export_accounts_to_ndjson(ndjson_path, self.user_id, self.master_password,
+                                                      self.connection))
+
+        with open(ndjson_path, 'rb') as ndjson_file:
+            complete_export = ndjson_file.read()
+
+        # Simulate a crash while writing line 4, then resume at it after deleting an Account written before the crash
+        with open(ndjson_path, 'wb') as ndjson_file:
+            ndjson_file.write(complete_export[:complete_export.index(b'Company 2') + 5])
+
+        delete_account(get_account_id_by_account_name_and_user_id('Company 0', self.user_id, self.connection),
+                       self.connection)
+
+        self.assertEqual(6, export_accounts_to_ndjson(ndjson_path, self.user_id, self.master_password,
+                                                      self.connection, start_line=4))
+
+        with open(ndjson_path, 'rb') as ndjson_file:
+            self.assertEqual(complete_export, ndjson_file.read())
+
+        other_user_id = create_user(email='importer@gmail.com', password='OtherPassword', connection=self.connection)
+        importer = import_accounts_from_ndjson(ndjson_path, other_user_id, 'OtherPassword', self.connection,
+                                               batch_size=2)
+        last_line, results = next(importer)
+        importer.close()
+        self.assertEqual((3, [2, 3]), (last_line, [line for line, _, _ in results]))
+
+        batches = list(import_accounts_from_ndjson(ndjson_path, other_user_id, 'OtherPassword', self.connection,
+                                                   start_line=last_line + 1))
+        results = [result for _, results in batches for result in results]
+
+        self.assertEqual([5], [last_line for last_line, _ in batches])
+        self.assertEqual([4, 5], [line for line, _, _ in results])
+        self.assertTrue(all(account_id is not None for _, account_id, _ in results))
+        self.assertEqual(['Company 0', 'Company 1', 'Company 2', 'Company 3'],
+                         [account[0] for account in
+                          get_all_account_names_urls_and_usernames_by_user_id(other_user_id, self.connection)])
+
+        duplicates = [result for _, results in import_accounts_from_ndjson(ndjson_path, other_user_id, 'OtherPassword',
+                                                                           self.connection) for result in results]
+        self.assertEqual([None] * 4, [account_id for _, account_id, _ in duplicates])
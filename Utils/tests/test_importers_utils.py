@@ -0,0 +1,202 @@
+import json
+import os
+import tempfile
+import unittest
+
+from Utils.database import db_setup, create_user, get_all_account_names_urls_and_usernames_by_user_id, \
+    get_account_id_by_account_name_and_user_id, get_decrypted_account_password
+from Utils.importers import detect_importer, read_accounts, import_accounts_from_file, _JSONReader
+
+
+class ImportersUtilsTests(unittest.TestCase):
+    def setUp(self) -> None:
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self) -> None:
+        self.directory.cleanup()
+
+    def write_file(self, name: str, contents: str) -> str:
+        path = os.path.join(self.directory.name, name)
+
+        with open(path, 'w', encoding='utf-8') as file:
+            file.write(contents)
+
+        return path
+
+    def test_bitwarden_csv(self):
+        """
+        Only the login rows are read, with the first of their uris.
+        """
+        path = self.write_file('bitwarden.csv',
+                               'folder,favorite,type,name,notes,fields,reprompt,login_uri,login_username,'
+                               'login_password,login_totp\n'
+                               ',,login,Example,,,0,"https://example.com,https://example.org",user,Password1,\n'
+                               ',,note,A note,Secret,,0,,,,\n'
+                               'Work,1,login,Intranet,,,0,,worker,Password2,\n')
+
+        self.assertEqual('bitwarden-csv', detect_importer(path).name)
+        self.assertEqual([{'name': 'Example', 'url': 'https://example.com', 'username': 'user',
+                           'password': 'Password1'},
+                          {'name': 'Intranet', 'url': None, 'username': 'worker', 'password': 'Password2'}],
+                         list(read_accounts(path)))
+
+    def test_1password_and_browser_csv(self):
+        """
+        Column names are matched case-insensitively, and browser Accounts without a name are named after their host.
+        """
+        onepassword_path = self.write_file('1password.csv', 'Title,Url,Username,Password,OTPAuth,Notes\n'
+                                                            'Example,https://example.com,user,Password1,,\n')
+        firefox_path = self.write_file('firefox.csv', 'url,username,password,httpRealm,formActionOrigin,guid\n'
+                                                      'https://login.Example.com:8443/a,user,Password2,,,{1}\n')
+
+        self.assertEqual('1password-csv', detect_importer(onepassword_path).name)
+        self.assertEqual([{'name': 'Example', 'url': 'https://example.com', 'username': 'user',
+                           'password': 'Password1'}], list(read_accounts(onepassword_path)))
+
+        self.assertEqual('browser-csv', detect_importer(firefox_path).name)
+        self.assertEqual([{'name': 'login.example.com', 'url': 'https://login.Example.com:8443/a', 'username': 'user',
+                           'password': 'Password2'}], list(read_accounts(firefox_path)))
+
+    def test_bitwarden_json(self):
+        """
+        Only the login items are read, also when the items span many chunks of the incremental reader.
+        """
+        items = [{'id': str(i), 'type': 1, 'name': f'Company {i}', 'notes': 'x' * 100,
+                  'login': {'uris': [{'match': None, 'uri': f'https://company{i}.com'}], 'username': 'user',
+                            'password': f'Pass"word{i}'}} for i in range(2000)]
+        items.insert(1, {'id': 'note', 'type': 2, 'name': 'A note', 'secureNote': {'type': 0}})
+        path = self.write_file('bitwarden.json', json.dumps({'encrypted': False, 'folders': [{'id': 'f', 'name': 'F'}],
+                                                             'items': items, 'count': 12345}, indent=2))
+
+        self.assertEqual('bitwarden-json', detect_importer(path).name)
+
+        accounts = list(read_accounts(path))
+
+        self.assertEqual(2000, len(accounts))
+        self.assertEqual({'name': 'Company 1999', 'url': 'https://company1999.com', 'username': 'user',
+                          'password': 'Pass"word1999'}, accounts[-1])
+
+    def test_bitwarden_json_encrypted_or_invalid(self):
+        """
+        Encrypted exports and invalid JSON raise a ValueError.
+        """
+        encrypted_path = self.write_file('encrypted.json', '{"encrypted": true, "passwordProtected": true, '
+                                                           '"data": "2.abc"}')
+        invalid_path = self.write_file('invalid.json', '{"encrypted": false, "items": [{"type": 1}, {"type": ]}')
+
+        with self.assertRaises(ValueError):
+            list(read_accounts(encrypted_path))
+
+        with self.assertRaises(ValueError):
+            list(read_accounts(invalid_path, 'bitwarden-json'))
+
+    def test_json_reader_numbers_across_chunks(self):
+        """
+        A number split across two chunks is decoded whole.
+        """
+        path = self.write_file('numbers.json', '[1, 23456, 789]')
+
+        with open(path, 'r', encoding='utf-8') as file:
+            reader = _JSONReader(file, chunk_size=3)
+            reader.expect('[')
+            values = []
+
+            for _ in reader.items(']'):
+                values.append(reader.value())
+
+        self.assertEqual([1, 23456, 789], values)
+
+    def test_keepass_xml(self):
+        """
+        Entries are read from nested groups, without their histories and without the recycle bin.
+        """
+        path = self.write_file('keepass.xml', """<?xml version="1.0" encoding="utf-8" standalone="yes"?>
+<KeePassFile>
+    <Meta><RecycleBinUUID>YmlufQ==</RecycleBinUUID></Meta>
+    <Root>
+        <Group>
+            <UUID>cm9vdA==</UUID>
+            <Name>Root</Name>
+            <Entry>
+                <UUID>ZW50cnk=</UUID>
+                <String><Key>Title</Key><Value>Example</Value></String>
+                <String><Key>UserName</Key><Value>user</Value></String>
+                <String><Key>Password</Key><Value ProtectInMemory="True">Password1</Value></String>
+                <String><Key>URL</Key><Value>https://example.com</Value></String>
+                <History>
+                    <Entry>
+                        <String><Key>Title</Key><Value>Old example</Value></String>
+                        <String><Key>Password</Key><Value>OldPassword</Value></String>
+                    </Entry>
+                </History>
+            </Entry>
+            <Group>
+                <UUID>d29yaw==</UUID>
+                <Name>Work</Name>
+                <Entry>
+                    <String><Key>Title</Key><Value>Intranet</Value></String>
+                    <String><Key>UserName</Key><Value>worker</Value></String>
+                    <String><Key>Password</Key><Value>Password2</Value></String>
+                    <String><Key>URL</Key><Value /></String>
+                </Entry>
+            </Group>
+            <Group>
+                <UUID>YmlufQ==</UUID>
+                <Name>Recycle Bin</Name>
+                <Entry>
+                    <String><Key>Title</Key><Value>Deleted</Value></String>
+                </Entry>
+            </Group>
+        </Group>
+    </Root>
+</KeePassFile>
+""")
+
+        self.assertEqual('keepass-xml', detect_importer(path).name)
+        self.assertEqual([{'name': 'Example', 'url': 'https://example.com', 'username': 'user',
+                           'password': 'Password1'},
+                          {'name': 'Intranet', 'url': None, 'username': 'worker', 'password': 'Password2'}],
+                         list(read_accounts(path)))
+
+    def test_unsupported_format(self):
+        """
+        A file in no supported format, or an unknown importer name, raises a ValueError.
+        """
+        path = self.write_file('other.csv', 'a,b,c\n1,2,3\n')
+
+        with self.assertRaises(ValueError):
+            detect_importer(path)
+
+        with self.assertRaises(ValueError):
+            read_accounts(path, 'unknown')
+
+    def test_import_accounts_from_file(self):
+        """
+        Accounts are created in batches, and the ones that cannot be added are returned.
+        """
+        connection, cursor = db_setup()
+        user_id = create_user(email='testemail@gmail.com', password='MasterPassword', connection=connection)
+
+        path = self.write_file('chrome.csv', 'name,url,username,password,note\n'
+                                             'Company 1,https://company1.com,user,Password1,\n'
+                                             'Company 2,,user,Password2,\n'
+                                             'company 1,,duplicate,Password3,\n'
+                                             'Company 3,,,Password4,\n')
+
+        account_ids, unimportable_accounts = import_accounts_from_file(path, user_id, 'MasterPassword', connection,
+                                                                       batch_size=2)
+
+        self.assertEqual(2, len(account_ids))
+        self.assertEqual([('Company 1', 'https://company1.com', 'user'), ('Company 2', None, 'user')],
+                         get_all_account_names_urls_and_usernames_by_user_id(user_id, connection))
+        self.assertEqual('Password2', get_decrypted_account_password(
+            get_account_id_by_account_name_and_user_id('Company 2', user_id, connection), 'MasterPassword',
+            connection))
+        self.assertEqual(['company 1', 'Company 3'], [account['name'] for account in unimportable_accounts])
+
+        cursor.close()
+        connection.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,151 @@
+import json
+import os
+import tempfile
+import unittest
+
+from Utils import instrumentation
+from Utils.cryptography import derive_256_bit_salt_and_key, encrypt_aes_256_gcm, decrypt_aes_256_gcm
+from Utils.database import db_setup, get_user_id_by_email
+from Utils.instrumentation import instrumented, timer, snapshot, to_prometheus_text, dump, LATENCY_BUCKETS
+
+
+@instrumented(name='tests.add', bytes_argument='data')
+def add(first: int, second: int, data: bytes = b'') -> int:
+    return first + second
+
+
+@instrumented(name='tests.fail')
+def fail():
+    raise ValueError('failure')
+
+
+class InstrumentationUtilsTests(unittest.TestCase):
+    def setUp(self) -> None:
+        instrumentation.reset()
+        instrumentation.enable()
+
+    def tearDown(self) -> None:
+        instrumentation.disable()
+        instrumentation.reset()
+
+    def test_disabled_records_nothing(self):
+        """
+        Instrumented functions still work but record nothing while instrumentation is disabled.
+        """
+        instrumentation.disable()
+
+        self.assertEqual(3, add(1, 2))
+
+        with timer('tests.block'):
+            pass
+
+        self.assertEqual({}, snapshot())
+
+    def test_instrumented_counts_calls_and_bytes(self):
+        """
+        Records the call count and the bytes of the given argument whether it is passed positionally or by keyword.
+        """
+        add(1, 2, b'abc')
+        add(1, 2, data='héllo')
+        add(1, 2)
+
+        metric = snapshot()['tests.add']
+
+        self.assertEqual(3, metric['calls'])
+        self.assertEqual(0, metric['errors'])
+        self.assertEqual(9, metric['bytes_processed'])
+        self.assertEqual(3, metric['latency_buckets']['+Inf'])
+
+    def test_instrumented_counts_errors(self):
+        """
+        Records calls that raise as errors and re-raises the exception.
+        """
+        with self.assertRaises(ValueError):
+            fail()
+
+        self.assertEqual(1, snapshot()['tests.fail']['errors'])
+
+    def test_timer(self):
+        """
+        The timer context manager records the enclosed block, including blocks that raise.
+        """
+        with timer('tests.block', bytes_processed=10):
+            pass
+
+        with self.assertRaises(KeyError):
+            with timer('tests.block'):
+                raise KeyError('missing')
+
+        metric = snapshot()['tests.block']
+
+        self.assertEqual(2, metric['calls'])
+        self.assertEqual(1, metric['errors'])
+        self.assertEqual(10, metric['bytes_processed'])
+
+    def test_histogram_buckets_are_cumulative(self):
+        """
+        Each latency bucket counts the calls at or below its upper bound.
+        """
+        instrumentation.record('tests.record', LATENCY_BUCKETS[0])
+        instrumentation.record('tests.record', LATENCY_BUCKETS[2] * 0.9)
+        instrumentation.record('tests.record', LATENCY_BUCKETS[-1] * 2)
+
+        buckets = snapshot()['tests.record']['latency_buckets']
+
+        self.assertEqual(1, buckets[str(LATENCY_BUCKETS[0])])
+        self.assertEqual(1, buckets[str(LATENCY_BUCKETS[1])])
+        self.assertEqual(2, buckets[str(LATENCY_BUCKETS[2])])
+        self.assertEqual(2, buckets[str(LATENCY_BUCKETS[-1])])
+        self.assertEqual(3, buckets['+Inf'])
+
+    def test_hot_paths_are_instrumented(self):
+        """
+        Key derivation, AES, and the database utils record their calls.
+        """
+        salt, key = derive_256_bit_salt_and_key('password')
+        ciphertext, nonce, tag = encrypt_aes_256_gcm(key, 'plaintext')
+        decrypt_aes_256_gcm(key, ciphertext, nonce, tag)
+
+        connection, cursor = db_setup()
+        get_user_id_by_email('missing@gmail.com', connection)
+        cursor.close()
+        connection.close()
+
+        metrics = snapshot()
+
+        self.assertEqual(8, metrics['Utils.cryptography.derive_256_bit_salt_and_key']['bytes_processed'])
+        self.assertEqual(9, metrics['Utils.cryptography.encrypt_aes_256_gcm']['bytes_processed'])
+        self.assertEqual(len(ciphertext), metrics['Utils.cryptography.decrypt_aes_256_gcm']['bytes_processed'])
+        self.assertEqual(1, metrics['Utils.database.get_user_id_by_email']['calls'])
+
+    def test_to_prometheus_text(self):
+        """
+        Exposes counters and a histogram per instrumented function in the Prometheus text format.
+        """
+        add(1, 2, b'abc')
+
+        lines = to_prometheus_text().splitlines()
+
+        self.assertIn('# TYPE ppm_call_duration_seconds histogram', lines)
+        self.assertIn('ppm_calls_total{function="tests.add"} 1', lines)
+        self.assertIn('ppm_bytes_processed_total{function="tests.add"} 3', lines)
+        self.assertIn('ppm_call_duration_seconds_bucket{function="tests.add",le="+Inf"} 1', lines)
+        self.assertIn('ppm_call_duration_seconds_count{function="tests.add"} 1', lines)
+
+    def test_dump(self):
+        """
+        Writes the metrics to JSON and Prometheus text-format files.
+        """
+        add(1, 2)
+
+        with tempfile.TemporaryDirectory() as directory:
+            json_path = os.path.join(directory, 'metrics.json')
+            prometheus_path = os.path.join(directory, 'metrics.prom')
+
+            dump(json_path=json_path, prometheus_path=prometheus_path)
+
+            with open(json_path, 'r', encoding='utf-8') as json_file:
+                self.assertEqual(1, json.load(json_file)['tests.add']['calls'])
+
+            with open(prometheus_path, 'r', encoding='utf-8') as prometheus_file:
+                self.assertIn('ppm_calls_total{function="tests.add"} 1', prometheus_file.read())
@@ -0,0 +1,145 @@
+import os
+import sqlite3
+import tempfile
+import unittest
+
+from Database.database_setup import setup_database
+from Utils.database import create_user, create_account, get_all_account_names_urls_and_usernames_by_user_id, \
+    get_decrypted_account_password, get_account_id_by_account_name_and_user_id, is_valid_login, \
+    seal_account_metadata, get_account_version, changes_since, get_reused_account_passwords_by_user_id, \
+    find_accounts_for_url, edit_account, compact_account_changes
+from Utils.sharded_vault import ShardedVault, shard_database_file, shard_name, DIRECTORY_NAME
+
+
+class ShardedVaultUtilsTests(unittest.TestCase):
+    def setUp(self) -> None:
+        self.directory = tempfile.TemporaryDirectory()
+        self.vault_path = os.path.join(self.directory.name, 'shards')
+
+    def tearDown(self) -> None:
+        self.directory.cleanup()
+
+    def test_users_are_created_in_their_own_shards(self):
+        """
+        Each User's rows are only in their shard, where the Utils.database functions work unchanged, and a User that
+        could not be created leaves neither a directory row nor a shard behind.
+        """
+        with ShardedVault(self.vault_path) as vault:
+            first_id = vault.create_user('first@gmail.com', 'FirstPassword')
+            second_id = vault.create_user('second@gmail.com', 'SecondPassword')
+
+            create_account(first_id, 'FirstPassword', 'Company', 'https://company.com', 'first', 'AccountPassword',
+                           vault.connect(first_id))
+
+            with self.assertRaises(sqlite3.IntegrityError):
+                vault.create_user('first@gmail.com', 'OtherPassword')
+
+            with self.assertRaises(ValueError):
+                vault.create_user('invalid email', 'OtherPassword')
+
+        self.assertEqual(sorted([DIRECTORY_NAME, shard_name(first_id), shard_name(second_id)]),
+                         sorted(os.listdir(self.vault_path)))
+
+        with ShardedVault(self.vault_path) as vault:
+            first_shard = vault.connect_by_email('first@gmail.com')
+            second_shard = vault.connect_by_email('second@gmail.com')
+
+            self.assertEqual((first_id, second_id), (vault.get_user_id_by_email('first@gmail.com'),
+                                                     vault.get_user_id_by_email('second@gmail.com')))
+            self.assertTrue(is_valid_login('first@gmail.com', 'FirstPassword', first_shard))
+            self.assertFalse(is_valid_login('first@gmail.com', 'FirstPassword', second_shard))
+            self.assertEqual('AccountPassword', get_decrypted_account_password(
+                get_account_id_by_account_name_and_user_id('Company', first_id, first_shard), 'FirstPassword',
+                first_shard))
+            self.assertIsNone(get_all_account_names_urls_and_usernames_by_user_id(second_id, second_shard))
+            self.assertEqual(1, second_shard.execute("SELECT COUNT(*) FROM users").fetchone()[0])
+
+            with self.assertRaises(ValueError):
+                vault.connect_by_email('other@gmail.com')
+
+    def test_writes_of_different_users_do_not_contend(self):
+        with ShardedVault(self.vault_path) as vault:
+            first_id = vault.create_user('first@gmail.com', 'FirstPassword')
+            second_id = vault.create_user('second@gmail.com', 'SecondPassword')
+
+            # The first User's shard stays locked for writing while the second User writes to theirs
+            writer = sqlite3.connect(os.path.join(self.vault_path, shard_name(first_id)), timeout=0)
+            writer.execute("BEGIN IMMEDIATE")
+
+            first_shard = sqlite3.connect(os.path.join(self.vault_path, shard_name(first_id)), timeout=0)
+            second_shard = sqlite3.connect(os.path.join(self.vault_path, shard_name(second_id)), timeout=0)
+
+            try:
+                create_account(second_id, 'SecondPassword', 'Company', None, 'second', 'AccountPassword',
+                               second_shard)
+
+                with self.assertRaises(sqlite3.OperationalError):
+                    create_account(first_id, 'FirstPassword', 'Company', None, 'first', 'AccountPassword',
+                                   first_shard)
+            finally:
+                writer.rollback()
+
+                for connection in (writer, first_shard, second_shard):
+                    connection.close()
+
+    def test_shard_database_file(self):
+        """
+        Every row of each User, including the change journal, the indexes, and the sealed metadata, is copied to their
+        shard, so that the versions and revisions carry over.
+        """
+        db_name = os.path.join(self.directory.name, 'vault.sqlite3')
+        setup_database(db_name)
+        connection = sqlite3.connect(db_name)
+
+        first_id = create_user('first@gmail.com', 'FirstPassword', connection)
+        second_id = create_user('second@gmail.com', 'SecondPassword', connection)
+
+        for user_id, master_password in ((first_id, 'FirstPassword'), (second_id, 'SecondPassword')):
+            create_account(user_id, master_password, 'Gmail', 'https://mail.google.com', 'bob', 'Password',
+                           connection)
+            create_account(user_id, master_password, 'Google', 'https://www.google.com', 'bob', 'Password',
+                           connection)
+
+        edit_account(get_account_id_by_account_name_and_user_id('Gmail', first_id, connection), connection,
+                     username='robert')
+        seal_account_metadata(second_id, 'SecondPassword', connection)
+
+        # As the setup of every database does, before the shards are written
+        compact_account_changes(connection)
+
+        tables = [row[0] for row in connection.execute("SELECT name FROM sqlite_master WHERE type='table' AND name "
+                                                       "NOT LIKE 'sqlite_%' AND name != 'account_changes_compaction'")]
+        row_counts = {table: connection.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0] for table in tables}
+        first_changes = changes_since(first_id, 0, connection)
+        first_gmail_id = get_account_id_by_account_name_and_user_id('Gmail', first_id, connection)
+        first_gmail_version = get_account_version(first_gmail_id, connection)
+        connection.close()
+
+        self.assertEqual(2, shard_database_file(db_name, self.vault_path))
+
+        with ShardedVault(self.vault_path) as vault:
+            shards = [vault.connect(first_id), vault.connect(second_id)]
+
+            for table in tables:
+                self.assertEqual(row_counts[table], sum(shard.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+                                                        for shard in shards), table)
+
+            first_shard, second_shard = shards
+
+            self.assertEqual(first_changes, changes_since(first_id, 0, first_shard))
+            self.assertEqual(first_gmail_version, get_account_version(first_gmail_id, first_shard))
+            self.assertEqual(['Gmail', 'Google'], [account[1] for account in
+                                                   find_accounts_for_url(first_id, 'mail.google.com', first_shard)])
+
+            self.assertTrue(is_valid_login('second@gmail.com', 'SecondPassword', second_shard))
+            self.assertEqual([('Gmail', 'https://mail.google.com', 'bob'), ('Google', 'https://www.google.com', 'bob')],
+                             get_all_account_names_urls_and_usernames_by_user_id(second_id, second_shard))
+            self.assertEqual([['Gmail', 'Google']], [[name for _, name in group] for group in
+                                                     get_reused_account_passwords_by_user_id(second_id, second_shard)])
+
+        with self.assertRaises(ValueError):
+            shard_database_file(db_name, self.vault_path)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,158 @@
+import json
+import logging
+import os
+import sqlite3
+import tempfile
+import unittest
+from unittest import mock
+
+from Utils.database import create_user, get_user_id_by_email, get_account_id_by_account_name_and_user_id
+from Utils.sql_trace import normalize_sql, SQLTrace, traced_connect, connect, explain_query_plan, TracedConnection, \
+    ENABLED_ENV_VAR
+
+
+class SQLTraceUtilsTests(unittest.TestCase):
+    def setUp(self) -> None:
+        self.sql_trace = SQLTrace(slow_query_threshold_ms=1000, slow_query_logger=logging.getLogger('tests.sql_trace'))
+        self.connection = traced_connect(':memory:', sql_trace=self.sql_trace)
+        self.connection.execute("CREATE TABLE users (id INTEGER PRIMARY KEY AUTOINCREMENT, email TEXT UNIQUE NOT NULL, "
+                                "password TEXT NOT NULL) STRICT")
+        self.connection.execute("CREATE TABLE accounts (id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT NOT NULL, "
+                                "user_id INTEGER NOT NULL, UNIQUE(name, user_id)) STRICT")
+        self.connection.execute("CREATE TABLE user_keys (user_id INTEGER PRIMARY KEY, salt BLOB NOT NULL) STRICT")
+        self.connection.execute("CREATE TABLE sealed_users (user_id INTEGER PRIMARY KEY) STRICT")
+        self.connection.commit()
+        self.sql_trace.reset()
+
+    def tearDown(self) -> None:
+        self.connection.close()
+
+    def statement(self, normalized_statement: str) -> dict:
+        for stats in self.sql_trace.report():
+            if stats['statement'] == normalized_statement:
+                return stats
+
+        self.fail(f'{normalized_statement} was not traced')
+
+    def test_normalize_sql(self):
+        """
+        Replaces every literal and parameter with '?' and collapses whitespace.
+        """
+        self.assertEqual('SELECT id FROM accounts WHERE name=? AND user_id=?',
+                         normalize_sql('SELECT id FROM accounts WHERE name=:name AND user_id=:user_id'))
+        self.assertEqual('SELECT id FROM accounts WHERE name=? AND user_id=?',
+                         normalize_sql("SELECT id FROM accounts\n    WHERE name='O''Brien' AND user_id=12"))
+        self.assertEqual('INSERT INTO t VALUES (?, ?, ?, ?, ?)',
+                         normalize_sql("INSERT INTO t VALUES (NULL, X'0aff', -1.5e3, ?1, @value)"))
+        self.assertEqual('SELECT t1.a FROM t1', normalize_sql('SELECT t1.a FROM t1'))
+
+    def test_bound_values_are_not_traced(self):
+        """
+        Neither the bound values nor the literals of a statement end up in the trace.
+        """
+        create_user(email='secret@gmail.com', password='SecretPassword', connection=self.connection)
+
+        traced = json.dumps(self.sql_trace.report())
+
+        self.assertNotIn('secret@gmail.com', traced)
+        self.assertNotIn('argon2', traced)
+
+    def test_traces_utils_database_statements(self):
+        """
+        Counts and times the statements run by Utils.database, including single-row lookups whose cursor is dropped
+        without being closed.
+        """
+        user_id = create_user(email='new-email@gmail.com', password='ShortPassword', connection=self.connection)
+
+        self.assertEqual(user_id, get_user_id_by_email('new-email@gmail.com', self.connection))
+
+        insert = self.statement('INSERT INTO users VALUES (?, ?, ?) RETURNING id')
+        lookup = self.statement('SELECT id FROM users WHERE email=?')
+
+        self.assertEqual((1, 1, 1), (insert['count'], insert['timed_count'], insert['rows']))
+        self.assertEqual((1, 1, 1), (lookup['count'], lookup['timed_count'], lookup['rows']))
+        self.assertEqual(1, self.statement('COMMIT')['count'])
+
+    def test_rows_affected(self):
+        """
+        Records the rows affected by modifying statements and the rows returned by queries.
+        """
+        cursor = self.connection.cursor()
+        cursor.executemany("INSERT INTO users VALUES (?, ?, ?)",
+                           [(None, f'{i}@gmail.com', 'password') for i in range(5)])
+        cursor.execute("UPDATE users SET password='changed' WHERE id > 2")
+        cursor.execute("SELECT email FROM users")
+        cursor.fetchmany(2)
+        cursor.fetchall()
+        cursor.close()
+
+        self.assertEqual(5, self.statement('INSERT INTO users VALUES (?, ?, ?)')['rows'])
+        self.assertEqual(5, self.statement('INSERT INTO users VALUES (?, ?, ?)')['count'])
+        self.assertEqual(3, self.statement('UPDATE users SET password=? WHERE id > ?')['rows'])
+        self.assertEqual(5, self.statement('SELECT email FROM users')['rows'])
+
+    def test_repeated_statements(self):
+        """
+        A lookup run once per row (N+1), like the name to id lookups of the GUI export, is reported as repeated.
+        """
+        self.connection.execute("INSERT INTO users VALUES (1, 'a@gmail.com', 'password')")
+        self.connection.executemany("INSERT INTO accounts VALUES (NULL, ?, 1)", [(f'Company {i}',) for i in range(12)])
+
+        for i in range(12):
+            get_account_id_by_account_name_and_user_id(f'Company {i}', 1, self.connection)
+
+        repeated = {stats['statement']: stats for stats in self.sql_trace.repeated_statements(min_count=10)}
+
+        self.assertEqual(12, repeated['SELECT id FROM accounts WHERE name=? AND user_id=?']['count'])
+
+    def test_slow_queries_are_logged_with_query_plan(self):
+        """
+        Statements over the threshold are logged with their EXPLAIN QUERY PLAN.
+        """
+        self.sql_trace.slow_query_threshold_seconds = 0
+
+        with self.assertLogs('tests.sql_trace', level='WARNING') as logs:
+            get_account_id_by_account_name_and_user_id('Company', 1, self.connection)
+
+        slow_query = self.sql_trace.slow_queries[0]
+
+        self.assertEqual('SELECT id FROM accounts WHERE name=? AND user_id=?', slow_query['statement'])
+        self.assertTrue(any('USING' in line and 'INDEX' in line for line in slow_query['query_plan']))
+        self.assertIn('SELECT id FROM accounts WHERE name=? AND user_id=?', logs.output[0])
+
+    def test_explain_query_plan_unexplainable_statement(self):
+        """
+        Returns an empty plan for statements SQLite cannot explain.
+        """
+        self.assertEqual([], explain_query_plan('NOT SQL', (), self.connection))
+
+    def test_dump(self):
+        """
+        Writes the statements, repeated statements, and slow queries as JSON.
+        """
+        get_user_id_by_email('a@gmail.com', self.connection)
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'trace.json')
+            self.sql_trace.dump(path, repeated_statement_count=1)
+
+            with open(path, 'r', encoding='utf-8') as report_file:
+                report = json.load(report_file)
+
+        self.assertEqual(['SELECT id FROM users WHERE email=?'],
+                         [stats['statement'] for stats in report['repeated_statements']])
+        self.assertEqual([], report['slow_queries'])
+
+    def test_connect_only_traces_when_enabled(self):
+        """
+        connect returns a plain connection unless the environment enables tracing.
+        """
+        with mock.patch.dict(os.environ, {ENABLED_ENV_VAR: ''}):
+            connection = connect(':memory:')
+            self.assertIs(sqlite3.Connection, type(connection))
+            connection.close()
+
+        with mock.patch.dict(os.environ, {ENABLED_ENV_VAR: '1'}):
+            connection = connect(':memory:', sql_trace=self.sql_trace)
+            self.assertIsInstance(connection, TracedConnection)
+            connection.close()
@@ -0,0 +1,242 @@
+import os
+import sqlite3
+import tempfile
+import unittest
+
+from Utils.database import db_setup, create_user, create_account, seal_account_metadata, \
+    get_account_id_by_account_name_and_user_id
+from Utils.storage import StorageBackend, SQLiteBackend, LogStructuredBackend, LogCorruptedError, store_account, \
+    reveal_account_password
+
+ENCRYPTED_PASSWORD = (b'ciphertext', b's' * 32, b'n' * 16, b't' * 16)
+
+
+class StorageBackendConformanceTests:
+    """
+    The behavior every storage backend shares, run by a TestCase per backend that implements open_backend.
+    """
+    def open_backend(self) -> StorageBackend:
+        raise NotImplementedError
+
+    def setUp(self) -> None:
+        self.backend = self.open_backend()
+        self.user_id = self.backend.add_user('testemail@gmail.com', 'hashed password')
+
+    def tearDown(self) -> None:
+        self.backend.close()
+
+    def test_users(self):
+        other_user_id = self.backend.add_user('other@gmail.com', 'other hashed password')
+
+        self.assertNotEqual(self.user_id, other_user_id)
+        self.assertEqual(other_user_id, self.backend.get_user_id_by_email('other@gmail.com'))
+        self.assertIsNone(self.backend.get_user_id_by_email('unknown@gmail.com'))
+
+        self.backend.set_user_password(self.user_id, 'new hashed password')
+
+        self.assertEqual('new hashed password', self.backend.get_user_password(self.user_id))
+        self.assertEqual('other hashed password', self.backend.get_user_password(other_user_id))
+        self.assertIsNone(self.backend.get_user_password(3400))
+
+        with self.assertRaises(sqlite3.IntegrityError):
+            self.backend.add_user('other@gmail.com', 'hashed password')
+
+        with self.assertRaises(ValueError):
+            self.backend.set_user_password(3400, 'hashed password')
+
+    def test_accounts(self):
+        """
+        Accounts are found by name ignoring ASCII case, listed in id order, and updated and deleted by id.
+        """
+        company_id = self.backend.add_account(self.user_id, 'Company', 'https://company.com', 'user',
+                                              ENCRYPTED_PASSWORD)
+        bank_id = self.backend.add_account(self.user_id, 'Bank', None, 'banker', ENCRYPTED_PASSWORD)
+
+        self.assertEqual(company_id, self.backend.get_account_id_by_name(self.user_id, 'COMPANY'))
+        self.assertIsNone(self.backend.get_account_id_by_name(self.user_id + 1, 'Company'))
+        self.assertEqual((company_id, self.user_id, 'Company', 'https://company.com', 'user', *ENCRYPTED_PASSWORD),
+                         self.backend.get_account(company_id))
+        self.assertEqual(['Company', 'Bank'], [account.name for account in self.backend.list_accounts(self.user_id)])
+
+        with self.assertRaises(sqlite3.IntegrityError):
+            self.backend.add_account(self.user_id, 'bank', None, 'other', ENCRYPTED_PASSWORD)
+
+        with self.assertRaises(sqlite3.IntegrityError):
+            self.backend.update_account(company_id, name='BANK')
+
+        with self.assertRaises(ValueError):
+            self.backend.add_account(3400, 'Company', None, 'user', ENCRYPTED_PASSWORD)
+
+        new_password = (b'new ciphertext', b'S' * 32, b'N' * 16, b'T' * 16)
+        self.backend.update_account(bank_id, name='Savings', username='saver', encrypted_password=new_password)
+
+        self.assertEqual((bank_id, self.user_id, 'Savings', None, 'saver', *new_password),
+                         self.backend.get_account(bank_id))
+        self.assertIsNone(self.backend.get_account_id_by_name(self.user_id, 'Bank'))
+
+        self.backend.delete_account(company_id)
+
+        self.assertIsNone(self.backend.get_account(company_id))
+        self.assertIsNone(self.backend.get_account_id_by_name(self.user_id, 'Company'))
+        self.assertEqual([bank_id], [account.id for account in self.backend.list_accounts(self.user_id)])
+        self.assertEqual([], self.backend.list_accounts(self.user_id + 1))
+
+        # Ids are not reused
+        self.assertGreater(self.backend.add_account(self.user_id, 'Company', None, 'user', ENCRYPTED_PASSWORD),
+                           bank_id)
+
+        with self.assertRaises(ValueError):
+            self.backend.delete_account(company_id)
+
+        with self.assertRaises(ValueError):
+            self.backend.update_account(company_id, username='user')
+
+    def test_search_accounts(self):
+        self.backend.add_account(self.user_id, 'Company', 'https://www.example.com', 'user', ENCRYPTED_PASSWORD)
+        self.backend.add_account(self.user_id, 'Bank', None, 'Example', ENCRYPTED_PASSWORD)
+        self.backend.add_account(self.user_id, 'Other', None, 'other', ENCRYPTED_PASSWORD)
+
+        self.assertEqual(['Company', 'Bank'], [account.name for account in
+                                               self.backend.search_accounts(self.user_id, 'EXAMPLE')])
+        self.assertEqual(3, len(self.backend.search_accounts(self.user_id, '')))
+        self.assertEqual([], self.backend.search_accounts(self.user_id + 1, ''))
+
+    def test_transactions(self):
+        """
+        The writes of a transaction are all rolled back if it raises, and nested transactions join the outer one.
+        """
+        with self.assertRaises(RuntimeError):
+            with self.backend.transaction():
+                self.backend.add_account(self.user_id, 'Company', None, 'user', ENCRYPTED_PASSWORD)
+
+                with self.backend.transaction():
+                    self.backend.add_account(self.user_id, 'Bank', None, 'banker', ENCRYPTED_PASSWORD)
+
+                self.backend.set_user_password(self.user_id, 'new hashed password')
+                raise RuntimeError
+
+        self.assertEqual([], self.backend.list_accounts(self.user_id))
+        self.assertEqual('hashed password', self.backend.get_user_password(self.user_id))
+
+        with self.backend.transaction():
+            self.backend.add_account(self.user_id, 'Company', None, 'user', ENCRYPTED_PASSWORD)
+            self.backend.add_account(self.user_id, 'Bank', None, 'banker', ENCRYPTED_PASSWORD)
+
+        self.assertEqual(['Company', 'Bank'], [account.name for account in self.backend.list_accounts(self.user_id)])
+
+    def test_store_and_reveal_account(self):
+        account_id = store_account(self.backend, self.user_id, 'MasterPassword', 'Company', None, 'user',
+                                   'AccountPassword')
+
+        self.assertEqual('AccountPassword', reveal_account_password(self.backend, account_id, 'MasterPassword'))
+
+        with self.assertRaises(ValueError):
+            reveal_account_password(self.backend, account_id, 'WrongPassword')
+
+        with self.assertRaises(ValueError):
+            store_account(self.backend, self.user_id, 'MasterPassword', 'Bank', None, 'banker', '')
+
+
+class SQLiteBackendTests(StorageBackendConformanceTests, unittest.TestCase):
+    def open_backend(self) -> StorageBackend:
+        return SQLiteBackend(db_setup()[0])
+
+    def test_reads_the_accounts_of_utils_database(self):
+        """
+        Accounts written by Utils.database are read back, sealed metadata included, but sealed metadata is not written.
+        """
+        user_id = create_user('sealed@gmail.com', 'MasterPassword', self.backend.connection)
+        account_id = create_account(user_id, 'MasterPassword', 'Gmail', 'https://mail.google.com', 'bob', 'Password',
+                                    self.backend.connection)
+        seal_account_metadata(user_id, 'MasterPassword', self.backend.connection)
+
+        self.assertEqual(('Gmail', 'https://mail.google.com', 'bob'), self.backend.get_account(account_id)[2:5])
+        self.assertEqual(account_id, self.backend.get_account_id_by_name(user_id, 'gmail'))
+        self.assertEqual([account_id], [account.id for account in self.backend.search_accounts(user_id, 'bob')])
+        self.assertEqual('Password', reveal_account_password(self.backend, account_id, 'MasterPassword'))
+
+        with self.assertRaises(ValueError):
+            self.backend.add_account(user_id, 'Google', None, 'bob', ENCRYPTED_PASSWORD)
+
+        with self.assertRaises(ValueError):
+            self.backend.update_account(account_id, username='robert')
+
+        self.backend.delete_account(account_id)
+
+        self.assertIsNone(get_account_id_by_account_name_and_user_id('Gmail', user_id, self.backend.connection))
+
+
+class LogStructuredBackendTests(StorageBackendConformanceTests, unittest.TestCase):
+    def open_backend(self) -> StorageBackend:
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.log_path = os.path.join(self.directory.name, 'vault.ppmlog')
+
+        return LogStructuredBackend(self.log_path, sync=False)
+
+    def test_reopen_replays_the_log(self):
+        account_id = self.backend.add_account(self.user_id, 'Company', None, 'user', ENCRYPTED_PASSWORD)
+        self.backend.update_account(account_id, url='https://company.com')
+        self.backend.close()
+
+        self.backend = LogStructuredBackend(self.log_path)
+
+        self.assertEqual((account_id, self.user_id, 'Company', 'https://company.com', 'user', *ENCRYPTED_PASSWORD),
+                         self.backend.get_account(account_id))
+        self.assertEqual(self.user_id, self.backend.get_user_id_by_email('testemail@gmail.com'))
+
+    def test_torn_append_is_dropped(self):
+        """
+        A transaction whose append was cut short is not replayed, and the next one is appended on its own line, while a
+        line that cannot be read before the last one means that the log was corrupted.
+        """
+        self.backend.add_account(self.user_id, 'Company', None, 'user', ENCRYPTED_PASSWORD)
+        self.backend.close()
+
+        with open(self.log_path, 'ab') as log_file:
+            log_file.write(b'{"records":[["account",')
+
+        self.backend = LogStructuredBackend(self.log_path)
+        self.backend.add_account(self.user_id, 'Bank', None, 'banker', ENCRYPTED_PASSWORD)
+        self.backend.close()
+
+        self.backend = LogStructuredBackend(self.log_path)
+
+        self.assertEqual(['Company', 'Bank'], [account.name for account in self.backend.list_accounts(self.user_id)])
+
+        self.backend.close()
+
+        with open(self.log_path, 'rb') as log_file:
+            lines = log_file.read().split(b'\n')
+
+        with open(self.log_path, 'wb') as log_file:
+            log_file.write(b'\n'.join([lines[0], b'not json', *lines[1:]]))
+
+        with self.assertRaises(LogCorruptedError):
+            LogStructuredBackend(self.log_path)
+
+    def test_compact(self):
+        """
+        Compaction keeps the live records only, and the ids of the deleted ones are still not reused.
+        """
+        for index in range(10):
+            account_id = self.backend.add_account(self.user_id, f'Account {index}', None, 'user', ENCRYPTED_PASSWORD)
+            self.backend.update_account(account_id, username='edited')
+
+        self.backend.delete_account(account_id)
+        size = os.path.getsize(self.log_path)
+
+        self.backend.compact()
+
+        self.assertLess(os.path.getsize(self.log_path), size / 2)
+        self.backend.close()
+
+        self.backend = LogStructuredBackend(self.log_path)
+
+        self.assertEqual(9, len(self.backend.list_accounts(self.user_id)))
+        self.assertEqual({'edited'}, {account.username for account in self.backend.list_accounts(self.user_id)})
+        self.assertGreater(self.backend.add_account(self.user_id, 'New', None, 'user', ENCRYPTED_PASSWORD), account_id)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,155 @@
+import os
+import sqlite3
+import tempfile
+import unittest
+from unittest import mock
+
+from Database.database_setup import setup_database
+from Utils import sync
+from Utils.database import db_setup, create_user, create_accounts, edit_account, delete_account, \
+    get_account_id_by_account_name_and_user_id, get_all_account_names_urls_and_usernames_by_user_id, \
+    get_decrypted_account_password, get_user_id_by_email, find_accounts_for_url, \
+    get_reused_account_passwords_by_user_id, compact_account_changes, get_current_revision
+from Utils.sync import sync_vaults
+
+EMAIL = 'testemail@gmail.com'
+MASTER_PASSWORD = 'MasterPassword'
+
+
+class SyncUtilsTests(unittest.TestCase):
+    def setUp(self) -> None:
+        self.directory = tempfile.TemporaryDirectory()
+        self.peer_path = os.path.join(self.directory.name, 'peer.sqlite3')
+        self.connection, self.cursor = db_setup()
+        self.user_id = create_user(email=EMAIL, password=MASTER_PASSWORD, connection=self.connection)
+
+        create_accounts(self.user_id, MASTER_PASSWORD, [
+            {'name': name, 'url': f'https://{name.lower()}.com', 'username': 'user', 'password': f'{name}Password'}
+            for name in ('Alpha', 'Bravo', 'Charlie', 'Delta')], self.connection)
+
+    def tearDown(self) -> None:
+        self.cursor.close()
+        self.connection.close()
+        self.directory.cleanup()
+
+    def peer(self) -> sqlite3.Connection:
+        peer_connection = sqlite3.connect(self.peer_path)
+        self.addCleanup(peer_connection.close)
+
+        return peer_connection
+
+    def account_id(self, connection: sqlite3.Connection, name: str) -> int:
+        return get_account_id_by_account_name_and_user_id(name, get_user_id_by_email(EMAIL, connection), connection)
+
+    def test_sync_to_a_new_vault_and_back(self):
+        """
+        A new peer vault gets the User and all the Accounts, with their url index and fingerprints, and a second sync
+        with no changes compares no buckets.
+        """
+        report = sync_vaults(self.connection, self.peer_path, EMAIL, MASTER_PASSWORD)
+
+        self.assertEqual((['Alpha', 'Bravo', 'Charlie', 'Delta'], [], []),
+                         (report['pushed'], report['pulled'], report['conflicts']))
+
+        peer = self.peer()
+        peer_user_id = get_user_id_by_email(EMAIL, peer)
+
+        self.assertEqual(get_all_account_names_urls_and_usernames_by_user_id(self.user_id, self.connection),
+                         get_all_account_names_urls_and_usernames_by_user_id(peer_user_id, peer))
+        self.assertEqual('BravoPassword', get_decrypted_account_password(self.account_id(peer, 'Bravo'),
+                                                                         MASTER_PASSWORD, peer))
+        self.assertEqual(['Bravo'], [account[1] for account in find_accounts_for_url(peer_user_id, 'bravo.com', peer)])
+        self.assertEqual(4, peer.execute("SELECT COUNT(*) FROM account_fingerprints").fetchone()[0])
+
+        self.assertEqual({'pulled': [], 'pushed': [], 'conflicts': [], 'buckets_compared': 0},
+                         sync_vaults(self.connection, self.peer_path, EMAIL, MASTER_PASSWORD))
+
+    def test_three_way_merge(self):
+        """
+        Changes on one side are copied to the other, and Accounts changed differently on both sides are conflicts
+        that are left as they are unless a side is preferred.
+        """
+        sync_vaults(self.connection, self.peer_path, EMAIL, MASTER_PASSWORD)
+        peer = self.peer()
+        peer_user_id = get_user_id_by_email(EMAIL, peer)
+
+        edit_account(self.account_id(self.connection, 'Alpha'), self.connection, username='local-user')
+        edit_account(self.account_id(self.connection, 'Delta'), self.connection, username='local-delta')
+        delete_account(self.account_id(peer, 'Bravo'), peer)
+        edit_account(self.account_id(peer, 'Delta'), peer, MASTER_PASSWORD, password='PeerDeltaPassword')
+        create_accounts(peer_user_id, MASTER_PASSWORD, [{'name': 'Echo', 'url': None, 'username': 'user',
+                                                         'password': 'AlphaPassword'}], peer)
+
+        report = sync_vaults(self.connection, self.peer_path, EMAIL, MASTER_PASSWORD)
+
+        self.assertEqual((['Alpha'], ['Bravo', 'Echo'], ['Delta']),
+                         (report['pushed'], report['pulled'], report['conflicts']))
+        self.assertEqual([('Alpha', 'https://alpha.com', 'local-user'), ('Charlie', 'https://charlie.com', 'user'),
+                          ('Delta', 'https://delta.com', 'local-delta'), ('Echo', None, 'user')],
+                         sorted(get_all_account_names_urls_and_usernames_by_user_id(self.user_id, self.connection)))
+        self.assertEqual('PeerDeltaPassword', get_decrypted_account_password(self.account_id(peer, 'Delta'),
+                                                                             MASTER_PASSWORD, peer))
+        self.assertEqual([['Alpha', 'Echo']], [[name for _, name in group] for group in
+                                               get_reused_account_passwords_by_user_id(self.user_id,
+                                                                                       self.connection)])
+
+        # The conflict is reported again until it is resolved
+        self.assertEqual(['Delta'], sync_vaults(self.connection, self.peer_path, EMAIL, MASTER_PASSWORD)['conflicts'])
+
+        report = sync_vaults(self.connection, self.peer_path, EMAIL, MASTER_PASSWORD, prefer='remote')
+
+        self.assertEqual((['Delta'], ['Delta']), (report['pulled'], report['conflicts']))
+        self.assertEqual('PeerDeltaPassword', get_decrypted_account_password(
+            self.account_id(self.connection, 'Delta'), MASTER_PASSWORD, self.connection))
+        self.assertEqual([], sync_vaults(self.connection, self.peer_path, EMAIL, MASTER_PASSWORD)['conflicts'])
+
+    def test_only_the_accounts_changed_since_the_last_sync_are_rehashed(self):
+        """
+        A sync rehashes the Accounts the change journals logged since the previous sync (including the ones it copied
+        itself), and every Account again once the journal was compacted past the last hashed revision.
+        """
+        sync_vaults(self.connection, self.peer_path, EMAIL, MASTER_PASSWORD)
+        sync_vaults(self.connection, self.peer_path, EMAIL, MASTER_PASSWORD)
+
+        edit_account(self.account_id(self.connection, 'Alpha'), self.connection, username='local-user')
+
+        with mock.patch.object(sync, '_row_hash', wraps=sync._row_hash) as row_hash:
+            self.assertEqual(['Alpha'], sync_vaults(self.connection, self.peer_path, EMAIL, MASTER_PASSWORD)['pushed'])
+            self.assertEqual(1, row_hash.call_count)
+
+            row_hash.reset_mock()
+            self.assertEqual(0, sync_vaults(self.connection, self.peer_path, EMAIL, MASTER_PASSWORD)[
+                'buckets_compared'])
+            self.assertEqual(1, row_hash.call_count)
+
+            row_hash.reset_mock()
+            delete_account(self.account_id(self.connection, 'Bravo'), self.connection)
+            compact_account_changes(self.connection, get_current_revision(self.connection))
+            self.assertEqual(['Bravo'], sync_vaults(self.connection, self.peer_path, EMAIL, MASTER_PASSWORD)['pushed'])
+            self.assertEqual(3, row_hash.call_count)
+
+    def test_accounts_added_on_both_sides_with_the_same_contents_do_not_conflict(self):
+        setup_database(self.peer_path)
+        peer = self.peer()
+        peer_user_id = create_user(email=EMAIL, password=MASTER_PASSWORD, connection=peer)
+        create_accounts(peer_user_id, MASTER_PASSWORD, [
+            {'name': 'Alpha', 'url': 'https://alpha.com', 'username': 'user', 'password': 'AlphaPassword'},
+            {'name': 'Bravo', 'url': 'https://bravo.com', 'username': 'user', 'password': 'AlphaPassword'}], peer)
+
+        report = sync_vaults(self.connection, self.peer_path, EMAIL, MASTER_PASSWORD)
+
+        self.assertEqual((['Charlie', 'Delta'], [], ['Bravo']),
+                         (report['pushed'], report['pulled'], report['conflicts']))
+
+    def test_invalid_login_changes_nothing(self):
+        setup_database(self.peer_path)
+        create_user(email=EMAIL, password='OtherPassword', connection=self.peer())
+
+        with self.assertRaises(ValueError):
+            sync_vaults(self.connection, self.peer_path, EMAIL, MASTER_PASSWORD)
+
+        self.assertEqual(0, self.peer().execute("SELECT COUNT(*) FROM accounts").fetchone()[0])
+
+
+if __name__ == '__main__':
+    unittest.main()
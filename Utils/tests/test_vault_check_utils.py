@@ -0,0 +1,84 @@
+import json
+import unittest
+
+from Utils.database import db_setup, create_user, create_account
+from Utils.vault_check import check_vault
+
+
+class VaultCheckUtilsTests(unittest.TestCase):
+    def setUp(self) -> None:
+        self.connection, self.cursor = db_setup()
+        self.master_password = 'MasterPassword'
+        self.user_id = create_user(email='testemail@gmail.com', password=self.master_password,
+                                   connection=self.connection)
+        self.account_ids = [create_account(user_id=self.user_id, master_password=self.master_password,
+                                           name=f'Company {i}', url=None, username='user', password=f'Password {i}',
+                                           connection=self.connection) for i in range(4)]
+
+    def tearDown(self) -> None:
+        self.cursor.close()
+        self.connection.close()
+
+    def corrupt(self, account_id: int, column: str, transform):
+        self.cursor.execute(f"SELECT {column} FROM accounts WHERE id=?", (account_id,))
+        value = self.cursor.fetchone()[0]
+        self.cursor.execute(f"UPDATE accounts SET {column}=? WHERE id=?", (transform(value), account_id))
+        self.connection.commit()
+
+    def test_intact_vault(self):
+        progress = []
+
+        report = check_vault(self.user_id, self.master_password, self.connection, workers=1,
+                             progress=lambda checked, total: progress.append((checked, total)))
+
+        self.assertEqual({'ok': True, 'integrity_check': ['ok'], 'foreign_key_violations': [], 'accounts_checked': 4,
+                          'bad_accounts': []}, report)
+        self.assertEqual((0, 4), progress[0])
+        self.assertEqual((4, 4), progress[-1])
+        self.assertEqual(report, json.loads(json.dumps(report)))
+
+    def test_corrupt_rows(self):
+        """
+        Reports each Account whose ciphertext, tag, nonce, or salt was altered, the same way with several workers.
+        """
+        flip_first_byte = lambda value: bytes([value[0] ^ 1]) + value[1:]
+
+        self.corrupt(self.account_ids[0], 'password', flip_first_byte)
+        self.corrupt(self.account_ids[1], 'tag', lambda value: value[:8])
+        self.corrupt(self.account_ids[2], 'salt', flip_first_byte)
+
+        reports = [check_vault(self.user_id, self.master_password, self.connection, workers=workers)
+                   for workers in (1, 2)]
+
+        self.assertEqual(reports[0], reports[1])
+        self.assertFalse(reports[0]['ok'])
+        self.assertEqual(4, reports[0]['accounts_checked'])
+        self.assertEqual([(self.account_ids[0], 'Company 0', 'decryption failed: MAC check failed'),
+                          (self.account_ids[1], 'Company 1', 'malformed tag (8 bytes)'),
+                          (self.account_ids[2], 'Company 2', 'decryption failed: MAC check failed')],
+                         [(account['account_id'], account['name'], account['error'])
+                          for account in reports[0]['bad_accounts']])
+
+    def test_wrong_master_password(self):
+        """
+        With the wrong master password, no Account decrypts.
+        """
+        report = check_vault(self.user_id, 'WrongPassword', self.connection, workers=1)
+
+        self.assertEqual(self.account_ids, [account['account_id'] for account in report['bad_accounts']])
+
+    def test_foreign_key_violations(self):
+        self.cursor.execute("PRAGMA foreign_keys = OFF;")
+        self.cursor.execute("INSERT INTO account_urls VALUES (999, ?, 'example.com', 'example.com')", (self.user_id,))
+        self.connection.commit()
+
+        report = check_vault(self.user_id, self.master_password, self.connection, workers=1, quick=True)
+
+        self.assertFalse(report['ok'])
+        self.assertEqual([{'table': 'account_urls', 'rowid': 999, 'parent': 'accounts', 'foreign_key': 0}],
+                         report['foreign_key_violations'])
+        self.assertEqual([], report['bad_accounts'])
+
+    def test_non_existent_user(self):
+        with self.assertRaises(ValueError):
+            check_vault(3400, self.master_password, self.connection)
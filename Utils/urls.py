@@ -0,0 +1,138 @@
+import ipaddress
+import os
+import re
+from functools import lru_cache
+from typing import Optional, Tuple, Iterable
+from urllib.parse import urlsplit
+
+# Account urls are free text, so they are normalized into a host and a registrable domain (the public suffix plus one
+# label, e.g. login.example.co.uk -> example.co.uk) for matching the url of a page against the Accounts. The public
+# suffixes come from a snapshot of the Public Suffix List (https://publicsuffix.org, Mozilla Public License 2.0)
+# bundled in Utils/data, so that no network access is needed. Both the ICANN and the private sections are used, as
+# browsers do, so that e.g. two github.io sites are different domains.
+
+VALID_HOST_PATTERN = re.compile(r'[a-z0-9_-]+(\.[a-z0-9_-]+)*')
+
+PUBLIC_SUFFIX_LIST_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'public_suffix_list.dat')
+
+
+def _to_ascii(host: str) -> str:
+    """
+    Returns the IDNA (punycode) form of the given lowercase host, or the host itself if it cannot be encoded.
+    """
+    if host.isascii():
+        return host
+
+    try:
+        return host.encode('idna').decode('ascii')
+    except UnicodeError:
+        return host
+
+
+class PublicSuffixList:
+    """
+    The rules of a Public Suffix List, matched with the algorithm described at https://publicsuffix.org/list/.
+    """
+    def __init__(self, rules: Iterable[str]):
+        """
+        :param rules: the rules in the list format: plain suffixes, "*."-prefixed wildcards, and "!"-prefixed exceptions
+        """
+        self._rules = set()
+        self._wildcards = set()
+        self._exceptions = set()
+
+        for rule in rules:
+            if rule.startswith('!'):
+                self._exceptions.add(_to_ascii(rule[1:]))
+            elif rule.startswith('*.'):
+                self._wildcards.add(_to_ascii(rule[2:]))
+            else:
+                self._rules.add(_to_ascii(rule))
+
+    @classmethod
+    def from_file(cls, path: str) -> 'PublicSuffixList':
+        with open(path, 'r', encoding='utf-8') as list_file:
+            return cls(line.split()[0].lower() for line in list_file
+                       if line.strip() and not line.startswith('//'))
+
+    def public_suffix(self, host: str) -> str:
+        """
+        Returns the public suffix of the given lowercase ASCII host, which is its last label if no rule matches.
+        """
+        labels = host.split('.')
+
+        # The candidates go from the longest to the shortest, so the first match is the longest matching rule
+        for i in range(len(labels)):
+            candidate = '.'.join(labels[i:])
+
+            if candidate in self._exceptions:
+                return '.'.join(labels[i + 1:])
+
+            if candidate in self._rules or (i + 1 < len(labels) and '.'.join(labels[i + 1:]) in self._wildcards):
+                return candidate
+
+        return labels[-1]
+
+    def registrable_domain(self, host: str) -> Optional[str]:
+        """
+        Returns the registrable domain of the given lowercase ASCII host (its public suffix plus one label), or None if
+        the host is itself a public suffix.
+        """
+        suffix = self.public_suffix(host)
+
+        if host == suffix:
+            return None
+
+        return '.'.join(host.split('.')[-(suffix.count('.') + 2):])
+
+
+@lru_cache(maxsize=None)
+def default_public_suffix_list() -> PublicSuffixList:
+    """
+    Returns the bundled Public Suffix List, which is loaded on first use.
+    """
+    return PublicSuffixList.from_file(PUBLIC_SUFFIX_LIST_PATH)
+
+
+def normalize_url(url: Optional[str], public_suffix_list: Optional[PublicSuffixList] = None)\
+        -> Optional[Tuple[str, str]]:
+    """
+    Normalizes the given url, which may lack a scheme (e.g. "Example.com/login"), into its host and registrable domain.
+    The host is lowercased and IDNA-encoded, without the port, credentials, or trailing dot. IP addresses and hosts
+    that are public suffixes (like localhost) are their own registrable domain.
+    :param url: the url to normalize
+    :param public_suffix_list: the list to use (defaults to the bundled one)
+    :return: the host and the registrable domain, or None if the url has no valid host
+    """
+    if not url or not url.strip():
+        return None
+
+    url = url.strip()
+
+    if '://' not in url:
+        url = f'//{url}'
+
+    try:
+        host = urlsplit(url).hostname
+    except ValueError:
+        return None
+
+    host = host.rstrip('.') if host else None
+
+    if not host:
+        return None
+
+    try:
+        ipaddress.ip_address(host)
+        return host, host
+    except ValueError:
+        pass
+
+    host = _to_ascii(host)
+
+    if not VALID_HOST_PATTERN.fullmatch(host):
+        return None
+
+    domain = (public_suffix_list or default_public_suffix_list()).registrable_domain(host)
+
+    return host, domain or host
@@ -0,0 +1,189 @@
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from sqlite3 import Connection
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from argon2.exceptions import HashingError
+
+from Utils.cryptography import derive_256_bit_salt_and_key, decrypt_aes_256_gcm
+from Utils.database import reveal_sealed_account_metadata
+
+# An fsck for the vault: SQLite's own integrity and foreign key checks, plus a check that every Account password of a
+# User still decrypts, i.e. that its salt, nonce, ciphertext, and tag are intact. Otherwise a corrupt row is only
+# noticed when the User opens that Account. Almost all the time goes into Argon2 (one run per salt, and every Account
+# has its own salt), so the rows are grouped by salt and checked in parallel worker processes, one chunk at a time,
+# with progress reported as chunks complete.
+
+NONCE_SIZE = 16
+TAG_SIZE = 16
+MIN_SALT_SIZE = 8
+BLOCK_SIZE = 16
+
+# Chunks per worker, so that the progress is reported regularly and a slow chunk does not leave the others idle
+CHUNKS_PER_WORKER = 4
+
+AccountRow = Tuple[int, bytes, bytes, bytes, bytes]
+
+
+def _malformed_field(ciphertext: bytes, salt: bytes, nonce: bytes, tag: bytes) -> Optional[str]:
+    """
+    Returns the error of the first field of an Account password that cannot be valid regardless of the key, else None.
+    """
+    if len(salt) < MIN_SALT_SIZE:
+        return f'malformed salt ({len(salt)} bytes)'
+
+    if len(nonce) != NONCE_SIZE:
+        return f'malformed nonce ({len(nonce)} bytes)'
+
+    if len(tag) != TAG_SIZE:
+        return f'malformed tag ({len(tag)} bytes)'
+
+    if not ciphertext or len(ciphertext) % BLOCK_SIZE:
+        return f'malformed ciphertext ({len(ciphertext)} bytes, not a whole number of blocks)'
+
+    return None
+
+
+def check_account_rows(master_password: str, rows: List[AccountRow]) -> List[Tuple[int, str]]:
+    """
+    Checks that each of the given Account passwords decrypts with the master password, deriving one key per salt.
+    Runs in the worker processes of check_vault.
+    :param master_password: the User's master password
+    :param rows: the id, ciphertext, salt, nonce, and tag of the Account passwords to check
+    :return: the id and error of each Account whose password does not decrypt
+    """
+    keys: Dict[bytes, bytes] = {}
+    bad_rows = []
+
+    for account_id, ciphertext, salt, nonce, tag in rows:
+        error = _malformed_field(ciphertext, salt, nonce, tag)
+
+        if error is None:
+            try:
+                if salt not in keys:
+                    keys[salt] = derive_256_bit_salt_and_key(password=master_password, salt=salt)[1]
+
+                decrypt_aes_256_gcm(key=keys[salt], ciphertext=ciphertext, nonce=nonce, tag=tag)
+            except HashingError as e:
+                error = f'key derivation failed: {e}'
+            except UnicodeDecodeError:
+                error = 'the decrypted password is not valid utf-8'
+            except ValueError as e:
+                # A MAC check failure means the ciphertext, nonce, tag, or salt changed since the row was written
+                error = f'decryption failed: {e}'
+
+        if error is not None:
+            bad_rows.append((account_id, error))
+
+    return bad_rows
+
+
+def _chunk_rows_by_salt(rows: List[AccountRow], chunk_count: int) -> List[List[AccountRow]]:
+    """
+    Splits the rows into at most chunk_count chunks of similar size, keeping the rows that share a salt together.
+    """
+    rows_by_salt: Dict[bytes, List[AccountRow]] = {}
+
+    for row in rows:
+        rows_by_salt.setdefault(row[2], []).append(row)
+
+    chunk_size = max(len(rows_by_salt) // max(chunk_count, 1), 1)
+    chunks = []
+    chunk = []
+
+    for index, salt_rows in enumerate(rows_by_salt.values(), start=1):
+        chunk.extend(salt_rows)
+
+        if index % chunk_size == 0:
+            chunks.append(chunk)
+            chunk = []
+
+    if chunk:
+        chunks.append(chunk)
+
+    return chunks
+
+
+def check_vault(user_id: int, master_password: str, connection: Connection, workers: Optional[int] = None,
+                progress: Optional[Callable[[int, int], None]] = None, quick: bool = False) -> Dict[str, Any]:
+    """
+    Checks the database file and the Account passwords of the User with the given id, and returns a JSON-serializable
+    report: the output of PRAGMA integrity_check (or quick_check), the foreign key violations, the number of Accounts
+    checked, and the id, name, and error of each Account whose password does not decrypt.
+    :param user_id: the id of the User whose Accounts are checked
+    :param master_password: the User's master password, which must already be verified
+    :param connection: the database connection to use
+    :param workers: the number of worker processes (defaults to the number of CPUs; 1 checks in this process)
+    :param progress: called with the number of Accounts checked so far and the total after each chunk
+    :param quick: whether to run PRAGMA quick_check, which skips the index consistency checks, instead of
+    integrity_check
+    :return: the report, whose ok key is True if no problem was found
+    :raise ValueError: if there is no User with the given id
+    """
+    cursor = connection.cursor()
+
+    cursor.execute("SELECT EXISTS (SELECT 1 FROM users WHERE id=?)", (user_id,))
+
+    if not cursor.fetchone()[0]:
+        cursor.close()
+        raise ValueError(f'There is no User with the given user_id ({user_id})')
+
+    cursor.execute("PRAGMA quick_check" if quick else "PRAGMA integrity_check")
+    integrity_check = [row[0] for row in cursor.fetchall()]
+
+    cursor.execute("PRAGMA foreign_key_check")
+    foreign_key_violations = [{'table': table, 'rowid': rowid, 'parent': parent, 'foreign_key': foreign_key}
+                              for table, rowid, parent, foreign_key in cursor.fetchall()]
+
+    cursor.execute("SELECT id, name, password, salt, nonce, tag FROM accounts WHERE user_id=? ORDER BY id",
+                   (user_id,))
+    names = {}
+    rows = []
+
+    for account_id, name, ciphertext, salt, nonce, tag in cursor.fetchall():
+        names[account_id] = name
+        rows.append((account_id, ciphertext, salt, nonce, tag))
+
+    cursor.close()
+
+    # The names of sealed Accounts are reported if their metadata decrypts, else by their placeholder
+    try:
+        names.update((account_id, metadata[0]) for account_id, metadata in
+                     reveal_sealed_account_metadata(user_id, list(names), connection).items())
+    except ValueError:
+        pass
+
+    workers = workers or os.cpu_count() or 1
+    chunks = _chunk_rows_by_salt(rows, workers * CHUNKS_PER_WORKER)
+    bad_rows = []
+    checked = 0
+
+    if progress:
+        progress(0, len(rows))
+
+    if workers == 1 or len(chunks) <= 1:
+        for chunk in chunks:
+            bad_rows.extend(check_account_rows(master_password, chunk))
+            checked += len(chunk)
+
+            if progress:
+                progress(checked, len(rows))
+    else:
+        with ProcessPoolExecutor(max_workers=min(workers, len(chunks))) as executor:
+            futures = {executor.submit(check_account_rows, master_password, chunk): len(chunk) for chunk in chunks}
+
+            for future in as_completed(futures):
+                bad_rows.extend(future.result())
+                checked += futures[future]
+
+                if progress:
+                    progress(checked, len(rows))
+
+    bad_accounts = [{'account_id': account_id, 'name': names[account_id], 'error': error}
+                    for account_id, error in sorted(bad_rows)]
+
+    return {'ok': integrity_check == ['ok'] and not foreign_key_violations and not bad_accounts,
+            'integrity_check': integrity_check,
+            'foreign_key_violations': foreign_key_violations,
+            'accounts_checked': len(rows),
+            'bad_accounts': bad_accounts}
@@ -1,5 +1,13 @@
 import os
 
 ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
-DB_NAME = ROOT_DIR + r'\personal_password_manager.sqlite3'
+DB_NAME = os.path.join(ROOT_DIR, 'personal_password_manager.sqlite3')
 VALID_EMAIL_PATTERN = '^[_a-z0-9-]+(\\.[_a-z0-9-]+)*@[a-z0-9-]+(\\.[a-z0-9-]+)*(\\.[a-z]{2,4})$'
+# The optional breached-password corpus (see Utils.breach_check), checked against generated and existing passwords
+BREACHED_PASSWORDS_PATH = os.path.join(ROOT_DIR, 'breached_passwords.bin')
+# The directory of the encrypted vault backups (see Utils.backup)
+BACKUP_DIR = os.path.join(ROOT_DIR, 'backups')
+# How many backup chains (a full backup and its incremental backups) are kept by default
+BACKUP_KEEP_CHAINS = 3
+# How often the GUI checks whether another process (the CLI, another instance, or a sync) changed the vault
+EXTERNAL_CHANGES_POLL_INTERVAL_MS = 1000